@@ -13,6 +13,7 @@ from app.schemas.ai_config import (
     AIConfigListResponse
 )
 from app.schemas.common import ApiResponse, ErrorDetail
+from app.core.provider_factory import invalidate_llm_provider_cache
 import json
 
 router = APIRouter()
@@ -98,6 +99,8 @@ async def create_ai_config(
         
         db.add(db_config)
         db.commit()
+        # 配置已变更，使缓存的provider失效
+        invalidate_llm_provider_cache()
         db.refresh(db_config)
         
         extra_config = None
@@ -162,6 +165,8 @@ async def update_ai_config(
             db_config.is_active = config.is_active
         
         db.commit()
+        # 配置已变更，使缓存的provider失效
+        invalidate_llm_provider_cache()
         db.refresh(db_config)
         
         extra_config = None
@@ -215,6 +220,8 @@ async def activate_ai_config(
         # 激活指定配置
         db_config.is_active = True
         db.commit()
+        # 配置已变更，使缓存的provider失效
+        invalidate_llm_provider_cache()
         db.refresh(db_config)
         
         extra_config = None
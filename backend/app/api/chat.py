@@ -1,9 +1,11 @@
 """
 聊天API路由
 """
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from app.db import get_db
+from app.db import SessionLocal, get_db
 from app.schemas.chat import (
     ChatRequest, ChatResponse, ChatMessage, SessionItem, SessionListResponse, SessionMessagesResponse
 )
@@ -12,7 +14,8 @@ import json
 from app.schemas.common import ApiResponse, ErrorDetail
 from app.core.provider_factory import get_llm_provider
 from app.services.chat_service import ChatService
-from app.models import Session as SessionModel, Message
+from app.services.message_annotation_service import chat_message_from_row
+from app.models import Session as SessionModel, Message, ConversationSummary
 
 router = APIRouter()
 
@@ -35,12 +38,13 @@ async def chat(
         chat_service = ChatService(db, llm_provider)
         
         # 处理聊天请求
-        result = chat_service.process_chat(
+        result = await chat_service.aprocess_chat(
             request.session_id, 
             request.messages,
             experience_mode=request.experience_mode,
             ai_style=request.ai_style,
-            chat_mode=request.chat_mode
+            chat_mode=request.chat_mode,
+            deep_chat_engine=request.deep_chat_engine
         )
         
         # 构建响应
@@ -57,6 +61,58 @@ async def chat(
         return ApiResponse(data=None, error=error_detail)
 
 
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    流式聊天接口（Server-Sent Events）
+    
+    事件类型：
+    - start: {"session_id"}
+    - delta: {"field", "index", "text"}，回复字段（reply / emotion_reflection / step* 等）的增量文本
+    - final: 与 /chat 的 data 相同，包含 emotion、risk_level、card_data 等
+    - error: {"code", "message"}
+    """
+    async def event_stream():
+        # 流式响应会在路由函数返回后继续执行，这里自行管理数据库会话的生命周期
+        db = SessionLocal()
+        try:
+            llm_provider = get_llm_provider(db=db)
+            chat_service = ChatService(db, llm_provider)
+            async for event in chat_service.astream_chat(
+                request.session_id,
+                request.messages,
+                experience_mode=request.experience_mode,
+                ai_style=request.ai_style,
+                chat_mode=request.chat_mode,
+                deep_chat_engine=request.deep_chat_engine
+            ):
+                data = event["data"]
+                if event["event"] == "final":
+                    data = ChatResponse(**data).model_dump(mode="json")
+                yield _format_sse(event["event"], data)
+        except Exception as e:
+            error_detail = ErrorDetail(
+                code="CHAT_ERROR",
+                message=f"处理聊天请求时发生错误: {str(e)}"
+            )
+            yield _format_sse("error", error_detail.model_dump())
+        finally:
+            db.close()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # 禁止nginx等反向代理缓冲
+        },
+    )
+
+
+def _format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @router.get("/sessions", response_model=ApiResponse[SessionListResponse])
 async def get_sessions(
     db: Session = Depends(get_db)
@@ -161,6 +217,7 @@ async def get_session_messages(
 @router.post("/sessions/{session_id}/generate-card", response_model=ApiResponse[ChatResponse])
 async def generate_card(
     session_id: str,
+    engine: Optional[Literal["multi_step", "single_shot"]] = Query(default=None, description="深聊引擎，为空时使用部署默认值"),
     db: Session = Depends(get_db)
 ):
     """
@@ -190,15 +247,8 @@ async def generate_card(
             )
             return ApiResponse(data=None, error=error_detail)
         
-        # 转换为ChatMessage格式
-        chat_messages = [
-            ChatMessage(
-                role=msg.role,
-                content=msg.content,
-                card_data=msg.card_data if hasattr(msg, 'card_data') else None
-            )
-            for msg in messages
-        ]
+        # 转换为ChatMessage格式（带解析标注的用户消息保留标注，供情绪趋势分析使用）
+        chat_messages = [chat_message_from_row(msg) for msg in messages]
         
         # 恢复对话状态
         conversation_state = None
@@ -222,14 +272,14 @@ async def generate_card(
         from app.schemas.style import UserProfile, ParsedState
         from app.core.conversation_algorithm import (
             parse_user_message, select_style, select_interventions,
-            integrate_and_optimize_conversation
+            aintegrate_and_optimize_conversation
         )
         from app.core.step_controller import StepController
         from app.core.five_step_planner import FiveStepPlanner
         
         # 第一步：整合已聊内容，优化prompt
         # 这个步骤会分析整个对话历史，提取关键信息，优化解析结果和结构化信息
-        optimized_parsed, optimized_structured_info = integrate_and_optimize_conversation(
+        optimized_parsed, optimized_structured_info = await aintegrate_and_optimize_conversation(
             messages=chat_messages,
             conversation_state=conversation_state,
             llm_provider=llm_provider
@@ -267,12 +317,13 @@ async def generate_card(
         )
         
         # 生成关心卡（使用深聊模式）
-        llm_result = llm_provider.generate_deep_chat_reply(
+        llm_result = await llm_provider.agenerate_deep_chat_reply(
             messages=chat_messages,
             parsed=optimized_parsed,
             style=style,
             plan=plan,
-            interventions=interventions
+            interventions=interventions,
+            engine=engine
         )
         
         # 更新对话状态为card_generated
@@ -297,7 +348,9 @@ async def generate_card(
             card_data=llm_result.card_data,
             prompt_tokens=llm_result.prompt_tokens,
             completion_tokens=llm_result.completion_tokens,
-            total_tokens=llm_result.total_tokens
+            total_tokens=llm_result.total_tokens,
+            cached_tokens=llm_result.cached_tokens,
+            output_budget_key=llm_result.output_budget_key
         )
         db.add(assistant_message)
         db.commit()
@@ -348,6 +401,9 @@ async def delete_session(
         # 删除该会话的所有消息
         db.query(Message).filter(Message.session_id == session_id).delete()
         
+        # 删除该会话的滚动摘要（LLM写的对话概要，同样属于会话内容）
+        db.query(ConversationSummary).filter(ConversationSummary.session_id == session_id).delete()
+        
         # 删除会话
         db.delete(session)
         db.commit()
@@ -149,7 +149,7 @@ async def get_daily_detail(
                     ChatMessage(role=msg.role, content=msg.content)
                     for msg in topic_messages
                 ]
-                narrative_summary = summary_service.generate_topic_narrative(
+                narrative_summary = await summary_service.agenerate_topic_narrative(
                     topic=topic,
                     messages=chat_messages,
                     emotion_summary=emotion_summary
@@ -180,7 +180,7 @@ async def get_daily_detail(
                     ChatMessage(role=msg.role, content=msg.content)
                     for msg in msgs
                 ]
-                narrative_summary = summary_service.generate_topic_narrative(
+                narrative_summary = await summary_service.agenerate_topic_narrative(
                     topic=topic,
                     messages=chat_messages,
                     emotion_summary=emotion_summary
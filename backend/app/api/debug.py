@@ -0,0 +1,38 @@
+"""
+调试API路由
+"""
+from typing import Optional
+from fastapi import APIRouter, Query
+from app.schemas.common import ApiResponse, ErrorDetail
+from app.schemas.debug import TraceList
+from app.core.tracing import get_trace_recorder, slow_trace_ms
+
+router = APIRouter()
+
+
+@router.get("/debug/traces", response_model=ApiResponse[TraceList])
+async def get_recent_traces(
+    min_ms: Optional[float] = Query(default=None, ge=0, description="最小总耗时（毫秒），为空时使用 TRACE_SLOW_MS"),
+    limit: int = Query(default=20, ge=1, le=200, description="最多返回的条数"),
+    name: Optional[str] = Query(default=None, description="只看某类trace：chat / chat_stream"),
+):
+    """
+    获取最近的慢对话轮次（新的在前），包含按阶段汇总的耗时和完整的span列表
+    """
+    try:
+        threshold = slow_trace_ms() if min_ms is None else min_ms
+        recorder = get_trace_recorder()
+        return ApiResponse(
+            data=TraceList(
+                min_ms=threshold,
+                recorder=recorder.stats(),
+                traces=recorder.recent(min_ms=threshold, limit=limit, name=name),
+            ),
+            error=None
+        )
+    except Exception as e:
+        error_detail = ErrorDetail(
+            code="TRACES_ERROR",
+            message=f"获取对话追踪时发生错误: {str(e)}"
+        )
+        return ApiResponse(data=None, error=error_detail)
@@ -0,0 +1,18 @@
+"""
+Prometheus指标API路由
+"""
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.core.metrics import get_metrics_registry
+
+router = APIRouter()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    以 Prometheus 文本格式导出进程内指标（对话耗时、LLM调用耗时/TTFT/tokens、JSON解析与回退、数据库提交耗时）
+    """
+    return PlainTextResponse(get_metrics_registry().render(), media_type=CONTENT_TYPE)
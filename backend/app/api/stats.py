@@ -7,9 +7,18 @@ from sqlalchemy import func
 from datetime import date, datetime, timedelta
 from collections import Counter, defaultdict
 from app.db import get_db
-from app.models import Message, DailySummary
-from app.schemas.stats import EmotionStatsOverview, TokensUsageStats
+from app.models import Message, DailySummary, ConversationSummary
+from app.schemas.stats import EmotionStatsOverview, TokensUsageStats, DeepChatEngineStats, CompletionCacheStats, CoalescingStats, ProviderPoolStats, RateLimitStats, HistoryCompactionStats, PromptTemplateCacheStats, JsonParseStats, OutputBudgetStats
 from app.schemas.common import ApiResponse, ErrorDetail
+from app.core.deep_chat_engine import get_deep_chat_stats, resolve_deep_chat_engine
+from app.core.providers.completion_cache import get_completion_cache
+from app.core.providers.singleflight import get_singleflight
+from app.core.providers.failover_provider import FailoverLLMProvider
+from app.core.providers.rate_limiter import get_rate_limiter_stats
+from app.core.provider_factory import get_llm_provider
+from app.core.prompt_builder import get_prompt_template_cache
+from app.core.response_schemas import get_parse_stats, schema_enabled
+from app.core.providers.output_budget import get_output_budgets, refit_enabled
 
 router = APIRouter()
 
@@ -132,12 +141,14 @@ async def get_tokens_stats(
         total_prompt_tokens = sum(msg.prompt_tokens or 0 for msg in messages)
         total_completion_tokens = sum(msg.completion_tokens or 0 for msg in messages)
         total_tokens = sum(msg.total_tokens or 0 for msg in messages)
+        total_cached_tokens = sum(msg.cached_tokens or 0 for msg in messages)
         
         # 按日期分组统计
         daily_usage_dict = defaultdict(lambda: {
             "prompt_tokens": 0,
             "completion_tokens": 0,
-            "total_tokens": 0
+            "total_tokens": 0,
+            "cached_tokens": 0
         })
         
         for msg in messages:
@@ -145,6 +156,7 @@ async def get_tokens_stats(
             daily_usage_dict[msg_date]["prompt_tokens"] += msg.prompt_tokens or 0
             daily_usage_dict[msg_date]["completion_tokens"] += msg.completion_tokens or 0
             daily_usage_dict[msg_date]["total_tokens"] += msg.total_tokens or 0
+            daily_usage_dict[msg_date]["cached_tokens"] += msg.cached_tokens or 0
         
         # 生成每日使用数据（包含所有日期，即使没有消息）
         daily_usage = []
@@ -155,14 +167,16 @@ async def get_tokens_stats(
                     "date": current_date.isoformat(),
                     "prompt_tokens": daily_usage_dict[current_date]["prompt_tokens"],
                     "completion_tokens": daily_usage_dict[current_date]["completion_tokens"],
-                    "total_tokens": daily_usage_dict[current_date]["total_tokens"]
+                    "total_tokens": daily_usage_dict[current_date]["total_tokens"],
+                    "cached_tokens": daily_usage_dict[current_date]["cached_tokens"]
                 })
             else:
                 daily_usage.append({
                     "date": current_date.isoformat(),
                     "prompt_tokens": 0,
                     "completion_tokens": 0,
-                    "total_tokens": 0
+                    "total_tokens": 0,
+                    "cached_tokens": 0
                 })
             current_date += timedelta(days=1)
         
@@ -171,6 +185,8 @@ async def get_tokens_stats(
                 total_prompt_tokens=total_prompt_tokens,
                 total_completion_tokens=total_completion_tokens,
                 total_tokens=total_tokens,
+                total_cached_tokens=total_cached_tokens,
+                cache_hit_rate=round(total_cached_tokens / total_prompt_tokens, 4) if total_prompt_tokens else 0.0,
                 daily_usage=daily_usage,
                 message_count=len(messages)
             ),
@@ -183,3 +199,174 @@ async def get_tokens_stats(
             message=f"获取Tokens统计信息时发生错误: {str(e)}"
         )
         return ApiResponse(data=None, error=error_detail)
+
+
+@router.get("/stats/deep-chat", response_model=ApiResponse[DeepChatEngineStats])
+async def get_deep_chat_stats_api():
+    """
+    获取深聊引擎统计：各引擎的平均调用次数、耗时、tokens，以及 single_shot 的补发（修复）率
+    """
+    try:
+        return ApiResponse(
+            data=DeepChatEngineStats(
+                default_engine=resolve_deep_chat_engine(),
+                engines=get_deep_chat_stats().snapshot()
+            ),
+            error=None
+        )
+    except Exception as e:
+        error_detail = ErrorDetail(
+            code="DEEP_CHAT_STATS_ERROR",
+            message=f"获取深聊引擎统计时发生错误: {str(e)}"
+        )
+        return ApiResponse(data=None, error=error_detail)
+
+
+@router.get("/stats/llm-cache", response_model=ApiResponse[CompletionCacheStats])
+async def get_completion_cache_stats():
+    """
+    获取LLM补全缓存的命中/未命中统计
+    """
+    try:
+        return ApiResponse(data=CompletionCacheStats(**get_completion_cache().stats()), error=None)
+    except Exception as e:
+        error_detail = ErrorDetail(
+            code="LLM_CACHE_STATS_ERROR",
+            message=f"获取LLM缓存统计时发生错误: {str(e)}"
+        )
+        return ApiResponse(data=None, error=error_detail)
+
+
+@router.get("/stats/prompt-templates", response_model=ApiResponse[PromptTemplateCacheStats])
+async def get_prompt_template_stats():
+    """
+    获取提示词模板缓存的命中率统计
+    """
+    try:
+        return ApiResponse(data=PromptTemplateCacheStats(**get_prompt_template_cache().stats()), error=None)
+    except Exception as e:
+        error_detail = ErrorDetail(
+            code="PROMPT_TEMPLATE_STATS_ERROR",
+            message=f"获取提示词模板缓存统计时发生错误: {str(e)}"
+        )
+        return ApiResponse(data=None, error=error_detail)
+
+
+@router.get("/stats/llm-coalescing", response_model=ApiResponse[CoalescingStats])
+async def get_coalescing_stats():
+    """
+    获取相同LLM请求的合并统计（被合并的调用没有重复消耗tokens）
+    """
+    try:
+        return ApiResponse(data=CoalescingStats(**get_singleflight().stats()), error=None)
+    except Exception as e:
+        error_detail = ErrorDetail(
+            code="LLM_COALESCING_STATS_ERROR",
+            message=f"获取LLM请求合并统计时发生错误: {str(e)}"
+        )
+        return ApiResponse(data=None, error=error_detail)
+
+
+@router.get("/stats/llm-providers", response_model=ApiResponse[ProviderPoolStats])
+async def get_provider_pool_stats(db: Session = Depends(get_db)):
+    """
+    获取LLM provider故障转移池的熔断器状态、p95延迟与对冲统计
+    """
+    try:
+        provider = get_llm_provider(db)
+        if isinstance(provider, FailoverLLMProvider):
+            stats = ProviderPoolStats(failover_enabled=True, **provider.stats())
+        else:
+            stats = ProviderPoolStats(failover_enabled=False, hedged_requests=0, hedge_wins=0, members=[])
+        return ApiResponse(data=stats, error=None)
+    except Exception as e:
+        error_detail = ErrorDetail(
+            code="LLM_PROVIDER_STATS_ERROR",
+            message=f"获取LLM provider池统计时发生错误: {str(e)}"
+        )
+        return ApiResponse(data=None, error=error_detail)
+
+
+@router.get("/stats/llm-rate-limits", response_model=ApiResponse[RateLimitStats])
+async def get_rate_limit_stats():
+    """
+    获取各provider API key的RPM/TPM限流排队统计（按优先级）
+    """
+    try:
+        return ApiResponse(data=RateLimitStats(limiters=get_rate_limiter_stats()), error=None)
+    except Exception as e:
+        error_detail = ErrorDetail(
+            code="LLM_RATE_LIMIT_STATS_ERROR",
+            message=f"获取LLM限流统计时发生错误: {str(e)}"
+        )
+        return ApiResponse(data=None, error=error_detail)
+
+
+@router.get("/stats/llm-parse", response_model=ApiResponse[JsonParseStats])
+async def get_json_parse_stats():
+    """
+    获取各provider输出的JSON解析结果：直接解析、经清理/提取修复后解析、解析失败（返回安全回复）的次数与比例
+    """
+    try:
+        return ApiResponse(
+            data=JsonParseStats(schema_enabled=schema_enabled(), providers=get_parse_stats().snapshot()),
+            error=None
+        )
+    except Exception as e:
+        error_detail = ErrorDetail(
+            code="LLM_PARSE_STATS_ERROR",
+            message=f"获取JSON解析统计时发生错误: {str(e)}"
+        )
+        return ApiResponse(data=None, error=error_detail)
+
+
+@router.get("/stats/llm-output-budgets", response_model=ApiResponse[OutputBudgetStats])
+async def get_output_budget_stats():
+    """
+    获取各 (provider, 对话阶段, 步骤) 当前的输出预算（max_tokens）、实际输出tokens分布与截断次数
+    """
+    try:
+        return ApiResponse(
+            data=OutputBudgetStats(refit_enabled=refit_enabled(), budgets=get_output_budgets().stats()),
+            error=None
+        )
+    except Exception as e:
+        error_detail = ErrorDetail(
+            code="LLM_OUTPUT_BUDGET_STATS_ERROR",
+            message=f"获取输出预算统计时发生错误: {str(e)}"
+        )
+        return ApiResponse(data=None, error=error_detail)
+
+
+@router.get("/stats/history-compaction", response_model=ApiResponse[HistoryCompactionStats])
+async def get_history_compaction_stats(db: Session = Depends(get_db)):
+    """
+    获取对话历史压缩节省的prompt tokens（与 Message 上记录的实际prompt tokens对比）
+    """
+    try:
+        compacted_sessions, compacted_turns, tokens_saved = db.query(
+            func.count(ConversationSummary.session_id),
+            func.coalesce(func.sum(ConversationSummary.compacted_turns), 0),
+            func.coalesce(func.sum(ConversationSummary.tokens_saved), 0),
+        ).one()
+        prompt_tokens = db.query(func.coalesce(func.sum(Message.prompt_tokens), 0)).filter(
+            Message.role == "assistant"
+        ).scalar()
+        
+        total = prompt_tokens + tokens_saved
+        return ApiResponse(
+            data=HistoryCompactionStats(
+                compacted_sessions=compacted_sessions,
+                compacted_turns=compacted_turns,
+                estimated_tokens_saved=tokens_saved,
+                prompt_tokens=prompt_tokens,
+                savings_rate=round(tokens_saved / total, 4) if total else 0.0
+            ),
+            error=None
+        )
+    except Exception as e:
+        error_detail = ErrorDetail(
+            code="HISTORY_COMPACTION_STATS_ERROR",
+            message=f"获取对话历史压缩统计时发生错误: {str(e)}"
+        )
+        return ApiResponse(data=None, error=error_detail)
@@ -0,0 +1,154 @@
+"""
+请求级的用户消息解析结果复用
+
+一次 /api/chat 请求里，同一条用户消息会被解析多次：对话算法的主解析（可能升级为一次LLM调用）、
+ChatService 保存前的质量自检、summarizing→inviting 的校正重解析……结果都相同，重复解析既浪费CPU，
+也可能重复触发LLM升级。这里提供一个请求级的分析上下文：
+
+- 请求入口用 with analysis_scope(): ... 包裹（ChatService 的三个入口、生成关心卡）
+- 解析入口（emotion_parser_adapter、质量自检）通过 memoized_parse / amemoized_parse 取结果：
+  按消息内容与解析器可见的历史窗口的哈希缓存 ParsedState 与置信度，命中时返回副本，调用方修改不会影响后续阶段
+- 解析结果按来源分级：rules（纯规则） < enhanced（增强解析，不调用LLM） < llm（允许LLM升级），
+  只要求规则结果的调用方可以复用更高级别的结果，要求LLM升级的调用方不会拿到规则结果
+- 推测式解析（先用规则草稿生成回复、LLM增强在后台进行）用 cached_parse / remember_parse 分开查与存，
+  草稿不入缓存，增强结果返回后才记为 llm 级别
+- 不在 analysis_scope 中时直接解析，不做缓存
+
+解析结果同时取决于消息本身和最近几条历史（情绪趋势、上下文一致性、历史标注），因此键里包含
+最近 HISTORY_WINDOW 条历史的角色、内容与解析标注：内容相同但上下文不同的两条消息（例如两次“嗯”）
+不会拿到彼此的结果。
+"""
+import contextvars
+import hashlib
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+from app.core.tracing import annotate_trace
+from app.schemas.chat import AnnotatedChatMessage, ChatMessage
+from app.schemas.style import ParsedState
+
+PARSE_LEVELS = {"rules": 0, "enhanced": 1, "llm": 2}
+
+# 解析器最多回看最近5条历史（情绪趋势分析），窗口外的历史不影响解析结果
+HISTORY_WINDOW = 5
+
+ParseResult = Tuple[ParsedState, float]
+History = Optional[Sequence[ChatMessage]]
+
+
+def message_key(message: ChatMessage, history: History = None) -> str:
+    """消息内容 + 最近 HISTORY_WINDOW 条历史（角色、内容、解析标注）的哈希"""
+    digest = hashlib.sha1()
+    for item in (history or [])[-HISTORY_WINDOW:]:
+        digest.update(f"{item.role}\x1f{item.content}\x1f".encode("utf-8"))
+        if isinstance(item, AnnotatedChatMessage):
+            digest.update(repr((item.emotions, item.intensity, item.scene)).encode("utf-8"))
+        digest.update(b"\x1e")
+    digest.update(b"\x1d" + message.content.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class AnalysisContext:
+    """一次请求内的解析结果缓存：{消息与历史窗口的哈希: (解析级别, ParsedState, 置信度)}"""
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[str, ParsedState, float]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, message: ChatMessage, history: History, level: str) -> Optional[ParseResult]:
+        entry = self._entries.get(message_key(message, history))
+        if entry is None or PARSE_LEVELS[entry[0]] < PARSE_LEVELS[level]:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1].model_copy(deep=True), entry[2]
+
+    def put(self, message: ChatMessage, history: History, level: str, parsed: ParsedState, confidence: float) -> None:
+        key = message_key(message, history)
+        existing = self._entries.get(key)
+        if existing is not None and PARSE_LEVELS[existing[0]] > PARSE_LEVELS[level]:
+            return
+        self._entries[key] = (level, parsed.model_copy(deep=True), confidence)
+
+
+_current_analysis: contextvars.ContextVar[Optional[AnalysisContext]] = contextvars.ContextVar(
+    "analysis_context", default=None
+)
+
+
+def current_analysis() -> Optional[AnalysisContext]:
+    return _current_analysis.get()
+
+
+@contextmanager
+def analysis_scope() -> Iterator[AnalysisContext]:
+    """
+    开始一个请求级的分析上下文（已在上下文中时复用外层的）
+
+    用法：
+        with analysis_scope():
+            ...
+    """
+    context = _current_analysis.get()
+    if context is not None:
+        yield context
+        return
+
+    context = AnalysisContext()
+    token = _current_analysis.set(context)
+    try:
+        yield context
+    finally:
+        if context.hits:
+            annotate_trace(parse_reused=context.hits)
+        try:
+            _current_analysis.reset(token)
+        except ValueError:
+            # 流式响应的异步生成器可能在另一个上下文中被关闭
+            pass
+
+
+def memoized_parse(
+    message: ChatMessage, history: History, level: str, parse: Callable[[], ParseResult]
+) -> ParseResult:
+    """取本请求内已有的解析结果（同一消息与历史窗口，级别不低于 level），没有时调用 parse() 并缓存"""
+    context = _current_analysis.get()
+    if context is None:
+        return parse()
+    cached = context.get(message, history, level)
+    if cached is not None:
+        return cached
+    parsed, confidence = parse()
+    context.put(message, history, level, parsed, confidence)
+    return parsed, confidence
+
+
+async def amemoized_parse(
+    message: ChatMessage, history: History, level: str, parse: Callable[[], Awaitable[ParseResult]]
+) -> ParseResult:
+    """memoized_parse 的异步版本"""
+    context = _current_analysis.get()
+    if context is None:
+        return await parse()
+    cached = context.get(message, history, level)
+    if cached is not None:
+        return cached
+    parsed, confidence = await parse()
+    context.put(message, history, level, parsed, confidence)
+    return parsed, confidence
+
+
+def cached_parse(message: ChatMessage, history: History, level: str) -> Optional[ParseResult]:
+    """只查不解析：本请求内已有的解析结果（级别不低于 level），没有或不在上下文中时返回 None"""
+    context = _current_analysis.get()
+    if context is None:
+        return None
+    return context.get(message, history, level)
+
+
+def remember_parse(message: ChatMessage, history: History, level: str, parsed: ParsedState, confidence: float) -> None:
+    """记录在别处完成的解析结果（不在上下文中时忽略）"""
+    context = _current_analysis.get()
+    if context is not None:
+        context.put(message, history, level, parsed, confidence)
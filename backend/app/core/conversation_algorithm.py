@@ -2,6 +2,10 @@
 对话算法核心流程（增强版：支持5步骤系统）
 实现风格系统、5步骤对话流程、快速/深聊模式、体验模式
 """
+import asyncio
+import logging
+from typing import AsyncIterator
+
 from app.schemas.chat import ChatMessage
 from app.schemas.style import (
     StyleProfile, ParsedState, UserProfile, ReplyPlan, InterventionConfig, ConversationState
@@ -11,9 +15,19 @@ from app.core.style_resolver import StyleResolver
 from app.core.intervention_manager import get_intervention_manager
 from app.core.step_controller import StepController
 from app.core.five_step_planner import FiveStepPlanner
+from app.core.keyword_engine import register_keyword_table, register_keywords, scan_keywords
 from app.core.risk_detection import detect_self_harm_keywords, detect_violence_keywords
-from app.core.emotion_parser_adapter import parse_user_message as parse_user_message_with_adapter
+from app.core.providers.rate_limiter import PRIORITY_HIGH_RISK, PRIORITY_INTERACTIVE, llm_priority
+from app.core.metrics import SPECULATIVE_PARSE
+from app.core.tracing import annotate_trace, span
+from app.core.emotion_parser_adapter import (
+    aparse_user_message as aparse_user_message_with_adapter,
+    parse_user_message as parse_user_message_with_adapter,
+    speculative_parse_enabled,
+    start_speculative_parse,
+)
 
+logger = logging.getLogger(__name__)
 
 # 预定义的干预模块（带描述信息，用于构建prompt）
 # 这些描述会传递给LLM，帮助理解每个干预模块的用途
@@ -35,6 +49,56 @@ INTERVENTION_DESCRIPTIONS = {
 }
 
 
+# parse_user_message 使用的关键词表（登记到共享关键词引擎，每条消息只扫描一遍）
+# 扩展的情绪关键词映射（支持13种情绪，neutral 为默认情绪）
+EMOTION_KEYWORDS = register_keyword_table({
+    "anxiety": ["焦虑", "担心", "紧张", "不安", "anxiety", "worried", "nervous", "worries"],
+    "sadness": ["难过", "伤心", "沮丧", "失落", "sad", "sadness", "depressed", "down"],
+    "anger": ["生气", "愤怒", "恼火", "angry", "anger", "mad", "furious"],
+    "guilt": ["内疚", "愧疚", "guilt", "guilty", "自责"],
+    "shame": ["羞耻", "丢脸", "shame", "ashamed", "embarrassed"],
+    "fear": ["害怕", "恐惧", "fear", "scared", "afraid", "terrified"],
+    "tired": ["累", "疲惫", "疲倦", "tired", "exhausted", "drained"],
+    "overwhelmed": ["崩溃", "受不了", "overwhelmed", "崩溃", "撑不住"],
+    "confusion": ["困惑", "迷茫", "confusion", "confused", "lost"],
+    "joy": ["开心", "高兴", "快乐", "joy", "happy", "pleased"],
+    "relief": ["放松", "relief", "relieved", "轻松"],
+    "calm": ["平静", "calm", "peaceful", "serene"],
+})
+
+# 强度增强词（按强度分级）
+EXTREME_INTENSITY_WORDS = register_keywords(["极度", "超级", "非常非常", "extremely", "extremely", "崩溃", "绝望"])
+HIGH_INTENSITY_WORDS = register_keywords(["非常", "特别", "很", "very", "really", "much"])
+MEDIUM_INTENSITY_WORDS = register_keywords(["比较", "有点", "somewhat", "quite"])
+LOW_INTENSITY_WORDS = register_keywords(["稍微", "一点点", "a bit", "slightly", "little"])
+
+# 扩展的场景识别
+SCENE_KEYWORDS = register_keyword_table({
+    "exam": ["考试", "期末", "测验", "exam", "test", "quiz"],
+    "study": ["学习", "作业", "study", "homework", "课程"],
+    "work": ["工作", "加班", "职场", "work", "job", "career", "同事", "老板"],
+    "career": ["职业", "career", "职业规划", "工作规划"],
+    "relationship": ["恋爱", "分手", "relationship", "love", "感情", "对象"],
+    "family": ["家庭", "父母", "家人", "family", "parent", "家人"],
+    "social": ["社交", "朋友", "social", "friend", "友谊"],
+    "health": ["健康", "身体", "health", "身体", "疾病"],
+    "self-worth": ["自我价值", "自卑", "self-worth", "自信", "自我"],
+    "future": ["未来", "前途", "future", "将来"],
+})
+
+# 增强的风险等级检测
+HIGH_RISK_KEYWORDS = register_keywords(["自杀", "自残", "不想活", "结束生命", "suicide", "kill myself", "self-harm", "不想活了"])
+MEDIUM_RISK_KEYWORDS = register_keywords(["绝望", "没有希望", "hopeless", "desperate", "撑不下去"])
+
+# 增强的用户目标识别
+PLAN_KEYWORDS = register_keywords(["怎么办", "建议", "如何", "how", "suggestion", "方法", "计划", "plan"])
+ANALYSIS_KEYWORDS = register_keywords(["理解", "为什么", "why", "understand", "分析", "analyze", "原因"])
+LISTEN_KEYWORDS = register_keywords(["倾听", "听我说", "想聊聊", "想说话"])
+
+# summarizing 之后用户回复中的校正信息
+CORRECTION_KEYWORDS = register_keywords(["不对", "不是", "漏了", "还有", "其实", "应该是", "更准确", "更贴切", "纠正", "补充"])
+
+
 def parse_user_message(message: ChatMessage, history: list[ChatMessage] = None) -> ParsedState:
     """
     解析用户消息，提取情绪、强度、场景等信息
@@ -45,34 +109,15 @@ def parse_user_message(message: ChatMessage, history: list[ChatMessage] = None)
     - 考虑对话历史上下文
     - 更准确的场景和风险识别
     """
-    content = message.content.lower()
+    hits = scan_keywords(message.content)
     history = history or []
     
-    # 扩展的情绪关键词映射（支持13种情绪）
-    emotion_keywords = {
-        "anxiety": ["焦虑", "担心", "紧张", "不安", "anxiety", "worried", "nervous", "worries"],
-        "sadness": ["难过", "伤心", "沮丧", "失落", "sad", "sadness", "depressed", "down"],
-        "anger": ["生气", "愤怒", "恼火", "angry", "anger", "mad", "furious"],
-        "guilt": ["内疚", "愧疚", "guilt", "guilty", "自责"],
-        "shame": ["羞耻", "丢脸", "shame", "ashamed", "embarrassed"],
-        "fear": ["害怕", "恐惧", "fear", "scared", "afraid", "terrified"],
-        "tired": ["累", "疲惫", "疲倦", "tired", "exhausted", "drained"],
-        "overwhelmed": ["崩溃", "受不了", "overwhelmed", "崩溃", "撑不住"],
-        "confusion": ["困惑", "迷茫", "confusion", "confused", "lost"],
-        "joy": ["开心", "高兴", "快乐", "joy", "happy", "pleased"],
-        "relief": ["放松", "relief", "relieved", "轻松"],
-        "calm": ["平静", "calm", "peaceful", "serene"],
-        "neutral": []  # 默认情绪
-    }
-    
     # 检测情绪（支持多情绪）
     detected_emotions = []
     emotion_scores = {}  # 记录每个情绪的匹配强度
     
-    for emotion, keywords in emotion_keywords.items():
-        if emotion == "neutral":
-            continue
-        matches = sum(1 for kw in keywords if kw in content)
+    for emotion, keywords in EMOTION_KEYWORDS.items():
+        matches = hits.count(keywords)
         if matches > 0:
             detected_emotions.append(emotion)
             emotion_scores[emotion] = matches
@@ -88,19 +133,13 @@ def parse_user_message(message: ChatMessage, history: list[ChatMessage] = None)
     # 更细粒度的强度估算（1-10）
     intensity = 5  # 默认中等强度
     
-    # 强度增强词（按强度分级）
-    extreme_intensity_words = ["极度", "超级", "非常非常", "extremely", "extremely", "崩溃", "绝望"]
-    high_intensity_words = ["非常", "特别", "很", "very", "really", "much"]
-    medium_intensity_words = ["比较", "有点", "somewhat", "quite"]
-    low_intensity_words = ["稍微", "一点点", "a bit", "slightly", "little"]
-    
-    if any(word in content for word in extreme_intensity_words):
+    if hits.any(EXTREME_INTENSITY_WORDS):
         intensity = 9
-    elif any(word in content for word in high_intensity_words):
+    elif hits.any(HIGH_INTENSITY_WORDS):
         intensity = 7
-    elif any(word in content for word in medium_intensity_words):
+    elif hits.any(MEDIUM_INTENSITY_WORDS):
         intensity = 4
-    elif any(word in content for word in low_intensity_words):
+    elif hits.any(LOW_INTENSITY_WORDS):
         intensity = 2
     
     # 根据情绪数量调整强度（多情绪叠加可能增加强度）
@@ -118,24 +157,10 @@ def parse_user_message(message: ChatMessage, history: list[ChatMessage] = None)
         if any(emotion in recent_emotions for emotion in detected_emotions):
             intensity = min(10, intensity + 1)
     
-    # 扩展的场景识别
-    scene_keywords = {
-        "exam": ["考试", "期末", "测验", "exam", "test", "quiz"],
-        "study": ["学习", "作业", "study", "homework", "课程"],
-        "work": ["工作", "加班", "职场", "work", "job", "career", "同事", "老板"],
-        "career": ["职业", "career", "职业规划", "工作规划"],
-        "relationship": ["恋爱", "分手", "relationship", "love", "感情", "对象"],
-        "family": ["家庭", "父母", "家人", "family", "parent", "家人"],
-        "social": ["社交", "朋友", "social", "friend", "友谊"],
-        "health": ["健康", "身体", "health", "身体", "疾病"],
-        "self-worth": ["自我价值", "自卑", "self-worth", "自信", "自我"],
-        "future": ["未来", "前途", "future", "将来"],
-    }
-    
     detected_scene = "general"
     scene_scores = {}
-    for scene, keywords in scene_keywords.items():
-        matches = sum(1 for kw in keywords if kw in content)
+    for scene, keywords in SCENE_KEYWORDS.items():
+        matches = hits.count(keywords)
         if matches > 0:
             scene_scores[scene] = matches
     
@@ -143,14 +168,11 @@ def parse_user_message(message: ChatMessage, history: list[ChatMessage] = None)
         detected_scene = max(scene_scores, key=scene_scores.get)
     
     # 增强的风险等级检测
-    high_risk_keywords = ["自杀", "自残", "不想活", "结束生命", "suicide", "kill myself", "self-harm", "不想活了"]
-    medium_risk_keywords = ["绝望", "没有希望", "hopeless", "desperate", "撑不下去"]
-    
     risk_level = "low"
-    if any(kw in content for kw in high_risk_keywords):
+    if hits.any(HIGH_RISK_KEYWORDS):
         risk_level = "high"
         intensity = max(intensity, 9)  # 高风险时至少强度9
-    elif any(kw in content for kw in medium_risk_keywords):
+    elif hits.any(MEDIUM_RISK_KEYWORDS):
         risk_level = "medium"
         intensity = max(intensity, 7)
     elif intensity >= 8:
@@ -159,15 +181,11 @@ def parse_user_message(message: ChatMessage, history: list[ChatMessage] = None)
     # 增强的用户目标识别
     user_goal = "want_relief"  # 默认想要缓解
     
-    plan_keywords = ["怎么办", "建议", "如何", "how", "suggestion", "方法", "计划", "plan"]
-    analysis_keywords = ["理解", "为什么", "why", "understand", "分析", "analyze", "原因"]
-    listen_keywords = ["倾听", "听我说", "想聊聊", "想说话"]
-    
-    if any(kw in content for kw in plan_keywords):
+    if hits.any(PLAN_KEYWORDS):
         user_goal = "want_plan"
-    elif any(kw in content for kw in analysis_keywords):
+    elif hits.any(ANALYSIS_KEYWORDS):
         user_goal = "want_clarification"
-    elif any(kw in content for kw in listen_keywords):
+    elif hits.any(LISTEN_KEYWORDS):
         user_goal = "want_listen"
     
     # 检测自伤和暴力关键词
@@ -211,11 +229,6 @@ def integrate_and_optimize_conversation(
     Returns:
         (optimized_parsed, optimized_structured_info): 优化后的解析结果和结构化信息
     """
-    # 1. 从对话状态中获取已有的结构化信息
-    structured_info = {}
-    if conversation_state and conversation_state.structuredInfo:
-        structured_info = conversation_state.structuredInfo.copy()
-    
     # 2. 分析整个对话历史，提取关键信息
     user_messages = [m for m in messages if m.role == "user"]
     
@@ -231,14 +244,58 @@ def integrate_and_optimize_conversation(
             use_enhanced=True
         )
     else:
-        # 如果没有用户消息，创建默认解析
-        optimized_parsed = ParsedState(
-            emotions=["neutral"],
-            intensity=5,
-            scene="general",
-            riskLevel="low",
-            userGoal="want_listen"
+        optimized_parsed = _default_parsed_state()
+    
+    return optimized_parsed, _optimize_structured_info(messages, conversation_state, optimized_parsed)
+
+
+async def aintegrate_and_optimize_conversation(
+    messages: list[ChatMessage],
+    conversation_state: ConversationState | None,
+    llm_provider: LLMProvider
+) -> tuple[ParsedState, dict]:
+    """
+    integrate_and_optimize_conversation 的异步版本（增强解析中的LLM调用通过 await 执行）
+    """
+    user_messages = [m for m in messages if m.role == "user"]
+    last_user_message = user_messages[-1] if user_messages else None
+    
+    if last_user_message:
+        optimized_parsed = await aparse_user_message_with_adapter(
+            last_user_message,
+            history=messages[:-1],
+            llm_provider=llm_provider,
+            use_enhanced=True
         )
+    else:
+        optimized_parsed = _default_parsed_state()
+    
+    return optimized_parsed, _optimize_structured_info(messages, conversation_state, optimized_parsed)
+
+
+def _default_parsed_state() -> ParsedState:
+    # 如果没有用户消息，创建默认解析
+    return ParsedState(
+        emotions=["neutral"],
+        intensity=5,
+        scene="general",
+        riskLevel="low",
+        userGoal="want_listen"
+    )
+
+
+def _optimize_structured_info(
+    messages: list[ChatMessage],
+    conversation_state: ConversationState | None,
+    optimized_parsed: ParsedState
+) -> dict:
+    """根据解析结果和对话历史整合结构化信息"""
+    # 1. 从对话状态中获取已有的结构化信息
+    structured_info = {}
+    if conversation_state and conversation_state.structuredInfo:
+        structured_info = conversation_state.structuredInfo.copy()
+    
+    user_messages = [m for m in messages if m.role == "user"]
     
     # 4. 从对话历史中提取更多信息
     # 提取resources信息
@@ -270,7 +327,7 @@ def integrate_and_optimize_conversation(
             if key in existing_info and existing_info[key]:
                 structured_info[key] = existing_info[key]
     
-    return optimized_parsed, structured_info
+    return structured_info
 
 
 def extract_resources_from_conversation(messages: list[ChatMessage]) -> dict:
@@ -596,12 +653,51 @@ def determine_conversation_stage(
     return "inviting", True, False
 
 
+class TurnPlan:
+    """单轮对话的规划结果（阶段、风格、步骤、回复计划），在LLM调用前后共享"""
+    def __init__(
+        self,
+        user_message: ChatMessage,
+        parsed: ParsedState,
+        conversation_state: ConversationState,
+        stage: str,
+        should_show_button: bool,
+        should_show_satisfaction_buttons: bool,
+        is_guiding_phase: bool,
+        style: StyleProfile,
+        mode: str,
+        steps_to_execute: list[int],
+        experience_mode: str | None = None,
+        interventions: list[InterventionConfig] = None,
+        plan: ReplyPlan | None = None,
+    ):
+        self.user_message = user_message
+        self.parsed = parsed
+        self.conversation_state = conversation_state
+        self.stage = stage
+        self.should_show_button = should_show_button
+        self.should_show_satisfaction_buttons = should_show_satisfaction_buttons
+        self.is_guiding_phase = is_guiding_phase
+        self.style = style
+        self.mode = mode
+        self.steps_to_execute = steps_to_execute
+        self.experience_mode = experience_mode
+        self.interventions = interventions or []
+        self.plan = plan
+
+    @property
+    def is_deep_chat(self) -> bool:
+        # 深聊模式下，分别调用5次AI请求，每个步骤一次
+        return not self.is_guiding_phase and self.mode == "deep" and len(self.steps_to_execute) == 5
+
+
 def generate_reply_with_algorithm(
     llm_provider: LLMProvider,
     messages: list[ChatMessage],
     user_profile: UserProfile,
     conversation_state: ConversationState | None = None,
     chat_mode: str | None = None,
+    deep_chat_engine: str | None = None,
 ) -> tuple[LLMResult, ConversationState]:
     """
     使用对话算法生成回复（增强版：支持5步骤系统和多阶段对话流程）
@@ -621,6 +717,416 @@ def generate_reply_with_algorithm(
         (LLMResult, ConversationState): 回复结果和更新后的对话状态
     """
     # 1. 接收用户输入
+    default_reply = _default_reply_if_no_user_message(messages, conversation_state)
+    if default_reply:
+        return default_reply
+    user_message = messages[-1]
+    
+    # 2. 判断用户是否发出了风格或模式相关指令（已在user_profile中处理）
+    # 这里可以进一步检测用户输入中的模式切换指令
+    
+    # 3. 执行情绪解析与风险检测（使用适配器，支持增强版解析器）
+    with span("parse"), llm_priority(_turn_priority(user_message)):
+        parsed = parse_user_message_with_adapter(
+            user_message,
+            history=messages[:-1] if len(messages) > 1 else [],
+            llm_provider=llm_provider,
+            use_enhanced=True  # 启用增强版解析器
+        )
+    
+    # 4-7. 确定阶段、风格、步骤与回复计划
+    with span("plan"):
+        turn = plan_conversation_turn(messages, parsed, user_profile, conversation_state, chat_mode)
+    
+    # 8. 调用LLM生成回复
+    with _completion_span(turn), llm_priority(_turn_priority(user_message, turn.parsed)):
+        if turn.is_deep_chat:
+            llm_result = llm_provider.generate_deep_chat_reply(
+                messages=messages,
+                parsed=turn.parsed,
+                style=turn.style,
+                plan=turn.plan,
+                interventions=turn.interventions,
+                engine=deep_chat_engine
+            )
+        else:
+            # 引导阶段、快速模式或非完整5步骤：使用结构化回复
+            llm_result = llm_provider.generate_structured_reply(
+                messages=messages,
+                parsed=turn.parsed,
+                style=turn.style,
+                plan=turn.plan,
+                interventions=turn.interventions,
+                conversation_stage=turn.stage
+            )
+    
+    # 9. 更新对话状态
+    with span("finalize_turn"):
+        updated_state = finalize_conversation_turn(turn, llm_result, messages)
+    if _needs_summary_correction(turn):
+        # 用户提供了校正，重新解析用户消息以更新结构化信息
+        with span("summary_correction"):
+            corrected_parsed = parse_user_message_with_adapter(
+                user_message,
+                history=messages[:-1],
+                llm_provider=llm_provider,
+                use_enhanced=True
+            )
+        _apply_summary_correction(updated_state, corrected_parsed)
+    
+    return llm_result, updated_state
+
+
+async def agenerate_reply_with_algorithm(
+    llm_provider: LLMProvider,
+    messages: list[ChatMessage],
+    user_profile: UserProfile,
+    conversation_state: ConversationState | None = None,
+    chat_mode: str | None = None,
+    deep_chat_engine: str | None = None,
+) -> tuple[LLMResult, ConversationState]:
+    """
+    generate_reply_with_algorithm 的异步版本
+    
+    规划与状态更新逻辑完全相同，情绪解析和回复生成中的LLM调用通过 await 执行；
+    启用推测式解析时，LLM增强解析与主回复生成并发执行（见 SpeculativeTurn）
+    """
+    default_reply = _default_reply_if_no_user_message(messages, conversation_state)
+    if default_reply:
+        return default_reply
+    user_message = messages[-1]
+    
+    parsed, refinement = await _aparse_for_turn(llm_provider, messages)
+    
+    if refinement is not None:
+        speculative = SpeculativeTurn(
+            llm_provider, messages, user_profile, conversation_state, chat_mode, deep_chat_engine, refinement
+        )
+        llm_result = await speculative.acomplete(parsed)
+        turn = speculative.turn
+    else:
+        with span("plan"):
+            turn = plan_conversation_turn(messages, parsed, user_profile, conversation_state, chat_mode)
+        llm_result = await _acomplete_turn(llm_provider, messages, turn, deep_chat_engine)
+    
+    with span("finalize_turn"):
+        updated_state = finalize_conversation_turn(turn, llm_result, messages)
+    if _needs_summary_correction(turn):
+        with span("summary_correction"):
+            corrected_parsed = await aparse_user_message_with_adapter(
+                user_message,
+                history=messages[:-1],
+                llm_provider=llm_provider,
+                use_enhanced=True
+            )
+        _apply_summary_correction(updated_state, corrected_parsed)
+    
+    return llm_result, updated_state
+
+
+async def astream_reply_with_algorithm(
+    llm_provider: LLMProvider,
+    messages: list[ChatMessage],
+    user_profile: UserProfile,
+    conversation_state: ConversationState | None = None,
+    chat_mode: str | None = None,
+    deep_chat_engine: str | None = None,
+) -> AsyncIterator[dict]:
+    """
+    流式版本的对话算法：规划与状态更新逻辑与 agenerate_reply_with_algorithm 相同
+    
+    产出事件：
+    - {"type": "delta", "field", "index", "text"}：回复字段的增量文本
+    - {"type": "done", "result": LLMResult, "state": ConversationState}：最后一个事件
+    """
+    default_reply = _default_reply_if_no_user_message(messages, conversation_state)
+    if default_reply:
+        llm_result, state = default_reply
+        yield {"type": "delta", "field": "reply", "index": None, "text": llm_result.reply}
+        yield {"type": "done", "result": llm_result, "state": state}
+        return
+    user_message = messages[-1]
+    
+    parsed, refinement = await _aparse_for_turn(llm_provider, messages)
+    
+    speculative = None
+    if refinement is not None:
+        speculative = SpeculativeTurn(
+            llm_provider, messages, user_profile, conversation_state, chat_mode, deep_chat_engine, refinement
+        )
+        stream = speculative.astream(parsed)
+    else:
+        with span("plan"):
+            turn = plan_conversation_turn(messages, parsed, user_profile, conversation_state, chat_mode)
+        stream = _astream_turn(llm_provider, messages, turn, deep_chat_engine)
+    
+    llm_result = None
+    async for event in stream:
+        if event["type"] == "result":
+            llm_result = event["result"]
+        else:
+            yield event
+    if speculative is not None:
+        turn = speculative.turn
+    if llm_result is None:
+        raise ValueError("流式生成没有返回结果")
+    
+    streamed_reply = llm_result.reply
+    with span("finalize_turn"):
+        updated_state = finalize_conversation_turn(turn, llm_result, messages)
+    # 邀请阶段会在回复末尾追加邀请文案，补发这部分增量
+    if llm_result.reply.startswith(streamed_reply) and len(llm_result.reply) > len(streamed_reply):
+        yield {"type": "delta", "field": "reply", "index": None, "text": llm_result.reply[len(streamed_reply):]}
+    if _needs_summary_correction(turn):
+        with span("summary_correction"):
+            corrected_parsed = await aparse_user_message_with_adapter(
+                user_message,
+                history=messages[:-1],
+                llm_provider=llm_provider,
+                use_enhanced=True
+            )
+        _apply_summary_correction(updated_state, corrected_parsed)
+    
+    yield {"type": "done", "result": llm_result, "state": updated_state}
+
+
+async def _aparse_for_turn(
+    llm_provider: LLMProvider,
+    messages: list[ChatMessage],
+) -> tuple[ParsedState, "asyncio.Task[ParsedState] | None"]:
+    """
+    异步路径的情绪解析（使用适配器，启用增强版解析器）
+    
+    启用推测式解析且需要LLM增强时，返回规则草稿和已开始执行的LLM增强任务；否则任务为None
+    """
+    user_message = messages[-1]
+    history = messages[:-1] if len(messages) > 1 else []
+    with span("parse"), llm_priority(_turn_priority(user_message)):
+        if speculative_parse_enabled():
+            return start_speculative_parse(user_message, history=history, llm_provider=llm_provider)
+        parsed = await aparse_user_message_with_adapter(
+            user_message,
+            history=history,
+            llm_provider=llm_provider,
+            use_enhanced=True
+        )
+        return parsed, None
+
+
+async def _acomplete_turn(
+    llm_provider: LLMProvider,
+    messages: list[ChatMessage],
+    turn: TurnPlan,
+    deep_chat_engine: str | None = None,
+) -> LLMResult:
+    """按本轮规划调用LLM生成回复（异步）"""
+    with _completion_span(turn), llm_priority(_turn_priority(turn.user_message, turn.parsed)):
+        if turn.is_deep_chat:
+            return await llm_provider.agenerate_deep_chat_reply(
+                messages=messages,
+                parsed=turn.parsed,
+                style=turn.style,
+                plan=turn.plan,
+                interventions=turn.interventions,
+                engine=deep_chat_engine
+            )
+        return await llm_provider.agenerate_structured_reply(
+            messages=messages,
+            parsed=turn.parsed,
+            style=turn.style,
+            plan=turn.plan,
+            interventions=turn.interventions,
+            conversation_stage=turn.stage
+        )
+
+
+async def _astream_turn(
+    llm_provider: LLMProvider,
+    messages: list[ChatMessage],
+    turn: TurnPlan,
+    deep_chat_engine: str | None = None,
+) -> AsyncIterator[dict]:
+    """按本轮规划流式生成回复，产出 delta 事件和最后的 result 事件"""
+    with _completion_span(turn), llm_priority(_turn_priority(turn.user_message, turn.parsed)):
+        if turn.is_deep_chat:
+            stream = llm_provider.astream_deep_chat_reply(
+                messages=messages,
+                parsed=turn.parsed,
+                style=turn.style,
+                plan=turn.plan,
+                interventions=turn.interventions,
+                engine=deep_chat_engine
+            )
+        else:
+            stream = llm_provider.astream_structured_reply(
+                messages=messages,
+                parsed=turn.parsed,
+                style=turn.style,
+                plan=turn.plan,
+                interventions=turn.interventions,
+                conversation_stage=turn.stage
+            )
+        async for event in stream:
+            yield event
+
+
+RISK_LEVEL_ORDER = {"low": 1, "medium": 2, "high": 3}
+
+# 流式缓冲队列的结束标记
+_STREAM_END = object()
+
+
+class SpeculativeTurn:
+    """
+    推测式执行一轮对话：按规则草稿的规划立即开始生成主回复，LLM增强解析同时进行，返回后
+    - 风险等级升高，或按精确解析应改用 crisis_safe 风格：草稿生成作废，按精确解析重新规划并生成
+    - 否则保留草稿生成的回复，精确解析只用于对话状态与统计（structuredInfo、消息标注）
+    
+    多数升级解析的轮次因此省掉一次完整的LLM往返。流式生成时草稿回复的增量先缓冲，精确解析确认后
+    才发出，用户不会看到随后被作废的内容（见 astream：流式只提前了生成的开始，首字仍要等精确解析）。
+    LLM增强解析失败时沿用规则草稿，按 refine_failed 计数。
+    """
+
+    def __init__(
+        self,
+        llm_provider: LLMProvider,
+        messages: list[ChatMessage],
+        user_profile: UserProfile,
+        conversation_state: ConversationState | None,
+        chat_mode: str | None,
+        deep_chat_engine: str | None,
+        refinement: "asyncio.Task[ParsedState]",
+    ):
+        self.llm_provider = llm_provider
+        self.messages = messages
+        self.user_profile = user_profile
+        # 规划会就地更新对话状态，每次规划都从请求开始时的状态复制一份
+        self.initial_state = conversation_state.model_copy(deep=True) if conversation_state else None
+        self.chat_mode = chat_mode
+        self.deep_chat_engine = deep_chat_engine
+        self.refinement = refinement
+        self.turn: TurnPlan | None = None
+
+    def _plan(self, parsed: ParsedState) -> TurnPlan:
+        state = self.initial_state.model_copy(deep=True) if self.initial_state else None
+        with span("plan"):
+            return plan_conversation_turn(self.messages, parsed, self.user_profile, state, self.chat_mode)
+
+    async def _aresolve(self) -> TurnPlan | None:
+        """等待精确解析：草稿规划仍成立时就地换上精确解析并返回None，否则返回按精确解析重新规划的结果"""
+        draft_turn = self.turn
+        try:
+            with span("speculation.await_refinement"):
+                refined = await self.refinement
+        except Exception as e:
+            logger.warning(f"[Speculative Parse] LLM增强解析失败，沿用规则草稿: {str(e)}", exc_info=True)
+            SPECULATIVE_PARSE.inc(outcome="refine_failed")
+            annotate_trace(speculative_parse="refine_failed")
+            return None
+        reason = _speculation_invalidated(draft_turn, refined, self.user_profile)
+        SPECULATIVE_PARSE.inc(outcome=reason or "kept")
+        annotate_trace(speculative_parse=reason or "kept")
+        if reason is None:
+            draft_turn.parsed = refined
+            return None
+        return self._plan(refined)
+
+    async def acomplete(self, draft: ParsedState) -> LLMResult:
+        self.turn = self._plan(draft)
+        completion = asyncio.create_task(
+            _acomplete_turn(self.llm_provider, self.messages, self.turn, self.deep_chat_engine)
+        )
+        try:
+            replanned = await self._aresolve()
+        except BaseException:
+            _discard(completion)
+            raise
+        finally:
+            self.refinement.cancel()
+        if replanned is None:
+            return await completion
+        _discard(completion)
+        self.turn = replanned
+        return await _acomplete_turn(self.llm_provider, self.messages, replanned, self.deep_chat_engine)
+
+    async def astream(self, draft: ParsedState) -> AsyncIterator[dict]:
+        """
+        流式生成：流式时只推测“开始生成”这一步——草稿回复的请求立即发出，增量缓冲在队列里，
+        但首个增量仍要等精确解析返回后才发给客户端，首字延迟只省下请求建立与排队的时间，
+        不会早于精确解析。草稿被作废时已经产生的生成tokens照样计费。
+        """
+        self.turn = self._plan(draft)
+        buffered: asyncio.Queue = asyncio.Queue()
+        pump = asyncio.create_task(_apump(
+            _astream_turn(self.llm_provider, self.messages, self.turn, self.deep_chat_engine), buffered
+        ))
+        try:
+            replanned = await self._aresolve()
+            if replanned is not None:
+                pump.cancel()
+                self.turn = replanned
+                async for event in _astream_turn(self.llm_provider, self.messages, replanned, self.deep_chat_engine):
+                    yield event
+                return
+            while True:
+                item = await buffered.get()
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.refinement.cancel()
+            pump.cancel()
+
+
+def _speculation_invalidated(turn: TurnPlan, refined: ParsedState, user_profile: UserProfile) -> str | None:
+    """精确解析是否推翻草稿规划（返回原因）：风险等级升高，或应改用 crisis_safe 风格"""
+    if RISK_LEVEL_ORDER.get(refined.riskLevel, 1) > RISK_LEVEL_ORDER.get(turn.parsed.riskLevel, 1):
+        return "risk_raised"
+    if turn.style.id != "crisis_safe" and select_style(user_profile, refined).id == "crisis_safe":
+        return "crisis_style"
+    return None
+
+
+async def _apump(events: AsyncIterator[dict], queue: asyncio.Queue) -> None:
+    """把流式事件搬进缓冲队列，出错时放入异常，最后放入结束标记"""
+    try:
+        async for event in events:
+            queue.put_nowait(event)
+    except Exception as e:
+        queue.put_nowait(e)
+    finally:
+        queue.put_nowait(_STREAM_END)
+        await events.aclose()
+
+
+def _discard(task: asyncio.Task) -> None:
+    """放弃一个后台任务：未完成的取消，已完成的取走异常（避免 "exception was never retrieved" 警告）"""
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()
+
+
+def _completion_span(turn: TurnPlan):
+    """本轮主回复生成的span（深聊模式的各步骤和LLM调用挂在它下面）"""
+    return span("completion", stage=turn.stage, mode=turn.mode, deep_chat=turn.is_deep_chat)
+
+
+def _turn_priority(user_message: ChatMessage, parsed: ParsedState | None = None) -> str:
+    """本轮LLM请求的排队优先级：高风险对话优先于普通交互"""
+    if parsed is not None and parsed.riskLevel == "high":
+        return PRIORITY_HIGH_RISK
+    if detect_self_harm_keywords(user_message.content):
+        return PRIORITY_HIGH_RISK
+    return PRIORITY_INTERACTIVE
+
+
+def _default_reply_if_no_user_message(
+    messages: list[ChatMessage],
+    conversation_state: ConversationState | None,
+) -> tuple[LLMResult, ConversationState] | None:
     user_message = messages[-1] if messages else None
     if not user_message or user_message.role != "user":
         # 如果没有用户消息，返回默认回复
@@ -635,17 +1141,23 @@ def generate_reply_with_algorithm(
             ),
             default_state
         )
+    return None
+
+
+def plan_conversation_turn(
+    messages: list[ChatMessage],
+    parsed: ParsedState,
+    user_profile: UserProfile,
+    conversation_state: ConversationState | None = None,
+    chat_mode: str | None = None,
+) -> TurnPlan:
+    """
+    根据解析结果规划本轮对话（不调用LLM）：阶段判断、风格选择、步骤与回复计划
     
-    # 2. 判断用户是否发出了风格或模式相关指令（已在user_profile中处理）
-    # 这里可以进一步检测用户输入中的模式切换指令
-    
-    # 3. 执行情绪解析与风险检测（使用适配器，支持增强版解析器）
-    parsed = parse_user_message_with_adapter(
-        user_message,
-        history=messages[:-1] if len(messages) > 1 else [],
-        llm_provider=llm_provider,
-        use_enhanced=True  # 启用增强版解析器
-    )
+    Returns:
+        TurnPlan: 本轮规划结果，conversation_state 会被就地更新阶段与轮次
+    """
+    user_message = messages[-1]
     
     # 3.5. 更新对话轮数和阶段
     if not conversation_state:
@@ -720,7 +1232,8 @@ def generate_reply_with_algorithm(
     
     # 4. 根据风险程度、用户偏好与场景，选择当前风格
     # 高风险时强制使用crisis_safe风格
-    style = select_style(user_profile, parsed)
+    with span("select_style"):
+        style = select_style(user_profile, parsed)
     
     # 5. 判断是否在引导阶段（chatting/exploring/summarizing/inviting）
     # 引导阶段不执行5步生成，只进行普通对话
@@ -731,56 +1244,58 @@ def generate_reply_with_algorithm(
     if is_guiding_phase:
         # 引导阶段：只进行普通对话，不执行5步生成
         # 使用简单的对话生成，不涉及5步骤系统
-        llm_result = llm_provider.generate_structured_reply(
-            messages=messages,
+        return TurnPlan(
+            user_message=user_message,
             parsed=parsed,
+            conversation_state=conversation_state,
+            stage=stage,
+            should_show_button=should_show_button,
+            should_show_satisfaction_buttons=should_show_satisfaction_buttons,
+            is_guiding_phase=True,
             style=style,
+            mode="guiding",
+            # 设置步骤为空，因为引导阶段不执行5步生成
+            steps_to_execute=[],
             plan=ReplyPlan(style=style, interventions=[], structure={}),
-            interventions=[],
-            conversation_stage=stage
         )
-        # 引导阶段不生成卡片数据，确保card_data为None
-        llm_result.card_data = None
-        # 设置步骤为空，因为引导阶段不执行5步生成
-        steps_to_execute = []
-        mode = "guiding"
-        experience_mode = None
-    else:
-        # 非引导阶段（inviting或card_generated）：可以执行5步生成
-        # 5. 根据当前体验模式与对话进度，确定本轮要执行的步骤集合
-        step_controller = StepController()
-        experience_mode = None
-        if getattr(user_profile, "preferredExperienceMode", None):
-            experience_mode = user_profile.preferredExperienceMode
-        if conversation_state and getattr(conversation_state, "experienceMode", None):
-            experience_mode = conversation_state.experienceMode
-        # 如果前端明确指定了chat_mode，优先使用；否则通过step_controller自动判断
-        if chat_mode:
-            mode = chat_mode
-            # 深聊模式下，一次性执行所有5个步骤
-            if chat_mode == "deep":
-                steps_to_execute = [1, 2, 3, 4, 5]
-            else:
-                # 快速模式：根据体验模式决定步骤
-                _, steps_to_execute, experience_mode = step_controller.determine_mode_and_steps(
-                    parsed=parsed,
-                    user_profile=user_profile,
-                    conversation_state=conversation_state,
-                    user_input=user_message.content
-                )
-                mode = "quick"
+    
+    # 非引导阶段（inviting或card_generated）：可以执行5步生成
+    # 5. 根据当前体验模式与对话进度，确定本轮要执行的步骤集合
+    step_controller = StepController()
+    experience_mode = None
+    if getattr(user_profile, "preferredExperienceMode", None):
+        experience_mode = user_profile.preferredExperienceMode
+    if conversation_state and getattr(conversation_state, "experienceMode", None):
+        experience_mode = conversation_state.experienceMode
+    # 如果前端明确指定了chat_mode，优先使用；否则通过step_controller自动判断
+    if chat_mode:
+        mode = chat_mode
+        # 深聊模式下，一次性执行所有5个步骤
+        if chat_mode == "deep":
+            steps_to_execute = [1, 2, 3, 4, 5]
         else:
-            mode, steps_to_execute, experience_mode = step_controller.determine_mode_and_steps(
+            # 快速模式：根据体验模式决定步骤
+            _, steps_to_execute, experience_mode = step_controller.determine_mode_and_steps(
                 parsed=parsed,
                 user_profile=user_profile,
                 conversation_state=conversation_state,
                 user_input=user_message.content
             )
-        
-        # 6. 选择干预模块
+            mode = "quick"
+    else:
+        mode, steps_to_execute, experience_mode = step_controller.determine_mode_and_steps(
+            parsed=parsed,
+            user_profile=user_profile,
+            conversation_state=conversation_state,
+            user_input=user_message.content
+        )
+    
+    # 6. 选择干预模块
+    with span("select_interventions"):
         interventions = select_interventions(parsed, style)
-        
-        # 7. 针对选定的步骤，规划本轮回复内容
+    
+    # 7. 针对选定的步骤，规划本轮回复内容
+    with span("plan_steps", steps=len(steps_to_execute)):
         five_step_planner = FiveStepPlanner()
         plan = five_step_planner.plan_steps(
             parsed=parsed,
@@ -789,27 +1304,43 @@ def generate_reply_with_algorithm(
             steps_to_execute=steps_to_execute,
             conversation_state=conversation_state.model_dump() if conversation_state else None
         )
-        
-        # 8. 调用LLM生成回复
-        # 深聊模式下，分别调用5次AI请求，每个步骤一次
-        if mode == "deep" and len(steps_to_execute) == 5:
-            llm_result = llm_provider.generate_deep_chat_reply(
-                messages=messages,
-                parsed=parsed,
-                style=style,
-                plan=plan,
-                interventions=interventions
-            )
-        else:
-            # 快速模式或非完整5步骤：使用原来的方法
-            llm_result = llm_provider.generate_structured_reply(
-                messages=messages,
-                parsed=parsed,
-                style=style,
-                plan=plan,
-                interventions=interventions,
-                conversation_stage=stage
-            )
+    
+    return TurnPlan(
+        user_message=user_message,
+        parsed=parsed,
+        conversation_state=conversation_state,
+        stage=stage,
+        should_show_button=should_show_button,
+        should_show_satisfaction_buttons=should_show_satisfaction_buttons,
+        is_guiding_phase=False,
+        style=style,
+        mode=mode,
+        steps_to_execute=steps_to_execute,
+        experience_mode=experience_mode,
+        interventions=interventions,
+        plan=plan,
+    )
+
+
+def finalize_conversation_turn(
+    turn: TurnPlan,
+    llm_result: LLMResult,
+    messages: list[ChatMessage],
+) -> ConversationState:
+    """
+    LLM返回后的后处理：调整回复内容、设置按钮标记、更新对话状态与结构化信息
+    
+    Returns:
+        ConversationState: 更新后的对话状态
+    """
+    stage = turn.stage
+    conversation_state = turn.conversation_state
+    parsed = turn.parsed
+    user_message = turn.user_message
+    
+    if turn.is_guiding_phase:
+        # 引导阶段不生成卡片数据，确保card_data为None
+        llm_result.card_data = None
     
     # 8.5. 根据阶段调整回复内容（如果需要）
     if stage == "inviting":
@@ -818,22 +1349,22 @@ def generate_reply_with_algorithm(
             llm_result.reply += "\n\n我可以基于刚刚的聊天帮你做一张今天的关心卡，里面会有我听见的重点、一点温柔但不虚的分析，以及一些你现在就能尝试的小行动。"
     
     # 设置是否显示按钮
-    llm_result.should_show_card_button = should_show_button
-    llm_result.should_show_satisfaction_buttons = should_show_satisfaction_buttons
+    llm_result.should_show_card_button = turn.should_show_button
+    llm_result.should_show_satisfaction_buttons = turn.should_show_satisfaction_buttons
     
     # 9. 更新对话状态
     step_controller = StepController()
-    if is_guiding_phase:
+    if turn.is_guiding_phase:
         # 引导阶段：不更新步骤状态，只更新对话状态
         updated_state = conversation_state or ConversationState()
     else:
         # 非引导阶段：正常更新步骤状态
         updated_state = step_controller.update_conversation_state(
             conversation_state=conversation_state,
-            executed_steps=steps_to_execute,
-            mode=mode,
-            experience_mode=experience_mode,
-            step_content=plan.stepContents if 'plan' in locals() else {}
+            executed_steps=turn.steps_to_execute,
+            mode=turn.mode,
+            experience_mode=turn.experience_mode,
+            step_content=turn.plan.stepContents if turn.plan else {}
         )
     
     # 更新多阶段流程状态
@@ -857,29 +1388,26 @@ def generate_reply_with_algorithm(
     if resources:
         updated_state.structuredInfo["resources"] = resources
     
-    # 在summarizing阶段，如果用户回复了校正信息，更新结构化信息
+    return updated_state
+
+
+def _needs_summary_correction(turn: TurnPlan) -> bool:
+    """在summarizing阶段，如果用户回复了校正信息，需要重新解析以更新结构化信息"""
     # 注意：这里stage是当前阶段，如果上一轮是summarizing且用户现在回复了，stage应该是inviting
     # 所以我们需要检查上一轮的状态
-    previous_stage = conversation_state.conversationStage if conversation_state else None
-    if previous_stage == "summarizing" and stage == "inviting":
+    previous_stage = turn.conversation_state.conversationStage if turn.conversation_state else None
+    if previous_stage == "summarizing" and turn.stage == "inviting":
         # 上一轮是summarizing，现在进入inviting，说明用户已经回复了
         # 检查用户回复是否包含校正信息
-        correction_keywords = ["不对", "不是", "漏了", "还有", "其实", "应该是", "更准确", "更贴切", "纠正", "补充"]
-        if any(kw in user_message.content for kw in correction_keywords):
-            # 用户提供了校正，重新解析用户消息以更新结构化信息
-            corrected_parsed = parse_user_message_with_adapter(
-                user_message,
-                history=messages[:-1],
-                llm_provider=llm_provider,
-                use_enhanced=True
-            )
-            if corrected_parsed.emotions:
-                updated_state.structuredInfo["emotion_primary"] = corrected_parsed.emotions[0]
-            updated_state.structuredInfo["emotion_intensity"] = corrected_parsed.intensity
-            if corrected_parsed.scene != "general":
-                updated_state.structuredInfo["topic"] = corrected_parsed.scene
-            if corrected_parsed.userGoal:
-                updated_state.structuredInfo["need"] = corrected_parsed.userGoal
-    
-    return llm_result, updated_state
+        return scan_keywords(turn.user_message.content).any(CORRECTION_KEYWORDS)
+    return False
+
 
+def _apply_summary_correction(updated_state: ConversationState, corrected_parsed: ParsedState) -> None:
+    if corrected_parsed.emotions:
+        updated_state.structuredInfo["emotion_primary"] = corrected_parsed.emotions[0]
+    updated_state.structuredInfo["emotion_intensity"] = corrected_parsed.intensity
+    if corrected_parsed.scene != "general":
+        updated_state.structuredInfo["topic"] = corrected_parsed.scene
+    if corrected_parsed.userGoal:
+        updated_state.structuredInfo["need"] = corrected_parsed.userGoal
@@ -0,0 +1,105 @@
+"""
+深聊模式生成引擎选择与修复统计
+
+- multi_step：每个步骤单独请求一次（按步骤依赖关系并发，见 step_scheduler）
+- single_shot：一次结构化请求生成全部步骤字段，只对缺失/为空的步骤补发单步请求
+
+部署级默认引擎由环境变量 DEEP_CHAT_ENGINE 指定，单次请求可以覆盖。
+"""
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEEP_CHAT_ENGINES = ("multi_step", "single_shot")
+DEFAULT_DEEP_CHAT_ENGINE = "multi_step"
+
+
+def resolve_deep_chat_engine(requested: Optional[str] = None) -> str:
+    """返回本次请求使用的深聊引擎：请求参数 > 环境变量 DEEP_CHAT_ENGINE > multi_step"""
+    if requested in DEEP_CHAT_ENGINES:
+        return requested
+    if requested:
+        logger.warning(f"[Deep Chat] 未知的深聊引擎 {requested}，使用部署默认值")
+
+    configured = os.getenv("DEEP_CHAT_ENGINE", DEFAULT_DEEP_CHAT_ENGINE).strip().lower()
+    if configured not in DEEP_CHAT_ENGINES:
+        logger.warning(f"[Deep Chat] DEEP_CHAT_ENGINE={configured} 无效，使用 {DEFAULT_DEEP_CHAT_ENGINE}")
+        return DEFAULT_DEEP_CHAT_ENGINE
+    return configured
+
+
+class DeepChatStats:
+    """进程内的深聊引擎统计（调用次数、耗时、tokens、single_shot 的修复率）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._engines: Dict[str, Dict[str, Any]] = {
+                engine: {
+                    "requests": 0,
+                    "llm_calls": 0,
+                    "total_elapsed_ms": 0.0,
+                    "total_tokens": 0,
+                    # 以下仅 single_shot 使用
+                    "parse_failures": 0,
+                    "repaired_requests": 0,
+                    "repaired_steps": {},
+                }
+                for engine in DEEP_CHAT_ENGINES
+            }
+
+    def record(
+        self,
+        engine: str,
+        llm_calls: int,
+        elapsed_ms: float,
+        total_tokens: int,
+        repaired_steps: Optional[List[int]] = None,
+        parse_failed: bool = False,
+    ) -> None:
+        with self._lock:
+            stats = self._engines[engine]
+            stats["requests"] += 1
+            stats["llm_calls"] += llm_calls
+            stats["total_elapsed_ms"] += elapsed_ms
+            stats["total_tokens"] += total_tokens
+            if parse_failed:
+                stats["parse_failures"] += 1
+            if repaired_steps:
+                stats["repaired_requests"] += 1
+                for step_num in repaired_steps:
+                    stats["repaired_steps"][step_num] = stats["repaired_steps"].get(step_num, 0) + 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """返回各引擎的统计快照（含平均值与修复率）"""
+        with self._lock:
+            result = {}
+            for engine, stats in self._engines.items():
+                requests = stats["requests"]
+                result[engine] = {
+                    "requests": requests,
+                    "llm_calls": stats["llm_calls"],
+                    "avg_llm_calls": round(stats["llm_calls"] / requests, 2) if requests else 0.0,
+                    "avg_elapsed_ms": round(stats["total_elapsed_ms"] / requests, 1) if requests else 0.0,
+                    "avg_tokens": round(stats["total_tokens"] / requests, 1) if requests else 0.0,
+                    "parse_failures": stats["parse_failures"],
+                    "repaired_requests": stats["repaired_requests"],
+                    "repair_rate": round(stats["repaired_requests"] / requests, 4) if requests else 0.0,
+                    "repaired_steps": dict(sorted(stats["repaired_steps"].items())),
+                }
+            return result
+
+
+# 全局单例
+_deep_chat_stats = DeepChatStats()
+
+
+def get_deep_chat_stats() -> DeepChatStats:
+    """获取深聊引擎统计单例"""
+    return _deep_chat_stats
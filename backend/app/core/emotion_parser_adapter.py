@@ -2,18 +2,36 @@
 情感解析器适配器
 提供向后兼容的接口，支持逐步迁移到增强版解析器
 """
+import asyncio
+import os
 from typing import Optional, Tuple
 from app.schemas.chat import ChatMessage
 from app.schemas.style import ParsedState
+from app.core.analysis_context import amemoized_parse, cached_parse, memoized_parse, remember_parse
 from app.core.llm_provider import LLMProvider
 # 延迟导入以避免循环导入
 # from app.core.conversation_algorithm import parse_user_message as rule_based_parse
-from app.core.enhanced_emotion_parser import EnhancedEmotionParser, parse_user_message_enhanced
+from app.core.enhanced_emotion_parser import (
+    EnhancedEmotionParser,
+    aparse_user_message_enhanced,
+    parse_user_message_enhanced,
+)
 
 
 # 全局配置：是否启用增强版解析器
 ENABLE_ENHANCED_PARSER = True  # 可以通过环境变量控制
 
+# 规则匹配的默认置信度
+RULE_BASED_CONFIDENCE = 0.7
+
+
+def speculative_parse_enabled() -> bool:
+    """
+    是否启用推测式解析（SPECULATIVE_PARSE_ENABLED，默认false）：需要LLM增强解析时，先用规则草稿规划并开始生成回复，
+    LLM增强解析与主回复生成并发执行
+    """
+    return os.getenv("SPECULATIVE_PARSE_ENABLED", "false").lower() in ("1", "true", "yes")
+
 
 def parse_user_message(
     message: ChatMessage,
@@ -24,7 +42,8 @@ def parse_user_message(
     """
     解析用户消息（适配器接口，向后兼容）
     
-    这个函数会根据配置自动选择使用规则匹配或增强版解析器
+    这个函数会根据配置自动选择使用规则匹配或增强版解析器；在 analysis_scope 中时，同一请求内
+    对同一条消息的重复解析直接复用结果
     
     Args:
         message: 用户消息
@@ -40,40 +59,58 @@ def parse_user_message(
     if should_use_enhanced is None:
         should_use_enhanced = ENABLE_ENHANCED_PARSER
     
+    parsed, _ = memoized_parse(
+        message,
+        history,
+        _parse_level(should_use_enhanced, llm_provider),
+        lambda: _parse(message, history, llm_provider, should_use_enhanced),
+    )
+    return parsed
+
+
+def _parse_level(should_use_enhanced: bool, llm_provider: Optional[LLMProvider]) -> str:
+    if not should_use_enhanced:
+        return "rules"
+    return "llm" if llm_provider is not None else "enhanced"
+
+
+def _parse(
+    message: ChatMessage,
+    history: Optional[list[ChatMessage]],
+    llm_provider: Optional[LLMProvider],
+    should_use_enhanced: bool
+) -> Tuple[ParsedState, float]:
     # 如果启用增强版且有LLM提供者，使用增强版
     if should_use_enhanced and llm_provider is not None:
         try:
-            parsed, confidence = parse_user_message_enhanced(
+            return parse_user_message_enhanced(
                 message=message,
                 history=history,
                 llm_provider=llm_provider,
                 enable_llm=True
             )
-            # 可以在这里记录置信度（如果需要）
-            return parsed
         except Exception as e:
             # 增强版失败，回退到规则匹配
             print(f"增强版解析失败，回退到规则匹配: {e}")
-            # 延迟导入以避免循环导入
-            from app.core.conversation_algorithm import parse_user_message as rule_based_parse
-            return rule_based_parse(message, history)
+            return _rule_based_parse(message, history)
     
     # 使用增强版但不启用LLM（只使用多因素强度计算等增强功能）
     if should_use_enhanced:
         try:
             parser = EnhancedEmotionParser(llm_provider=None, enable_llm=False)
-            parsed, confidence = parser.parse(message, history)
-            return parsed
+            return parser.parse(message, history)
         except Exception as e:
             print(f"增强版解析失败，回退到规则匹配: {e}")
-            # 延迟导入以避免循环导入
-            from app.core.conversation_algorithm import parse_user_message as rule_based_parse
-            return rule_based_parse(message, history)
+            return _rule_based_parse(message, history)
     
     # 使用原始规则匹配
+    return _rule_based_parse(message, history)
+
+
+def _rule_based_parse(message: ChatMessage, history: Optional[list[ChatMessage]]) -> Tuple[ParsedState, float]:
     # 延迟导入以避免循环导入
     from app.core.conversation_algorithm import parse_user_message as rule_based_parse
-    return rule_based_parse(message, history)
+    return rule_based_parse(message, history), RULE_BASED_CONFIDENCE
 
 
 def parse_user_message_with_confidence(
@@ -96,25 +133,92 @@ def parse_user_message_with_confidence(
     """
     should_use_enhanced = use_enhanced if use_enhanced is not None else ENABLE_ENHANCED_PARSER
     
-    if should_use_enhanced:
-        try:
-            return parse_user_message_enhanced(
-                message=message,
-                history=history,
-                llm_provider=llm_provider,
-                enable_llm=(llm_provider is not None)
-            )
-        except Exception as e:
-            print(f"增强版解析失败，回退到规则匹配: {e}")
-            # 延迟导入以避免循环导入
-            from app.core.conversation_algorithm import parse_user_message as rule_based_parse
-            parsed = rule_based_parse(message, history)
-            # 规则匹配的默认置信度
-            return parsed, 0.7
+    return memoized_parse(
+        message,
+        history,
+        _parse_level(should_use_enhanced, llm_provider),
+        lambda: _parse(message, history, llm_provider, should_use_enhanced),
+    )
+
+
+async def aparse_user_message(
+    message: ChatMessage,
+    history: list[ChatMessage] = None,
+    llm_provider: Optional[LLMProvider] = None,
+    use_enhanced: Optional[bool] = None
+) -> ParsedState:
+    """
+    parse_user_message 的异步版本（LLM增强通过 await 调用）
+    """
+    should_use_enhanced = use_enhanced
+    if should_use_enhanced is None:
+        should_use_enhanced = ENABLE_ENHANCED_PARSER
     
-    # 规则匹配模式
-    # 延迟导入以避免循环导入
-    from app.core.conversation_algorithm import parse_user_message as rule_based_parse
-    parsed = rule_based_parse(message, history)
-    return parsed, 0.7  # 规则匹配的默认置信度
+    if should_use_enhanced and llm_provider is not None:
+        parsed, _ = await amemoized_parse(
+            message,
+            history,
+            "llm",
+            lambda: _aparse_with_llm(message, history, llm_provider),
+        )
+        return parsed
+    
+    # 不涉及LLM调用，直接复用同步逻辑
+    return parse_user_message(message, history, llm_provider=None, use_enhanced=should_use_enhanced)
+
+
+async def _aparse_with_llm(
+    message: ChatMessage,
+    history: Optional[list[ChatMessage]],
+    llm_provider: LLMProvider
+) -> Tuple[ParsedState, float]:
+    try:
+        return await aparse_user_message_enhanced(
+            message=message,
+            history=history,
+            llm_provider=llm_provider,
+            enable_llm=True
+        )
+    except Exception as e:
+        print(f"增强版解析失败，回退到规则匹配: {e}")
+        return _rule_based_parse(message, history)
+
+
+def start_speculative_parse(
+    message: ChatMessage,
+    history: list[ChatMessage] = None,
+    llm_provider: Optional[LLMProvider] = None
+) -> Tuple[ParsedState, Optional["asyncio.Task[ParsedState]"]]:
+    """
+    推测式解析（需在事件循环中调用）
+    
+    Returns:
+        (ParsedState, refinement)：不需要LLM增强（或本请求已有LLM级别的结果）时 refinement 为None，
+        解析结果即最终结果；否则解析结果是规则草稿，refinement 是已开始执行的LLM增强任务，
+        完成后结果记入本请求的分析上下文（后续的质量自检、校正重解析直接复用）
+    """
+    if llm_provider is None:
+        return parse_user_message(message, history, use_enhanced=True), None
+    
+    cached = cached_parse(message, history, "llm")
+    if cached is not None:
+        return cached[0], None
+    
+    try:
+        parser = EnhancedEmotionParser(llm_provider=llm_provider, enable_llm=True)
+        parsed, confidence, refinement = parser.speculative_parse(message, history)
+    except Exception as e:
+        print(f"增强版解析失败，回退到规则匹配: {e}")
+        parsed, confidence = _rule_based_parse(message, history)
+        refinement = None
+    
+    if refinement is None:
+        remember_parse(message, history, "llm", parsed, confidence)
+        return parsed, None
+    return parsed, asyncio.create_task(_arefine(message, history, refinement))
+
 
+async def _arefine(message: ChatMessage, history: Optional[list[ChatMessage]], refinement) -> ParsedState:
+    parsed, confidence = await refinement
+    remember_parse(message, history, "llm", parsed, confidence)
+    return parsed
@@ -1,14 +1,21 @@
 """
 增强版情感解析器
-实现混合模式（规则+LLM）、置信度评估、多因素强度计算、情绪趋势分析等功能
+实现混合模式（规则+本地分类器+LLM）、置信度评估、多因素强度计算、情绪趋势分析等功能
 """
 import json
 import re
-from typing import Optional, List, Dict, Tuple
+from typing import Any, Coroutine, Optional, List, Dict, Tuple
 from app.schemas.chat import ChatMessage
 from app.schemas.style import ParsedState
+from app.core.keyword_engine import KeywordHits, register_keyword_table, register_keywords, scan_keywords
 from app.core.llm_provider import LLMProvider
+from app.core.local_classifier import get_local_classifier, local_classifier_min_confidence
+from app.core.metrics import ENHANCED_PARSER
+from app.core.providers.completion_cache import completion_cache_policy
+from app.core.providers.output_budget import output_budget
+from app.core.response_schemas import response_schema
 from app.core.risk_detection import detect_self_harm_keywords, detect_violence_keywords
+from app.core.tracing import span
 # 延迟导入以避免循环导入
 # from app.core.conversation_algorithm import parse_user_message as rule_based_parse
 
@@ -18,6 +25,9 @@ CONFIDENCE_THRESHOLD_HIGH = 0.8  # 高置信度阈值，直接使用规则结果
 CONFIDENCE_THRESHOLD_MEDIUM = 0.5  # 中置信度阈值，需要LLM增强
 CONFIDENCE_THRESHOLD_LLM = 0.3  # 低置信度阈值，必须使用LLM
 
+# LLM增强解析结果的缓存时间（秒）：同一条消息+历史的解析结果是确定的，重试/重复请求可直接复用
+LLM_PARSE_CACHE_TTL = 3600
+
 # 情绪类型的基础强度权重（不同情绪类型的默认强度不同）
 EMOTION_BASE_INTENSITY = {
     "anxiety": 5,
@@ -50,6 +60,34 @@ SCENE_INTENSITY_MODIFIERS = {
     "social": 1.0,
 }
 
+# 置信度评估与复杂度判断使用的关键词（登记到共享关键词引擎，每条消息只扫描一遍）
+# 情绪关键词匹配度（只含中文关键词）
+CONFIDENCE_EMOTION_KEYWORDS = register_keyword_table({
+    "anxiety": ["焦虑", "担心", "紧张", "不安"],
+    "sadness": ["难过", "伤心", "沮丧", "失落"],
+    "anger": ["生气", "愤怒", "恼火"],
+    "guilt": ["内疚", "愧疚", "自责"],
+    "shame": ["羞耻", "丢脸"],
+    "fear": ["害怕", "恐惧"],
+    "tired": ["累", "疲惫", "疲倦"],
+    "overwhelmed": ["崩溃", "受不了", "撑不住"],
+    "confusion": ["困惑", "迷茫"],
+    "joy": ["开心", "高兴", "快乐"],
+    "relief": ["放松", "轻松"],
+    "calm": ["平静"],
+})
+
+# 明确的情绪词 / 强度词（表达清晰度）
+CLARITY_EMOTION_INDICATORS = register_keywords([
+    "焦虑", "担心", "难过", "生气", "开心", "害怕",
+    "累", "崩溃", "困惑", "内疚", "羞耻"
+])
+CLARITY_INTENSITY_INDICATORS = register_keywords(["非常", "特别", "很", "极度", "超级"])
+
+# 可能表示反讽的表达 / 模糊表达
+IRONY_INDICATORS = register_keywords(["呵呵", "哈哈", "真好", "太好了", "太棒了"])
+VAGUE_INDICATORS = register_keywords(["说不清", "不知道", "可能", "也许", "好像"])
+
 
 class EmotionTrend:
     """情绪趋势分析结果"""
@@ -98,7 +136,115 @@ class EnhancedEmotionParser:
             (ParsedState, confidence): 解析结果和置信度
         """
         history = history or []
+        with span("parse.rules"):
+            rule_result, confidence, should_use_llm = self._rule_stage(message, history, use_llm_enhancement)
+        
+        # 4. 本地分类器（自动判断需要LLM时先试，置信度足够就不再调用LLM）
+        if should_use_llm and use_llm_enhancement is None:
+            local = self._local_classifier_stage(message, rule_result, confidence)
+            if local is not None:
+                ENHANCED_PARSER.inc(path="local")
+                return local
+        
+        # 5. LLM增强（如果需要）
+        if should_use_llm:
+            try:
+                with span("parse.llm_enhance", confidence=round(confidence, 3)):
+                    llm_result = self._llm_enhanced_parse(message, history, rule_result)
+                ENHANCED_PARSER.inc(path="llm")
+                return self._finish_llm_parse(rule_result, llm_result, confidence)
+            except Exception as e:
+                ENHANCED_PARSER.inc(path="llm_failed")
+                # LLM调用失败，回退到规则结果
+                print(f"LLM增强解析失败，使用规则结果: {e}")
+                return rule_result, confidence
+        
+        # 6. 应用增强算法（即使不使用LLM，也应用多因素强度计算等）
+        ENHANCED_PARSER.inc(path="rules")
+        enhanced_result = self._apply_enhancements(rule_result, message, history)
+        
+        return enhanced_result, confidence
+    
+    async def aparse(
+        self,
+        message: ChatMessage,
+        history: List[ChatMessage] = None,
+        use_llm_enhancement: Optional[bool] = None
+    ) -> Tuple[ParsedState, float]:
+        """
+        parse 的异步版本：规则阶段相同，LLM增强通过 await 调用，不阻塞事件循环
+        """
+        history = history or []
+        with span("parse.rules"):
+            rule_result, confidence, should_use_llm = self._rule_stage(message, history, use_llm_enhancement)
+        
+        if should_use_llm and use_llm_enhancement is None:
+            local = self._local_classifier_stage(message, rule_result, confidence)
+            if local is not None:
+                ENHANCED_PARSER.inc(path="local")
+                return local
+        
+        if should_use_llm:
+            return await self._aescalate(message, history, rule_result, confidence)
+        
+        ENHANCED_PARSER.inc(path="rules")
+        enhanced_result = self._apply_enhancements(rule_result, message, history)
+        
+        return enhanced_result, confidence
+    
+    def speculative_parse(
+        self,
+        message: ChatMessage,
+        history: List[ChatMessage] = None
+    ) -> Tuple[ParsedState, float, Optional[Coroutine[Any, Any, Tuple[ParsedState, float]]]]:
+        """
+        推测式解析：规则阶段（及本地分类器）立即完成，需要LLM增强时不等待
         
+        Returns:
+            (ParsedState, confidence, refinement)：不需要LLM增强时 refinement 为None，解析结果即最终结果；
+            否则解析结果是规则草稿（已应用多因素强度等增强），refinement 是尚未调度的LLM增强协程，
+            结果与 aparse 相同，由调用方放进任务与主回复生成并发执行
+        """
+        history = history or []
+        with span("parse.rules"):
+            rule_result, confidence, should_use_llm = self._rule_stage(message, history, None)
+        
+        if should_use_llm:
+            local = self._local_classifier_stage(message, rule_result, confidence)
+            if local is not None:
+                ENHANCED_PARSER.inc(path="local")
+                return local[0], local[1], None
+            draft = self._apply_enhancements(rule_result, message, history)
+            return draft, confidence, self._aescalate(message, history, rule_result, confidence)
+        
+        ENHANCED_PARSER.inc(path="rules")
+        return self._apply_enhancements(rule_result, message, history), confidence, None
+    
+    async def _aescalate(
+        self,
+        message: ChatMessage,
+        history: List[ChatMessage],
+        rule_result: ParsedState,
+        confidence: float
+    ) -> Tuple[ParsedState, float]:
+        """LLM增强并与规则结果融合，失败时回退到规则结果"""
+        try:
+            with span("parse.llm_enhance", confidence=round(confidence, 3)):
+                llm_result = await self._allm_enhanced_parse(message, history, rule_result)
+            ENHANCED_PARSER.inc(path="llm")
+            return self._finish_llm_parse(rule_result, llm_result, confidence)
+        except Exception as e:
+            ENHANCED_PARSER.inc(path="llm_failed")
+            print(f"LLM增强解析失败，使用规则结果: {e}")
+            return rule_result, confidence
+    
+    def _rule_stage(
+        self,
+        message: ChatMessage,
+        history: List[ChatMessage],
+        use_llm_enhancement: Optional[bool]
+    ) -> Tuple[ParsedState, float, bool]:
+        """规则匹配 + 置信度 + 是否需要LLM增强的判断"""
         # 1. 规则匹配（快速）
         # 延迟导入以避免循环导入
         from app.core.conversation_algorithm import parse_user_message as rule_based_parse
@@ -115,25 +261,48 @@ class EnhancedEmotionParser:
                 (confidence < CONFIDENCE_THRESHOLD_MEDIUM or 
                  self._is_complex_case(message, rule_result))
             )
+        return rule_result, confidence, should_use_llm
+    
+    def _local_classifier_stage(
+        self,
+        message: ChatMessage,
+        rule_result: ParsedState,
+        confidence: float
+    ) -> Optional[Tuple[ParsedState, float]]:
+        """
+        本地分类器（规则与LLM之间的中间层）
         
-        # 4. LLM增强（如果需要）
-        if should_use_llm:
-            try:
-                llm_result = self._llm_enhanced_parse(message, history, rule_result)
-                # 融合结果
-                final_result = self._merge_results(rule_result, llm_result, confidence)
-                # LLM增强后，置信度提升
-                final_confidence = min(1.0, confidence + 0.2)
-                return final_result, final_confidence
-            except Exception as e:
-                # LLM调用失败，回退到规则结果
-                print(f"LLM增强解析失败，使用规则结果: {e}")
-                return rule_result, confidence
-        
-        # 5. 应用增强算法（即使不使用LLM，也应用多因素强度计算等）
-        enhanced_result = self._apply_enhancements(rule_result, message, history)
-        
-        return enhanced_result, confidence
+        情绪、场景、强度取分类器的预测，风险等级、目标等仍以规则为准，按与LLM结果相同的方式融合。
+        分类器未加载或预测置信度低于阈值时返回None，由调用方继续调用LLM。
+        """
+        classifier = get_local_classifier()
+        if classifier is None:
+            return None
+        with span("parse.local_classifier", confidence=round(confidence, 3)) as current:
+            prediction = classifier.predict(message.content)
+            accepted = prediction.confidence >= local_classifier_min_confidence()
+            current.set(local_confidence=round(prediction.confidence, 3), accepted=accepted)
+        if not accepted:
+            return None
+        local_result = rule_result.model_copy(update={
+            "emotions": prediction.emotions,
+            "scene": prediction.scene,
+            "intensity": prediction.intensity,
+        })
+        final_result = self._merge_results(rule_result, local_result, confidence)
+        return final_result, max(confidence, prediction.confidence)
+    
+    def _finish_llm_parse(
+        self,
+        rule_result: ParsedState,
+        llm_result: ParsedState,
+        confidence: float
+    ) -> Tuple[ParsedState, float]:
+        # 融合结果
+        final_result = self._merge_results(rule_result, llm_result, confidence)
+        # LLM增强后，置信度提升
+        final_confidence = min(1.0, confidence + 0.2)
+        return final_result, final_confidence
     
     def _calculate_confidence(
         self,
@@ -149,11 +318,10 @@ class EnhancedEmotionParser:
         2. 表达清晰度（0-0.3）
         3. 上下文一致性（0-0.3）
         """
-        content = message.content.lower()
         confidence = 1.0
         
         # 1. 关键词匹配度
-        keyword_score = self._calculate_keyword_match_score(content, rule_result)
+        keyword_score = self._calculate_keyword_match_score(scan_keywords(message.content), rule_result)
         confidence *= (0.6 + 0.4 * keyword_score)
         
         # 2. 表达清晰度
@@ -167,32 +335,17 @@ class EnhancedEmotionParser:
         
         return min(1.0, max(0.0, confidence))
     
-    def _calculate_keyword_match_score(self, content: str, parsed: ParsedState) -> float:
+    def _calculate_keyword_match_score(self, hits: KeywordHits, parsed: ParsedState) -> float:
         """计算关键词匹配得分"""
         # 检查情绪关键词匹配
-        emotion_keywords = {
-            "anxiety": ["焦虑", "担心", "紧张", "不安"],
-            "sadness": ["难过", "伤心", "沮丧", "失落"],
-            "anger": ["生气", "愤怒", "恼火"],
-            "guilt": ["内疚", "愧疚", "自责"],
-            "shame": ["羞耻", "丢脸"],
-            "fear": ["害怕", "恐惧"],
-            "tired": ["累", "疲惫", "疲倦"],
-            "overwhelmed": ["崩溃", "受不了", "撑不住"],
-            "confusion": ["困惑", "迷茫"],
-            "joy": ["开心", "高兴", "快乐"],
-            "relief": ["放松", "轻松"],
-            "calm": ["平静"],
-        }
-        
         matched_keywords = 0
         total_keywords = 0
         
         for emotion in parsed.emotions:
-            if emotion in emotion_keywords:
-                keywords = emotion_keywords[emotion]
+            if emotion in CONFIDENCE_EMOTION_KEYWORDS:
+                keywords = CONFIDENCE_EMOTION_KEYWORDS[emotion]
                 total_keywords += len(keywords)
-                matched_keywords += sum(1 for kw in keywords if kw in content)
+                matched_keywords += hits.count(keywords)
         
         if total_keywords == 0:
             return 0.5  # 中性情绪，给中等分数
@@ -202,18 +355,14 @@ class EnhancedEmotionParser:
     def _assess_expression_clarity(self, content: str) -> float:
         """评估表达清晰度"""
         score = 0.5  # 基础分数
+        hits = scan_keywords(content)
         
         # 检查是否有明确的情绪词
-        emotion_indicators = [
-            "焦虑", "担心", "难过", "生气", "开心", "害怕",
-            "累", "崩溃", "困惑", "内疚", "羞耻"
-        ]
-        if any(indicator in content for indicator in emotion_indicators):
+        if hits.any(CLARITY_EMOTION_INDICATORS):
             score += 0.3
         
         # 检查是否有强度词
-        intensity_indicators = ["非常", "特别", "很", "极度", "超级"]
-        if any(indicator in content for indicator in intensity_indicators):
+        if hits.any(CLARITY_INTENSITY_INDICATORS):
             score += 0.1
         
         # 检查长度（太短可能不够清晰，太长可能冗余）
@@ -261,10 +410,10 @@ class EnhancedEmotionParser:
     def _is_complex_case(self, message: ChatMessage, rule_result: ParsedState) -> bool:
         """判断是否为复杂情况，需要LLM增强"""
         content = message.content.lower()
+        hits = scan_keywords(message.content)
         
         # 1. 检测反讽、隐喻等复杂表达
-        irony_indicators = ["呵呵", "哈哈", "真好", "太好了", "太棒了"]  # 可能表示反讽
-        if any(indicator in content for indicator in irony_indicators) and "开心" not in content:
+        if hits.any(IRONY_INDICATORS) and "开心" not in content:
             return True
         
         # 2. 检测多重否定
@@ -281,8 +430,7 @@ class EnhancedEmotionParser:
             return True
         
         # 4. 检测模糊表达
-        vague_indicators = ["说不清", "不知道", "可能", "也许", "好像"]
-        if any(indicator in content for indicator in vague_indicators):
+        if hits.any(VAGUE_INDICATORS):
             return True
         
         return False
@@ -297,6 +445,51 @@ class EnhancedEmotionParser:
         if not self.llm_provider:
             return rule_result
         
+        try:
+            # 使用LLM Provider的JSON补全（按 emotion_parse Schema 强制结构化输出）
+            if hasattr(self.llm_provider, '_perform_chat_completion'):
+                with completion_cache_policy(ttl=LLM_PARSE_CACHE_TTL), response_schema("emotion_parse"), output_budget("emotion_parse"):
+                    result_text = self.llm_provider._perform_chat_completion(
+                        self._build_llm_parse_messages(message, history, rule_result), mode="structured"
+                    )
+            else:
+                # 回退到规则结果
+                return rule_result
+            return self._llm_text_to_parsed(result_text, message, rule_result)
+        except Exception as e:
+            print(f"LLM解析失败: {e}")
+            return rule_result
+    
+    async def _allm_enhanced_parse(
+        self,
+        message: ChatMessage,
+        history: List[ChatMessage],
+        rule_result: ParsedState
+    ) -> ParsedState:
+        """_llm_enhanced_parse 的异步版本"""
+        if not self.llm_provider:
+            return rule_result
+        
+        try:
+            if hasattr(self.llm_provider, '_aperform_chat_completion'):
+                with completion_cache_policy(ttl=LLM_PARSE_CACHE_TTL), response_schema("emotion_parse"), output_budget("emotion_parse"):
+                    result_text = await self.llm_provider._aperform_chat_completion(
+                        self._build_llm_parse_messages(message, history, rule_result), mode="structured"
+                    )
+            else:
+                return rule_result
+            return self._llm_text_to_parsed(result_text, message, rule_result)
+        except Exception as e:
+            print(f"LLM解析失败: {e}")
+            return rule_result
+    
+    def _build_llm_parse_messages(
+        self,
+        message: ChatMessage,
+        history: List[ChatMessage],
+        rule_result: ParsedState
+    ) -> List[Dict[str, str]]:
+        """构建LLM情绪解析的消息"""
         # 构建历史摘要
         history_summary = ""
         if history:
@@ -336,39 +529,38 @@ class EnhancedEmotionParser:
 
 只输出JSON，不要包含其他文本。"""
         
-        # 调用LLM
-        try:
-            chat_messages = [
-                {"role": "system", "content": "你是一个专业的情绪分析助手，只输出JSON格式的结果。"},
-                {"role": "user", "content": prompt}
-            ]
-            
-            # 使用LLM Provider的文本生成方法
-            if hasattr(self.llm_provider, '_perform_text_completion'):
-                result_text = self.llm_provider._perform_text_completion(chat_messages)
-                if isinstance(result_text, dict):
-                    result_text = result_text.get("text", "")
-            else:
-                # 回退到规则结果
-                return rule_result
-            
-            # 解析JSON
+        return [
+            {"role": "system", "content": "你是一个专业的情绪分析助手，只输出JSON格式的结果。"},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _llm_text_to_parsed(
+        self,
+        result_text,
+        message: ChatMessage,
+        rule_result: ParsedState
+    ) -> ParsedState:
+        """把LLM返回的JSON文本转换为ParsedState"""
+        if isinstance(result_text, dict):
+            result_text = result_text.get("text", "")
+        
+        # 解析JSON（provider 的解析器会处理代码块等包装，并计入解析结果统计）
+        if hasattr(self.llm_provider, '_parse_json_payload'):
+            result_dict = self.llm_provider._parse_json_payload(result_text)
+        else:
             result_dict = json.loads(result_text)
-            
-            # 构建ParsedState
-            return ParsedState(
-                emotions=result_dict.get("emotions", rule_result.emotions)[:3],
-                intensity=result_dict.get("intensity", rule_result.intensity),
-                scene=result_dict.get("scene", rule_result.scene),
-                riskLevel=result_dict.get("riskLevel", rule_result.riskLevel),
-                userGoal=result_dict.get("userGoal", rule_result.userGoal),
-                hasSelfHarmKeywords=detect_self_harm_keywords(message.content),
-                hasViolenceKeywords=detect_violence_keywords(message.content),
-                problemSummary=result_dict.get("problemSummary", rule_result.problemSummary)
-            )
-        except Exception as e:
-            print(f"LLM解析失败: {e}")
-            return rule_result
+        
+        # 构建ParsedState
+        return ParsedState(
+            emotions=result_dict.get("emotions", rule_result.emotions)[:3],
+            intensity=result_dict.get("intensity", rule_result.intensity),
+            scene=result_dict.get("scene", rule_result.scene),
+            riskLevel=result_dict.get("riskLevel", rule_result.riskLevel),
+            userGoal=result_dict.get("userGoal", rule_result.userGoal),
+            hasSelfHarmKeywords=detect_self_harm_keywords(message.content),
+            hasViolenceKeywords=detect_violence_keywords(message.content),
+            problemSummary=result_dict.get("problemSummary", rule_result.problemSummary)
+        )
     
     def _merge_results(
         self,
@@ -595,3 +787,19 @@ def parse_user_message_enhanced(
     parser = EnhancedEmotionParser(llm_provider=llm_provider, enable_llm=enable_llm)
     return parser.parse(message, history)
 
+
+
+async def aparse_user_message_enhanced(
+    message: ChatMessage,
+    history: List[ChatMessage] = None,
+    llm_provider: Optional[LLMProvider] = None,
+    enable_llm: bool = True
+) -> Tuple[ParsedState, float]:
+    """
+    增强版解析函数（异步版本）
+    
+    Returns:
+        (ParsedState, confidence): 解析结果和置信度
+    """
+    parser = EnhancedEmotionParser(llm_provider=llm_provider, enable_llm=enable_llm)
+    return await parser.aparse(message, history)
@@ -0,0 +1,156 @@
+"""
+对话历史压缩（按tokens预算）
+
+前端每次都会带上完整的对话历史，_format_messages 原样拼进每个提示词，prompt tokens 随轮数线性增长，
+深聊模式下还要乘以步骤数。这里按估算的tokens预算压缩历史：
+
+- 最近 N 轮对话原样保留
+- 更早的对话折叠进按会话保存的滚动摘要（增量更新，见 HistoryCompactionService），
+  以「此前对话摘要」的形式并入系统提示词
+- 压缩只影响发给LLM的消息，对话算法（轮次、阶段判断等）看到的仍是完整历史
+
+压缩结果按调用点设置：with history_compaction(compaction): ...，同一上下文中所有经 _format_messages 的调用生效。
+
+配置（环境变量）：
+- LLM_HISTORY_TOKEN_BUDGET: 历史消息的默认tokens预算（默认3000，0表示不压缩）
+- LLM_HISTORY_TOKEN_BUDGETS: 按provider/模型覆盖预算的JSON，如 {"openai:gpt-4o-mini": 6000, "ollama": 1500}
+- LLM_HISTORY_KEEP_TURNS: 原样保留的最近轮数（默认4）
+"""
+import contextvars
+import hashlib
+import json
+import logging
+import math
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Iterator, List, Optional, Tuple
+
+from app.schemas.chat import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_HEADER = "\n\n【此前对话摘要】（更早的对话已压缩为以下摘要，最近几轮对话仍完整保留）\n"
+
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的tokens数：中文等非ASCII字符约1个/字，ASCII约4字符/个"""
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return math.ceil(ascii_chars / 4) + (len(text) - ascii_chars)
+
+
+def estimate_messages_tokens(messages: List[ChatMessage]) -> int:
+    return sum(estimate_tokens(msg.content) + MESSAGE_OVERHEAD_TOKENS for msg in messages)
+
+
+def history_fingerprint(messages: List[ChatMessage]) -> str:
+    """消息前缀的指纹，用于确认保存的摘要与前端带来的历史一致"""
+    digest = hashlib.sha256()
+    for msg in messages:
+        digest.update(f"{msg.role}\x1f{msg.content}\x1e".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def recent_window_start(messages: List[ChatMessage], keep_turns: int) -> int:
+    """最近 keep_turns 轮（以用户消息为一轮的开始）在消息列表中的起始下标"""
+    if keep_turns <= 0:
+        return len(messages)
+    seen = 0
+    for index in range(len(messages) - 1, -1, -1):
+        if messages[index].role == "user":
+            seen += 1
+            if seen == keep_turns:
+                return index
+    return 0
+
+
+@dataclass(frozen=True)
+class HistoryBudget:
+    """历史消息的tokens预算"""
+    max_tokens: int
+    keep_turns: int
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def history_budget_for(provider: Any) -> HistoryBudget:
+    """按 provider/模型 返回历史tokens预算（故障转移池按主provider计）"""
+    members = getattr(provider, "members", None)
+    if members:
+        provider = members[0].provider
+    name = provider.__class__.__name__.replace("Provider", "").lower()
+    model = getattr(provider, "model", None)
+
+    max_tokens = _env_int("LLM_HISTORY_TOKEN_BUDGET", 3000)
+    raw_overrides = os.getenv("LLM_HISTORY_TOKEN_BUDGETS")
+    if raw_overrides:
+        try:
+            overrides = json.loads(raw_overrides)
+            if f"{name}:{model}" in overrides:
+                max_tokens = int(overrides[f"{name}:{model}"])
+            elif name in overrides:
+                max_tokens = int(overrides[name])
+        except (TypeError, ValueError, AttributeError) as e:
+            logger.warning(f"[History Compaction] LLM_HISTORY_TOKEN_BUDGETS 无效: {str(e)}")
+    return HistoryBudget(max_tokens=max_tokens, keep_turns=_env_int("LLM_HISTORY_KEEP_TURNS", 4))
+
+
+@dataclass
+class HistoryCompaction:
+    """
+    本轮对话的历史压缩结果
+
+    Attributes:
+        summary: 滚动摘要
+        folded_count: 被摘要替代的前缀消息条数
+        message_count: 完整历史的消息条数（只压缩这份历史，避免误用到其他消息列表）
+        saved_tokens: 每次LLM调用节省的估算tokens（被替代的消息 - 摘要）
+        applied_calls: 本轮实际使用压缩历史的LLM调用次数
+    """
+    summary: str
+    folded_count: int
+    message_count: int
+    saved_tokens: int
+    applied_calls: int = 0
+
+
+_compaction: contextvars.ContextVar[Optional[HistoryCompaction]] = contextvars.ContextVar("history_compaction", default=None)
+
+
+@contextmanager
+def history_compaction(compaction: Optional[HistoryCompaction]) -> Iterator[None]:
+    """
+    为当前调用点设置历史压缩结果（None表示不压缩）
+
+    用法：
+        with history_compaction(compaction):
+            generate_reply_with_algorithm(provider, messages, ...)
+    """
+    token = _compaction.set(compaction)
+    try:
+        yield
+    finally:
+        _compaction.reset(token)
+
+
+def compact_history(system_prompt: str, messages: List[ChatMessage]) -> Tuple[str, List[ChatMessage]]:
+    """
+    按当前上下文的压缩结果，把较早的消息替换为系统提示词中的摘要
+
+    system_prompt 为 SystemPrompt 时摘要追加在动态后缀，不影响可缓存的固定前缀
+    """
+    compaction = _compaction.get()
+    if compaction is None or compaction.folded_count <= 0 or len(messages) != compaction.message_count:
+        return system_prompt, messages
+    compaction.applied_calls += 1
+    return system_prompt + SUMMARY_HEADER + compaction.summary, messages[compaction.folded_count:]
@@ -0,0 +1,170 @@
+"""
+流式JSON字段提取器
+
+LLM以JSON格式流式输出时，在完整JSON到达之前就把指定顶层字段的字符串内容增量地提取出来，
+用于SSE推送（例如 reply、emotion_reflection、step1_emotion_mirror 等）。
+只处理顶层对象中的字符串值，以及顶层字符串数组（如 step4_suggestions）中的元素。
+"""
+from typing import Iterable, List, Optional, Tuple
+
+# 流式推送的文本字段（简洁模式 / 3卡片模式 / 5步骤模式）
+STREAM_TEXT_FIELDS = (
+    "reply",
+    "emotion_reflection",
+    "cognitive_clarification",
+    "action_suggestions",
+    "step1_emotion_mirror",
+    "step1_problem_restate",
+    "step2_breakdown",
+    "step3_explanation",
+    "step4_suggestions",
+    "step5_summary",
+)
+
+_SIMPLE_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+# (字段名, 数组下标或None, 增量文本)
+FieldDelta = Tuple[str, Optional[int], str]
+
+
+class IncrementalJsonFieldExtractor:
+    """
+    增量解析JSON文本，返回指定顶层字段的字符串增量
+
+    用法：
+        extractor = IncrementalJsonFieldExtractor(["reply"])
+        for chunk in stream:
+            for field, index, text in extractor.feed(chunk):
+                ...
+    """
+
+    def __init__(self, fields: Iterable[str] = STREAM_TEXT_FIELDS):
+        self.fields = set(fields)
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._unicode_digits: Optional[str] = None
+        self._pending_high_surrogate: Optional[int] = None
+        self._expect_key = False
+        self._string_is_key = False
+        self._key_buffer: List[str] = []
+        self._last_key: Optional[str] = None
+        # 当前正在输出的目标 (字段, 下标)
+        self._target: Optional[Tuple[str, Optional[int]]] = None
+        # 当前所在的被跟踪数组字段及其元素计数
+        self._array_field: Optional[str] = None
+        self._array_index = -1
+
+    def feed(self, chunk: str) -> List[FieldDelta]:
+        """输入一段文本，返回本段中解析出的字段增量（同一目标的连续字符会合并）"""
+        deltas: List[FieldDelta] = []
+        for char in chunk:
+            emitted = self._consume(char)
+            if emitted is None:
+                continue
+            field, index, text = emitted
+            if deltas and deltas[-1][0] == field and deltas[-1][1] == index:
+                deltas[-1] = (field, index, deltas[-1][2] + text)
+            else:
+                deltas.append(emitted)
+        return deltas
+
+    def _consume(self, char: str) -> Optional[FieldDelta]:
+        if not self._started:
+            # 跳过 ```json 等包装，直到第一个 {
+            if char == "{":
+                self._started = True
+                self._depth = 1
+                self._expect_key = True
+            return None
+
+        if self._in_string:
+            return self._consume_string_char(char)
+
+        if char == '"':
+            self._in_string = True
+            self._string_is_key = self._depth == 1 and self._expect_key
+            if self._string_is_key:
+                self._key_buffer = []
+            elif self._depth == 1 and self._last_key in self.fields:
+                self._target = (self._last_key, None)
+            elif self._depth == 2 and self._array_field is not None:
+                self._array_index += 1
+                self._target = (self._array_field, self._array_index)
+            return None
+
+        if char in "{[":
+            if char == "[" and self._depth == 1 and self._last_key in self.fields:
+                self._array_field = self._last_key
+                self._array_index = -1
+            self._depth += 1
+        elif char in "}]":
+            self._depth -= 1
+            if self._depth == 1:
+                self._array_field = None
+            if self._depth <= 0:
+                # 顶层对象结束，之后的内容全部忽略
+                self._started = False
+                self._depth = 0
+        elif char == ":" and self._depth == 1:
+            self._expect_key = False
+        elif char == "," and self._depth == 1:
+            self._expect_key = True
+        return None
+
+    def _consume_string_char(self, char: str) -> Optional[FieldDelta]:
+        if self._unicode_digits is not None:
+            self._unicode_digits += char
+            if len(self._unicode_digits) < 4:
+                return None
+            try:
+                code = int(self._unicode_digits, 16)
+            except ValueError:
+                code = ord("?")
+            self._unicode_digits = None
+            if 0xD800 <= code <= 0xDBFF:
+                self._pending_high_surrogate = code
+                return None
+            if 0xDC00 <= code <= 0xDFFF and self._pending_high_surrogate is not None:
+                code = 0x10000 + ((self._pending_high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+                self._pending_high_surrogate = None
+            return self._emit(chr(code))
+
+        if self._escape:
+            self._escape = False
+            if char == "u":
+                self._unicode_digits = ""
+                return None
+            return self._emit(_SIMPLE_ESCAPES.get(char, char))
+
+        if char == "\\":
+            self._escape = True
+            return None
+
+        if char == '"':
+            self._in_string = False
+            if self._string_is_key:
+                self._last_key = "".join(self._key_buffer)
+                self._string_is_key = False
+            self._target = None
+            return None
+
+        return self._emit(char)
+
+    def _emit(self, text: str) -> Optional[FieldDelta]:
+        if self._string_is_key:
+            self._key_buffer.append(text)
+            return None
+        if self._target is None:
+            return None
+        return self._target[0], self._target[1], text
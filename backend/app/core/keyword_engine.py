@@ -0,0 +1,179 @@
+"""
+共享的多模式关键词匹配引擎（Aho–Corasick）
+
+一轮对话里，同一条用户消息会被多个检测器反复扫描：对话算法的情绪/强度/场景/风险/目标表、规则情绪解析、
+风险检测、风格切换、体验模式、增强解析器的复杂度判断……每个检测器都各自 lower() 一遍，再逐个关键词做子串查找。
+这里把所有检测器的关键词在导入时登记到同一个自动机里：
+
+- 各模块用 register_keywords / register_keyword_table 登记自己的关键词（统一转小写），返回值照常用于计数
+- scan_keywords(text) 对小写后的消息只扫描一遍，得到命中的关键词集合（KeywordHits）
+- 扫描结果按原文缓存（LRU），同一轮里后续检测器直接复用，不再重复扫描
+- 检测器用 hits.any(keywords) / hits.count(keywords) / kw in hits 替代原来的子串循环，
+  count 与原来的 sum(1 for kw in keywords if kw in content) 语义一致（表里重复的关键词会重复计数）
+
+配置（环境变量）：
+- KEYWORD_ENGINE: automaton（默认）或 substring（不建自动机，退回逐个子串查找，用于对照和排查）
+- KEYWORD_SCAN_CACHE_SIZE: 按原文缓存的扫描结果条数（默认512）
+"""
+import os
+import threading
+from collections import deque
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+KEYWORD_ENGINES = ("automaton", "substring")
+DEFAULT_KEYWORD_ENGINE = "automaton"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def keyword_engine() -> str:
+    configured = os.getenv("KEYWORD_ENGINE", DEFAULT_KEYWORD_ENGINE).strip().lower()
+    return configured if configured in KEYWORD_ENGINES else DEFAULT_KEYWORD_ENGINE
+
+
+class KeywordAutomaton:
+    """
+    Aho–Corasick 自动机：一次扫描找出文本中出现的全部关键词（包括相互重叠、互为前缀/后缀的关键词）
+
+    构建时把失败链展开成「只记录与根节点不同的转移」的稠密表，扫描时每个字符只需一到两次字典查找。
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords: FrozenSet[str] = frozenset(kw for kw in keywords if kw)
+        goto: List[Dict[str, int]] = [{}]
+        terminal: List[Optional[str]] = [None]
+        for keyword in self.keywords:
+            state = 0
+            for ch in keyword:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    terminal.append(None)
+                state = nxt
+            terminal[state] = keyword
+
+        root = goto[0]
+        fail = [0] * len(goto)
+        outputs: List[Tuple[str, ...]] = [()] * len(goto)
+        # rows[s]：状态s上与根节点转移不同的那部分转移（根节点的转移在扫描时单独查）
+        rows: List[Dict[str, int]] = [{} for _ in goto]
+        queue = deque()
+        for ch, nxt in root.items():
+            outputs[nxt] = (terminal[nxt],) if terminal[nxt] else ()
+            rows[nxt] = dict(goto[nxt])
+            queue.append(nxt)
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                fallback = fail[state]
+                while fallback and ch not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[nxt] = goto[fallback].get(ch, 0)
+                own = (terminal[nxt],) if terminal[nxt] else ()
+                outputs[nxt] = own + outputs[fail[nxt]]
+                # 失败状态的非根转移先继承，再用自身的转移覆盖
+                row = dict(rows[fail[nxt]])
+                row.update(goto[nxt])
+                rows[nxt] = row
+                queue.append(nxt)
+
+        self._root = root
+        self._rows = rows
+        self._outputs = outputs
+        self.state_count = len(goto)
+
+    def find(self, text: str) -> FrozenSet[str]:
+        """返回 text 中出现过的关键词集合（text 需已按登记时的规则小写）"""
+        rows = self._rows
+        outputs = self._outputs
+        root_get = self._root.get
+        matched = set()
+        state = 0
+        for ch in text:
+            nxt = rows[state].get(ch)
+            state = root_get(ch, 0) if nxt is None else nxt
+            if outputs[state]:
+                matched.update(outputs[state])
+        return frozenset(matched)
+
+
+class KeywordHits:
+    """一段文本的关键词命中结果，供各检测器查询"""
+
+    __slots__ = ("_contains",)
+
+    def __init__(self, contains: Callable[[str], bool]):
+        self._contains = contains
+
+    def __contains__(self, keyword: str) -> bool:
+        return self._contains(keyword)
+
+    def any(self, keywords: Iterable[str]) -> bool:
+        return any(map(self._contains, keywords))
+
+    def count(self, keywords: Iterable[str]) -> int:
+        return sum(map(self._contains, keywords))
+
+
+_keywords: set = set()
+_automaton: Optional[KeywordAutomaton] = None
+_lock = threading.Lock()
+
+
+def register_keywords(keywords: Iterable[str]) -> Tuple[str, ...]:
+    """登记一组关键词，返回小写后的元组（保留原顺序和重复项，检测器照常用它计数）"""
+    global _automaton
+    normalized = tuple(kw.lower() for kw in keywords)
+    with _lock:
+        if not _keywords.issuperset(normalized):
+            _keywords.update(normalized)
+            _automaton = None
+            _scan_cached.cache_clear()
+    return normalized
+
+
+def register_keyword_table(table: Mapping[str, Sequence[str]]) -> Dict[str, Tuple[str, ...]]:
+    """登记 {标签: [关键词...]} 形式的关键词表，返回同样结构（保持键顺序）"""
+    return {label: register_keywords(keywords) for label, keywords in table.items()}
+
+
+def get_keyword_automaton() -> KeywordAutomaton:
+    global _automaton
+    automaton = _automaton
+    if automaton is None:
+        with _lock:
+            if _automaton is None:
+                _automaton = KeywordAutomaton(_keywords)
+            automaton = _automaton
+    return automaton
+
+
+@lru_cache(maxsize=_env_int("KEYWORD_SCAN_CACHE_SIZE", 512))
+def _scan_cached(text: str) -> KeywordHits:
+    return KeywordHits(get_keyword_automaton().find(text.lower()).__contains__)
+
+
+def scan_keywords(text: str) -> KeywordHits:
+    """
+    扫描一段文本（大小写不敏感），返回命中的关键词
+
+    用法：
+        hits = scan_keywords(message.content)
+        if hits.any(HIGH_RISK_KEYWORDS): ...
+        matches = hits.count(keywords)
+    """
+    if keyword_engine() == "substring":
+        return KeywordHits(text.lower().__contains__)
+    return _scan_cached(text)
+
+
+def clear_keyword_scan_cache() -> None:
+    _scan_cached.cache_clear()
@@ -2,7 +2,7 @@
 LLM Provider抽象接口和实现
 """
 from abc import ABC, abstractmethod
-from typing import Literal, Optional
+from typing import AsyncIterator, Literal, Optional
 from pydantic import BaseModel
 from app.schemas.chat import ChatMessage
 from app.schemas.style import StyleProfile, ParsedState, ReplyPlan, InterventionConfig
@@ -21,6 +21,10 @@ class LLMResult(BaseModel):
     prompt_tokens: Optional[int] = None  # 输入tokens数
     completion_tokens: Optional[int] = None  # 输出tokens数
     total_tokens: Optional[int] = None  # 总tokens数
+    cached_tokens: Optional[int] = None  # 输入tokens中命中上游前缀缓存的部分
+    output_budget_key: Optional[str] = None  # 单次调用生成的回复对应的输出预算key（见 output_budget.py）
+    # 深聊模式各步骤的耗时与tokens统计（可选）：[{step, started_ms, elapsed_ms, prompt_tokens, ...}]
+    step_metrics: Optional[list[dict]] = None
     # 多阶段对话流程控制
     should_show_card_button: bool = False  # 是否显示"开始关心吧！"按钮
     should_show_satisfaction_buttons: bool = False  # 是否显示"满意/不满意"按钮（阶段3完成后）
@@ -67,6 +71,98 @@ class LLMProvider(ABC):
             LLMResult: 包含回复、情绪分析等信息
         """
         pass
+    
+    def generate_deep_chat_reply(
+        self,
+        messages: list[ChatMessage],
+        parsed: ParsedState,
+        style: StyleProfile,
+        plan: ReplyPlan,
+        interventions: list[InterventionConfig],
+        engine: Optional[Literal["multi_step", "single_shot"]] = None,
+    ) -> LLMResult:
+        """
+        深聊模式生成（默认退化为一次结构化回复，子类可按步骤分别生成）
+        
+        engine 指定深聊引擎（multi_step / single_shot），为空时使用部署默认值（DEEP_CHAT_ENGINE）
+        """
+        return self.generate_structured_reply(messages, parsed, style, plan, interventions)
+    
+    def generate_text(self, messages: list[ChatMessage]) -> str | None:
+        """
+        生成纯文本回复（默认不支持，返回None）
+        """
+        return None
+    
+    # ===== 异步接口：与上面的同步接口一一对应，供 async 路由直接 await，不阻塞事件循环 =====
+    
+    @abstractmethod
+    async def agenerate_reply(self, messages: list[ChatMessage]) -> LLMResult:
+        """generate_reply 的异步版本"""
+        pass
+    
+    @abstractmethod
+    async def agenerate_structured_reply(
+        self,
+        messages: list[ChatMessage],
+        parsed: ParsedState,
+        style: StyleProfile,
+        plan: ReplyPlan,
+        interventions: list[InterventionConfig],
+        conversation_stage: Optional[Literal["chatting", "exploring", "summarizing", "inviting", "card_generated"]] = None,
+    ) -> LLMResult:
+        """generate_structured_reply 的异步版本"""
+        pass
+    
+    @abstractmethod
+    async def agenerate_deep_chat_reply(
+        self,
+        messages: list[ChatMessage],
+        parsed: ParsedState,
+        style: StyleProfile,
+        plan: ReplyPlan,
+        interventions: list[InterventionConfig],
+        engine: Optional[Literal["multi_step", "single_shot"]] = None,
+    ) -> LLMResult:
+        """generate_deep_chat_reply 的异步版本"""
+        pass
+    
+    @abstractmethod
+    async def agenerate_text(self, messages: list[ChatMessage]) -> str | None:
+        """generate_text 的异步版本"""
+        pass
+    
+    # ===== 流式接口：产出事件字典，供 SSE 接口推送 =====
+    # {"type": "delta", "field": 字段名, "index": 数组下标或None, "text": 增量文本}
+    # {"type": "result", "result": LLMResult}（最后一个事件）
+    
+    async def astream_structured_reply(
+        self,
+        messages: list[ChatMessage],
+        parsed: ParsedState,
+        style: StyleProfile,
+        plan: ReplyPlan,
+        interventions: list[InterventionConfig],
+        conversation_stage: Optional[Literal["chatting", "exploring", "summarizing", "inviting", "card_generated"]] = None,
+    ) -> AsyncIterator[dict]:
+        """流式结构化回复（默认实现：等待完整结果后一次性输出）"""
+        result = await self.agenerate_structured_reply(messages, parsed, style, plan, interventions, conversation_stage)
+        yield {"type": "delta", "field": "reply", "index": None, "text": result.reply}
+        yield {"type": "result", "result": result}
+    
+    async def astream_deep_chat_reply(
+        self,
+        messages: list[ChatMessage],
+        parsed: ParsedState,
+        style: StyleProfile,
+        plan: ReplyPlan,
+        interventions: list[InterventionConfig],
+        engine: Optional[Literal["multi_step", "single_shot"]] = None,
+    ) -> AsyncIterator[dict]:
+        """流式深聊回复（默认实现：等待完整结果后一次性输出）"""
+        result = await self.agenerate_deep_chat_reply(messages, parsed, style, plan, interventions, engine)
+        yield {"type": "delta", "field": "reply", "index": None, "text": result.reply}
+        yield {"type": "result", "result": result}
 
 
 class MockLLMProvider(LLMProvider):
@@ -118,4 +214,32 @@ class MockLLMProvider(LLMProvider):
         """Mock结构化回复生成"""
         # 使用旧的 generate_reply 作为后备
         return self.generate_reply(messages)
-
+    
+    async def agenerate_reply(self, messages: list[ChatMessage]) -> LLMResult:
+        """Mock实现没有IO，直接复用同步逻辑"""
+        return self.generate_reply(messages)
+    
+    async def agenerate_structured_reply(
+        self,
+        messages: list[ChatMessage],
+        parsed: ParsedState,
+        style: StyleProfile,
+        plan: ReplyPlan,
+        interventions: list[InterventionConfig],
+        conversation_stage: Optional[Literal["chatting", "exploring", "summarizing", "inviting", "card_generated"]] = None,
+    ) -> LLMResult:
+        return self.generate_structured_reply(messages, parsed, style, plan, interventions, conversation_stage)
+    
+    async def agenerate_deep_chat_reply(
+        self,
+        messages: list[ChatMessage],
+        parsed: ParsedState,
+        style: StyleProfile,
+        plan: ReplyPlan,
+        interventions: list[InterventionConfig],
+        engine: Optional[Literal["multi_step", "single_shot"]] = None,
+    ) -> LLMResult:
+        return self.generate_deep_chat_reply(messages, parsed, style, plan, interventions, engine)
+    
+    async def agenerate_text(self, messages: list[ChatMessage]) -> str | None:
+        return self.generate_text(messages)
@@ -0,0 +1,394 @@
+"""
+本地CPU情绪分类器（字符n-gram哈希特征 + 线性模型，基于NumPy）
+
+增强解析器在规则置信度不足或判定为复杂情况时会调用LLM重新解析，回复开始前多一次完整的LLM往返。
+这里提供一个介于规则与LLM之间的中间层：
+
+- 特征：小写后的字符 1~3-gram，用 crc32 哈希到固定维度（跨进程稳定），次线性词频 + L2 归一化
+- 模型：13类情绪的多标签逻辑回归、场景的 softmax 多分类、强度（1-10）的线性回归，共享同一组特征
+- 置信度：各项判断中最没把握的那一项的概率——输出的情绪的概率、未输出的情绪中最高概率的补、
+  场景的最高概率，三者取最小（任何一项在两可之间都说明这条消息需要LLM）
+- 权重保存为版本化的 .npz 文件（数组 + JSON元数据），服务启动时加载；标签表随权重一起保存
+- 训练：scripts/train_emotion_classifier.py 从 Message 表导出带解析标注的用户消息训练
+
+配置（环境变量）：
+- LOCAL_CLASSIFIER_ENABLED: 总开关（默认true；NumPy 未安装或权重文件不存在时自动不启用）
+- LOCAL_CLASSIFIER_PATH: 权重文件路径（默认 app/config/emotion_classifier.npz）
+- LOCAL_CLASSIFIER_MIN_CONFIDENCE: 采用本地分类结果所需的最低置信度（默认0.7，低于此值仍调用LLM；
+  训练脚本会在留出集上报告当前阈值下的覆盖率与准确率）
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 未安装时本地分类器不可用，增强解析器仍在规则与LLM之间切换
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# 权重文件格式版本：特征提取或数组布局变化时递增，旧文件加载时报错而不是给出错误的预测
+MODEL_FORMAT_VERSION = 1
+
+DEFAULT_MODEL_PATH = Path(__file__).parent.parent / "config" / "emotion_classifier.npz"
+DEFAULT_HASH_DIM = 1 << 14
+DEFAULT_NGRAM_RANGE = (1, 3)
+DEFAULT_MIN_CONFIDENCE = 0.7
+
+# 输出的情绪最多3个（与LLM解析结果一致）
+MAX_EMOTIONS = 3
+INTENSITY_RANGE = (1, 10)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def local_classifier_enabled() -> bool:
+    return os.getenv("LOCAL_CLASSIFIER_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+def local_classifier_min_confidence() -> float:
+    return _env_float("LOCAL_CLASSIFIER_MIN_CONFIDENCE", DEFAULT_MIN_CONFIDENCE)
+
+
+def local_classifier_path() -> Path:
+    configured = os.getenv("LOCAL_CLASSIFIER_PATH")
+    return Path(configured) if configured else DEFAULT_MODEL_PATH
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("本地情绪分类器需要 NumPy（pip install numpy）")
+
+
+def hashed_ngrams(text: str, hash_dim: int, ngram_range: Tuple[int, int]) -> Dict[int, float]:
+    """文本 -> {哈希桶: 特征值}（次线性词频，L2归一化）"""
+    text = " ".join(text.lower().split())
+    counts: Dict[int, int] = {}
+    low, high = ngram_range
+    for n in range(low, high + 1):
+        for i in range(len(text) - n + 1):
+            bucket = zlib.crc32(text[i:i + n].encode("utf-8")) % hash_dim
+            counts[bucket] = counts.get(bucket, 0) + 1
+    if not counts:
+        return {}
+    features = {bucket: 1.0 + math.log(count) for bucket, count in counts.items()}
+    norm = math.sqrt(sum(value * value for value in features.values()))
+    return {bucket: value / norm for bucket, value in features.items()}
+
+
+@dataclass
+class LocalPrediction:
+    """本地分类器对一条消息的预测"""
+    emotions: List[str]
+    scene: str
+    intensity: int
+    confidence: float
+    emotion_scores: Dict[str, float] = field(default_factory=dict)
+    scene_score: float = 0.0
+
+
+@dataclass
+class TrainingSample:
+    """一条训练样本（来自带解析标注的用户消息）"""
+    text: str
+    emotions: List[str]
+    scene: str
+    intensity: int
+
+
+class LocalEmotionClassifier:
+    """字符n-gram哈希特征上的多标签情绪 / 场景 / 强度线性模型"""
+
+    def __init__(
+        self,
+        emotion_labels: Sequence[str],
+        scene_labels: Sequence[str],
+        emotion_weights,
+        emotion_bias,
+        scene_weights,
+        scene_bias,
+        intensity_weights,
+        intensity_bias: float,
+        hash_dim: int = DEFAULT_HASH_DIM,
+        ngram_range: Tuple[int, int] = DEFAULT_NGRAM_RANGE,
+        metadata: Optional[Dict] = None,
+    ):
+        _require_numpy()
+        self.emotion_labels = list(emotion_labels)
+        self.scene_labels = list(scene_labels)
+        self.emotion_weights = np.asarray(emotion_weights, dtype=np.float32)
+        self.emotion_bias = np.asarray(emotion_bias, dtype=np.float32)
+        self.scene_weights = np.asarray(scene_weights, dtype=np.float32)
+        self.scene_bias = np.asarray(scene_bias, dtype=np.float32)
+        self.intensity_weights = np.asarray(intensity_weights, dtype=np.float32)
+        self.intensity_bias = float(intensity_bias)
+        self.hash_dim = int(hash_dim)
+        self.ngram_range = (int(ngram_range[0]), int(ngram_range[1]))
+        self.metadata = dict(metadata or {})
+
+        expected = {
+            "emotion_weights": (self.hash_dim, len(self.emotion_labels)),
+            "emotion_bias": (len(self.emotion_labels),),
+            "scene_weights": (self.hash_dim, len(self.scene_labels)),
+            "scene_bias": (len(self.scene_labels),),
+            "intensity_weights": (self.hash_dim,),
+        }
+        for name, shape in expected.items():
+            if getattr(self, name).shape != shape:
+                raise ValueError(f"{name} 形状为 {getattr(self, name).shape}，应为 {shape}")
+
+    @property
+    def version(self) -> str:
+        return str(self.metadata.get("model_version", "unknown"))
+
+    def predict(self, text: str) -> LocalPrediction:
+        """预测一条消息的情绪、场景、强度与置信度"""
+        features = hashed_ngrams(text, self.hash_dim, self.ngram_range)
+        if features:
+            index = np.fromiter(features.keys(), dtype=np.int64, count=len(features))
+            values = np.fromiter(features.values(), dtype=np.float32, count=len(features))
+            emotion_logits = values @ self.emotion_weights[index] + self.emotion_bias
+            scene_logits = values @ self.scene_weights[index] + self.scene_bias
+            intensity = float(values @ self.intensity_weights[index]) + self.intensity_bias
+        else:
+            emotion_logits = self.emotion_bias
+            scene_logits = self.scene_bias
+            intensity = self.intensity_bias
+
+        emotion_probs = _sigmoid(emotion_logits)
+        scene_probs = _softmax(scene_logits)
+
+        ranked = np.argsort(-emotion_probs)
+        chosen = [i for i in ranked[:MAX_EMOTIONS] if emotion_probs[i] >= 0.5] or [ranked[0]]
+        # 标签数不超过 MAX_EMOTIONS 时可能全部入选，此时没有“落选的最高分”可比
+        rejected = ranked[len(chosen)] if len(ranked) > len(chosen) else None
+        scene_index = int(np.argmax(scene_probs))
+        scene_score = float(scene_probs[scene_index])
+        rejected_margin = 1.0 - float(emotion_probs[rejected]) if rejected is not None else 1.0
+        confidence = min(float(emotion_probs[chosen[-1]]), rejected_margin, scene_score)
+
+        low, high = INTENSITY_RANGE
+        return LocalPrediction(
+            emotions=[self.emotion_labels[i] for i in chosen],
+            scene=self.scene_labels[scene_index],
+            intensity=int(max(low, min(high, round(intensity)))),
+            confidence=confidence,
+            emotion_scores={label: float(p) for label, p in zip(self.emotion_labels, emotion_probs)},
+            scene_score=scene_score,
+        )
+
+    def save(self, path: Path | str) -> None:
+        """保存为 .npz（数组 + JSON元数据）"""
+        metadata = dict(self.metadata)
+        metadata.update(
+            format_version=MODEL_FORMAT_VERSION,
+            emotion_labels=self.emotion_labels,
+            scene_labels=self.scene_labels,
+            hash_dim=self.hash_dim,
+            ngram_range=list(self.ngram_range),
+            intensity_bias=self.intensity_bias,
+        )
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                metadata=np.array(json.dumps(metadata, ensure_ascii=False)),
+                emotion_weights=self.emotion_weights,
+                emotion_bias=self.emotion_bias,
+                scene_weights=self.scene_weights,
+                scene_bias=self.scene_bias,
+                intensity_weights=self.intensity_weights,
+            )
+
+    @classmethod
+    def load(cls, path: Path | str) -> "LocalEmotionClassifier":
+        """从 .npz 加载；格式版本不一致时抛出 ValueError"""
+        _require_numpy()
+        with np.load(path, allow_pickle=False) as data:
+            metadata = json.loads(str(data["metadata"]))
+            version = metadata.get("format_version")
+            if version != MODEL_FORMAT_VERSION:
+                raise ValueError(f"权重文件格式版本为 {version}，当前支持 {MODEL_FORMAT_VERSION}，请重新训练")
+            return cls(
+                emotion_labels=metadata["emotion_labels"],
+                scene_labels=metadata["scene_labels"],
+                emotion_weights=data["emotion_weights"],
+                emotion_bias=data["emotion_bias"],
+                scene_weights=data["scene_weights"],
+                scene_bias=data["scene_bias"],
+                intensity_weights=data["intensity_weights"],
+                intensity_bias=metadata["intensity_bias"],
+                hash_dim=metadata["hash_dim"],
+                ngram_range=tuple(metadata["ngram_range"]),
+                metadata=metadata,
+            )
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-np.clip(x, -30.0, 30.0)))
+
+
+def _softmax(x):
+    shifted = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return shifted / np.sum(shifted, axis=-1, keepdims=True)
+
+
+def train_classifier(
+    samples: Sequence[TrainingSample],
+    emotion_labels: Sequence[str],
+    scene_labels: Sequence[str],
+    hash_dim: int = DEFAULT_HASH_DIM,
+    ngram_range: Tuple[int, int] = DEFAULT_NGRAM_RANGE,
+    epochs: int = 30,
+    learning_rate: float = 0.1,
+    l2: float = 1e-5,
+    batch_size: int = 128,
+    seed: int = 0,
+    model_version: Optional[str] = None,
+) -> LocalEmotionClassifier:
+    """
+    小批量 AdaGrad 训练三个头（情绪 BCE、场景交叉熵、强度均方误差）
+
+    哈希特征很稀疏，各桶出现频率相差很大，AdaGrad 按参数累计梯度平方缩放步长，少见的n-gram也能学到。
+    特征按样本稀疏保存，每个批次再展开成稠密矩阵，内存占用为 batch_size x hash_dim。
+    标签表之外的情绪/场景被忽略（场景不在表中的样本不参与场景头的训练）。
+    """
+    _require_numpy()
+    if not samples:
+        raise ValueError("没有训练样本")
+    emotion_index = {label: i for i, label in enumerate(emotion_labels)}
+    scene_index = {label: i for i, label in enumerate(scene_labels)}
+
+    features = [hashed_ngrams(s.text, hash_dim, ngram_range) for s in samples]
+    emotion_targets = np.zeros((len(samples), len(emotion_labels)), dtype=np.float32)
+    scene_targets = np.full(len(samples), -1, dtype=np.int64)
+    intensity_targets = np.zeros(len(samples), dtype=np.float32)
+    for row, sample in enumerate(samples):
+        for emotion in sample.emotions:
+            if emotion in emotion_index:
+                emotion_targets[row, emotion_index[emotion]] = 1.0
+        scene_targets[row] = scene_index.get(sample.scene, -1)
+        intensity_targets[row] = sample.intensity
+
+    rng = np.random.default_rng(seed)
+    emotion_weights = np.zeros((hash_dim, len(emotion_labels)), dtype=np.float32)
+    # 偏置从标签先验出发，稀有情绪一开始就倾向于不输出
+    prior = np.clip(emotion_targets.mean(axis=0), 1e-3, 1 - 1e-3)
+    emotion_bias = np.log(prior / (1 - prior)).astype(np.float32)
+    scene_weights = np.zeros((hash_dim, len(scene_labels)), dtype=np.float32)
+    scene_bias = np.zeros(len(scene_labels), dtype=np.float32)
+    intensity_weights = np.zeros(hash_dim, dtype=np.float32)
+    intensity_bias = np.array([intensity_targets.mean()], dtype=np.float32)
+
+    params = [emotion_weights, emotion_bias, scene_weights, scene_bias, intensity_weights, intensity_bias]
+    accumulators = [np.zeros_like(param) for param in params]
+
+    def step(grads) -> None:
+        for param, accumulator, grad in zip(params, accumulators, grads):
+            accumulator += grad * grad
+            param -= learning_rate * grad / (np.sqrt(accumulator) + 1e-8)
+
+    started = time.perf_counter()
+    for _ in range(epochs):
+        order = rng.permutation(len(samples))
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            x = np.zeros((len(rows), hash_dim), dtype=np.float32)
+            for i, row in enumerate(rows):
+                if features[row]:
+                    x[i, list(features[row].keys())] = list(features[row].values())
+
+            emotion_error = _sigmoid(x @ emotion_weights + emotion_bias) - emotion_targets[rows]
+
+            scene_error = np.zeros((len(rows), len(scene_labels)), dtype=np.float32)
+            labelled = scene_targets[rows] >= 0
+            if labelled.any():
+                scene_error[labelled] = _softmax(x[labelled] @ scene_weights + scene_bias)
+                scene_error[np.flatnonzero(labelled), scene_targets[rows][labelled]] -= 1.0
+
+            intensity_error = x @ intensity_weights + intensity_bias - intensity_targets[rows]
+
+            step([
+                x.T @ emotion_error / len(rows) + l2 * emotion_weights,
+                emotion_error.mean(axis=0),
+                x.T @ scene_error / max(1, int(labelled.sum())) + l2 * scene_weights,
+                scene_error.sum(axis=0) / max(1, int(labelled.sum())),
+                x.T @ intensity_error / len(rows) + l2 * intensity_weights,
+                intensity_error.mean(keepdims=True),
+            ])
+
+    metadata = {
+        "model_version": model_version or time.strftime("%Y%m%d%H%M%S"),
+        "trained_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "samples": len(samples),
+        "epochs": epochs,
+        "train_seconds": round(time.perf_counter() - started, 2),
+    }
+    return LocalEmotionClassifier(
+        emotion_labels=emotion_labels,
+        scene_labels=scene_labels,
+        emotion_weights=emotion_weights,
+        emotion_bias=emotion_bias,
+        scene_weights=scene_weights,
+        scene_bias=scene_bias,
+        intensity_weights=intensity_weights,
+        intensity_bias=float(intensity_bias[0]),
+        hash_dim=hash_dim,
+        ngram_range=ngram_range,
+        metadata=metadata,
+    )
+
+
+_classifier: Optional[LocalEmotionClassifier] = None
+_load_attempted = False
+_lock = threading.Lock()
+
+
+def load_local_classifier(path: Optional[Path | str] = None) -> Optional[LocalEmotionClassifier]:
+    """
+    加载权重文件并设为全局分类器（服务启动时调用）；未启用、NumPy 未安装、文件不存在或加载失败时返回 None
+    """
+    global _classifier, _load_attempted
+    with _lock:
+        _load_attempted = True
+        _classifier = None
+        if not local_classifier_enabled():
+            return None
+        if np is None:
+            logger.info("[Local Classifier] NumPy 未安装，不启用本地情绪分类器")
+            return None
+        path = Path(path) if path else local_classifier_path()
+        if not path.exists():
+            logger.info(f"[Local Classifier] 权重文件 {path} 不存在，不启用本地情绪分类器")
+            return None
+        try:
+            _classifier = LocalEmotionClassifier.load(path)
+        except Exception as e:
+            logger.warning(f"[Local Classifier] 加载 {path} 失败，不启用本地情绪分类器: {str(e)}")
+            return None
+        logger.info(
+            f"[Local Classifier] 已加载 {path}（版本 {_classifier.version}，"
+            f"{_classifier.metadata.get('samples', '?')} 条训练样本）"
+        )
+        return _classifier
+
+
+def get_local_classifier() -> Optional[LocalEmotionClassifier]:
+    """全局本地分类器（未在启动时加载过时，首次调用时加载）"""
+    if not _load_attempted:
+        return load_local_classifier()
+    return _classifier
@@ -0,0 +1,382 @@
+"""
+Prometheus 文本格式的进程内指标（/metrics）
+
+不依赖 prometheus_client，这里实现最小的 Counter / Gauge / Histogram 和文本导出（exposition format 0.0.4），
+足够让 Prometheus 直接抓取。标签只使用代码里已经知道的信息：
+
+- provider: provider名称（与解析统计、输出预算相同，如 openai / claude / failover）
+- model: provider 配置的模型名
+- mode: simple / structured / text / deep_step_N（深聊单步请求按步骤区分）
+- stage: 输出预算key中的阶段（chatting / exploring / summarizing / inviting / deep / emotion_parse ...）
+
+指标：
+- zhiqingyu_chat_latency_seconds{endpoint, stage}: 一轮对话端到端耗时（含解析、LLM调用与数据库提交）
+- zhiqingyu_chat_requests_in_flight{endpoint}: 正在处理的对话请求数
+- zhiqingyu_llm_completion_latency_seconds{provider, model, mode, stage}: 一次上游补全请求的耗时（不含缓存命中与限流排队）
+- zhiqingyu_llm_time_to_first_token_seconds{provider, model, mode, stage}: 流式请求收到第一个片段的耗时
+- zhiqingyu_llm_completions_in_flight{provider}: 正在进行的上游补全请求数
+- zhiqingyu_llm_completion_errors_total{provider, model, mode, stage}: 上游补全请求抛错的次数
+- zhiqingyu_llm_prompt_tokens_total / zhiqingyu_llm_completion_tokens_total{provider, model}: tokens用量
+- zhiqingyu_llm_json_parse_total{provider, outcome}: JSON解析结果（direct / repaired / failed）
+- zhiqingyu_llm_safe_reply_total{provider, mode}: 回退为 SAFE_REPLY 的次数
+- zhiqingyu_enhanced_parser_total{path}: 增强解析器的走向（rules / local / llm / llm_failed），llm与llm_failed之和的占比即LLM升级率，local为本地分类器代替LLM的次数
+- zhiqingyu_speculative_parse_total{outcome}: 推测式解析的结果（kept：草稿生成的回复保留；risk_raised / crisis_style：
+  精确解析改变了风险等级或风格，取消草稿重新生成；refine_failed：LLM增强解析失败，沿用规则草稿）
+- zhiqingyu_db_commit_latency_seconds: 数据库提交（含flush）耗时
+"""
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+NAMESPACE = "zhiqingyu"
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+DB_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def _format_value(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = f"{NAMESPACE}_{name}"
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 的标签应为 {self.labelnames}，得到 {tuple(labels)}")
+        return tuple("" if labels[name] is None else str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        if amount < 0:
+            raise ValueError("Counter只能增加")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    TYPE = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    @contextmanager
+    def track_inprogress(self, **labels: Any) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # 每组标签：[各桶计数（非累计）..., 总和, 总数]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels: Any) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return int(state[-1]) if state else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, state):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_bound(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {int(state[-1])}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    return _registry
+
+
+CHAT_LATENCY = _registry.register(Histogram(
+    "chat_latency_seconds", "End-to-end latency of one chat turn.", ("endpoint", "stage"),
+))
+CHAT_IN_FLIGHT = _registry.register(Gauge(
+    "chat_requests_in_flight", "Chat requests currently being processed.", ("endpoint",),
+))
+LLM_COMPLETION_LATENCY = _registry.register(Histogram(
+    "llm_completion_latency_seconds", "Latency of one upstream LLM completion request.",
+    ("provider", "model", "mode", "stage"),
+))
+LLM_TIME_TO_FIRST_TOKEN = _registry.register(Histogram(
+    "llm_time_to_first_token_seconds", "Time until the first streamed chunk of an LLM completion.",
+    ("provider", "model", "mode", "stage"),
+))
+LLM_IN_FLIGHT = _registry.register(Gauge(
+    "llm_completions_in_flight", "Upstream LLM completion requests currently in flight.", ("provider",),
+))
+LLM_ERRORS = _registry.register(Counter(
+    "llm_completion_errors_total", "Upstream LLM completion requests that raised.", ("provider", "model", "mode", "stage"),
+))
+LLM_PROMPT_TOKENS = _registry.register(Counter(
+    "llm_prompt_tokens_total", "Prompt tokens reported by the upstream API.", ("provider", "model"),
+))
+LLM_COMPLETION_TOKENS = _registry.register(Counter(
+    "llm_completion_tokens_total", "Completion tokens reported by the upstream API.", ("provider", "model"),
+))
+JSON_PARSE = _registry.register(Counter(
+    "llm_json_parse_total", "Outcomes of parsing LLM JSON output.", ("provider", "outcome"),
+))
+SAFE_REPLY_TOTAL = _registry.register(Counter(
+    "llm_safe_reply_total", "Replies that fell back to SAFE_REPLY.", ("provider", "mode"),
+))
+ENHANCED_PARSER = _registry.register(Counter(
+    "enhanced_parser_total", "Enhanced emotion parser outcomes: rules only, answered by the local classifier, escalated to the LLM, or LLM failed.", ("path",),
+))
+SPECULATIVE_PARSE = _registry.register(Counter(
+    "speculative_parse_total", "Speculative turns: draft reply kept, discarded and regenerated after the refined parse, or kept because refinement failed.", ("outcome",),
+))
+DB_COMMIT_LATENCY = _registry.register(Histogram(
+    "db_commit_latency_seconds", "Latency of database commits (including flush).", (), buckets=DB_LATENCY_BUCKETS,
+))
+
+
+_chat_turn_labels: contextvars.ContextVar[Optional[Dict[str, str]]] = contextvars.ContextVar("metrics_chat_turn", default=None)
+
+
+@contextmanager
+def chat_turn(endpoint: str) -> Iterator[None]:
+    """
+    记录一轮对话的端到端耗时与在途请求数，处理过程中用 annotate_chat_turn 补充 stage 标签
+
+    用法：
+        with chat_turn("chat"):
+            ...
+    """
+    labels = {"stage": ""}
+    token = _chat_turn_labels.set(labels)
+    start = time.perf_counter()
+    CHAT_IN_FLIGHT.inc(endpoint=endpoint)
+    try:
+        yield
+    finally:
+        CHAT_IN_FLIGHT.dec(endpoint=endpoint)
+        CHAT_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint, stage=labels["stage"])
+        try:
+            _chat_turn_labels.reset(token)
+        except ValueError:
+            # 流式响应的异步生成器可能在另一个上下文中被关闭
+            pass
+
+
+def annotate_chat_turn(stage: str) -> None:
+    """设置当前对话请求的 stage 标签，不在 chat_turn 中时忽略"""
+    labels = _chat_turn_labels.get()
+    if labels is not None:
+        labels["stage"] = stage or ""
+
+
+def install_db_metrics(session_factory: Any) -> None:
+    """在 Session 工厂上注册提交耗时的监听（before_commit 到 after_commit，包含flush）"""
+    from sqlalchemy import event
+
+    def before_commit(session):
+        session.info["metrics_commit_started"] = time.perf_counter()
+
+    def after_commit(session):
+        started = session.info.pop("metrics_commit_started", None)
+        if started is not None:
+            DB_COMMIT_LATENCY.observe(time.perf_counter() - started)
+
+    def after_soft_rollback(session, previous_transaction):
+        # 提交失败回滚时丢弃开始时间，不计入耗时
+        session.info.pop("metrics_commit_started", None)
+
+    event.listen(session_factory, "before_commit", before_commit)
+    event.listen(session_factory, "after_commit", after_commit)
+    event.listen(session_factory, "after_soft_rollback", after_soft_rollback)
+
+
+def _completion_labels(provider: Any, mode: str) -> Dict[str, str]:
+    # 延迟导入：providers 包会导入本模块
+    from app.core.providers.output_budget import current_budget_key
+
+    stage, step, provider_name = current_budget_key(provider._parse_stats_key(), mode)
+    return {
+        "provider": provider_name,
+        "model": getattr(provider, "model", None) or "",
+        "mode": f"deep_step_{step}" if stage == "deep" and step else mode,
+        "stage": stage,
+    }
+
+
+def _record_completion(labels: Dict[str, str], started: float, usage: Optional[Dict[str, Any]]) -> None:
+    LLM_COMPLETION_LATENCY.observe(time.perf_counter() - started, **labels)
+    if not usage:
+        return
+    token_labels = {"provider": labels["provider"], "model": labels["model"]}
+    if usage.get("prompt_tokens"):
+        LLM_PROMPT_TOKENS.inc(usage["prompt_tokens"], **token_labels)
+    if usage.get("completion_tokens"):
+        LLM_COMPLETION_TOKENS.inc(usage["completion_tokens"], **token_labels)
+
+
+def metered(func):
+    """包裹同步的 _perform_chat_completion(self, chat_messages, mode)：记录上游请求耗时、在途数与tokens"""
+
+    @functools.wraps(func)
+    def wrapper(self, chat_messages, mode: str):
+        labels = _completion_labels(self, mode)
+        started = time.perf_counter()
+        with LLM_IN_FLIGHT.track_inprogress(provider=labels["provider"]):
+            try:
+                result = func(self, chat_messages, mode)
+            except Exception:
+                LLM_ERRORS.inc(**labels)
+                raise
+        _record_completion(labels, started, result.get("usage") if isinstance(result, dict) else None)
+        return result
+
+    return wrapper
+
+
+def ametered(func):
+    """包裹异步的 _aperform_chat_completion(self, chat_messages, mode)，逻辑同 metered"""
+
+    @functools.wraps(func)
+    async def wrapper(self, chat_messages, mode: str):
+        labels = _completion_labels(self, mode)
+        started = time.perf_counter()
+        with LLM_IN_FLIGHT.track_inprogress(provider=labels["provider"]):
+            try:
+                result = await func(self, chat_messages, mode)
+            except Exception:
+                LLM_ERRORS.inc(**labels)
+                raise
+        _record_completion(labels, started, result.get("usage") if isinstance(result, dict) else None)
+        return result
+
+    return wrapper
+
+
+def metered_stream(func):
+    """包裹 _astream_chat_completion(self, chat_messages, mode, usage)：额外记录首个片段的耗时（TTFT）"""
+
+    @functools.wraps(func)
+    async def wrapper(self, chat_messages, mode: str, usage: Dict[str, Any]):
+        labels = _completion_labels(self, mode)
+        started = time.perf_counter()
+        first_chunk = True
+        with LLM_IN_FLIGHT.track_inprogress(provider=labels["provider"]):
+            try:
+                async for chunk in func(self, chat_messages, mode, usage):
+                    if first_chunk:
+                        LLM_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started, **labels)
+                        first_chunk = False
+                    yield chunk
+            except Exception:
+                LLM_ERRORS.inc(**labels)
+                raise
+        _record_completion(labels, started, usage)
+
+    return wrapper
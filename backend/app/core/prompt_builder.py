@@ -1,7 +1,11 @@
 """
 Prompt building utilities for LLM providers.
 """
-from typing import Any, Dict, List, Literal, Optional
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List, Literal, Optional
 
 from app.schemas.chat import ChatMessage
 from app.schemas.style import StyleProfile, ParsedState, ReplyPlan, InterventionConfig
@@ -69,26 +73,188 @@ def build_simple_prompt() -> str:
 只输出JSON，不要包含任何其他文本。"""
 
 
-def build_structured_prompt(
-    parsed: ParsedState,
-    style: StyleProfile,
-    plan: ReplyPlan,
-    interventions: List[InterventionConfig],
-    conversation_stage: Optional[Literal["chatting", "exploring", "summarizing", "inviting", "card_generated"]] = None,
-) -> str:
+@dataclass(frozen=True)
+class SystemPrompt:
     """
-    构建结构化回复模式的系统提示词。
-    
-    Args:
-        parsed: 情绪解析结果
-        style: 风格配置
-        plan: 回复计划
-        interventions: 干预模块列表
-        conversation_stage: 对话阶段
-        
-    Returns:
-        系统提示词字符串
+    拆分为固定前缀与动态后缀的系统提示词
+
+    static 只包含不随用户、轮次变化的内容（角色、阶段/步骤说明、规则、输出格式），放在最前面，
+    上游的前缀缓存（OpenAI自动前缀缓存、Anthropic cache_control、Gemini隐式缓存）才能跨请求命中；
+    dynamic 包含本轮的风格配置、用户状态、干预模块等。
+    """
+    static: str
+    dynamic: str
+
+    def __str__(self) -> str:
+        return f"{self.static}\n\n{self.dynamic}"
+
+    def __add__(self, other: str) -> "SystemPrompt":
+        # 追加的内容（如历史摘要）都属于动态部分
+        return SystemPrompt(self.static, self.dynamic + other)
+
+
+# 输出格式中需要按本轮用户状态填写的字段（固定前缀里只放说明，具体值放在动态后缀）
+INTENSITY_PLACEHOLDER = "情绪强度数字（按下方「输出要求」填写）"
+RISK_LEVEL_PLACEHOLDER = "风险等级（按下方「输出要求」填写）"
+
+
+def _style_section(style: StyleProfile, tone_suffix: str = "") -> str:
+    tone_desc = {
+        "gentle": "温和、柔和",
+        "neutral": "中性、冷静",
+        "firm": "坚定、直接",
+        "playful": "轻松、友好",
+    }.get(style.tone, "温和")
+
+    directness_desc = {
+        1: "非常委婉",
+        2: "委婉",
+        3: "适中",
+        4: "直接",
+        5: "非常直接",
+    }.get(style.directness, "适中")
+
+    return f"""当前风格配置：
+- 语气: {tone_desc}{tone_suffix}
+- 直白程度: {directness_desc} (1-5，当前为{style.directness})
+- 共情比重: {style.emotionFocus}/5
+- 理性分析比重: {style.analysisDepth}/5
+- 行动建议比重: {style.actionFocus}/5
+- 幽默程度: {style.jokingLevel}/5
+- 对敏感话题的安全偏好: {style.safetyBias}"""
+
+
+def _user_state_section(parsed: ParsedState) -> str:
+    return f"""当前用户状态：
+- 情绪: {', '.join(parsed.emotions)}
+- 强度: {parsed.intensity}/10
+- 场景: {parsed.scene}
+- 风险等级: {parsed.riskLevel}
+- 用户目标: {parsed.userGoal}"""
+
+
+def _interventions_text(interventions: List[InterventionConfig]) -> str:
+    from app.core.conversation_algorithm import INTERVENTION_DESCRIPTIONS
+
+    interv_descs = []
+    for interv in interventions:
+        desc = INTERVENTION_DESCRIPTIONS.get(interv.id, f"干预模块: {interv.id}")
+        interv_descs.append(f"- {interv.id}: {desc}")
+    return "\n".join(interv_descs) if interv_descs else "无特定干预模块"
+
+
+def _output_requirement(parsed: ParsedState) -> str:
+    # 规范化风险等级：parsed.riskLevel 应该是 "low", "medium", 或 "high"
+    risk_level_value = normalize_risk_level(parsed.riskLevel) if hasattr(parsed, 'riskLevel') else "low"
+    return f"""输出要求：
+- "intensity" 填 {parsed.intensity}
+- "risk_level" 填 "{risk_level_value}"
+
+只输出JSON，不要包含任何其他文本。"""
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
     """
+    预编译的提示词模板
+
+    static、风格配置和干预模块说明只取决于 (对话阶段/步骤, 风格, 干预模块)，编译一次后缓存；
+    每轮只需要代入 ParsedState 的字段（用户状态、intensity、risk_level）和本轮的附加段落。
+    """
+    static: str
+    style_text: str
+    interventions_text: Optional[str] = None
+
+    def render(self, parsed: ParsedState, extra_sections: List[str] = ()) -> SystemPrompt:
+        sections = [self.style_text, _user_state_section(parsed)]
+        if self.interventions_text:
+            sections.append(self.interventions_text)
+        sections.extend(extra_sections)
+        sections.append(_output_requirement(parsed))
+        return SystemPrompt(self.static, "\n\n".join(sections))
+
+
+class PromptTemplateCache:
+    """提示词模板的有界LRU缓存"""
+
+    def __init__(self, max_entries: int = 256):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, PromptTemplate]" = OrderedDict()
+        self.max_entries = max(1, max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compile(self, key: Hashable, compile_template: Callable[[], PromptTemplate]) -> PromptTemplate:
+        with self._lock:
+            template = self._entries.get(key)
+            if template is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return template
+            self.misses += 1
+
+        # 编译在锁外进行，并发未命中时最多重复编译一次，结果相同
+        template = compile_template()
+        with self._lock:
+            self._entries[key] = template
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return template
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+
+_template_cache: Optional[PromptTemplateCache] = None
+_template_cache_lock = threading.Lock()
+
+
+def get_prompt_template_cache() -> PromptTemplateCache:
+    """获取提示词模板缓存单例（容量：PROMPT_TEMPLATE_CACHE_MAX_ENTRIES，默认256）"""
+    global _template_cache
+    if _template_cache is None:
+        with _template_cache_lock:
+            if _template_cache is None:
+                try:
+                    max_entries = int(os.getenv("PROMPT_TEMPLATE_CACHE_MAX_ENTRIES", 256))
+                except ValueError:
+                    max_entries = 256
+                _template_cache = PromptTemplateCache(max_entries)
+    return _template_cache
+
+
+def _style_key(style: StyleProfile) -> tuple:
+    # 风格配置文件可能被修改后重新加载，除id外还带上参与渲染的字段，避免命中过期的模板
+    return (
+        style.id, style.tone, style.directness, style.emotionFocus, style.analysisDepth,
+        style.actionFocus, style.jokingLevel, style.safetyBias,
+    )
+
+
+def _interventions_key(interventions: List[InterventionConfig]) -> tuple:
+    return tuple(interv.id for interv in interventions)
+
+
+def _compile_structured_template(
+    style: StyleProfile,
+    interventions: List[InterventionConfig],
+    conversation_stage: Optional[str],
+) -> PromptTemplate:
+    """按对话阶段、风格和干预模块编译结构化回复模式的提示词模板（与本轮用户状态无关）"""
     # 根据对话阶段生成针对性的提示词
     stage_specific_instruction = ""
     if conversation_stage == "chatting":
@@ -143,78 +309,38 @@ def build_structured_prompt(
 - 让用户感受到这是出于关心和陪伴，而不是机械的服务
 """
     
-    tone_desc = {
-        "gentle": "温和、柔和",
-        "neutral": "中性、冷静",
-        "firm": "坚定、直接",
-        "playful": "轻松、友好",
-    }.get(style.tone, "温和")
-
-    directness_desc = {
-        1: "非常委婉",
-        2: "委婉",
-        3: "适中",
-        4: "直接",
-        5: "非常直接",
-    }.get(style.directness, "适中")
-
-    from app.core.conversation_algorithm import INTERVENTION_DESCRIPTIONS
-
-    interv_descs = []
-    for interv in interventions:
-        desc = INTERVENTION_DESCRIPTIONS.get(interv.id, f"干预模块: {interv.id}")
-        interv_descs.append(f"- {interv.id}: {desc}")
-    interv_text = "\n".join(interv_descs) if interv_descs else "无特定干预模块"
-
-    # 规范化风险等级：parsed.riskLevel 应该是 "low", "medium", 或 "high"
-    risk_level_value = normalize_risk_level(parsed.riskLevel) if hasattr(parsed, 'riskLevel') else "low"
+    style_text = _style_section(style, "（请确保语气温暖、亲切、有人情味）")
+    interv_text = _interventions_text(interventions)
 
     # 阶段3（summarizing）：单独处理，只做温柔总结和简单反问确认
     if conversation_stage == "summarizing":
-        return f"""你是一个温暖的情绪陪伴 AI，受过基础心理学训练，但不是医生，不进行诊断或治疗。
+        static = f"""你是一个温暖的情绪陪伴 AI，受过基础心理学训练，但不是医生，不进行诊断或治疗。
 {stage_specific_instruction}
 
-当前风格配置：
-- 语气: {tone_desc}（请确保语气温暖、亲切、有人情味）
-- 直白程度: {directness_desc} (1-5，当期为{style.directness})
-- 共情比重: {style.emotionFocus}/5
-- 理性分析比重: {style.analysisDepth}/5
-- 行动建议比重: {style.actionFocus}/5
-- 幽默程度: {style.jokingLevel}/5
-- 对敏感话题的安全偏好: {style.safetyBias}
-
 请遵守（用温暖的方式）：
 - 不使用羞辱、不鼓励自责、不鼓励自伤或他伤
 - 避免极端措辞（如"必须"、"永远"、"完全不可能"）
 - 避免人格评判（如"你就是太懒"）
 - 用词要自然、温暖、有人情味，避免生硬、机械或过于正式的表达
 
-当前用户状态：
-- 情绪: {', '.join(parsed.emotions)}
-- 强度: {parsed.intensity}/10
-- 场景: {parsed.scene}
-- 风险等级: {parsed.riskLevel}
-- 用户目标: {parsed.userGoal}
-
 请以严格的JSON格式输出，格式如下：
 {{
   "theme": "本次对话的核心主题（简洁概括，10-20字）",
   "reply": "一段简洁、温暖、有人情味的回复（温柔总结用户分享的核心内容，然后简单反问'我说的对吗？'）",
   "emotion": "情绪标签（从用户情绪中选择一个）",
-  "intensity": {parsed.intensity},
+  "intensity": {INTENSITY_PLACEHOLDER},
   "topics": ["主题1", "主题2"],
-  "risk_level": "{risk_level_value}"
+  "risk_level": "{RISK_LEVEL_PLACEHOLDER}"
 }}
 
 注意：
 - 只需要生成一段自然语言回复，不要分5个步骤
-- 重点是温柔总结+简单反问确认，不要继续提问或引导用户分享更多
-
-只输出JSON，不要包含任何其他文本。"""
+- 重点是温柔总结+简单反问确认，不要继续提问或引导用户分享更多"""
+        return PromptTemplate(static, style_text)
 
     # 引导阶段（chatting/exploring）：只做轻量提问和共情，不暴露5步骤结构
     if conversation_stage in ["chatting", "exploring"]:
-        return f"""你是一个温暖的情绪陪伴 AI，受过基础心理学训练，但不是医生，不进行诊断或治疗。
+        static = f"""你是一个温暖的情绪陪伴 AI，受过基础心理学训练，但不是医生，不进行诊断或治疗。
 {stage_specific_instruction}
 你的目标是：在当前引导阶段，用温暖、真诚、有人情味的方式，简单接住用户情绪，并通过1-2个开放式问题，温柔地邀请用户多说一点。
 
@@ -225,15 +351,6 @@ def build_structured_prompt(
 - 控制字数在阶段提示中建议的范围内（通常200-500字）
 - 让用户感受到被理解、被接住，而不是被分析或被指导
 
-当前风格配置：
-- 语气: {tone_desc}（请确保语气温暖、亲切、有人情味）
-- 直白程度: {directness_desc} (1-5，当期为{style.directness})
-- 共情比重: {style.emotionFocus}/5
-- 理性分析比重: {style.analysisDepth}/5
-- 行动建议比重: {style.actionFocus}/5
-- 幽默程度: {style.jokingLevel}/5
-- 对敏感话题的安全偏好: {style.safetyBias}
-
 请遵守（用温暖的方式）：
 - 不使用羞辱、不鼓励自责、不鼓励自伤或他伤
 - 避免极端措辞（如"必须"、"永远"、"完全不可能"）
@@ -241,70 +358,24 @@ def build_structured_prompt(
 - 先回应情绪，再用1-2个温柔的开放式问题邀请用户多说
 - 用词要自然、温暖、有人成分，避免生硬、机械或过于正式的表达
 
-当前用户状态：
-- 情绪: {', '.join(parsed.emotions)}
-- 强度: {parsed.intensity}/10
-- 场景: {parsed.scene}
-- 风险等级: {parsed.riskLevel}
-- 用户目标: {parsed.userGoal}
-
-建议采用的干预模块（仅作为语气参考，不需要显式提及）：
-{interv_text}
-
 请以严格的JSON格式输出，格式如下：
 {{
   "theme": "本次对话的核心主题（简洁概括，10-20字）",
   "reply": "一段简洁、温暖、有人情味的回复（以共情 + 1-2个开放式提问为主）",
   "emotion": "情绪标签（从用户情绪中选择一个）",
-  "intensity": {parsed.intensity},
+  "intensity": {INTENSITY_PLACEHOLDER},
   "topics": ["主题1", "主题2"],
-  "risk_level": "{risk_level_value}"
+  "risk_level": "{RISK_LEVEL_PLACEHOLDER}"
 }}
 
 注意：
 - 只需要生成一段自然语言回复，不要分5个步骤
 - 不要输出任何分析、解释、建议或行动计划
-- 不要暴露“步骤1/步骤2”等结构化用语
-- 只输出JSON，不要包含任何其他文本。"""
+- 不要暴露“步骤1/步骤2”等结构化用语"""
+        return PromptTemplate(static, style_text, f"建议采用的干预模块（仅作为语气参考，不需要显式提及）：\n{interv_text}")
 
     # 非引导阶段：始终使用5步骤模式（card_data），不再使用传统三部分模式
-    steps_desc = []
-    step_contents = getattr(plan, 'stepContents', {})
-
-    step_names = {
-        1: "情绪接住 & 问题确认",
-        2: "结构化拆解问题",
-        3: "专业视角解释（说人话）",
-        4: "小步可执行建议",
-        5: "温柔收尾 & 小结"
-    }
-
-    # 如果计划中指定了要执行的步骤，则按指定顺序，否则默认执行1-5步
-    steps_to_execute = getattr(plan, 'stepsToExecute', None) or [1, 2, 3, 4, 5]
-
-    for step_num in steps_to_execute:
-        step_name = step_names.get(step_num, f"步骤{step_num}")
-        step_info = step_contents.get(step_num, {})
-        required_elements = step_info.get("required_elements", {})
-
-        step_desc = f"步骤{step_num}：{step_name}\n"
-        if step_num == 1:
-            step_desc += f"  - 情绪镜像：{required_elements.get('emotion_mirror', '识别并镜像用户情绪')}\n"
-            step_desc += f"  - 问题复述：{required_elements.get('problem_restate', '用自己的话复述用户问题')}\n"
-        elif step_num == 2:
-            step_desc += "  - 问题拆解：将问题拆成2-3个层面（现实层/情绪层/思维层），用用户的内容作为例子\n"
-        elif step_num == 3:
-            step_desc += "  - 专业解释：引入1-2个心理学概念，用通俗语言解释，结合用户例子\n"
-        elif step_num == 4:
-            step_desc += "  - 行动建议：提供1-3条具体可执行建议，每条包含做什么、什么时候做、大约多久（5-30分钟可完成）\n"
-        elif step_num == 5:
-            step_desc += "  - 收尾小结：简要回顾本轮做了什么，肯定用户努力，提供温和的延续方向\n"
-
-        steps_desc.append(step_desc)
-
-    steps_text = "\n".join(steps_desc)
-
-    return f"""你是一个温暖的情绪陪伴 AI，受过基础心理学训练，但不是医生，不进行诊断或治疗。
+    static = f"""你是一个温暖的情绪陪伴 AI，受过基础心理学训练，但不是医生，不进行诊断或治疗。
 {stage_specific_instruction}
 你的目标是：用温暖、共情的方式，按照5步骤系统，从多个层面来回应用户。
 
@@ -317,15 +388,6 @@ def build_structured_prompt(
 - 每个步骤的内容应该足够详细，能够为用户提供实质性的帮助和洞察
 - 语气要温暖、亲切、有人成分，用词要自然、温暖，避免生硬、机械或过于正式的表达
 
-当前风格配置：
-- 语气: {tone_desc}（请确保语气温暖、亲切、有人情味）
-- 直白程度: {directness_desc} (1-5，当期为{style.directness})
-- 共情比重: {style.emotionFocus}/5
-- 理性分析比重: {style.analysisDepth}/5
-- 行动建议比重: {style.actionFocus}/5
-- 幽默程度: {style.jokingLevel}/5
-- 对敏感话题的安全偏好: {style.safetyBias}
-
 请遵守（用温暖的方式）：
 - 不使用羞辱、不鼓励自责、不鼓励自伤或他伤
 - 避免极端措辞（如"必须"、"永远"、"完全不可能"）
@@ -333,20 +395,7 @@ def build_structured_prompt(
 - 先回应情绪，再谈分析或建议
 - 用词要自然、温暖、有人成分，避免生硬、机械或过于正式的表达
 
-当前用户状态：
-- 情绪: {', '.join(parsed.emotions)}
-- 强度: {parsed.intensity}/10
-- 场景: {parsed.scene}
-- 风险等级: {parsed.riskLevel}
-- 用户目标: {parsed.userGoal}
-
-建议采用的干预模块：
-{interv_text}
-
-本轮要执行的步骤（按顺序）：
-{steps_text}
-
-请按照上述步骤生成回复，每个步骤要自然衔接。对于 risk_level = "high" 的情况，必须：
+请按照下方「本轮要执行的步骤」生成回复，每个步骤要自然衔接。对于 risk_level = "high" 的情况，必须：
 - 不提供任何具体方法或工具
 - 强调理解和关心
 - 引导用户联系现实世界可信的人（亲友、老师、医生等）
@@ -362,9 +411,9 @@ def build_structured_prompt(
   "step4_suggestions": ["Step 4的建议1（做什么、什么时候做、大约多久）", "Step 4的建议2", "Step 4的建议3"],
   "step5_summary": "Step 5的收尾小结（简要回顾、肯定用户努力、提供温暖的延续方向）",
   "emotion": "情绪标签（从用户情绪中选择一个）",
-  "intensity": {parsed.intensity},
+  "intensity": {INTENSITY_PLACEHOLDER},
   "topics": ["主题1", "主题2"],
-  "risk_level": "{risk_level_value}"
+  "risk_level": "{RISK_LEVEL_PLACEHOLDER}"
 }}
 
 注意：
@@ -374,77 +423,123 @@ def build_structured_prompt(
 - step2_breakdown 是Step 2的必需要素
 - step3_explanation 是Step 3的必需要素
 - step4_suggestions 是Step 4的必需要素（数组格式，每条建议要具体可执行）
-- step5_summary 是Step 5的必需要素
+- step5_summary 是Step 5的必需要素"""
+    return PromptTemplate(static, style_text, f"建议采用的干预模块：\n{interv_text}")
 
-只输出JSON，不要包含任何其他文本。"""
 
+def _steps_text(plan: ReplyPlan) -> str:
+    """本轮要执行的步骤说明（步骤1的要素来自本轮的回复计划）"""
+    steps_desc = []
+    step_contents = getattr(plan, 'stepContents', {})
 
-def build_single_step_prompt(
-    step_num: int,
+    step_names = {
+        1: "情绪接住 & 问题确认",
+        2: "结构化拆解问题",
+        3: "专业视角解释（说人话）",
+        4: "小步可执行建议",
+        5: "温柔收尾 & 小结"
+    }
+
+    # 如果计划中指定了要执行的步骤，则按指定顺序，否则默认执行1-5步
+    steps_to_execute = getattr(plan, 'stepsToExecute', None) or [1, 2, 3, 4, 5]
+
+    for step_num in steps_to_execute:
+        step_name = step_names.get(step_num, f"步骤{step_num}")
+        step_info = step_contents.get(step_num, {})
+        required_elements = step_info.get("required_elements", {})
+
+        step_desc = f"步骤{step_num}：{step_name}\n"
+        if step_num == 1:
+            step_desc += f"  - 情绪镜像：{required_elements.get('emotion_mirror', '识别并镜像用户情绪')}\n"
+            step_desc += f"  - 问题复述：{required_elements.get('problem_restate', '用自己的话复述用户问题')}\n"
+        elif step_num == 2:
+            step_desc += "  - 问题拆解：将问题拆成2-3个层面（现实层/情绪层/思维层），用用户的内容作为例子\n"
+        elif step_num == 3:
+            step_desc += "  - 专业解释：引入1-2个心理学概念，用通俗语言解释，结合用户例子\n"
+        elif step_num == 4:
+            step_desc += "  - 行动建议：提供1-3条具体可执行建议，每条包含做什么、什么时候做、大约多久（5-30分钟可完成）\n"
+        elif step_num == 5:
+            step_desc += "  - 收尾小结：简要回顾本轮做了什么，肯定用户努力，提供温和的延续方向\n"
+
+        steps_desc.append(step_desc)
+
+    return "\n".join(steps_desc)
+
+
+def build_structured_prompt(
     parsed: ParsedState,
     style: StyleProfile,
     plan: ReplyPlan,
     interventions: List[InterventionConfig],
-    previous_steps: Dict[int, Dict[str, Any]] = None,
-) -> str:
+    conversation_stage: Optional[Literal["chatting", "exploring", "summarizing", "inviting", "card_generated"]] = None,
+) -> SystemPrompt:
     """
-    为单个步骤构建系统提示词。
+    构建结构化回复模式的系统提示词。
     
     Args:
-        step_num: 步骤编号 (1-5)
         parsed: 情绪解析结果
         style: 风格配置
         plan: 回复计划
         interventions: 干预模块列表
-        previous_steps: 已完成的步骤结果（用于上下文）
+        conversation_stage: 对话阶段
         
     Returns:
-        系统提示词字符串
+        系统提示词（固定前缀按对话阶段区分，与用户无关）
     """
-    if previous_steps is None:
-        previous_steps = {}
-    
-    tone_desc = {
-        "gentle": "温和、柔和",
-        "neutral": "中性、冷静",
-        "firm": "坚定、直接",
-        "playful": "轻松、友好",
-    }.get(style.tone, "温和")
+    template = get_prompt_template_cache().get_or_compile(
+        ("structured", conversation_stage, _style_key(style), _interventions_key(interventions)),
+        lambda: _compile_structured_template(style, interventions, conversation_stage),
+    )
+    extra_sections = []
+    if conversation_stage not in ("summarizing", "chatting", "exploring"):
+        extra_sections.append(f"本轮要执行的步骤（按顺序）：\n{_steps_text(plan)}")
+    return template.render(parsed, extra_sections)
+
+
+# 深聊模式的步骤依赖关系（DAG）：步骤 -> 生成该步骤时需要作为上下文的前置步骤
+# 步骤2/3/4只需要步骤1的情绪接住与问题复述，可以并行生成；步骤5的收尾小结需要回顾前面所有步骤
+STEP_DEPENDENCIES: Dict[int, tuple[int, ...]] = {
+    1: (),
+    2: (1,),
+    3: (1,),
+    4: (1,),
+    5: (1, 2, 3, 4),
+}
 
-    directness_desc = {
-        1: "非常委婉",
-        2: "委婉",
-        3: "适中",
-        4: "直接",
-        5: "非常直接",
-    }.get(style.directness, "适中")
 
-    from app.core.conversation_algorithm import INTERVENTION_DESCRIPTIONS
+# 每个步骤在结构化JSON中对应的字段（single_shot 深聊引擎据此判断哪些步骤需要补发请求）
+STEP_FIELDS: Dict[int, tuple[str, ...]] = {
+    1: ("step1_emotion_mirror", "step1_problem_restate"),
+    2: ("step2_breakdown",),
+    3: ("step3_explanation",),
+    4: ("step4_suggestions",),
+    5: ("step5_summary",),
+}
 
-    interv_descs = []
-    for interv in interventions:
-        desc = INTERVENTION_DESCRIPTIONS.get(interv.id, f"干预模块: {interv.id}")
-        interv_descs.append(f"- {interv.id}: {desc}")
-    interv_text = "\n".join(interv_descs) if interv_descs else "无特定干预模块"
 
-    risk_level_value = normalize_risk_level(parsed.riskLevel) if hasattr(parsed, 'riskLevel') else "low"
+def get_step_dependencies(step_num: int, steps_to_execute: List[int]) -> List[int]:
+    """返回本轮实际要执行的步骤中，step_num 依赖的前置步骤"""
+    return [dep for dep in STEP_DEPENDENCIES.get(step_num, ()) if dep in steps_to_execute]
 
-    # 获取当前步骤的规划内容
-    step_contents = getattr(plan, 'stepContents', {})
-    step_info = step_contents.get(step_num, {})
-    required_elements = step_info.get("required_elements", {})
-    
-    # 步骤描述
-    step_names = {
-        1: "情绪接住 & 问题确认",
-        2: "结构化拆解问题",
-        3: "专业视角解释（说人话）",
-        4: "小步可执行建议",
-        5: "温柔收尾 & 小结"
-    }
-    step_name = step_names.get(step_num, f"步骤{step_num}")
-    
-    # 构建已完成的步骤上下文（用于后续步骤参考）
+
+def get_missing_steps(result_dict: Dict[str, Any], steps_to_execute: List[int]) -> List[int]:
+    """返回结构化结果中字段缺失或为空的步骤"""
+    missing = []
+    for step_num in steps_to_execute:
+        for field in STEP_FIELDS.get(step_num, ()):
+            value = result_dict.get(field)
+            if isinstance(value, list):
+                value = [item for item in value if isinstance(item, str) and item.strip()]
+            elif isinstance(value, str):
+                value = value.strip()
+            if not value:
+                missing.append(step_num)
+                break
+    return missing
+
+
+def _previous_steps_context(previous_steps: Dict[int, Dict[str, Any]]) -> str:
+    """已完成步骤的摘要（用于后续步骤参考）"""
     previous_context = ""
     if previous_steps:
         previous_context = "\n\n已完成的步骤：\n"
@@ -471,237 +566,80 @@ def build_single_step_prompt(
             elif prev_step_num == 5:
                 if prev_data.get("step5_summary"):
                     previous_context += f"- 步骤5（收尾小结）：{prev_data.get('step5_summary', '')[:100]}...\n"
-    
-    # 根据步骤编号构建不同的提示词
-    if step_num == 1:
-        # Step 1: 情绪接住 & 问题确认
-        return f"""你是一个情绪陪伴 AI，受过基础心理学训练，但不是医生，不进行诊断或治疗。
-
-你的任务是：完成步骤1 - {step_name}
+    return previous_context.strip()
 
-重要要求：
-- 你的回复应该详细、丰富、有深度，不要过于简短
-- 内容要充实，不能只是"下一步预告"
-- 可以包含具体的例子、场景描述、情感共鸣等内容
-- 让用户感受到被充分理解和关心
-
-当前风格配置：
-- 语气: {tone_desc}
-- 直白程度: {directness_desc} (1-5，当前为{style.directness})
-- 共情比重: {style.emotionFocus}/5
-- 理性分析比重: {style.analysisDepth}/5
-- 行动建议比重: {style.actionFocus}/5
-- 幽默程度: {style.jokingLevel}/5
-- 对敏感话题的安全偏好: {style.safetyBias}
-
-请遵守：
-- 不使用羞辱、不鼓励自责、不鼓励自伤或他伤
-- 避免极端措辞（如"必须"、"永远"、"完全不可能"）
-- 避免人格评判（如"你就是太懒"）
-- 先回应情绪，再谈分析或建议
-
-当前用户状态：
-- 情绪: {', '.join(parsed.emotions)}
-- 强度: {parsed.intensity}/10
-- 场景: {parsed.scene}
-- 风险等级: {parsed.riskLevel}
-- 用户目标: {parsed.userGoal}
-
-建议采用的干预模块：
-{interv_text}
 
-步骤1的具体要求：
+def _step1_requirements(plan: ReplyPlan) -> str:
+    """步骤1的具体要求（来自本轮的回复计划）"""
+    required_elements = getattr(plan, 'stepContents', {}).get(1, {}).get("required_elements", {})
+    return f"""步骤1的具体要求：
 - 情绪镜像：{required_elements.get('emotion_mirror', '识别并镜像用户情绪，明确点出1-2个情绪词')}
 - 问题复述：{required_elements.get('problem_restate', '用自己的话复述用户问题，整理成更清晰的表达')}
-{'- 正常化：' + required_elements.get('normalization', '') if required_elements.get('normalization') else ''}
+{'- 正常化：' + required_elements.get('normalization', '') if required_elements.get('normalization') else ''}"""
 
-{previous_context}
-
-请以严格的JSON格式输出，格式如下：
-{{
-  "step1_emotion_mirror": "情绪镜像句子（识别并镜像用户情绪，明确点出1-2个情绪词，200-300字）",
-  "step1_problem_restate": "问题复述段落（用自己的话复述用户问题，整理成更清晰的表达，300-500字）",
-  "emotion": "情绪标签（从用户情绪中选择一个）",
-  "intensity": {parsed.intensity},
-  "topics": ["主题1", "主题2"],
-  "risk_level": "{risk_level_value}"
-}}
 
-只输出JSON，不要包含任何其他文本。"""
+def _compile_step_template(
+    step_num: int,
+    style: StyleProfile,
+    interventions: List[InterventionConfig],
+) -> PromptTemplate:
+    """按步骤编号、风格和干预模块编译深聊单步骤的提示词模板（与本轮用户状态无关）"""
+    # 步骤描述
+    step_names = {
+        1: "情绪接住 & 问题确认",
+        2: "结构化拆解问题",
+        3: "专业视角解释（说人话）",
+        4: "小步可执行建议",
+        5: "温柔收尾 & 小结"
+    }
+    step_name = step_names.get(step_num, f"步骤{step_num}")
 
+    # 根据步骤编号构建不同的要求和输出格式（只包含与用户无关的内容）
+    extra_rules = ""
+    high_risk_rules = ""
+    if step_num == 1:
+        # Step 1: 情绪接住 & 问题确认（具体要求来自回复计划，放在动态部分）
+        extra_rules = "\n- 先回应情绪，再谈分析或建议"
+        step_requirements = "- 按下方「步骤1的具体要求」完成情绪镜像和问题复述"
+        output_fields = """  "step1_emotion_mirror": "情绪镜像句子（识别并镜像用户情绪，明确点出1-2个情绪词，200-300字）",
+  "step1_problem_restate": "问题复述段落（用自己的话复述用户问题，整理成更清晰的表达，300-500字）","""
     elif step_num == 2:
         # Step 2: 结构化拆解问题
-        return f"""你是一个情绪陪伴 AI，受过基础心理学训练，但不是医生，不进行诊断或治疗。
-
-你的任务是：完成步骤2 - {step_name}
-
-重要要求：
-- 你的回复应该详细、丰富、有深度，不要过于简短
-- 内容要充实，不能只是"下一步预告"
-- 可以包含具体的例子、场景描述、情感共鸣等内容
-- 让用户感受到被充分理解和关心
-
-当前风格配置：
-- 语气: {tone_desc}
-- 直白程度: {directness_desc} (1-5，当前为{style.directness})
-- 共情比重: {style.emotionFocus}/5
-- 理性分析比重: {style.analysisDepth}/5
-- 行动建议比重: {style.actionFocus}/5
-- 幽默程度: {style.jokingLevel}/5
-- 对敏感话题的安全偏好: {style.safetyBias}
-
-请遵守：
-- 不使用羞辱、不鼓励自责、不鼓励自伤或他伤
-- 避免极端措辞（如"必须"、"永远"、"完全不可能"）
-- 避免人格评判（如"你就是太懒"）
-
-当前用户状态：
-- 情绪: {', '.join(parsed.emotions)}
-- 强度: {parsed.intensity}/10
-- 场景: {parsed.scene}
-- 风险等级: {parsed.riskLevel}
-- 用户目标: {parsed.userGoal}
-
-建议采用的干预模块：
-{interv_text}
-
-步骤2的具体要求：
-- 问题拆解：将问题拆成2-3个层面（现实层/情绪层/思维层），用用户的内容作为例子
+        step_requirements = """- 问题拆解：将问题拆成2-3个层面（现实层/情绪层/思维层），用用户的内容作为例子
 - 每个层面都要详细说明，不能只是简单列举
-- 用用户的具体内容作为例子来说明每个层面
-
-{previous_context}
-
-请以严格的JSON格式输出，格式如下：
-{{
-  "step2_breakdown": "问题拆解内容（将问题拆成2-3个层面，用用户的内容作为例子，500-800字）",
-  "emotion": "情绪标签（从用户情绪中选择一个）",
-  "intensity": {parsed.intensity},
-  "topics": ["主题1", "主题2"],
-  "risk_level": "{risk_level_value}"
-}}
-
-只输出JSON，不要包含任何其他文本。"""
-
+- 用用户的具体内容作为例子来说明每个层面"""
+        output_fields = """  "step2_breakdown": "问题拆解内容（将问题拆成2-3个层面，用用户的内容作为例子，500-800字）","""
     elif step_num == 3:
         # Step 3: 专业视角解释（说人话）
-        return f"""你是一个情绪陪伴 AI，受过基础心理学训练，但不是医生，不进行诊断或治疗。
-
-你的任务是：完成步骤3 - {step_name}
-
-重要要求：
-- 你的回复应该详细、丰富、有深度，不要过于简短
-- 内容要充实，不能只是"下一步预告"
-- 可以包含具体的例子、场景描述、情感共鸣等内容
-- 让用户感受到被充分理解和关心
-
-当前风格配置：
-- 语气: {tone_desc}
-- 直白程度: {directness_desc} (1-5，当前为{style.directness})
-- 共情比重: {style.emotionFocus}/5
-- 理性分析比重: {style.analysisDepth}/5
-- 行动建议比重: {style.actionFocus}/5
-- 幽默程度: {style.jokingLevel}/5
-- 对敏感话题的安全偏好: {style.safetyBias}
-
-请遵守：
-- 不使用羞辱、不鼓励自责、不鼓励自伤或他伤
-- 避免极端措辞（如"必须"、"永远"、"完全不可能"）
-- 避免人格评判（如"你就是太懒"）
-
-当前用户状态：
-- 情绪: {', '.join(parsed.emotions)}
-- 强度: {parsed.intensity}/10
-- 场景: {parsed.scene}
-- 风险等级: {parsed.riskLevel}
-- 用户目标: {parsed.userGoal}
-
-建议采用的干预模块：
-{interv_text}
-
-步骤3的具体要求：
-- 专业解释：引入1-2个心理学概念，用通俗语言解释，结合用户例子
+        step_requirements = """- 专业解释：引入1-2个心理学概念，用通俗语言解释，结合用户例子
 - 不要使用过于专业的术语，要用"说人话"的方式解释
-- 每个概念都要结合用户的具体情况来说明
-
-{previous_context}
-
-请以严格的JSON格式输出，格式如下：
-{{
-  "step3_explanation": "专业解释内容（引入1-2个心理学概念，用通俗语言解释，结合用户例子，500-800字）",
-  "emotion": "情绪标签（从用户情绪中选择一个）",
-  "intensity": {parsed.intensity},
-  "topics": ["主题1", "主题2"],
-  "risk_level": "{risk_level_value}"
-}}
-
-只输出JSON，不要包含任何其他文本。"""
-
+- 每个概念都要结合用户的具体情况来说明"""
+        output_fields = """  "step3_explanation": "专业解释内容（引入1-2个心理学概念，用通俗语言解释，结合用户例子，500-800字）","""
     elif step_num == 4:
         # Step 4: 小步可执行建议
-        return f"""你是一个情绪陪伴 AI，受过基础心理学训练，但不是医生，不进行诊断或治疗。
-
-你的任务是：完成步骤4 - {step_name}
-
-重要要求：
-- 你的回复应该详细、丰富、有深度，不要过于简短
-- 内容要充实，不能只是"下一步预告"
-- 可以包含具体的例子、场景描述、情感共鸣等内容
-- 让用户感受到被充分理解和关心
-
-当前风格配置：
-- 语气: {tone_desc}
-- 直白程度: {directness_desc} (1-5，当前为{style.directness})
-- 共情比重: {style.emotionFocus}/5
-- 理性分析比重: {style.analysisDepth}/5
-- 行动建议比重: {style.actionFocus}/5
-- 幽默程度: {style.jokingLevel}/5
-- 对敏感话题的安全偏好: {style.safetyBias}
-
-请遵守：
-- 不使用羞辱、不鼓励自责、不鼓励自伤或他伤
-- 避免极端措辞（如"必须"、"永远"、"完全不可能"）
-- 避免人格评判（如"你就是太懒"）
-
-当前用户状态：
-- 情绪: {', '.join(parsed.emotions)}
-- 强度: {parsed.intensity}/10
-- 场景: {parsed.scene}
-- 风险等级: {parsed.riskLevel}
-- 用户目标: {parsed.userGoal}
-
-建议采用的干预模块：
-{interv_text}
-
-步骤4的具体要求：
-- 行动建议：提供1-3条具体可执行建议，每条包含做什么、什么时候做、大约多久（5-30分钟可完成）
+        step_requirements = """- 行动建议：提供1-3条具体可执行建议，每条包含做什么、什么时候做、大约多久（5-30分钟可完成）
 - 每条建议都要具体、可操作，不能是空泛的"要努力"、"要加油"等
-- 建议要小而可行，让用户能够立即开始执行
-
-{previous_context}
+- 建议要小而可行，让用户能够立即开始执行"""
+        high_risk_rules = """
 
 对于 risk_level = "high" 的情况，必须：
 - 不提供任何具体方法或工具
 - 强调理解和关心
 - 引导用户联系现实世界可信的人（亲友、老师、医生等）
-- 提醒用户尽快寻求专业心理或医疗帮助
-
-请以严格的JSON格式输出，格式如下：
-{{
-  "step4_suggestions": ["建议1（做什么、什么时候做、大约多久）", "建议2", "建议3"],
-  "emotion": "情绪标签（从用户情绪中选择一个）",
-  "intensity": {parsed.intensity},
-  "topics": ["主题1", "主题2"],
-  "risk_level": "{risk_level_value}"
-}}
-
-只输出JSON，不要包含任何其他文本。"""
-
+- 提醒用户尽快寻求专业心理或医疗帮助"""
+        output_fields = """  "step4_suggestions": ["建议1（做什么、什么时候做、大约多久）", "建议2", "建议3"],"""
     elif step_num == 5:
         # Step 5: 温柔收尾 & 小结
-        return f"""你是一个情绪陪伴 AI，受过基础心理学训练，但不是医生，不进行诊断或治疗。
+        step_requirements = """- 收尾小结：简要回顾本轮做了什么，肯定用户努力，提供温和的延续方向
+- 回顾要简洁但全面，涵盖前面4个步骤的主要内容
+- 肯定用户的努力和勇气，给予鼓励
+- 提供温和的延续方向，不要给用户压力"""
+        output_fields = """  "step5_summary": "收尾小结（简要回顾、肯定用户努力、提供延续方向，300-500字）",
+  "theme": "本次对话的核心主题（简洁概括，10-20字）","""
 
-你的任务是：完成步骤5 - {step_name}
+    static = f"""你是一个情绪陪伴 AI，受过基础心理学训练，但不是医生，不进行诊断或治疗。
+
+你的任务是：完成步骤{step_num} - {step_name}
 
 重要要求：
 - 你的回复应该详细、丰富、有深度，不要过于简短
@@ -709,54 +647,63 @@ def build_single_step_prompt(
 - 可以包含具体的例子、场景描述、情感共鸣等内容
 - 让用户感受到被充分理解和关心
 
-当前风格配置：
-- 语气: {tone_desc}
-- 直白程度: {directness_desc} (1-5，当前为{style.directness})
-- 共情比重: {style.emotionFocus}/5
-- 理性分析比重: {style.analysisDepth}/5
-- 行动建议比重: {style.actionFocus}/5
-- 幽默程度: {style.jokingLevel}/5
-- 对敏感话题的安全偏好: {style.safetyBias}
-
 请遵守：
 - 不使用羞辱、不鼓励自责、不鼓励自伤或他伤
 - 避免极端措辞（如"必须"、"永远"、"完全不可能"）
-- 避免人格评判（如"你就是太懒"）
-
-当前用户状态：
-- 情绪: {', '.join(parsed.emotions)}
-- 强度: {parsed.intensity}/10
-- 场景: {parsed.scene}
-- 风险等级: {parsed.riskLevel}
-- 用户目标: {parsed.userGoal}
-
-建议采用的干预模块：
-{interv_text}
-
-步骤5的具体要求：
-- 收尾小结：简要回顾本轮做了什么，肯定用户努力，提供温和的延续方向
-- 回顾要简洁但全面，涵盖前面4个步骤的主要内容
-- 肯定用户的努力和勇气，给予鼓励
-- 提供温和的延续方向，不要给用户压力
+- 避免人格评判（如"你就是太懒"）{extra_rules}
 
-{previous_context}
+步骤{step_num}的具体要求：
+{step_requirements}{high_risk_rules}
 
 请以严格的JSON格式输出，格式如下：
 {{
-  "step5_summary": "收尾小结（简要回顾、肯定用户努力、提供延续方向，300-500字）",
-  "theme": "本次对话的核心主题（简洁概括，10-20字）",
+{output_fields}
   "emotion": "情绪标签（从用户情绪中选择一个）",
-  "intensity": {parsed.intensity},
+  "intensity": {INTENSITY_PLACEHOLDER},
   "topics": ["主题1", "主题2"],
-  "risk_level": "{risk_level_value}"
-}}
+  "risk_level": "{RISK_LEVEL_PLACEHOLDER}"
+}}"""
+
+    return PromptTemplate(static, _style_section(style), f"建议采用的干预模块：\n{_interventions_text(interventions)}")
 
-只输出JSON，不要包含任何其他文本。"""
 
-    else:
+def build_single_step_prompt(
+    step_num: int,
+    parsed: ParsedState,
+    style: StyleProfile,
+    plan: ReplyPlan,
+    interventions: List[InterventionConfig],
+    previous_steps: Dict[int, Dict[str, Any]] = None,
+) -> SystemPrompt | str:
+    """
+    为单个步骤构建系统提示词。
+    
+    Args:
+        step_num: 步骤编号 (1-5)
+        parsed: 情绪解析结果
+        style: 风格配置
+        plan: 回复计划
+        interventions: 干预模块列表
+        previous_steps: 已完成的步骤结果（用于上下文）
+        
+    Returns:
+        系统提示词（固定前缀只随步骤编号变化，同一步骤在所有用户之间共享）
+    """
+    if step_num not in STEP_FIELDS:
         # 未知步骤，返回通用提示词
         return f"""你是一个情绪陪伴 AI，请完成步骤{step_num}。"""
 
+    template = get_prompt_template_cache().get_or_compile(
+        ("step", step_num, _style_key(style), _interventions_key(interventions)),
+        lambda: _compile_step_template(step_num, style, interventions),
+    )
+    extra_sections = []
+    if step_num == 1:
+        extra_sections.append(_step1_requirements(plan))
+    if previous_steps:
+        extra_sections.append(_previous_steps_context(previous_steps))
+    return template.render(parsed, extra_sections)
+
 
 def extract_user_question(messages: List[ChatMessage]) -> Optional[str]:
     """
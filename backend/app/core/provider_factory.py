@@ -1,9 +1,16 @@
 """
 LLM Provider工厂，根据数据库配置或环境变量选择provider
 """
+import json
 import os
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, Optional, Tuple
 from sqlalchemy.orm import Session
 from app.core.llm_provider import LLMProvider, MockLLMProvider
+from app.core.providers.base_provider import JsonChatLLMProvider
+from app.core.providers.failover_provider import FailoverLLMProvider
 from app.core.providers.openai_provider import OpenAIProvider
 from app.core.providers.ollama_provider import OllamaProvider
 from app.core.providers.gemini_provider import GeminiProvider
@@ -13,17 +20,69 @@ from app.core.providers.doubao_provider import DoubaoProvider
 from app.db import SessionLocal
 
 
+# Provider注册表：缓存已构建的provider实例，热路径不读数据库、不重新构建客户端
+# key为 ("db", 配置id, updated_at) 或 ("env", LLM_PROVIDER)
+_registry_lock = threading.Lock()
+_provider_registry: Dict[Tuple, LLMProvider] = {}
+_active_key: Optional[Tuple] = None
+_active_resolved_at = 0.0
+
+# 多进程部署时，其他进程修改配置无法通知到本进程；设置该值(秒)后会定期重新读取激活配置
+PROVIDER_CACHE_TTL = float(os.getenv("LLM_PROVIDER_CACHE_TTL", "0"))
+
+
 def get_llm_provider(db: Session = None) -> LLMProvider:
     """
     根据数据库配置或环境变量获取LLM Provider实例
     
-    优先从数据库读取激活的配置，如果没有则从环境变量读取
+    优先从数据库读取激活的配置，如果没有则从环境变量读取。
+    构建好的provider会被缓存，直到 invalidate_llm_provider_cache() 被调用
+    （AI配置的创建/更新/激活接口会调用）。
     
     环境变量 LLM_PROVIDER 可选值：
     - "openai": 使用OpenAI API
     - "ollama": 使用Ollama本地模型
     - 其他或未设置: 使用Mock实现
     """
+    global _active_key, _active_resolved_at
+    
+    key = _active_key
+    if key is not None and not _cache_expired():
+        provider = _provider_registry.get(key)
+        if provider is not None:
+            return provider
+    
+    with _registry_lock:
+        if _active_key is not None and not _cache_expired() and _active_key in _provider_registry:
+            return _provider_registry[_active_key]
+        
+        key, factory = _resolve_active_config(db)
+        provider = _provider_registry.get(key)
+        if provider is None:
+            provider = factory()
+            # 只保留当前版本，旧版本的provider不会再被使用
+            _provider_registry.clear()
+            _provider_registry[key] = provider
+        _active_key = key
+        _active_resolved_at = time.monotonic()
+        return provider
+
+
+def invalidate_llm_provider_cache() -> None:
+    """使provider缓存失效，下一次 get_llm_provider() 会重新读取激活配置"""
+    global _active_key
+    with _registry_lock:
+        _active_key = None
+        # updated_at 精度有限（秒级），同一秒内的两次修改key相同，因此同时丢弃已构建的实例
+        _provider_registry.clear()
+
+
+def _cache_expired() -> bool:
+    return PROVIDER_CACHE_TTL > 0 and time.monotonic() - _active_resolved_at > PROVIDER_CACHE_TTL
+
+
+def _resolve_active_config(db: Session = None) -> Tuple[Tuple, Callable[[], LLMProvider]]:
+    """读取激活配置，返回 (缓存key, 构建provider的函数)"""
     # 尝试从数据库读取配置
     if db is None:
         db = SessionLocal()
@@ -36,10 +95,18 @@ def get_llm_provider(db: Session = None) -> LLMProvider:
         active_config = db.query(AIConfig).filter(AIConfig.is_active == True).first()
         
         if active_config:
-            # 从数据库配置创建provider
-            provider = _create_provider_from_config(active_config)
-            if provider:
-                return provider
+            if _failover_enabled():
+                fallback_configs = _load_fallback_configs(db, active_config)
+                if fallback_configs:
+                    configs = [active_config] + fallback_configs
+                    key = ("db-pool",) + tuple((config.id, config.updated_at) for config in configs)
+                    snapshots = [_config_snapshot(config) for config in configs]
+                    return key, lambda: _create_failover_provider(snapshots)
+            
+            # 从数据库配置创建provider（先取出字段，避免session关闭后访问ORM对象）
+            config = _config_snapshot(active_config)
+            key = ("db", active_config.id, active_config.updated_at)
+            return key, lambda: _create_provider_from_config(config)
     except Exception as e:
         print(f"Failed to load config from database: {e}, falling back to environment variables")
     finally:
@@ -48,7 +115,64 @@ def get_llm_provider(db: Session = None) -> LLMProvider:
     
     # 回退到环境变量
     provider_name = os.getenv("LLM_PROVIDER", "mock").lower()
+    return ("env", provider_name), lambda: _create_provider_from_env(provider_name)
+
+
+def _failover_enabled() -> bool:
+    return os.getenv("LLM_FAILOVER_ENABLED", "false").lower() in ("1", "true", "yes")
+
+
+def _config_snapshot(config) -> SimpleNamespace:
+    """复制ORM对象中创建provider需要的字段"""
+    return SimpleNamespace(
+        provider=config.provider,
+        api_key=config.api_key,
+        base_url=config.base_url,
+        model=config.model,
+    )
+
+
+def _load_fallback_configs(db: Session, active_config) -> list:
+    """
+    读取备用provider配置：除激活配置外的其他AIConfig，
+    extra_config 中 {"failover": false} 的配置不参与，按 {"failover_priority": n}（越小越优先）排序
+    """
+    from app.models.ai_config import AIConfig
     
+    fallbacks = []
+    for config in db.query(AIConfig).filter(AIConfig.id != active_config.id).all():
+        try:
+            extra = json.loads(config.extra_config) if config.extra_config else {}
+        except (TypeError, ValueError):
+            extra = {}
+        if not isinstance(extra, dict):
+            extra = {}
+        if extra.get("failover", True) is False:
+            continue
+        fallbacks.append((extra.get("failover_priority", 100), config.provider, config))
+    fallbacks.sort(key=lambda item: (item[0], item[1]))
+    return [config for _, _, config in fallbacks]
+
+
+def _create_failover_provider(configs: list) -> LLMProvider:
+    """创建 主provider + 备用provider 的故障转移池；可用成员不足两个时直接返回主provider"""
+    members = []
+    for config in configs:
+        provider = _create_provider_from_config(config)
+        # 创建失败（如缺少API key）时会退化为Mock，不放入池中
+        if isinstance(provider, JsonChatLLMProvider):
+            members.append((f"{config.provider}:{config.model or 'default'}", provider))
+    
+    if not members:
+        return _create_provider_from_config(configs[0])
+    if len(members) == 1:
+        return members[0][1]
+    print(f"LLM provider failover pool: {[label for label, _ in members]}")
+    return FailoverLLMProvider(members)
+
+
+def _create_provider_from_env(provider_name: str) -> LLMProvider:
+    """根据环境变量创建provider实例"""
     if provider_name == "openai":
         try:
             return OpenAIProvider()
@@ -1,20 +1,48 @@
 """
 Shared JSON chat provider utilities.
 """
+import asyncio
 import json
 import logging
-from abc import abstractmethod
-from typing import Any, Dict, List, Literal, Optional
+import time
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional
 
+from app.core.deep_chat_engine import get_deep_chat_stats, resolve_deep_chat_engine
+from app.core.history_compaction import compact_history
+from app.core.json_stream import STREAM_TEXT_FIELDS, IncrementalJsonFieldExtractor
 from app.core.llm_provider import LLMProvider, LLMResult
+from app.core.metrics import SAFE_REPLY_TOTAL, ametered, metered, metered_stream
+from app.core.providers.completion_cache import acached_completion, cached_completion
+from app.core.providers.output_budget import (
+    abudgeted,
+    budgeted,
+    budgeted_stream,
+    current_budget_key,
+    get_output_budgets,
+    output_budget,
+)
+from app.core.providers.rate_limiter import arate_limited, rate_limited, rate_limited_stream
+from app.core.response_schemas import (
+    get_parse_stats,
+    resolve_response_schema,
+    response_schema,
+    step_schema_name,
+    structured_schema_name,
+)
 from app.core.prompt_builder import (
     build_simple_prompt,
     build_structured_prompt,
     build_single_step_prompt,
+    get_missing_steps,
+    get_step_dependencies,
+    STEP_FIELDS,
     normalize_risk_level,
     extract_user_question,
     normalize_intensity,
+    SystemPrompt,
 )
+from app.core.step_scheduler import run_step_dag, step_metric
+from app.core.tracing import atraced, span, traced, traced_stream
 from app.schemas.chat import ChatMessage
 from app.schemas.style import StyleProfile, ParsedState, ReplyPlan, InterventionConfig
 
@@ -28,42 +56,32 @@ class JsonChatLLMProvider(LLMProvider):
         self.logger = logging.getLogger(f"{self.__class__.__module__}.{self.__class__.__name__}")
 
     def generate_reply(self, messages: List[ChatMessage]) -> LLMResult:
-        system_prompt = build_simple_prompt()
-        self._log_prompt("simple", system_prompt)
-        chat_messages = self._format_messages(system_prompt, messages)
+        with span("build_prompt", mode="simple"):
+            system_prompt = build_simple_prompt()
+            self._log_prompt("simple", system_prompt)
+            chat_messages = self._format_messages(system_prompt, messages)
 
         try:
-            result = self._perform_chat_completion(chat_messages, mode="simple")
-            # result可以是字符串（旧格式）或字典（新格式，包含text和usage）
-            if isinstance(result, dict):
-                result_text = result.get("text", "")
-                usage_info = result.get("usage", {})
-            else:
-                result_text = result
-                usage_info = {}
-            
-            # 检查result_text是否有效
-            if not result_text or (isinstance(result_text, str) and not result_text.strip()):
-                self.logger.error("[LLM Provider] API返回的文本为空")
-                raise ValueError("API返回的文本为空")
-            
-            result_dict = self._parse_json_payload(result_text)
-            llm_result = self._build_simple_result(result_dict, messages)
-            # 设置tokens信息
-            if usage_info:
-                llm_result.prompt_tokens = usage_info.get("prompt_tokens")
-                llm_result.completion_tokens = usage_info.get("completion_tokens")
-                llm_result.total_tokens = usage_info.get("total_tokens")
-            return llm_result
+            with response_schema("simple"), output_budget("simple"):
+                result = self._perform_chat_completion(chat_messages, mode="simple")
+            return self._simple_result_from_completion(result, messages)
         except Exception:
             self.logger.exception("[LLM Provider] generate_reply failed, returning safe response")
-            return LLMResult(
-                reply=self.SAFE_REPLY,
-                emotion="neutral",
-                intensity=2,
-                topics=[],
-                risk_level="low",
-            )
+            return self._safe_simple_result()
+
+    async def agenerate_reply(self, messages: List[ChatMessage]) -> LLMResult:
+        with span("build_prompt", mode="simple"):
+            system_prompt = build_simple_prompt()
+            self._log_prompt("simple", system_prompt)
+            chat_messages = self._format_messages(system_prompt, messages)
+
+        try:
+            with response_schema("simple"), output_budget("simple"):
+                result = await self._aperform_chat_completion(chat_messages, mode="simple")
+            return self._simple_result_from_completion(result, messages)
+        except Exception:
+            self.logger.exception("[LLM Provider] agenerate_reply failed, returning safe response")
+            return self._safe_simple_result()
 
     def generate_structured_reply(
         self,
@@ -74,44 +92,40 @@ class JsonChatLLMProvider(LLMProvider):
         interventions: List[InterventionConfig],
         conversation_stage: Optional[Literal["chatting", "exploring", "summarizing", "inviting", "card_generated"]] = None,
     ) -> LLMResult:
-        system_prompt = build_structured_prompt(parsed, style, plan, interventions, conversation_stage)
-        self._log_prompt("structured", system_prompt)
-        chat_messages = self._format_messages(system_prompt, messages)
+        with span("build_prompt", mode="structured", stage=conversation_stage):
+            system_prompt = build_structured_prompt(parsed, style, plan, interventions, conversation_stage)
+            self._log_prompt("structured", system_prompt)
+            chat_messages = self._format_messages(system_prompt, messages)
 
         try:
-            result = self._perform_chat_completion(chat_messages, mode="structured")
-            # result可以是字符串（旧格式）或字典（新格式，包含text和usage）
-            if isinstance(result, dict):
-                result_text = result.get("text", "")
-                usage_info = result.get("usage", {})
-            else:
-                result_text = result
-                usage_info = {}
-            
-            # 检查result_text是否有效
-            if not result_text or (isinstance(result_text, str) and not result_text.strip()):
-                self.logger.error("[LLM Provider] API返回的文本为空")
-                raise ValueError("API返回的文本为空")
-            
-            result_dict = self._parse_json_payload(result_text)
-            llm_result = self._build_structured_result(result_dict, parsed, messages)
-            # 设置tokens信息
-            if usage_info:
-                llm_result.prompt_tokens = usage_info.get("prompt_tokens")
-                llm_result.completion_tokens = usage_info.get("completion_tokens")
-                llm_result.total_tokens = usage_info.get("total_tokens")
-            return llm_result
+            with response_schema(structured_schema_name(conversation_stage)), output_budget(conversation_stage or "structured"):
+                result = self._perform_chat_completion(chat_messages, mode="structured")
+            return self._structured_result_from_completion(result, parsed, messages)
         except Exception:
             self.logger.exception("[LLM Provider] generate_structured_reply failed, returning safe response")
-            # 规范化风险级别：parsed.riskLevel 可能是 "low", "medium", "high"
-            parsed_risk = normalize_risk_level(parsed.riskLevel) if hasattr(parsed, 'riskLevel') else "low"
-            return LLMResult(
-                reply=self.SAFE_REPLY,
-                emotion=parsed.emotions[0] if parsed.emotions else "neutral",
-                intensity=parsed.intensity,
-                topics=[parsed.scene],
-                risk_level=parsed_risk,
-            )
+            return self._safe_structured_result(parsed)
+
+    async def agenerate_structured_reply(
+        self,
+        messages: List[ChatMessage],
+        parsed: ParsedState,
+        style: StyleProfile,
+        plan: ReplyPlan,
+        interventions: List[InterventionConfig],
+        conversation_stage: Optional[Literal["chatting", "exploring", "summarizing", "inviting", "card_generated"]] = None,
+    ) -> LLMResult:
+        with span("build_prompt", mode="structured", stage=conversation_stage):
+            system_prompt = build_structured_prompt(parsed, style, plan, interventions, conversation_stage)
+            self._log_prompt("structured", system_prompt)
+            chat_messages = self._format_messages(system_prompt, messages)
+
+        try:
+            with response_schema(structured_schema_name(conversation_stage)), output_budget(conversation_stage or "structured"):
+                result = await self._aperform_chat_completion(chat_messages, mode="structured")
+            return self._structured_result_from_completion(result, parsed, messages)
+        except Exception:
+            self.logger.exception("[LLM Provider] agenerate_structured_reply failed, returning safe response")
+            return self._safe_structured_result(parsed)
 
     def generate_deep_chat_reply(
         self,
@@ -120,9 +134,10 @@ class JsonChatLLMProvider(LLMProvider):
         style: StyleProfile,
         plan: ReplyPlan,
         interventions: List[InterventionConfig],
+        engine: Optional[Literal["multi_step", "single_shot"]] = None,
     ) -> LLMResult:
         """
-        深聊模式：分别调用5次AI请求，每个步骤一次，然后整合结果
+        深聊模式：默认分别调用5次AI请求，每个步骤一次，然后整合结果
         
         Args:
             messages: 对话消息列表
@@ -130,53 +145,304 @@ class JsonChatLLMProvider(LLMProvider):
             style: 风格配置
             plan: 回复计划
             interventions: 干预模块列表
+            engine: 深聊引擎（multi_step / single_shot），为空时使用部署默认值
             
         Returns:
             LLMResult: 整合后的回复结果
         """
+        if resolve_deep_chat_engine(engine) == "single_shot":
+            return self._generate_single_shot_deep_chat(messages, parsed, style, plan, interventions)
+
         self.logger.info("[Deep Chat] 开始深聊模式：分别生成5个步骤")
         
         # 存储每个步骤的结果
         step_results = {}
-        total_prompt_tokens = 0
-        total_completion_tokens = 0
-        total_tokens = 0
-        
-        # 获取步骤内容规划
-        step_contents = getattr(plan, 'stepContents', {})
         steps_to_execute = getattr(plan, 'stepsToExecute', [1, 2, 3, 4, 5])
         
-        # 按顺序生成每个步骤
+        # 按顺序生成每个步骤（同步版本串行执行，上下文只包含依赖的步骤，与异步并发版本保持一致）
+        request_start = time.perf_counter()
         for step_num in steps_to_execute:
+            started = time.perf_counter()
             try:
                 self.logger.info(f"[Deep Chat] 正在生成步骤 {step_num}")
                 
                 # 为当前步骤生成内容
-                step_result = self.generate_single_step(
+                step_results[step_num] = self.generate_single_step(
                     step_num=step_num,
                     messages=messages,
                     parsed=parsed,
                     style=style,
                     plan=plan,
                     interventions=interventions,
-                    previous_steps=step_results  # 传递已完成的步骤，用于上下文
+                    previous_steps=self._dependency_results(step_num, steps_to_execute, step_results)
                 )
-                
-                step_results[step_num] = step_result
-                
-                # 累加tokens
-                if step_result.get("usage"):
-                    total_prompt_tokens += step_result["usage"].get("prompt_tokens", 0)
-                    total_completion_tokens += step_result["usage"].get("completion_tokens", 0)
-                    total_tokens += step_result["usage"].get("total_tokens", 0)
-                
             except Exception as e:
                 self.logger.error(f"[Deep Chat] 步骤 {step_num} 生成失败: {str(e)}", exc_info=True)
                 # 如果某个步骤失败，使用默认值
                 step_results[step_num] = {"content": "", "data": {}}
+            step_results[step_num]["timing"] = {
+                "started_ms": round((started - request_start) * 1000, 1),
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            }
         
         # 整合所有步骤的结果
-        return self._build_deep_chat_result(step_results, parsed, total_prompt_tokens, total_completion_tokens, total_tokens, messages)
+        return self._finish_multi_step_deep_chat(step_results, parsed, messages, request_start)
+
+    async def agenerate_deep_chat_reply(
+        self,
+        messages: List[ChatMessage],
+        parsed: ParsedState,
+        style: StyleProfile,
+        plan: ReplyPlan,
+        interventions: List[InterventionConfig],
+        engine: Optional[Literal["multi_step", "single_shot"]] = None,
+    ) -> LLMResult:
+        """
+        深聊模式（异步版本）：按步骤依赖关系（STEP_DEPENDENCIES）并发生成，
+        互不依赖的步骤（如2/3/4）同时请求，步骤5等待前面的步骤全部完成
+        """
+        if resolve_deep_chat_engine(engine) == "single_shot":
+            return await self._agenerate_single_shot_deep_chat(messages, parsed, style, plan, interventions)
+
+        self.logger.info("[Deep Chat] 开始深聊模式：按依赖关系并发生成步骤")
+        
+        request_start = time.perf_counter()
+        steps_to_execute = getattr(plan, 'stepsToExecute', [1, 2, 3, 4, 5])
+
+        async def run_step(step_num: int, dependency_results: Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+            self.logger.info(f"[Deep Chat] 正在生成步骤 {step_num}")
+            return await self.agenerate_single_step(
+                step_num=step_num,
+                messages=messages,
+                parsed=parsed,
+                style=style,
+                plan=plan,
+                interventions=interventions,
+                previous_steps=dependency_results
+            )
+
+        step_results = await run_step_dag(steps_to_execute, run_step)
+        return self._finish_multi_step_deep_chat(step_results, parsed, messages, request_start)
+
+    def _generate_single_shot_deep_chat(
+        self,
+        messages: List[ChatMessage],
+        parsed: ParsedState,
+        style: StyleProfile,
+        plan: ReplyPlan,
+        interventions: List[InterventionConfig],
+    ) -> LLMResult:
+        """
+        single_shot 深聊引擎：一次结构化请求生成全部步骤字段，再对缺失/为空的步骤逐个补发单步请求
+        """
+        self.logger.info("[Deep Chat] 开始深聊模式（single_shot）：一次生成全部步骤")
+        request_start = time.perf_counter()
+        steps_to_execute = getattr(plan, 'stepsToExecute', [1, 2, 3, 4, 5])
+
+        chat_messages = self._build_single_shot_messages(messages, parsed, style, plan, interventions)
+        try:
+            with response_schema("structured"), output_budget("deep"):
+                completion = self._perform_chat_completion(chat_messages, mode="structured")
+        except Exception as e:
+            self.logger.error(f"[Deep Chat] 一次性生成失败: {str(e)}", exc_info=True)
+            completion = None
+        result_dict, usage_info = self._single_shot_payload(completion)
+
+        repairs: Dict[int, Dict[str, Any]] = {}
+        for step_num in get_missing_steps(result_dict, steps_to_execute):
+            started = time.perf_counter()
+            try:
+                self.logger.info(f"[Deep Chat] 步骤 {step_num} 缺失，补发单步请求")
+                repairs[step_num] = self.generate_single_step(
+                    step_num=step_num,
+                    messages=messages,
+                    parsed=parsed,
+                    style=style,
+                    plan=plan,
+                    interventions=interventions,
+                    previous_steps=self._single_shot_context(step_num, steps_to_execute, result_dict, repairs),
+                )
+            except Exception as e:
+                self.logger.error(f"[Deep Chat] 步骤 {step_num} 补发失败: {str(e)}", exc_info=True)
+                repairs[step_num] = {"content": "", "data": {}}
+            repairs[step_num]["timing"] = {
+                "started_ms": round((started - request_start) * 1000, 1),
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            }
+
+        return self._finish_single_shot_deep_chat(
+            result_dict, usage_info, repairs, parsed, messages, request_start, parse_failed=completion is None or not result_dict
+        )
+
+    async def _agenerate_single_shot_deep_chat(
+        self,
+        messages: List[ChatMessage],
+        parsed: ParsedState,
+        style: StyleProfile,
+        plan: ReplyPlan,
+        interventions: List[InterventionConfig],
+    ) -> LLMResult:
+        """single_shot 深聊引擎（异步版本）：补发的单步请求按依赖关系并发执行"""
+        self.logger.info("[Deep Chat] 开始深聊模式（single_shot）：一次生成全部步骤")
+        request_start = time.perf_counter()
+        steps_to_execute = getattr(plan, 'stepsToExecute', [1, 2, 3, 4, 5])
+
+        chat_messages = self._build_single_shot_messages(messages, parsed, style, plan, interventions)
+        try:
+            with response_schema("structured"), output_budget("deep"):
+                completion = await self._aperform_chat_completion(chat_messages, mode="structured")
+        except Exception as e:
+            self.logger.error(f"[Deep Chat] 一次性生成失败: {str(e)}", exc_info=True)
+            completion = None
+        result_dict, usage_info = self._single_shot_payload(completion)
+
+        repairs = await self._arepair_missing_steps(
+            result_dict, steps_to_execute, messages, parsed, style, plan, interventions
+        )
+        return self._finish_single_shot_deep_chat(
+            result_dict, usage_info, repairs, parsed, messages, request_start, parse_failed=completion is None or not result_dict
+        )
+
+    async def _arepair_missing_steps(
+        self,
+        result_dict: Dict[str, Any],
+        steps_to_execute: List[int],
+        messages: List[ChatMessage],
+        parsed: ParsedState,
+        style: StyleProfile,
+        plan: ReplyPlan,
+        interventions: List[InterventionConfig],
+    ) -> Dict[int, Dict[str, Any]]:
+        """对 single_shot 结果中缺失的步骤补发单步请求（互不依赖的步骤并发）"""
+        missing_steps = get_missing_steps(result_dict, steps_to_execute)
+        if not missing_steps:
+            return {}
+        self.logger.info(f"[Deep Chat] 步骤 {missing_steps} 缺失，补发单步请求")
+
+        async def run_step(step_num: int, repaired_dependencies: Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+            return await self.agenerate_single_step(
+                step_num=step_num,
+                messages=messages,
+                parsed=parsed,
+                style=style,
+                plan=plan,
+                interventions=interventions,
+                previous_steps=self._single_shot_context(step_num, steps_to_execute, result_dict, repaired_dependencies),
+            )
+
+        return await run_step_dag(missing_steps, run_step)
+
+    def _build_single_shot_messages(
+        self,
+        messages: List[ChatMessage],
+        parsed: ParsedState,
+        style: StyleProfile,
+        plan: ReplyPlan,
+        interventions: List[InterventionConfig],
+    ) -> List[Dict[str, str]]:
+        # 不传对话阶段时，结构化提示词要求一次输出 step1_… 到 step5_summary 全部字段
+        with span("build_prompt", mode="deep_single_shot"):
+            system_prompt = build_structured_prompt(parsed, style, plan, interventions)
+            self._log_prompt("deep_single_shot", system_prompt)
+            return self._format_messages(system_prompt, messages)
+
+    def _single_shot_payload(self, completion: str | dict | None) -> tuple[Dict[str, Any], Dict[str, Any]]:
+        """解析一次性生成的结果，失败时返回空字典（所有步骤都会走补发）"""
+        if completion is None:
+            return {}, {}
+        try:
+            result_text, usage_info = self._unpack_completion(completion)
+        except ValueError:
+            return {}, {}
+        try:
+            result_dict = self._parse_json_payload(result_text)
+        except ValueError as e:
+            self.logger.error(f"[Deep Chat] 一次性生成结果解析失败: {str(e)}")
+            return {}, usage_info
+        return (result_dict if isinstance(result_dict, dict) else {}), usage_info
+
+    def _single_shot_context(
+        self,
+        step_num: int,
+        steps_to_execute: List[int],
+        result_dict: Dict[str, Any],
+        repairs: Dict[int, Dict[str, Any]],
+    ) -> Dict[int, Dict[str, Any]]:
+        """补发步骤的上下文：依赖步骤优先用补发结果，否则用一次性生成的结果"""
+        context = {}
+        for dep in get_step_dependencies(step_num, steps_to_execute):
+            context[dep] = repairs[dep] if dep in repairs else {"data": result_dict}
+        return context
+
+    def _finish_single_shot_deep_chat(
+        self,
+        result_dict: Dict[str, Any],
+        usage_info: Dict[str, Any],
+        repairs: Dict[int, Dict[str, Any]],
+        parsed: ParsedState,
+        messages: List[ChatMessage],
+        request_start: float,
+        parse_failed: bool = False,
+    ) -> LLMResult:
+        """合并补发结果，用 _build_structured_result 组装，并记录修复统计"""
+        merged = dict(result_dict)
+        for step_num, step_result in repairs.items():
+            step_data = step_result.get("data", {})
+            for field in STEP_FIELDS.get(step_num, ()):
+                if step_data.get(field):
+                    merged[field] = step_data[field]
+        # 保证按5步骤格式组装（即使一次性生成完全失败）
+        for fields in STEP_FIELDS.values():
+            for field in fields:
+                merged.setdefault(field, [] if field == "step4_suggestions" else "")
+
+        llm_result = self._build_structured_result(merged, parsed, messages)
+        if not llm_result.reply:
+            llm_result.reply = "抱歉，我无法生成回复。"
+
+        repair_prompt, repair_completion, repair_total = self._sum_step_usage(repairs)
+        llm_result.prompt_tokens = (usage_info.get("prompt_tokens") or 0) + repair_prompt or None
+        llm_result.completion_tokens = (usage_info.get("completion_tokens") or 0) + repair_completion or None
+        llm_result.total_tokens = (usage_info.get("total_tokens") or 0) + repair_total or None
+        llm_result.cached_tokens = (usage_info.get("cached_tokens") or 0) + self._sum_cached_tokens(repairs) or None
+        llm_result.step_metrics = [
+            step_metric(step_num, step_result)
+            for step_num, step_result in sorted(repairs.items())
+            if "timing" in step_result
+        ] or None
+
+        elapsed_ms = round((time.perf_counter() - request_start) * 1000, 1)
+        repaired_steps = sorted(repairs)
+        self.logger.info(
+            f"[Deep Chat] single_shot 完成，总耗时 {elapsed_ms}ms，补发步骤 {repaired_steps or '无'}"
+        )
+        get_deep_chat_stats().record(
+            "single_shot",
+            llm_calls=1 + len(repaired_steps),
+            elapsed_ms=elapsed_ms,
+            total_tokens=llm_result.total_tokens or 0,
+            repaired_steps=repaired_steps,
+            parse_failed=parse_failed,
+        )
+        return llm_result
+
+    def _finish_multi_step_deep_chat(
+        self,
+        step_results: Dict[int, Dict[str, Any]],
+        parsed: ParsedState,
+        messages: List[ChatMessage],
+        request_start: float,
+    ) -> LLMResult:
+        """整合 multi_step 各步骤结果，并记录引擎统计"""
+        llm_result = self._build_deep_chat_result(step_results, parsed, *self._sum_step_usage(step_results), messages)
+        llm_result.cached_tokens = self._sum_cached_tokens(step_results) or None
+        get_deep_chat_stats().record(
+            "multi_step",
+            llm_calls=len(step_results),
+            elapsed_ms=round((time.perf_counter() - request_start) * 1000, 1),
+            total_tokens=llm_result.total_tokens or 0,
+        )
+        return llm_result
 
     def generate_single_step(
         self,
@@ -203,54 +469,51 @@ class JsonChatLLMProvider(LLMProvider):
         Returns:
             包含步骤内容和usage信息的字典
         """
-        if previous_steps is None:
-            previous_steps = {}
-        
-        # 构建单个步骤的系统提示词
-        system_prompt = build_single_step_prompt(
-            step_num=step_num,
-            parsed=parsed,
-            style=style,
-            plan=plan,
-            interventions=interventions,
-            previous_steps=previous_steps
-        )
-        self._log_prompt(f"deep_step_{step_num}", system_prompt)
+        with span("deep.step", step=step_num):
+            chat_messages = self._build_single_step_messages(
+                step_num, messages, parsed, style, plan, interventions, previous_steps
+            )
         
-        # 格式化消息
-        chat_messages = self._format_messages(system_prompt, messages)
+            # 调用AI生成
+            try:
+                with response_schema(step_schema_name(step_num)), output_budget("deep", step=step_num):
+                    result = self._perform_chat_completion(chat_messages, mode="structured")
+                return self._step_result_from_completion(step_num, result)
+            except Exception as e:
+                self.logger.error(f"[Deep Chat] 步骤 {step_num} AI调用失败: {str(e)}", exc_info=True)
+                return {
+                    "content": {},
+                    "data": {},
+                    "usage": {}
+                }
+
+    async def agenerate_single_step(
+        self,
+        step_num: int,
+        messages: List[ChatMessage],
+        parsed: ParsedState,
+        style: StyleProfile,
+        plan: ReplyPlan,
+        interventions: List[InterventionConfig],
+        previous_steps: Dict[int, Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """generate_single_step 的异步版本"""
+        with span("deep.step", step=step_num):
+            chat_messages = self._build_single_step_messages(
+                step_num, messages, parsed, style, plan, interventions, previous_steps
+            )
         
-        # 调用AI生成
-        try:
-            result = self._perform_chat_completion(chat_messages, mode="structured")
-            
-            # 解析结果
-            if isinstance(result, dict):
-                result_text = result.get("text", "")
-                usage_info = result.get("usage", {})
-            else:
-                result_text = result
-                usage_info = {}
-            
-            # 检查result_text是否有效
-            if not result_text or (isinstance(result_text, str) and not result_text.strip()):
-                self.logger.error(f"[Deep Chat] 步骤 {step_num} API返回的文本为空")
-                raise ValueError(f"步骤 {step_num} API返回的文本为空")
-            
-            result_dict = self._parse_json_payload(result_text)
-            
-            return {
-                "content": result_dict,
-                "data": result_dict,
-                "usage": usage_info
-            }
-        except Exception as e:
-            self.logger.error(f"[Deep Chat] 步骤 {step_num} AI调用失败: {str(e)}", exc_info=True)
-            return {
-                "content": {},
-                "data": {},
-                "usage": {}
-            }
+            try:
+                with response_schema(step_schema_name(step_num)), output_budget("deep", step=step_num):
+                    result = await self._aperform_chat_completion(chat_messages, mode="structured")
+                return self._step_result_from_completion(step_num, result)
+            except Exception as e:
+                self.logger.error(f"[Deep Chat] 步骤 {step_num} AI调用失败: {str(e)}", exc_info=True)
+                return {
+                    "content": {},
+                    "data": {},
+                    "usage": {}
+                }
 
     def generate_text(self, messages: List[ChatMessage]) -> str | None:
         """
@@ -263,13 +526,7 @@ class JsonChatLLMProvider(LLMProvider):
             生成的文本，如果失败则返回 None
         """
         try:
-            # 将消息转换为字典格式
-            formatted_messages = []
-            for msg in messages:
-                formatted_messages.append({
-                    "role": msg.role,
-                    "content": msg.content
-                })
+            formatted_messages = self._format_text_messages(messages)
             
             # 调用 _perform_text_completion（如果存在）或 _perform_chat_completion
             if hasattr(self, '_perform_text_completion'):
@@ -278,32 +535,465 @@ class JsonChatLLMProvider(LLMProvider):
                 # 回退到 _perform_chat_completion，但使用 "text" 模式
                 result = self._perform_chat_completion(formatted_messages, mode="text")
             
-            if isinstance(result, dict):
-                return result.get("text", "").strip()
-            elif isinstance(result, str):
-                return result.strip()
+            return self._text_from_completion(result)
+        except Exception as e:
+            self.logger.exception(f"[Text Generation] 生成文本失败: {str(e)}")
             return None
+
+    async def agenerate_text(self, messages: List[ChatMessage]) -> str | None:
+        """generate_text 的异步版本"""
+        try:
+            formatted_messages = self._format_text_messages(messages)
+            
+            if hasattr(self, '_aperform_text_completion'):
+                result = await self._aperform_text_completion(formatted_messages)
+            else:
+                result = await self._aperform_chat_completion(formatted_messages, mode="text")
+            
+            return self._text_from_completion(result)
         except Exception as e:
             self.logger.exception(f"[Text Generation] 生成文本失败: {str(e)}")
             return None
 
-    @abstractmethod
-    def _perform_chat_completion(self, chat_messages: List[Dict[str, str]], mode: str) -> str | dict:
+    async def astream_structured_reply(
+        self,
+        messages: List[ChatMessage],
+        parsed: ParsedState,
+        style: StyleProfile,
+        plan: ReplyPlan,
+        interventions: List[InterventionConfig],
+        conversation_stage: Optional[Literal["chatting", "exploring", "summarizing", "inviting", "card_generated"]] = None,
+    ) -> AsyncIterator[dict]:
+        """
+        流式结构化回复：边接收边提取 reply / emotion_reflection / step* 字段，最后产出完整的 LLMResult
+        """
+        with span("build_prompt", mode="structured", stage=conversation_stage):
+            system_prompt = build_structured_prompt(parsed, style, plan, interventions, conversation_stage)
+            self._log_prompt("structured", system_prompt)
+            chat_messages = self._format_messages(system_prompt, messages)
+
+        completion = None
+        try:
+            async for event in self._astream_json_fields(
+                chat_messages, "structured", structured_schema_name(conversation_stage), (conversation_stage or "structured", 0)
+            ):
+                if event["type"] == "completion":
+                    completion = event
+                else:
+                    yield event
+            llm_result = self._structured_result_from_completion(completion, parsed, messages)
+        except Exception:
+            self.logger.exception("[LLM Provider] astream_structured_reply failed, returning safe response")
+            llm_result = self._safe_structured_result(parsed)
+        yield {"type": "result", "result": llm_result}
+
+    async def astream_deep_chat_reply(
+        self,
+        messages: List[ChatMessage],
+        parsed: ParsedState,
+        style: StyleProfile,
+        plan: ReplyPlan,
+        interventions: List[InterventionConfig],
+        engine: Optional[Literal["multi_step", "single_shot"]] = None,
+    ) -> AsyncIterator[dict]:
+        """
+        流式深聊模式：按步骤依赖关系并发流式生成，各步骤字段边生成边推送
+        （不同步骤的增量事件会交错到达，前端按 field 区分）
         """
-        Subclasses must implement the actual API call and return raw JSON string or dict.
+        if resolve_deep_chat_engine(engine) == "single_shot":
+            async for event in self._astream_single_shot_deep_chat(messages, parsed, style, plan, interventions):
+                yield event
+            return
+
+        self.logger.info("[Deep Chat] 开始流式深聊模式")
+        
+        request_start = time.perf_counter()
+        steps_to_execute = getattr(plan, 'stepsToExecute', [1, 2, 3, 4, 5])
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def run_step(step_num: int, dependency_results: Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+            chat_messages = self._build_single_step_messages(
+                step_num, messages, parsed, style, plan, interventions, dependency_results
+            )
+            completion = None
+            async for event in self._astream_json_fields(chat_messages, "structured", step_schema_name(step_num), ("deep", step_num)):
+                if event["type"] == "completion":
+                    completion = event
+                else:
+                    await queue.put(event)
+            return self._step_result_from_completion(step_num, completion)
+
+        async def run_all() -> Dict[int, Dict[str, Any]]:
+            try:
+                return await run_step_dag(steps_to_execute, run_step)
+            finally:
+                await queue.put(None)
+
+        task = asyncio.create_task(run_all())
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield event
+            step_results = await task
+        finally:
+            # 客户端断开时取消仍在进行的步骤
+            if not task.done():
+                task.cancel()
         
+        yield {
+            "type": "result",
+            "result": self._finish_multi_step_deep_chat(step_results, parsed, messages, request_start),
+        }
+
+    async def _astream_single_shot_deep_chat(
+        self,
+        messages: List[ChatMessage],
+        parsed: ParsedState,
+        style: StyleProfile,
+        plan: ReplyPlan,
+        interventions: List[InterventionConfig],
+    ) -> AsyncIterator[dict]:
+        """流式 single_shot：一次性生成的字段边生成边推送，补发步骤完成后整段推送"""
+        self.logger.info("[Deep Chat] 开始流式深聊模式（single_shot）")
+        request_start = time.perf_counter()
+        steps_to_execute = getattr(plan, 'stepsToExecute', [1, 2, 3, 4, 5])
+
+        chat_messages = self._build_single_shot_messages(messages, parsed, style, plan, interventions)
+        completion = None
+        try:
+            async for event in self._astream_json_fields(chat_messages, "structured", "structured", ("deep", 0)):
+                if event["type"] == "completion":
+                    completion = event
+                else:
+                    yield event
+        except Exception as e:
+            self.logger.error(f"[Deep Chat] 一次性生成失败: {str(e)}", exc_info=True)
+        result_dict, usage_info = self._single_shot_payload(completion)
+
+        repairs = await self._arepair_missing_steps(
+            result_dict, steps_to_execute, messages, parsed, style, plan, interventions
+        )
+        for step_num, step_result in sorted(repairs.items()):
+            step_data = step_result.get("data", {})
+            for field in STEP_FIELDS.get(step_num, ()):
+                value = step_data.get(field)
+                if isinstance(value, list):
+                    for index, item in enumerate(value):
+                        yield {"type": "delta", "field": field, "index": index, "text": str(item)}
+                elif value:
+                    yield {"type": "delta", "field": field, "index": None, "text": str(value)}
+
+        yield {
+            "type": "result",
+            "result": self._finish_single_shot_deep_chat(
+                result_dict, usage_info, repairs, parsed, messages, request_start,
+                parse_failed=completion is None or not result_dict,
+            ),
+        }
+
+    async def _astream_json_fields(
+        self,
+        chat_messages: List[Dict[str, str]],
+        mode: str,
+        schema_name: Optional[str] = None,
+        budget_scope: Optional[tuple[str, int]] = None,
+    ) -> AsyncIterator[dict]:
+        """
+        流式调用并增量提取JSON字段（schema_name 为本次调用下发的响应Schema，budget_scope 为输出预算的 (阶段, 步骤)）
+
+        产出 delta 事件，最后产出 {"type": "completion", "text": 完整文本, "usage": usage}
+        """
+        extractor = IncrementalJsonFieldExtractor(STREAM_TEXT_FIELDS)
+        text_parts: List[str] = []
+        usage: Dict[str, Any] = {}
+        stage, step = budget_scope or (mode, 0)
+        with response_schema(schema_name), output_budget(stage, step):
+            async for chunk in self._astream_chat_completion(chat_messages, mode, usage):
+                text_parts.append(chunk)
+                for field, index, text in extractor.feed(chunk):
+                    yield {"type": "delta", "field": field, "index": index, "text": text}
+        yield {"type": "completion", "text": "".join(text_parts), "usage": usage}
+
+
+    @staticmethod
+    async def _aiter_sse_data(response) -> AsyncIterator[str]:
+        """逐条产出SSE响应中 data: 行的内容"""
+        async for line in response.aiter_lines():
+            line = line.strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data and data != "[DONE]":
+                yield data
+
+    def _response_schema(self, mode: str) -> Optional[tuple[str, Dict[str, Any]]]:
+        """本次调用应下发的 (Schema名称, JSON Schema)，子类构建请求时按各自的原生机制使用"""
+        return resolve_response_schema(mode, self._parse_stats_key())
+
+    def _sampling_params(self, mode: str) -> Dict[str, Any]:
+        """
+        采样参数（子类构建请求时使用，同时参与补全缓存的key计算）
+
+        max_tokens 按 (对话阶段, 步骤, provider) 的输出预算表取值（见 output_budget.py），
+        text 模式用于总结类的纯文本生成，不需要太多 tokens
+        """
+        return {
+            "temperature": 0.7,
+            "max_tokens": get_output_budgets().budget_for(current_budget_key(self._parse_stats_key(), mode)),
+        }
+
+    # ===== 上游调用 =====
+    # 装饰器栈只在这里挂一次（自上而下）：tracing span → 补全缓存 / singleflight → 限流排队 →
+    # 输出预算记录 → 上游耗时与tokens指标。子类只实现不带装饰器的 _raw_* 方法；
+    # 缓存命中或合并到进行中的请求时不会调用 _raw_*，返回的 usage 为 0。
+
+    @traced
+    @cached_completion
+    @rate_limited
+    @budgeted
+    @metered
+    def _perform_chat_completion(self, chat_messages: List[Dict[str, str]], mode: str) -> str | dict:
+        """
+        同步补全调用（经过统一的装饰器栈）
+
         Returns:
             str: Raw JSON string (legacy format)
             dict: {"text": str, "usage": {"prompt_tokens": int, "completion_tokens": int, "total_tokens": int}} (new format)
         """
+        return self._raw_chat_completion(chat_messages, mode)
+
+    @atraced
+    @acached_completion
+    @arate_limited
+    @abudgeted
+    @ametered
+    async def _aperform_chat_completion(self, chat_messages: List[Dict[str, str]], mode: str) -> str | dict:
+        """_perform_chat_completion 的异步版本"""
+        return await self._araw_chat_completion(chat_messages, mode)
+
+    @traced_stream
+    @rate_limited_stream
+    @budgeted_stream
+    @metered_stream
+    async def _astream_chat_completion(
+        self,
+        chat_messages: List[Dict[str, str]],
+        mode: str,
+        usage: Dict[str, Any],
+    ) -> AsyncIterator[str]:
+        """流式补全调用（经过统一的装饰器栈，流式不走补全缓存），逐段产出文本，tokens使用信息写入 usage"""
+        async for chunk in self._araw_stream(chat_messages, mode, usage):
+            yield chunk
+
+    def _raw_chat_completion(self, chat_messages: List[Dict[str, str]], mode: str) -> str | dict:
+        """
+        Subclasses must implement the actual API call and return raw JSON string or dict
+        (same shapes as _perform_chat_completion). Do not decorate it; the stack lives on _perform_chat_completion.
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} 未实现 _raw_chat_completion")
+
+    async def _araw_chat_completion(self, chat_messages: List[Dict[str, str]], mode: str) -> str | dict:
+        """
+        Async counterpart of _raw_chat_completion; must use a non-blocking client
+        (httpx.AsyncClient / AsyncOpenAI) and return the same shapes.
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} 未实现 _araw_chat_completion")
 
-    def _format_messages(self, system_prompt: str, messages: List[ChatMessage]) -> List[Dict[str, str]]:
-        formatted = [{"role": "system", "content": system_prompt}]
+    async def _araw_stream(
+        self,
+        chat_messages: List[Dict[str, str]],
+        mode: str,
+        usage: Dict[str, Any],
+    ) -> AsyncIterator[str]:
+        """
+        流式调用API，逐段产出文本；tokens使用信息（如果API提供）写入 usage。
+        默认实现不支持流式，等待完整结果后一次性产出，子类可覆盖。
+        """
+        text, usage_info = self._unpack_completion(await self._araw_chat_completion(chat_messages, mode))
+        usage.update(usage_info)
+        yield text
+
+    def _unpack_completion(self, result: str | dict) -> tuple[str, Dict[str, Any]]:
+        """
+        拆分 _perform_chat_completion 的返回值为 (文本, usage)，文本为空时抛出异常
+        """
+        # result可以是字符串（旧格式）或字典（新格式，包含text和usage）
+        if isinstance(result, dict):
+            result_text = result.get("text", "")
+            usage_info = result.get("usage", {})
+        else:
+            result_text = result
+            usage_info = {}
+        
+        # 检查result_text是否有效
+        if not result_text or (isinstance(result_text, str) and not result_text.strip()):
+            self.logger.error("[LLM Provider] API返回的文本为空")
+            raise ValueError("API返回的文本为空")
+        
+        return result_text, usage_info
+
+    def _apply_usage(self, llm_result: LLMResult, usage_info: Dict[str, Any]) -> LLMResult:
+        """把tokens使用信息写入LLMResult"""
+        if usage_info:
+            llm_result.prompt_tokens = usage_info.get("prompt_tokens")
+            llm_result.completion_tokens = usage_info.get("completion_tokens")
+            llm_result.total_tokens = usage_info.get("total_tokens")
+            llm_result.cached_tokens = usage_info.get("cached_tokens")
+            llm_result.output_budget_key = usage_info.get("output_budget_key")
+        return llm_result
+
+    def _simple_result_from_completion(self, result: str | dict, messages: List[ChatMessage]) -> LLMResult:
+        result_text, usage_info = self._unpack_completion(result)
+        result_dict = self._parse_json_payload(result_text)
+        return self._apply_usage(self._build_simple_result(result_dict, messages), usage_info)
+
+    def _structured_result_from_completion(
+        self,
+        result: str | dict,
+        parsed: ParsedState,
+        messages: List[ChatMessage],
+    ) -> LLMResult:
+        result_text, usage_info = self._unpack_completion(result)
+        result_dict = self._parse_json_payload(result_text)
+        return self._apply_usage(self._build_structured_result(result_dict, parsed, messages), usage_info)
+
+    def _step_result_from_completion(self, step_num: int, result: str | dict) -> Dict[str, Any]:
+        try:
+            result_text, usage_info = self._unpack_completion(result)
+        except ValueError:
+            self.logger.error(f"[Deep Chat] 步骤 {step_num} API返回的文本为空")
+            raise ValueError(f"步骤 {step_num} API返回的文本为空")
+        
+        result_dict = self._parse_json_payload(result_text)
+        return {
+            "content": result_dict,
+            "data": result_dict,
+            "usage": usage_info
+        }
+
+    def _text_from_completion(self, result: str | dict) -> str | None:
+        if isinstance(result, dict):
+            return result.get("text", "").strip()
+        elif isinstance(result, str):
+            return result.strip()
+        return None
+
+    def _safe_simple_result(self) -> LLMResult:
+        SAFE_REPLY_TOTAL.inc(provider=self._parse_stats_key(), mode="simple")
+        return LLMResult(
+            reply=self.SAFE_REPLY,
+            emotion="neutral",
+            intensity=2,
+            topics=[],
+            risk_level="low",
+        )
+
+    def _safe_structured_result(self, parsed: ParsedState) -> LLMResult:
+        SAFE_REPLY_TOTAL.inc(provider=self._parse_stats_key(), mode="structured")
+        # 规范化风险级别：parsed.riskLevel 可能是 "low", "medium", "high"
+        parsed_risk = normalize_risk_level(parsed.riskLevel) if hasattr(parsed, 'riskLevel') else "low"
+        return LLMResult(
+            reply=self.SAFE_REPLY,
+            emotion=parsed.emotions[0] if parsed.emotions else "neutral",
+            intensity=parsed.intensity,
+            topics=[parsed.scene],
+            risk_level=parsed_risk,
+        )
+
+    def _build_single_step_messages(
+        self,
+        step_num: int,
+        messages: List[ChatMessage],
+        parsed: ParsedState,
+        style: StyleProfile,
+        plan: ReplyPlan,
+        interventions: List[InterventionConfig],
+        previous_steps: Dict[int, Dict[str, Any]] = None,
+    ) -> List[Dict[str, str]]:
+        if previous_steps is None:
+            previous_steps = {}
+        
+        with span("build_prompt", mode="deep_step", step=step_num):
+            # 构建单个步骤的系统提示词
+            system_prompt = build_single_step_prompt(
+                step_num=step_num,
+                parsed=parsed,
+                style=style,
+                plan=plan,
+                interventions=interventions,
+                previous_steps=previous_steps
+            )
+            self._log_prompt(f"deep_step_{step_num}", system_prompt)
+            
+            # 格式化消息
+            return self._format_messages(system_prompt, messages)
+
+    def _dependency_results(
+        self,
+        step_num: int,
+        steps_to_execute: List[int],
+        step_results: Dict[int, Dict[str, Any]],
+    ) -> Dict[int, Dict[str, Any]]:
+        """从已完成的步骤中取出 step_num 依赖的步骤结果，作为生成上下文"""
+        return {
+            dep: step_results[dep]
+            for dep in get_step_dependencies(step_num, steps_to_execute)
+            if dep in step_results
+        }
+
+    def _sum_step_usage(self, step_results: Dict[int, Dict[str, Any]]) -> tuple[int, int, int]:
+        """累加各步骤的tokens：(prompt, completion, total)"""
+        total_prompt_tokens = 0
+        total_completion_tokens = 0
+        total_tokens = 0
+        for step_result in step_results.values():
+            usage = step_result.get("usage")
+            if usage:
+                total_prompt_tokens += usage.get("prompt_tokens", 0)
+                total_completion_tokens += usage.get("completion_tokens", 0)
+                total_tokens += usage.get("total_tokens", 0)
+        return total_prompt_tokens, total_completion_tokens, total_tokens
+
+    def _sum_cached_tokens(self, step_results: Dict[int, Dict[str, Any]]) -> int:
+        """累加各步骤命中上游前缀缓存的输入tokens"""
+        return sum((step_result.get("usage") or {}).get("cached_tokens") or 0 for step_result in step_results.values())
+
+    def _format_text_messages(self, messages: List[ChatMessage]) -> List[Dict[str, str]]:
+        # 将消息转换为字典格式
+        return [{"role": msg.role, "content": msg.content} for msg in messages]
+
+    def _format_messages(self, system_prompt: str | SystemPrompt, messages: List[ChatMessage]) -> List[Dict[str, str]]:
+        # 历史超出tokens预算时，较早的对话以滚动摘要的形式并入系统提示词
+        system_prompt, messages = compact_history(system_prompt, messages)
+        if isinstance(system_prompt, SystemPrompt):
+            # 固定前缀与动态后缀分成两条system消息，由各provider决定合并方式或缓存标记
+            formatted = [
+                {"role": "system", "content": system_prompt.static},
+                {"role": "system", "content": system_prompt.dynamic},
+            ]
+        else:
+            formatted = [{"role": "system", "content": system_prompt}]
         for msg in messages:
             formatted.append({"role": msg.role, "content": msg.content})
         return formatted
 
-    def _log_prompt(self, mode: str, prompt: str) -> None:
+    @staticmethod
+    def _merge_system_messages(chat_messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        合并相邻的system消息（固定前缀在前，合并后仍是请求的最长公共前缀），
+        供只接受单条system消息的API使用
+        """
+        merged: List[Dict[str, str]] = []
+        for msg in chat_messages:
+            if msg["role"] == "system" and merged and merged[-1]["role"] == "system":
+                merged[-1] = {"role": "system", "content": f"{merged[-1]['content']}\n\n{msg['content']}"}
+            else:
+                merged.append(msg)
+        return merged
+
+    def _log_prompt(self, mode: str, prompt: str | SystemPrompt) -> None:
         """
         输出发送给AI的系统提示词，方便在控制台查看。
         """
@@ -329,7 +1019,9 @@ class JsonChatLLMProvider(LLMProvider):
         text = payload.strip()
         if not text:
             self.logger.error("[JSON Parser] payload为空字符串")
+            get_parse_stats().record(self._parse_stats_key(), "failed")
             raise ValueError("无法解析JSON：payload为空")
+        original_text = text
         
         # 处理常见的LLM输出包装，例如 ```json``` 或 ``` 块
         if "```json" in text:
@@ -347,24 +1039,37 @@ class JsonChatLLMProvider(LLMProvider):
                 text = text.split(end_tag, 1)[1]
         
         text = text.strip()
+        stats_key = self._parse_stats_key()
         if not text:
             self.logger.error("[JSON Parser] 清理后的文本为空")
+            get_parse_stats().record(stats_key, "failed")
             raise ValueError("无法解析JSON：清理后的文本为空")
         
         try:
-            return json.loads(text)
+            result = json.loads(text)
+            # 需要去掉代码块/思考标签才能解析的也算修复路径
+            get_parse_stats().record(stats_key, "direct" if text == original_text else "repaired")
+            return result
         except json.JSONDecodeError as e:
             self.logger.warning(f"[JSON Parser] JSON解析失败，尝试提取JSON对象: {str(e)}")
             extracted = self._extract_json_object(text)
             if extracted:
                 try:
-                    return json.loads(extracted)
+                    result = json.loads(extracted)
+                    get_parse_stats().record(stats_key, "repaired")
+                    return result
                 except json.JSONDecodeError:
                     self.logger.error(f"[JSON Parser] 提取的JSON对象仍然无法解析: {extracted[:200]}")
+                    get_parse_stats().record(stats_key, "failed")
                     raise ValueError(f"无法解析JSON：{str(e)}")
             self.logger.error(f"[JSON Parser] 无法从文本中提取JSON对象: {text[:200]}")
+            get_parse_stats().record(stats_key, "failed")
             raise ValueError(f"无法解析JSON：{str(e)}")
 
+    def _parse_stats_key(self) -> str:
+        """provider名称（去掉 Provider 后缀的类名），用于解析统计、按provider的Schema开关和输出预算"""
+        return self.__class__.__name__.replace("Provider", "").lower()
+
     def _extract_json_object(self, text: str) -> str | None:
         """
         从包含额外说明文字的文本中尝试提取第一个完整的JSON对象。
@@ -667,6 +1372,11 @@ class JsonChatLLMProvider(LLMProvider):
             prompt_tokens=total_prompt_tokens if total_prompt_tokens > 0 else None,
             completion_tokens=total_completion_tokens if total_completion_tokens > 0 else None,
             total_tokens=total_tokens if total_tokens > 0 else None,
+            step_metrics=[
+                step_metric(step_num, step_result)
+                for step_num, step_result in sorted(step_results.items())
+                if "timing" in step_result
+            ] or None,
         )
 
 
@@ -1,11 +1,12 @@
 """
 Anthropic Claude Provider实现
 """
+import json
 import os
-import httpx
-from typing import List, Dict
+from typing import Any, AsyncIterator, List, Dict
 
 from app.core.providers.base_provider import JsonChatLLMProvider
+from app.core.providers.http_pool import get_async_http_client, get_http_client
 
 
 class ClaudeProvider(JsonChatLLMProvider):
@@ -20,81 +21,15 @@ class ClaudeProvider(JsonChatLLMProvider):
         if not self.api_key:
             raise ValueError("API key is required for Claude provider")
 
-    def _perform_text_completion(self, chat_messages: List[Dict[str, str]]) -> str | dict:
-        """
-        执行纯文本生成（不要求 JSON 格式）
-        """
-        try:
-            # Claude API使用messages格式，需要分离system message
-            messages = []
-            system_message = None
-            
-            for msg in chat_messages:
-                if msg["role"] == "system":
-                    system_message = msg["content"]
-                elif msg["role"] in ["user", "assistant"]:
-                    messages.append({
-                        "role": msg["role"],
-                        "content": msg["content"]
-                    })
-
-            url = f"{self.base_url}/messages"
-            headers = {
-                "x-api-key": self.api_key,
-                "anthropic-version": "2023-06-01",
-                "content-type": "application/json"
-            }
-
-            payload = {
-                "model": self.model,
-                "max_tokens": 500,
-                "temperature": 0.7,
-                "messages": messages,
-            }
-            
-            if system_message:
-                payload["system"] = system_message
-
-            with httpx.Client(timeout=60.0) as client:
-                response = client.post(url, headers=headers, json=payload)
-                response.raise_for_status()
-                
-                result_data = response.json()
-                # Claude返回格式：content[0].text
-                if "content" in result_data and len(result_data["content"]) > 0:
-                    result_text = result_data["content"][0]["text"]
-                    
-                    # 提取tokens使用信息
-                    usage = result_data.get("usage", {})
-                    if usage:
-                        return {
-                            "text": result_text,
-                            "usage": {
-                                "prompt_tokens": usage.get("input_tokens", 0),
-                                "completion_tokens": usage.get("output_tokens", 0),
-                                "total_tokens": usage.get("input_tokens", 0) + usage.get("output_tokens", 0),
-                            }
-                        }
-                    return result_text
-                
-                raise ValueError(f"Unexpected Claude API response format: {result_data}")
-        except Exception as e:
-            self.logger.error(f"[Claude Provider] 文本生成失败: {str(e)}", exc_info=True)
-            raise
-
-    def _perform_chat_completion(self, chat_messages: List[Dict[str, str]], mode: str) -> str | dict:
-        """调用Claude API"""
-        # 如果是 text 模式，使用文本生成方法
-        if mode == "text":
-            return self._perform_text_completion(chat_messages)
-        
+    def _build_request(self, chat_messages: List[Dict[str, str]], mode: str) -> tuple[str, Dict[str, str], Dict[str, Any]]:
+        """构建 (url, headers, payload)"""
         # Claude API使用messages格式，需要分离system message
         messages = []
-        system_message = None
-        
+        system_messages = []
+
         for msg in chat_messages:
             if msg["role"] == "system":
-                system_message = msg["content"]
+                system_messages.append(msg["content"])
             elif msg["role"] in ["user", "assistant"]:
                 messages.append({
                     "role": msg["role"],
@@ -108,40 +43,132 @@ class ClaudeProvider(JsonChatLLMProvider):
             "content-type": "application/json"
         }
 
+        # Claude支持JSON格式输出，但需要通过工具调用或特殊提示
+        # 这里我们依赖prompt中的JSON格式要求
+        params = self._sampling_params(mode)
         payload = {
             "model": self.model,
-            "max_tokens": 2000,
-            "temperature": 0.7,
+            "max_tokens": params["max_tokens"],
+            "temperature": params["temperature"],
             "messages": messages,
         }
-        
-        if system_message:
-            payload["system"] = system_message
 
-        # Claude支持JSON格式输出，但需要通过工具调用或特殊提示
-        # 这里我们依赖prompt中的JSON格式要求
-        with httpx.Client(timeout=60.0) as client:
-            response = client.post(url, headers=headers, json=payload)
-            response.raise_for_status()
-            
-            result_data = response.json()
-            # Claude返回格式：content[0].text
-            if "content" in result_data and len(result_data["content"]) > 0:
+        schema = self._response_schema(mode)
+        if schema:
+            # Claude 没有JSON模式：定义一个工具并强制调用，工具参数即为符合Schema的结构化输出
+            name, json_schema = schema
+            payload["tools"] = [{
+                "name": name,
+                "description": "按照系统提示词的要求输出本轮回复的结构化结果",
+                "input_schema": json_schema,
+            }]
+            payload["tool_choice"] = {"type": "tool", "name": name}
+
+        if len(system_messages) > 1:
+            # 第一条是与用户无关的固定前缀，标记为缓存断点，后续请求命中时按缓存价格计费
+            payload["system"] = [{"type": "text", "text": text} for text in system_messages]
+            payload["system"][0]["cache_control"] = {"type": "ephemeral"}
+        elif system_messages:
+            payload["system"] = system_messages[0]
+
+        return url, headers, payload
+
+    def _parse_response(self, result_data: Dict[str, Any], mode: str) -> str | dict:
+        # Claude返回格式：content[0].text；强制工具调用时为 tool_use 块的 input
+        if "content" in result_data and len(result_data["content"]) > 0:
+            tool_use = next((block for block in result_data["content"] if block.get("type") == "tool_use"), None)
+            if tool_use is not None:
+                result_text = json.dumps(tool_use.get("input", {}), ensure_ascii=False)
+            else:
                 result_text = result_data["content"][0]["text"]
+            if mode != "text":
                 self.logger.info(f"[Claude Provider] API响应: {result_text}")
-                
-                # 提取tokens使用信息
-                usage = result_data.get("usage", {})
-                if usage:
-                    return {
-                        "text": result_text,
-                        "usage": {
-                            "prompt_tokens": usage.get("input_tokens", 0),
-                            "completion_tokens": usage.get("output_tokens", 0),
-                            "total_tokens": usage.get("input_tokens", 0) + usage.get("output_tokens", 0),
-                        }
+
+            # 提取tokens使用信息
+            usage = result_data.get("usage", {})
+            if usage:
+                prompt_usage = self._prompt_usage(usage)
+                completion_tokens = usage.get("output_tokens", 0)
+                return {
+                    "text": result_text,
+                    "usage": {
+                        **prompt_usage,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_usage["prompt_tokens"] + completion_tokens,
                     }
-                return result_text
-            
-            raise ValueError(f"Unexpected Claude API response format: {result_data}")
+                }
+            return result_text
+
+        raise ValueError(f"Unexpected Claude API response format: {result_data}")
 
+    @staticmethod
+    def _prompt_usage(usage: Dict[str, Any]) -> Dict[str, int]:
+        """
+        输入tokens：Claude的 input_tokens 不包含缓存写入/读取的部分，这里合计为完整的输入tokens，
+        cached_tokens 为命中缓存读取的部分
+        """
+        cached_tokens = usage.get("cache_read_input_tokens") or 0
+        prompt_tokens = usage.get("input_tokens", 0) + (usage.get("cache_creation_input_tokens") or 0) + cached_tokens
+        return {"prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens}
+
+    def _perform_text_completion(self, chat_messages: List[Dict[str, str]]) -> str | dict:
+        """
+        执行纯文本生成（不要求 JSON 格式）
+        """
+        try:
+            return self._perform_chat_completion(chat_messages, mode="text")
+        except Exception as e:
+            self.logger.error(f"[Claude Provider] 文本生成失败: {str(e)}", exc_info=True)
+            raise
+
+    async def _aperform_text_completion(self, chat_messages: List[Dict[str, str]]) -> str | dict:
+        try:
+            return await self._aperform_chat_completion(chat_messages, mode="text")
+        except Exception as e:
+            self.logger.error(f"[Claude Provider] 文本生成失败: {str(e)}", exc_info=True)
+            raise
+
+    def _raw_chat_completion(self, chat_messages: List[Dict[str, str]], mode: str) -> str | dict:
+        """调用Claude API"""
+        url, headers, payload = self._build_request(chat_messages, mode)
+        client = get_http_client("claude", self.base_url, self.api_key)
+        response = client.post(url, headers=headers, json=payload)
+        response.raise_for_status()
+        return self._parse_response(response.json(), mode)
+
+    async def _araw_chat_completion(self, chat_messages: List[Dict[str, str]], mode: str) -> str | dict:
+        """异步调用Claude API"""
+        url, headers, payload = self._build_request(chat_messages, mode)
+        client = get_async_http_client("claude", self.base_url, self.api_key)
+        response = await client.post(url, headers=headers, json=payload)
+        response.raise_for_status()
+        return self._parse_response(response.json(), mode)
+
+    async def _araw_stream(
+        self,
+        chat_messages: List[Dict[str, str]],
+        mode: str,
+        usage: Dict[str, Any],
+    ) -> AsyncIterator[str]:
+        """流式调用Claude API（SSE）"""
+        url, headers, payload = self._build_request(chat_messages, mode)
+        payload["stream"] = True
+        client = get_async_http_client("claude", self.base_url, self.api_key)
+        async with client.stream("POST", url, headers=headers, json=payload) as response:
+            response.raise_for_status()
+            async for data in self._aiter_sse_data(response):
+                event = json.loads(data)
+                event_type = event.get("type")
+                if event_type == "message_start":
+                    # message_start 携带输入tokens，message_delta 携带输出tokens
+                    usage.update(self._prompt_usage(event.get("message", {}).get("usage", {})))
+                elif event_type == "content_block_delta":
+                    # 强制工具调用时，工具参数以 input_json_delta 的 partial_json 流式返回
+                    delta = event.get("delta", {})
+                    text = delta.get("text") or delta.get("partial_json")
+                    if text:
+                        yield text
+                elif event_type == "message_delta":
+                    usage["completion_tokens"] = event.get("usage", {}).get("output_tokens", 0)
+        if usage:
+            usage["total_tokens"] = usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
@@ -0,0 +1,316 @@
+"""
+LLM 补全结果缓存（按内容寻址）
+
+缓存以装饰器形式挂在 JsonChatLLMProvider 的 _perform_chat_completion / _aperform_chat_completion 上（包裹子类的 _raw_* 实现），
+key 为 (provider, base_url, model, mode, messages, 采样参数) 的 sha256，只缓存成功的补全结果。
+
+- 内存 LRU 作为前端，可选 SQLite 持久化存储（进程重启后仍可命中）
+- TTL 与开关按调用点设置：with completion_cache_policy(ttl=...) / completion_cache_policy(enabled=False)，
+  最内层的设置生效；未设置时使用环境变量中的默认 TTL
+- 命中时返回的 usage 为 0（没有真正消耗 tokens），并在 usage 中标记 cached=True
+- 未命中时经 singleflight 合并并发中的相同请求（缓存关闭的调用点同样合并，见 singleflight.py）
+
+配置（环境变量）：
+- LLM_COMPLETION_CACHE_ENABLED: 总开关（默认true）
+- LLM_COMPLETION_CACHE_TTL: 未指定策略的调用点使用的默认TTL秒数（默认0，即不缓存）
+- LLM_COMPLETION_CACHE_MAX_ENTRIES: 内存LRU的最大条目数（默认512）
+- LLM_COMPLETION_CACHE_SQLITE: SQLite缓存文件路径（为空时不启用持久化）
+"""
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from app.core.providers.singleflight import get_singleflight, shared_result, singleflight_enabled
+from app.core.response_schemas import current_response_schema_name
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    """调用点的缓存策略"""
+    ttl: int
+    enabled: bool = True
+
+
+_policy: contextvars.ContextVar[Optional[CachePolicy]] = contextvars.ContextVar("completion_cache_policy", default=None)
+
+
+@contextmanager
+def completion_cache_policy(ttl: Optional[int] = None, enabled: bool = True) -> Iterator[None]:
+    """
+    为当前调用点设置缓存策略（对同一上下文中的所有LLM补全生效，可嵌套）
+
+    用法：
+        with completion_cache_policy(ttl=86400):
+            provider.generate_text(messages)
+        with completion_cache_policy(enabled=False):
+            provider.generate_structured_reply(...)
+    """
+    token = _policy.set(CachePolicy(ttl=ttl if ttl is not None else _default_ttl(), enabled=enabled))
+    try:
+        yield
+    finally:
+        _policy.reset(token)
+
+
+def _default_ttl() -> int:
+    return _env_int("LLM_COMPLETION_CACHE_TTL", 0)
+
+
+def _current_ttl() -> int:
+    """返回当前上下文的有效TTL（0表示不缓存）"""
+    if os.getenv("LLM_COMPLETION_CACHE_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return 0
+    policy = _policy.get()
+    if policy is None:
+        return _default_ttl()
+    return policy.ttl if policy.enabled else 0
+
+
+class _SQLiteStore:
+    """SQLite持久化存储（标准库 sqlite3，独立于业务数据库）"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completion_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM completion_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= time.time():
+                self._conn.execute("DELETE FROM completion_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any, expires_at: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completion_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at),
+            )
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM completion_cache")
+            self._conn.commit()
+
+
+class CompletionCache:
+    """内存LRU + 可选SQLite 的两级缓存"""
+
+    def __init__(self, max_entries: int = 512, sqlite_path: Optional[str] = None):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self.max_entries = max(1, max_entries)
+        self._store: Optional[_SQLiteStore] = None
+        if sqlite_path:
+            try:
+                self._store = _SQLiteStore(sqlite_path)
+            except sqlite3.Error as e:
+                logger.warning(f"[Completion Cache] 无法打开SQLite缓存 {sqlite_path}: {str(e)}，仅使用内存缓存")
+        self.hits = 0
+        self.misses = 0
+        self.sqlite_hits = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+
+        if self._store is not None:
+            stored = self._store.get(key)
+            if stored is not None:
+                value, expires_at = stored
+                with self._lock:
+                    self._put(key, value, expires_at)
+                    self.hits += 1
+                    self.sqlite_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._put(key, value, expires_at)
+        if self._store is not None:
+            self._store.set(key, value, expires_at)
+
+    def _put(self, key: str, value: Any, expires_at: float) -> None:
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.sqlite_hits = 0
+        if self._store is not None:
+            self._store.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "sqlite_hits": self.sqlite_hits,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "sqlite_enabled": self._store is not None,
+            }
+
+
+# 全局单例
+_completion_cache: Optional[CompletionCache] = None
+_init_lock = threading.Lock()
+
+
+def get_completion_cache() -> CompletionCache:
+    """获取补全缓存单例（首次调用时按环境变量初始化）"""
+    global _completion_cache
+    if _completion_cache is None:
+        with _init_lock:
+            if _completion_cache is None:
+                _completion_cache = CompletionCache(
+                    max_entries=_env_int("LLM_COMPLETION_CACHE_MAX_ENTRIES", 512),
+                    sqlite_path=os.getenv("LLM_COMPLETION_CACHE_SQLITE") or None,
+                )
+    return _completion_cache
+
+
+def completion_cache_key(provider: Any, chat_messages: Any, mode: str) -> str:
+    """计算补全请求的内容指纹"""
+    payload = {
+        "provider": provider.__class__.__name__,
+        "base_url": getattr(provider, "base_url", None),
+        "model": getattr(provider, "model", None),
+        "mode": mode,
+        "schema": current_response_schema_name(),
+        "messages": chat_messages,
+        "params": provider._sampling_params(mode),
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _cached_value(result: str | dict) -> Dict[str, Any]:
+    """统一成 {"text", "usage"} 形式再存入缓存"""
+    if isinstance(result, dict):
+        return {"text": result.get("text", ""), "usage": result.get("usage", {})}
+    return {"text": result, "usage": {}}
+
+
+def _hit_result(value: Dict[str, Any]) -> Dict[str, Any]:
+    # 命中缓存时没有真正调用LLM，tokens记为0
+    return {
+        "text": value["text"],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached": True},
+    }
+
+
+def _is_cacheable(result: str | dict) -> bool:
+    text = result.get("text") if isinstance(result, dict) else result
+    return isinstance(text, str) and bool(text.strip())
+
+
+def cached_completion(func):
+    """
+    包裹同步的 _perform_chat_completion(self, chat_messages, mode)：
+    先查缓存，未命中时经 singleflight 合并并发中的相同请求后再真正调用
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, chat_messages, mode: str):
+        ttl = _current_ttl()
+        if ttl <= 0 and not singleflight_enabled():
+            return func(self, chat_messages, mode)
+        key = completion_cache_key(self, chat_messages, mode)
+        if ttl > 0:
+            value = get_completion_cache().get(key)
+            if value is not None:
+                self.logger.info(f"[Completion Cache] 命中缓存 mode={mode} key={key[:12]}")
+                return _hit_result(value)
+
+        if singleflight_enabled():
+            result, shared = get_singleflight().do(key, lambda: func(self, chat_messages, mode))
+            if shared:
+                self.logger.info(f"[Completion Cache] 合并相同的进行中请求 mode={mode} key={key[:12]}")
+                return shared_result(result)
+        else:
+            result = func(self, chat_messages, mode)
+
+        if ttl > 0 and _is_cacheable(result):
+            get_completion_cache().set(key, _cached_value(result), ttl)
+        return result
+
+    return wrapper
+
+
+def acached_completion(func):
+    """包裹异步的 _aperform_chat_completion(self, chat_messages, mode)，逻辑同 cached_completion"""
+
+    @functools.wraps(func)
+    async def wrapper(self, chat_messages, mode: str):
+        ttl = _current_ttl()
+        if ttl <= 0 and not singleflight_enabled():
+            return await func(self, chat_messages, mode)
+        key = completion_cache_key(self, chat_messages, mode)
+        if ttl > 0:
+            value = get_completion_cache().get(key)
+            if value is not None:
+                self.logger.info(f"[Completion Cache] 命中缓存 mode={mode} key={key[:12]}")
+                return _hit_result(value)
+
+        if singleflight_enabled():
+            result, shared = await get_singleflight().ado(key, lambda: func(self, chat_messages, mode))
+            if shared:
+                self.logger.info(f"[Completion Cache] 合并相同的进行中请求 mode={mode} key={key[:12]}")
+                return shared_result(result)
+        else:
+            result = await func(self, chat_messages, mode)
+
+        if ttl > 0 and _is_cacheable(result):
+            get_completion_cache().set(key, _cached_value(result), ttl)
+        return result
+
+    return wrapper
@@ -0,0 +1,300 @@
+"""
+多Provider故障转移
+
+把多个 JsonChatLLMProvider 组合成一个有序的 provider 池（主 + 备用），在补全层面做故障转移：
+提示词构建、JSON解析等逻辑仍由 JsonChatLLMProvider 负责，只有实际的API调用会在成员之间切换，
+因此主 provider 失败时会先尝试备用 provider，全部失败才退化为 SAFE_REPLY。
+
+- 每个成员有独立的熔断器：连续失败达到阈值后熔断，冷却期后放行一次试探请求（半开）
+- 对冲请求（仅异步、非流式）：主 provider 超过其近期 p95 延迟仍未返回时，向下一个可用成员发出同样的请求，
+  取先完成的结果
+
+配置（环境变量）：
+- LLM_BREAKER_FAILURE_THRESHOLD: 连续失败多少次后熔断（默认3）
+- LLM_BREAKER_COOLDOWN: 熔断后多少秒进入半开状态（默认30）
+- LLM_HEDGE_ENABLED: 是否启用对冲请求（默认false）
+- LLM_HEDGE_MIN_SAMPLES: 主 provider 至少有多少个延迟样本后才启用对冲（默认20）
+- LLM_HEDGE_MIN_DELAY: 对冲等待时间的下限秒数（默认1.0）
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+from app.core.providers.base_provider import JsonChatLLMProvider
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class CircuitBreaker:
+    """连续失败计数熔断器（closed -> open -> half_open -> closed）"""
+
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        # 时钟可注入（测试中用假时钟推进冷却期）
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._half_open_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if self._clock() - self._opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow_request(self) -> bool:
+        """是否允许发出请求（半开状态只放行一个试探请求）"""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._half_open_in_flight:
+                self._half_open_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._half_open_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._half_open_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                # 半开试探失败或连续失败达到阈值：重新开始冷却
+                self._opened_at = self._clock()
+
+    def release(self) -> None:
+        """请求被取消（如对冲请求落败）时释放半开名额，不计成功或失败"""
+        with self._lock:
+            self._half_open_in_flight = False
+
+
+class PoolMember:
+    """provider 池成员：provider 实例 + 熔断器 + 近期延迟样本"""
+
+    def __init__(self, label: str, provider: JsonChatLLMProvider):
+        self.label = label
+        self.provider = provider
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(_env_float("LLM_BREAKER_FAILURE_THRESHOLD", 3)),
+            cooldown=_env_float("LLM_BREAKER_COOLDOWN", 30.0),
+        )
+        self._latencies: deque = deque(maxlen=200)
+        self.successes = 0
+        self.failures = 0
+
+    def record_latency(self, seconds: float) -> None:
+        self._latencies.append(seconds)
+
+    def p95_latency(self) -> Optional[float]:
+        samples = sorted(self._latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def sample_count(self) -> int:
+        return len(self._latencies)
+
+
+class FailoverLLMProvider(JsonChatLLMProvider):
+    """按顺序组合多个 provider，在API调用层面故障转移和对冲"""
+
+    def __init__(self, members: List[Tuple[str, JsonChatLLMProvider]]):
+        super().__init__()
+        if not members:
+            raise ValueError("FailoverLLMProvider requires at least one provider")
+        self.members = [PoolMember(label, provider) for label, provider in members]
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+
+    def _parse_stats_key(self) -> str:
+        # JSON在池这一层解析，无法区分由哪个成员返回；Schema是否下发由各成员自己决定
+        return "failover"
+
+    # ===== 补全调用 =====
+
+    def _perform_text_completion(self, chat_messages: List[Dict[str, str]]) -> str | dict:
+        return self._perform_chat_completion(chat_messages, mode="text")
+
+    async def _aperform_text_completion(self, chat_messages: List[Dict[str, str]]) -> str | dict:
+        return await self._aperform_chat_completion(chat_messages, mode="text")
+
+    # 池本身不经过装饰器栈：直接覆盖 _perform_* / _astream_chat_completion，调用各成员同名的入口，
+    # 缓存、限流、预算与指标由各成员按自己的 provider 记录，不会在池这一层重复计数
+
+    def _perform_chat_completion(self, chat_messages: List[Dict[str, str]], mode: str) -> str | dict:
+        """同步调用：按顺序尝试可用成员（同步路径不做对冲）"""
+        last_error: Optional[Exception] = None
+        for member in self._iter_available_members():
+            started = time.perf_counter()
+            try:
+                result = member.provider._perform_chat_completion(chat_messages, mode)
+            except Exception as e:
+                self._on_failure(member, e)
+                last_error = e
+                continue
+            self._on_success(member, time.perf_counter() - started)
+            return result
+        raise last_error or self._all_open_error()
+
+    async def _aperform_chat_completion(self, chat_messages: List[Dict[str, str]], mode: str) -> str | dict:
+        """异步调用：按顺序尝试可用成员，主请求超过 p95 延迟时对冲下一个成员"""
+        members = self._iter_available_members()
+        last_error: Optional[Exception] = None
+        member = next(members, None)
+        while member is not None:
+            try:
+                return await self._acall_with_hedge(member, members, chat_messages, mode)
+            except Exception as e:
+                last_error = e
+            member = next(members, None)
+        raise last_error or self._all_open_error()
+
+    async def _acall_member(self, member: PoolMember, chat_messages: List[Dict[str, str]], mode: str) -> str | dict:
+        started = time.perf_counter()
+        try:
+            result = await member.provider._aperform_chat_completion(chat_messages, mode)
+        except asyncio.CancelledError:
+            member.breaker.release()
+            raise
+        except Exception as e:
+            self._on_failure(member, e)
+            raise
+        self._on_success(member, time.perf_counter() - started)
+        return result
+
+    async def _acall_with_hedge(
+        self,
+        member: PoolMember,
+        members: Iterator[PoolMember],
+        chat_messages: List[Dict[str, str]],
+        mode: str,
+    ) -> str | dict:
+        """
+        调用 member；启用对冲且超过其 p95 延迟仍未返回时，从 members 中取下一个可用成员发出对冲请求，
+        返回先成功的结果（被取出的对冲成员失败后不会再被重复尝试）
+        """
+        hedge_delay = self._hedge_delay(member)
+        primary = asyncio.ensure_future(self._acall_member(member, chat_messages, mode))
+        pending = {primary}
+        try:
+            if hedge_delay is None:
+                return await primary
+
+            done, _ = await asyncio.wait(pending, timeout=hedge_delay)
+            hedge_member = None if done else next(members, None)
+            if hedge_member is not None:
+                self.hedged_requests += 1
+                self.logger.warning(
+                    f"[Failover] {member.label} 超过 {hedge_delay:.2f}s 未返回，对冲请求 {hedge_member.label}"
+                )
+                pending.add(asyncio.ensure_future(self._acall_member(hedge_member, chat_messages, mode)))
+
+            last_error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            # 返回、失败或调用方被取消时，取消仍在进行的请求
+            for task in pending:
+                task.cancel()
+
+    async def _astream_chat_completion(
+        self,
+        chat_messages: List[Dict[str, str]],
+        mode: str,
+        usage: Dict[str, Any],
+    ) -> AsyncIterator[str]:
+        """流式调用：尚未输出任何内容前失败时切换到下一个成员，已开始输出后的失败直接抛出"""
+        last_error: Optional[Exception] = None
+        for member in self._iter_available_members():
+            started = time.perf_counter()
+            has_output = False
+            try:
+                async for chunk in member.provider._astream_chat_completion(chat_messages, mode, usage):
+                    has_output = True
+                    yield chunk
+            except Exception as e:
+                self._on_failure(member, e)
+                if has_output:
+                    raise
+                last_error = e
+                continue
+            self._on_success(member, time.perf_counter() - started)
+            return
+        raise last_error or self._all_open_error()
+
+    # ===== 成员状态 =====
+
+    def _iter_available_members(self) -> Iterator[PoolMember]:
+        """按顺序惰性地产出熔断器放行的成员（只在真正调用前占用半开状态的试探名额）"""
+        for member in self.members:
+            if member.breaker.allow_request():
+                yield member
+
+    def _all_open_error(self) -> RuntimeError:
+        self.logger.error("[Failover] 所有LLM provider均处于熔断状态")
+        return RuntimeError("所有LLM provider均处于熔断状态")
+
+    def _hedge_delay(self, member: PoolMember) -> Optional[float]:
+        if os.getenv("LLM_HEDGE_ENABLED", "false").lower() not in ("1", "true", "yes"):
+            return None
+        if member.sample_count() < int(_env_float("LLM_HEDGE_MIN_SAMPLES", 20)):
+            return None
+        return max(member.p95_latency(), _env_float("LLM_HEDGE_MIN_DELAY", 1.0))
+
+    def _on_success(self, member: PoolMember, elapsed: float) -> None:
+        member.breaker.record_success()
+        member.record_latency(elapsed)
+        member.successes += 1
+
+    def _on_failure(self, member: PoolMember, error: Exception) -> None:
+        member.breaker.record_failure()
+        member.failures += 1
+        self.logger.warning(
+            f"[Failover] {member.label} 调用失败（熔断器: {member.breaker.state}）: {str(error)}"
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """provider 池状态（供统计接口使用）"""
+        return {
+            "hedged_requests": self.hedged_requests,
+            "hedge_wins": self.hedge_wins,
+            "members": [
+                {
+                    "label": member.label,
+                    "breaker_state": member.breaker.state,
+                    "successes": member.successes,
+                    "failures": member.failures,
+                    "p95_latency_ms": round(member.p95_latency() * 1000, 1) if member.p95_latency() is not None else None,
+                    "latency_samples": member.sample_count(),
+                }
+                for member in self.members
+            ],
+        }
@@ -1,11 +1,12 @@
 """
 Google Gemini Provider实现
 """
+import json
 import os
-import httpx
-from typing import List, Dict
+from typing import Any, AsyncIterator, List, Dict
 
 from app.core.providers.base_provider import JsonChatLLMProvider
+from app.core.providers.http_pool import get_async_http_client, get_http_client
 
 
 class GeminiProvider(JsonChatLLMProvider):
@@ -20,75 +21,16 @@ class GeminiProvider(JsonChatLLMProvider):
         if not self.api_key:
             raise ValueError("API key is required for Gemini provider")
 
-    def _perform_text_completion(self, chat_messages: List[Dict[str, str]]) -> str | dict:
-        """
-        执行纯文本生成（不要求 JSON 格式）
-        """
-        try:
-            # 转换消息格式：Gemini使用parts格式
-            contents = []
-            system_instruction = None
-            
-            for msg in chat_messages:
-                if msg["role"] == "system":
-                    # Gemini API需要system instruction作为单独的字段
-                    system_instruction = {"parts": [{"text": msg["content"]}]}
-                else:
-                    # 转换角色：user -> user, assistant -> model
-                    role = "user" if msg["role"] == "user" else "model"
-                    contents.append({
-                        "role": role,
-                        "parts": [{"text": msg["content"]}]
-                    })
-
-            url = f"{self.base_url}/models/{self.model}:generateContent"
-            params = {"key": self.api_key}
-            
-            payload = {
-                "contents": contents,
-            }
-            if system_instruction:
-                payload["systemInstruction"] = system_instruction
-
-            # 添加生成配置（不要求 JSON 格式）
-            payload["generationConfig"] = {
-                "temperature": 0.7,
-                "maxOutputTokens": 500,
-            }
-
-            with httpx.Client(timeout=60.0) as client:
-                response = client.post(url, params=params, json=payload)
-                response.raise_for_status()
-                
-                result_data = response.json()
-                # Gemini返回格式：candidates[0].content.parts[0].text
-                if "candidates" in result_data and len(result_data["candidates"]) > 0:
-                    candidate = result_data["candidates"][0]
-                    if "content" in candidate and "parts" in candidate["content"]:
-                        parts = candidate["content"]["parts"]
-                        if parts and "text" in parts[0]:
-                            result_text = parts[0]["text"]
-                            return result_text
-                
-                raise ValueError(f"Unexpected Gemini API response format: {result_data}")
-        except Exception as e:
-            self.logger.error(f"[Gemini Provider] 文本生成失败: {str(e)}", exc_info=True)
-            raise
-
-    def _perform_chat_completion(self, chat_messages: List[Dict[str, str]], mode: str) -> str | dict:
-        """调用Gemini API"""
-        # 如果是 text 模式，使用文本生成方法
-        if mode == "text":
-            return self._perform_text_completion(chat_messages)
-        
+    def _build_request(self, chat_messages: List[Dict[str, str]], mode: str) -> tuple[str, Dict[str, str], Dict[str, Any]]:
+        """构建 (url, params, payload)"""
         # 转换消息格式：Gemini使用parts格式
         contents = []
-        system_instruction = None
-        
+        system_parts = []
+
         for msg in chat_messages:
             if msg["role"] == "system":
-                # Gemini API需要system instruction作为单独的字段
-                system_instruction = {"parts": [{"text": msg["content"]}]}
+                # Gemini API需要system instruction作为单独的字段（固定前缀在前，便于命中隐式缓存）
+                system_parts.append({"text": msg["content"]})
             else:
                 # 转换角色：user -> user, assistant -> model
                 role = "user" if msg["role"] == "user" else "model"
@@ -99,34 +41,127 @@ class GeminiProvider(JsonChatLLMProvider):
 
         url = f"{self.base_url}/models/{self.model}:generateContent"
         params = {"key": self.api_key}
-        
+
         payload = {
             "contents": contents,
         }
-        if system_instruction:
-            payload["systemInstruction"] = system_instruction
+        if system_parts:
+            payload["systemInstruction"] = {"parts": system_parts}
 
-        # 添加生成配置
+        # 添加生成配置（text 模式不要求 JSON 格式）
+        sampling = self._sampling_params(mode)
         payload["generationConfig"] = {
-            "temperature": 0.7,
-            "maxOutputTokens": 2000,
-            "responseMimeType": "application/json"
+            "temperature": sampling["temperature"],
+            "maxOutputTokens": sampling["max_tokens"],
         }
+        if mode != "text":
+            payload["generationConfig"]["responseMimeType"] = "application/json"
+            schema = self._response_schema(mode)
+            if schema:
+                payload["generationConfig"]["responseSchema"] = self._to_gemini_schema(schema[1])
 
-        with httpx.Client(timeout=60.0) as client:
-            response = client.post(url, params=params, json=payload)
-            response.raise_for_status()
-            
-            result_data = response.json()
-            # Gemini返回格式：candidates[0].content.parts[0].text
-            if "candidates" in result_data and len(result_data["candidates"]) > 0:
-                candidate = result_data["candidates"][0]
-                if "content" in candidate and "parts" in candidate["content"]:
-                    parts = candidate["content"]["parts"]
-                    if parts and "text" in parts[0]:
-                        result_text = parts[0]["text"]
+        return url, params, payload
+
+    def _parse_response(self, result_data: Dict[str, Any], mode: str) -> str | dict:
+        # Gemini返回格式：candidates[0].content.parts[0].text
+        if "candidates" in result_data and len(result_data["candidates"]) > 0:
+            candidate = result_data["candidates"][0]
+            if "content" in candidate and "parts" in candidate["content"]:
+                parts = candidate["content"]["parts"]
+                if parts and "text" in parts[0]:
+                    result_text = parts[0]["text"]
+                    if mode != "text":
                         self.logger.info(f"[Gemini Provider] API响应: {result_text}")
-                        return result_text
-            
-            raise ValueError(f"Unexpected Gemini API response format: {result_data}")
+                    usage_metadata = result_data.get("usageMetadata")
+                    if usage_metadata:
+                        return {"text": result_text, "usage": self._usage_info(usage_metadata)}
+                    return result_text
+
+        raise ValueError(f"Unexpected Gemini API response format: {result_data}")
+
+    @classmethod
+    def _to_gemini_schema(cls, schema: Dict[str, Any]) -> Dict[str, Any]:
+        """把JSON Schema转换为Gemini的OpenAPI子集：类型名大写，不支持 additionalProperties"""
+        converted: Dict[str, Any] = {}
+        for key, value in schema.items():
+            if key == "additionalProperties":
+                continue
+            if key == "type":
+                converted["type"] = value.upper()
+            elif key == "properties":
+                converted["properties"] = {name: cls._to_gemini_schema(prop) for name, prop in value.items()}
+                # 按Schema中的字段顺序生成，流式输出时 reply 等字段会尽早出现
+                converted["propertyOrdering"] = list(value)
+            elif key == "items":
+                converted["items"] = cls._to_gemini_schema(value)
+            else:
+                converted[key] = value
+        return converted
+
+    @staticmethod
+    def _usage_info(usage_metadata: Dict[str, Any]) -> Dict[str, int]:
+        """提取tokens使用信息（cachedContentTokenCount 为命中缓存的输入tokens）"""
+        usage_info = {
+            "prompt_tokens": usage_metadata.get("promptTokenCount", 0),
+            "completion_tokens": usage_metadata.get("candidatesTokenCount", 0),
+            "total_tokens": usage_metadata.get("totalTokenCount", 0),
+        }
+        if "cachedContentTokenCount" in usage_metadata:
+            usage_info["cached_tokens"] = usage_metadata["cachedContentTokenCount"]
+        return usage_info
 
+    def _perform_text_completion(self, chat_messages: List[Dict[str, str]]) -> str | dict:
+        """
+        执行纯文本生成（不要求 JSON 格式）
+        """
+        try:
+            return self._perform_chat_completion(chat_messages, mode="text")
+        except Exception as e:
+            self.logger.error(f"[Gemini Provider] 文本生成失败: {str(e)}", exc_info=True)
+            raise
+
+    async def _aperform_text_completion(self, chat_messages: List[Dict[str, str]]) -> str | dict:
+        try:
+            return await self._aperform_chat_completion(chat_messages, mode="text")
+        except Exception as e:
+            self.logger.error(f"[Gemini Provider] 文本生成失败: {str(e)}", exc_info=True)
+            raise
+
+    def _raw_chat_completion(self, chat_messages: List[Dict[str, str]], mode: str) -> str | dict:
+        """调用Gemini API"""
+        url, params, payload = self._build_request(chat_messages, mode)
+        client = get_http_client("gemini", self.base_url, self.api_key)
+        response = client.post(url, params=params, json=payload)
+        response.raise_for_status()
+        return self._parse_response(response.json(), mode)
+
+    async def _araw_chat_completion(self, chat_messages: List[Dict[str, str]], mode: str) -> str | dict:
+        """异步调用Gemini API"""
+        url, params, payload = self._build_request(chat_messages, mode)
+        client = get_async_http_client("gemini", self.base_url, self.api_key)
+        response = await client.post(url, params=params, json=payload)
+        response.raise_for_status()
+        return self._parse_response(response.json(), mode)
+
+    async def _araw_stream(
+        self,
+        chat_messages: List[Dict[str, str]],
+        mode: str,
+        usage: Dict[str, Any],
+    ) -> AsyncIterator[str]:
+        """流式调用Gemini API（streamGenerateContent + SSE）"""
+        url, params, payload = self._build_request(chat_messages, mode)
+        url = url.replace(":generateContent", ":streamGenerateContent")
+        params = {**params, "alt": "sse"}
+        client = get_async_http_client("gemini", self.base_url, self.api_key)
+        async with client.stream("POST", url, params=params, json=payload) as response:
+            response.raise_for_status()
+            async for data in self._aiter_sse_data(response):
+                chunk = json.loads(data)
+                for candidate in chunk.get("candidates", [])[:1]:
+                    for part in candidate.get("content", {}).get("parts", []):
+                        if part.get("text"):
+                            yield part["text"]
+                usage_metadata = chunk.get("usageMetadata")
+                if usage_metadata:
+                    usage.update(self._usage_info(usage_metadata))
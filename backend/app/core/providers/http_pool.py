@@ -0,0 +1,142 @@
+"""
+LLM Provider 共享HTTP连接池
+
+按 (provider, base_url, api_key) 复用进程级的 httpx 客户端，避免每次调用都重新进行 TCP+TLS 握手。
+同步客户端全进程共享；异步客户端的连接绑定在事件循环上，因此按事件循环分别维护。
+
+配置（环境变量）：
+- LLM_HTTP_MAX_CONNECTIONS: 每个客户端的最大连接数（默认100）
+- LLM_HTTP_MAX_KEEPALIVE: 最大保活连接数（默认20）
+- LLM_HTTP_KEEPALIVE_EXPIRY: 保活连接的空闲过期秒数（默认30）
+- LLM_HTTP_TIMEOUT: 读写超时秒数（默认60）
+- LLM_HTTP_CONNECT_TIMEOUT: 建立连接超时秒数（默认10）
+- LLM_HTTP2: 是否启用HTTP/2（默认false，需要安装 httpx[http2]）
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from typing import Dict, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+_PoolKey = Tuple[str, str, str]
+
+_lock = threading.Lock()
+_sync_clients: Dict[_PoolKey, httpx.Client] = {}
+# 异步客户端：key -> (创建时的事件循环, 客户端)
+_async_clients: Dict[_PoolKey, Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = {}
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _http2_enabled() -> bool:
+    if os.getenv("LLM_HTTP2", "false").lower() not in ("1", "true", "yes"):
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("[HTTP Pool] LLM_HTTP2 已开启但未安装 h2（pip install httpx[http2]），使用 HTTP/1.1")
+        return False
+    return True
+
+
+def _client_options() -> dict:
+    timeout = _env_float("LLM_HTTP_TIMEOUT", 60.0)
+    return {
+        "timeout": httpx.Timeout(timeout, connect=_env_float("LLM_HTTP_CONNECT_TIMEOUT", 10.0)),
+        "limits": httpx.Limits(
+            max_connections=_env_int("LLM_HTTP_MAX_CONNECTIONS", 100),
+            max_keepalive_connections=_env_int("LLM_HTTP_MAX_KEEPALIVE", 20),
+            keepalive_expiry=_env_float("LLM_HTTP_KEEPALIVE_EXPIRY", 30.0),
+        ),
+        "http2": _http2_enabled(),
+    }
+
+
+def _make_key(provider: str, base_url: str | None, api_key: str | None) -> _PoolKey:
+    # 不在内存中的key里保存明文api_key
+    key_digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+    return provider, (base_url or "").rstrip("/"), key_digest
+
+
+def get_http_client(provider: str, base_url: str | None = None, api_key: str | None = None) -> httpx.Client:
+    """获取（或创建）共享的同步 httpx 客户端"""
+    key = _make_key(provider, base_url, api_key)
+    client = _sync_clients.get(key)
+    if client is not None and not client.is_closed:
+        return client
+    with _lock:
+        client = _sync_clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.Client(**_client_options())
+            _sync_clients[key] = client
+            logger.info(f"[HTTP Pool] 创建同步连接池: provider={provider}, base_url={key[1]}")
+        return client
+
+
+def get_async_http_client(provider: str, base_url: str | None = None, api_key: str | None = None) -> httpx.AsyncClient:
+    """
+    获取（或创建）当前事件循环上共享的异步 httpx 客户端
+
+    必须在事件循环中调用。如果之前的客户端属于另一个（已关闭的）事件循环，会重新创建。
+    """
+    key = _make_key(provider, base_url, api_key)
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(key)
+    if entry is not None:
+        client_loop, client = entry
+        if client_loop is loop and not client.is_closed:
+            return client
+    with _lock:
+        entry = _async_clients.get(key)
+        if entry is not None and entry[0] is loop and not entry[1].is_closed:
+            return entry[1]
+        client = httpx.AsyncClient(**_client_options())
+        _async_clients[key] = (loop, client)
+        logger.info(f"[HTTP Pool] 创建异步连接池: provider={provider}, base_url={key[1]}")
+        return client
+
+
+def close_http_clients() -> None:
+    """关闭所有同步客户端"""
+    with _lock:
+        clients = list(_sync_clients.values())
+        _sync_clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception as e:
+            logger.warning(f"[HTTP Pool] 关闭同步客户端失败: {e}")
+
+
+async def aclose_http_clients() -> None:
+    """关闭所有HTTP客户端（在FastAPI lifespan结束时调用）"""
+    close_http_clients()
+    loop = asyncio.get_running_loop()
+    with _lock:
+        entries = list(_async_clients.values())
+        _async_clients.clear()
+    for client_loop, client in entries:
+        # 其他事件循环上的客户端无法在这里await关闭，直接丢弃
+        if client_loop is not loop:
+            continue
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning(f"[HTTP Pool] 关闭异步客户端失败: {e}")
@@ -1,10 +1,12 @@
 """
 Ollama Provider实现（本地模型）
 """
+import json
 import os
-import httpx
+from typing import Any, AsyncIterator, Dict
 
 from app.core.providers.base_provider import JsonChatLLMProvider
+from app.core.providers.http_pool import get_async_http_client, get_http_client
 
 
 class OllamaProvider(JsonChatLLMProvider):
@@ -15,57 +17,101 @@ class OllamaProvider(JsonChatLLMProvider):
         self.base_url = base_url or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
         self.model = model or os.getenv("OLLAMA_MODEL", "llama3.2")
 
+    def _build_payload(self, chat_messages, mode: str) -> Dict[str, Any]:
+        # Ollama 使用模型自带的 temperature，只限制输出长度
+        payload = {
+            "model": self.model,
+            "messages": self._merge_system_messages(chat_messages),
+            "stream": False,
+            "options": {
+                "num_predict": self._sampling_params(mode)["max_tokens"],
+            },
+        }
+        schema = self._response_schema(mode)
+        if schema:
+            # Ollama 的 format 直接接受 JSON Schema（结构化输出）
+            payload["format"] = schema[1]
+        elif mode != "text":
+            payload["format"] = "json"
+        return payload
+
+    def _parse_response(self, result_data: Dict[str, Any], mode: str) -> str | dict:
+        if mode == "text":
+            result_text = result_data.get("message", {}).get("content", "")
+            if not result_text:
+                raise ValueError("API响应格式错误：content为空")
+        else:
+            result_text = result_data.get("message", {}).get("content", "{}")
+            self.logger.info(f"[Ollama Provider] API响应: {result_text}")
+
+        # 非流式响应同样带有 prompt_eval_count / eval_count
+        if "eval_count" in result_data:
+            prompt_tokens = result_data.get("prompt_eval_count", 0)
+            completion_tokens = result_data.get("eval_count", 0)
+            return {
+                "text": result_text,
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }
+        return result_text
+
     def _perform_text_completion(self, chat_messages) -> str | dict:
         """
         执行纯文本生成（不要求 JSON 格式）
         """
         try:
-            with httpx.Client(timeout=60.0) as client:
-                response = client.post(
-                    f"{self.base_url}/api/chat",
-                    json={
-                        "model": self.model,
-                        "messages": chat_messages,
-                        "stream": False,
-                        "options": {
-                            "num_predict": 500,
-                        },
-                    },
-                )
-                response.raise_for_status()
+            return self._perform_chat_completion(chat_messages, mode="text")
+        except Exception as e:
+            self.logger.error(f"[Ollama Provider] 文本生成失败: {str(e)}", exc_info=True)
+            raise
 
-                result_data = response.json()
-                result_text = result_data.get("message", {}).get("content", "")
-                if not result_text:
-                    raise ValueError("API响应格式错误：content为空")
-                
-                return result_text
+    async def _aperform_text_completion(self, chat_messages) -> str | dict:
+        try:
+            return await self._aperform_chat_completion(chat_messages, mode="text")
         except Exception as e:
             self.logger.error(f"[Ollama Provider] 文本生成失败: {str(e)}", exc_info=True)
             raise
 
-    def _perform_chat_completion(self, chat_messages, mode: str) -> str | dict:
-        # 如果是 text 模式，使用文本生成方法
-        if mode == "text":
-            return self._perform_text_completion(chat_messages)
-        
-        with httpx.Client(timeout=60.0) as client:
-            response = client.post(
-                f"{self.base_url}/api/chat",
-                json={
-                    "model": self.model,
-                    "messages": chat_messages,
-                    "format": "json",
-                    "stream": False,
-                    "options": {
-                        "num_predict": 2000,
-                    },
-                },
-            )
-            response.raise_for_status()
+    def _raw_chat_completion(self, chat_messages, mode: str) -> str | dict:
+        client = get_http_client("ollama", self.base_url)
+        response = client.post(
+            f"{self.base_url}/api/chat",
+            json=self._build_payload(chat_messages, mode),
+        )
+        response.raise_for_status()
+        return self._parse_response(response.json(), mode)
 
-            result_data = response.json()
-            result_text = result_data.get("message", {}).get("content", "{}")
-            self.logger.info(f"[Ollama Provider] API响应: {result_text}")
-            return result_text
+    async def _araw_chat_completion(self, chat_messages, mode: str) -> str | dict:
+        client = get_async_http_client("ollama", self.base_url)
+        response = await client.post(
+            f"{self.base_url}/api/chat",
+            json=self._build_payload(chat_messages, mode),
+        )
+        response.raise_for_status()
+        return self._parse_response(response.json(), mode)
 
+    async def _araw_stream(self, chat_messages, mode: str, usage: Dict[str, Any]) -> AsyncIterator[str]:
+        payload = self._build_payload(chat_messages, mode)
+        payload["stream"] = True
+        client = get_async_http_client("ollama", self.base_url)
+        # Ollama流式返回NDJSON，每行一个JSON对象，最后一行 done=true 并带有tokens统计
+        async with client.stream("POST", f"{self.base_url}/api/chat", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                content = data.get("message", {}).get("content")
+                if content:
+                    yield content
+                if data.get("done"):
+                    prompt_tokens = data.get("prompt_eval_count", 0)
+                    completion_tokens = data.get("eval_count", 0)
+                    usage.update({
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    })
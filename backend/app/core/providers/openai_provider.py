@@ -2,134 +2,182 @@
 OpenAI Provider实现
 """
 import os
-from openai import OpenAI
+from typing import Any, AsyncIterator, Dict
+
+from openai import AsyncOpenAI, OpenAI
 
 from app.core.providers.base_provider import JsonChatLLMProvider
+from app.core.providers.http_pool import get_async_http_client, get_http_client
 
 
 class OpenAIProvider(JsonChatLLMProvider):
     """OpenAI API实现（兼容OpenAI API格式的其他提供商）"""
 
+    # 兼容OpenAI格式的提供商（MiniMax、豆包等）只需覆盖这些类属性
+    DISPLAY_NAME = "OpenAI"
+    API_KEY_ENV = "OPENAI_API_KEY"
+    BASE_URL_ENV = "OPENAI_BASE_URL"
+    MODEL_ENV = "OPENAI_MODEL"
+    DEFAULT_BASE_URL = "https://api.openai.com/v1"
+    DEFAULT_MODEL = "gpt-4o-mini"
+    # 流式调用时是否请求 stream_options.include_usage（不支持该参数的兼容接口可关闭）
+    STREAM_INCLUDE_USAGE = True
+    # 是否支持 response_format={"type": "json_schema"}（不支持的兼容接口退回 json_object）
+    JSON_SCHEMA_SUPPORTED = True
+
     def __init__(self, api_key: str = None, base_url: str = None, model: str = None):
         super().__init__()
-        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
-        self.base_url = base_url or os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
-        self.model = model or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+        self.api_key = api_key or os.getenv(self.API_KEY_ENV)
+        self.base_url = base_url or os.getenv(self.BASE_URL_ENV, self.DEFAULT_BASE_URL)
+        self.model = model or os.getenv(self.MODEL_ENV, self.DEFAULT_MODEL)
 
         if not self.api_key:
-            raise ValueError("API key is required for OpenAI provider")
+            raise ValueError(f"API key is required for {self.DISPLAY_NAME} provider")
+
+        # 复用进程级连接池，避免每次调用重新握手
+        self.client = OpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=get_http_client(self.DISPLAY_NAME.lower(), self.base_url, self.api_key),
+        )
+        self._async_client: AsyncOpenAI | None = None
+        self._async_http_client = None
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """基于当前事件循环的共享连接池构建 AsyncOpenAI 客户端"""
+        http_client = get_async_http_client(self.DISPLAY_NAME.lower(), self.base_url, self.api_key)
+        if self._async_client is None or self._async_http_client is not http_client:
+            self._async_client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=http_client)
+            self._async_http_client = http_client
+        return self._async_client
+
+    def _build_request_kwargs(self, chat_messages, mode: str) -> Dict[str, Any]:
+        """构建 chat.completions.create 的参数"""
+        params = self._sampling_params(mode)
+        kwargs = {
+            "model": self.model,
+            "messages": self._merge_system_messages(chat_messages),
+            "temperature": params["temperature"],
+            "max_tokens": params["max_tokens"],
+        }
+        schema = self._response_schema(mode) if self.JSON_SCHEMA_SUPPORTED else None
+        if schema:
+            name, json_schema = schema
+            kwargs["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": name, "schema": json_schema, "strict": True},
+            }
+        elif mode != "text":
+            kwargs["response_format"] = {"type": "json_object"}
+        return kwargs
+
+    def _parse_response(self, response, mode: str) -> str | dict:
+        """校验API响应并提取文本与tokens使用信息"""
+        # 检查响应是否有效
+        if not response or not hasattr(response, 'choices'):
+            self.logger.error(f"[{self.DISPLAY_NAME} Provider] API响应中没有choices字段")
+            raise ValueError("API响应格式错误：缺少choices字段")
+
+        if not response.choices or len(response.choices) == 0:
+            self.logger.error(f"[{self.DISPLAY_NAME} Provider] API响应中choices为空")
+            raise ValueError("API响应格式错误：choices为空")
+
+        choice = response.choices[0]
+        if not hasattr(choice, 'message') or not choice.message:
+            self.logger.error(f"[{self.DISPLAY_NAME} Provider] API响应中message字段缺失")
+            raise ValueError("API响应格式错误：缺少message字段")
+
+        result_text = choice.message.content
+        if result_text is None:
+            self.logger.error(f"[{self.DISPLAY_NAME} Provider] API响应中content为None")
+            raise ValueError("API响应格式错误：content为None")
+
+        if mode != "text":
+            self.logger.info(f"[{self.DISPLAY_NAME} Provider] API响应: {result_text[:200]}...")  # 只记录前200字符
 
-        self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+        # 提取tokens使用信息
+        usage_info = {}
+        if hasattr(response, 'usage') and response.usage:
+            usage_info = self._usage_info(response.usage)
+
+        if usage_info:
+            return {
+                "text": result_text,
+                "usage": usage_info
+            }
+        return result_text
+
+    @staticmethod
+    def _usage_info(usage) -> Dict[str, int]:
+        """提取tokens使用信息（含命中上游前缀缓存的输入tokens）"""
+        usage_info = {
+            "prompt_tokens": getattr(usage, 'prompt_tokens', 0),
+            "completion_tokens": getattr(usage, 'completion_tokens', 0),
+            "total_tokens": getattr(usage, 'total_tokens', 0),
+        }
+        # OpenAI: prompt_tokens_details.cached_tokens；DeepSeek: prompt_cache_hit_tokens
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached_tokens = getattr(details, 'cached_tokens', None) if details is not None else None
+        if cached_tokens is None:
+            cached_tokens = getattr(usage, 'prompt_cache_hit_tokens', None)
+        if cached_tokens is not None:
+            usage_info["cached_tokens"] = cached_tokens
+        return usage_info
+
+    def _log_failure(self, e: Exception, mode: str, response=None) -> None:
+        if mode == "text":
+            self.logger.error(f"[{self.DISPLAY_NAME} Provider] 文本生成失败: {str(e)}", exc_info=True)
+            return
+        self.logger.error(f"[{self.DISPLAY_NAME} Provider] API调用失败: {str(e)}", exc_info=True)
+        # 记录完整的响应信息以便调试
+        if response is not None:
+            self.logger.error(f"[{self.DISPLAY_NAME} Provider] 响应对象: {response}")
+            if hasattr(response, 'choices'):
+                self.logger.error(f"[{self.DISPLAY_NAME} Provider] choices数量: {len(response.choices) if response.choices else 0}")
 
     def _perform_text_completion(self, chat_messages) -> str | dict:
         """
         执行纯文本生成（不要求 JSON 格式）
         """
+        return self._perform_chat_completion(chat_messages, mode="text")
+
+    async def _aperform_text_completion(self, chat_messages) -> str | dict:
+        return await self._aperform_chat_completion(chat_messages, mode="text")
+
+    def _raw_chat_completion(self, chat_messages, mode: str) -> str | dict:
+        response = None
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=chat_messages,
-                temperature=0.7,
-                max_tokens=500,  # 文本总结不需要太多 tokens
-            )
-            
-            # 检查响应是否有效
-            if not response or not hasattr(response, 'choices'):
-                self.logger.error("[OpenAI Provider] API响应中没有choices字段")
-                raise ValueError("API响应格式错误：缺少choices字段")
-            
-            if not response.choices or len(response.choices) == 0:
-                self.logger.error("[OpenAI Provider] API响应中choices为空")
-                raise ValueError("API响应格式错误：choices为空")
-            
-            choice = response.choices[0]
-            if not hasattr(choice, 'message') or not choice.message:
-                self.logger.error("[OpenAI Provider] API响应中message字段缺失")
-                raise ValueError("API响应格式错误：缺少message字段")
-            
-            result_text = choice.message.content
-            if result_text is None:
-                self.logger.error("[OpenAI Provider] API响应中content为None")
-                raise ValueError("API响应格式错误：content为None")
-            
-            # 提取tokens使用信息
-            usage_info = {}
-            if hasattr(response, 'usage') and response.usage:
-                usage = response.usage
-                usage_info = {
-                    "prompt_tokens": getattr(usage, 'prompt_tokens', 0),
-                    "completion_tokens": getattr(usage, 'completion_tokens', 0),
-                    "total_tokens": getattr(usage, 'total_tokens', 0),
-                }
-            
-            if usage_info:
-                return {
-                    "text": result_text,
-                    "usage": usage_info
-                }
-            return result_text
-            
+            response = self.client.chat.completions.create(**self._build_request_kwargs(chat_messages, mode))
+            return self._parse_response(response, mode)
         except Exception as e:
-            self.logger.error(f"[OpenAI Provider] 文本生成失败: {str(e)}", exc_info=True)
+            self._log_failure(e, mode, response)
             raise
 
-    def _perform_chat_completion(self, chat_messages, mode: str) -> str | dict:
+    async def _araw_chat_completion(self, chat_messages, mode: str) -> str | dict:
+        response = None
         try:
-            # 如果是 text 模式，使用文本生成方法
-            if mode == "text":
-                return self._perform_text_completion(chat_messages)
-            
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=chat_messages,
-                response_format={"type": "json_object"},
-                temperature=0.7,
-                max_tokens=2000,
-            )
-            
-            # 检查响应是否有效
-            if not response or not hasattr(response, 'choices'):
-                self.logger.error("[OpenAI Provider] API响应中没有choices字段")
-                raise ValueError("API响应格式错误：缺少choices字段")
-            
-            if not response.choices or len(response.choices) == 0:
-                self.logger.error("[OpenAI Provider] API响应中choices为空")
-                raise ValueError("API响应格式错误：choices为空")
-            
-            choice = response.choices[0]
-            if not hasattr(choice, 'message') or not choice.message:
-                self.logger.error("[OpenAI Provider] API响应中message字段缺失")
-                raise ValueError("API响应格式错误：缺少message字段")
-            
-            result_text = choice.message.content
-            if result_text is None:
-                self.logger.error("[OpenAI Provider] API响应中content为None")
-                raise ValueError("API响应格式错误：content为None")
-            
-            self.logger.info(f"[OpenAI Provider] API响应: {result_text[:200]}...")  # 只记录前200字符
-            
-            # 提取tokens使用信息
-            usage_info = {}
-            if hasattr(response, 'usage') and response.usage:
-                usage = response.usage
-                usage_info = {
-                    "prompt_tokens": getattr(usage, 'prompt_tokens', 0),
-                    "completion_tokens": getattr(usage, 'completion_tokens', 0),
-                    "total_tokens": getattr(usage, 'total_tokens', 0),
-                }
-            
-            if usage_info:
-                return {
-                    "text": result_text,
-                    "usage": usage_info
-                }
-            return result_text
-            
+            response = await self.async_client.chat.completions.create(**self._build_request_kwargs(chat_messages, mode))
+            return self._parse_response(response, mode)
         except Exception as e:
-            self.logger.error(f"[OpenAI Provider] API调用失败: {str(e)}", exc_info=True)
-            # 记录完整的响应信息以便调试
-            if 'response' in locals():
-                self.logger.error(f"[OpenAI Provider] 响应对象: {response}")
-                if hasattr(response, 'choices'):
-                    self.logger.error(f"[OpenAI Provider] choices数量: {len(response.choices) if response.choices else 0}")
-            raise
\ No newline at end of file
+            self._log_failure(e, mode, response)
+            raise
+
+    async def _araw_stream(self, chat_messages, mode: str, usage: Dict[str, Any]) -> AsyncIterator[str]:
+        kwargs = self._build_request_kwargs(chat_messages, mode)
+        kwargs["stream"] = True
+        if self.STREAM_INCLUDE_USAGE:
+            kwargs["stream_options"] = {"include_usage": True}
+        try:
+            stream = await self.async_client.chat.completions.create(**kwargs)
+            async for chunk in stream:
+                # 开启 include_usage 后，最后一个chunk只包含usage，choices为空
+                if getattr(chunk, "usage", None):
+                    usage.update(self._usage_info(chunk.usage))
+                if chunk.choices:
+                    delta = chunk.choices[0].delta
+                    if delta is not None and delta.content:
+                        yield delta.content
+        except Exception as e:
+            self.logger.error(f"[{self.DISPLAY_NAME} Provider] 流式调用失败: {str(e)}", exc_info=True)
+            raise
@@ -0,0 +1,341 @@
+"""
+按 (对话阶段, 步骤, provider) 的输出长度预算（max_tokens）
+
+过去所有JSON调用都请求 max_tokens=2000（text 模式500），一段话的引导阶段回复和完整的5步骤卡片用同一个上限，
+模型跑偏时最坏生成时间没有约束。这里维护一张预算表：
+
+- 调用点设置预算范围：with output_budget("exploring"): ... / output_budget("deep", step=3)；
+  未设置时 text 模式为 "text"，其余按 mode 名称
+- 预算先取默认值（DEFAULT_OUTPUT_BUDGETS，可用环境变量覆盖），样本足够后按最近的实际输出 tokens 重新拟合：
+  p99 × 余量，限制在 [下限, 默认值 × 上限倍数] 之间，并向上取整到 64 的倍数（避免预算频繁变化导致补全缓存key抖动）
+- 样本来源：每次真实调用的 usage.completion_tokens（装饰器位于补全缓存之下，缓存命中不计入）；
+  进程启动时从 Message.completion_tokens（带 output_budget_key 的单次调用回复）预热
+- 输出 tokens 达到本次 max_tokens 视为被截断：记录警告，并把该key的预算至少提高到本次的1.5倍
+
+配置（环境变量）：
+- LLM_OUTPUT_BUDGETS: JSON 覆盖默认值，key 为 "阶段"、"阶段:步骤"，或加 provider 前缀，
+  如 {"exploring": 600, "deep:3": 900, "openai:exploring": 500}
+- LLM_OUTPUT_BUDGET_REFIT: 是否按实际输出重新拟合（默认开启）
+- LLM_OUTPUT_BUDGET_MIN_SAMPLES: 开始拟合所需的最少样本数（默认20）
+- LLM_OUTPUT_BUDGET_HEADROOM: p99 之上的余量倍数（默认1.25）
+- LLM_OUTPUT_BUDGET_MAX_FACTOR: 拟合结果的上限为默认值的倍数（默认2）
+"""
+import contextvars
+import functools
+import json
+import logging
+import math
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 默认预算：key 为 "阶段" 或 "阶段:步骤"（步骤0表示整轮回复，省略）
+DEFAULT_OUTPUT_BUDGETS: Dict[str, int] = {
+    "simple": 800,
+    # 引导阶段只输出一段共情/提问的回复，是绝大部分流量
+    "chatting": 800,
+    "exploring": 800,
+    "summarizing": 1000,
+    "inviting": 1000,
+    "structured": 2000,
+    "card_generated": 2000,
+    # 深聊：single_shot 一次输出全部5个步骤，multi_step 每步单独请求
+    "deep": 2000,
+    "deep:1": 600,
+    "deep:2": 800,
+    "deep:3": 800,
+    "deep:4": 800,
+    "deep:5": 600,
+    "emotion_parse": 400,
+    "text": 500,
+}
+FALLBACK_TEXT_BUDGET = 500
+FALLBACK_JSON_BUDGET = 2000
+
+MIN_BUDGET = 128
+BUDGET_GRANULARITY = 64
+SAMPLE_WINDOW = 200
+TRUNCATION_BUMP = 1.5
+
+BudgetKey = Tuple[str, int, str]  # (stage, step, provider)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def refit_enabled() -> bool:
+    return os.getenv("LLM_OUTPUT_BUDGET_REFIT", "true").lower() in ("1", "true", "yes")
+
+
+def _round_up(value: float) -> int:
+    return int(math.ceil(value / BUDGET_GRANULARITY) * BUDGET_GRANULARITY)
+
+
+def format_budget_key(key: BudgetKey) -> str:
+    """预算key的字符串形式 "provider:阶段[:步骤]"（持久化到 Message.output_budget_key）"""
+    stage, step, provider = key
+    return f"{provider}:{stage}:{step}" if step else f"{provider}:{stage}"
+
+
+def parse_budget_key(value: str) -> Optional[BudgetKey]:
+    parts = value.split(":")
+    if len(parts) == 2:
+        return parts[1], 0, parts[0]
+    if len(parts) == 3 and parts[2].isdigit():
+        return parts[1], int(parts[2]), parts[0]
+    return None
+
+
+_scope: contextvars.ContextVar[Optional[Tuple[str, int]]] = contextvars.ContextVar("output_budget", default=None)
+
+
+@contextmanager
+def output_budget(stage: str, step: int = 0) -> Iterator[None]:
+    """
+    为当前调用点设置输出预算范围（对同一上下文中的所有LLM补全生效，可嵌套）
+
+    用法：
+        with output_budget("exploring"):
+            self._perform_chat_completion(chat_messages, mode="structured")
+        with output_budget("deep", step=3):
+            ...
+    """
+    token = _scope.set((stage, step))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def current_budget_key(provider_name: str, mode: str) -> BudgetKey:
+    scope = _scope.get()
+    if mode == "text" or scope is None:
+        # 纯文本生成（每日总结、历史摘要等）统一为 text，不受外层JSON调用点的范围影响
+        return ("text" if mode == "text" else mode), 0, provider_name
+    return scope[0], scope[1], provider_name
+
+
+class _BudgetState:
+    """单个预算key的样本与拟合结果"""
+
+    def __init__(self, default: int):
+        self.default = default
+        self.samples: Deque[int] = deque(maxlen=SAMPLE_WINDOW)
+        self.floor = MIN_BUDGET  # 发生截断后提高的下限
+        self.budget = default
+        self.calls = 0
+        self.truncations = 0
+
+    def refit(self) -> None:
+        ceiling = max(self.default, int(self.default * _env_float("LLM_OUTPUT_BUDGET_MAX_FACTOR", 2.0)))
+        fitted = self.default
+        if refit_enabled() and len(self.samples) >= _env_int("LLM_OUTPUT_BUDGET_MIN_SAMPLES", 20):
+            ordered = sorted(self.samples)
+            p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+            fitted = _round_up(p99 * _env_float("LLM_OUTPUT_BUDGET_HEADROOM", 1.25))
+        self.budget = min(ceiling, max(MIN_BUDGET, self.floor, fitted))
+
+    def percentile(self, q: float) -> Optional[int]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class OutputBudgetTable:
+    """输出预算表（进程内）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states: Dict[BudgetKey, _BudgetState] = {}
+        self._overrides: Optional[Dict[str, int]] = None
+
+    def _load_overrides(self) -> Dict[str, int]:
+        if self._overrides is None:
+            overrides: Dict[str, int] = {}
+            raw = os.getenv("LLM_OUTPUT_BUDGETS")
+            if raw:
+                try:
+                    overrides = {str(name): int(value) for name, value in json.loads(raw).items()}
+                except (TypeError, ValueError, AttributeError) as e:
+                    logger.warning(f"[Output Budget] LLM_OUTPUT_BUDGETS 无效: {str(e)}")
+            self._overrides = overrides
+        return self._overrides
+
+    def default_for(self, key: BudgetKey) -> int:
+        stage, step, provider = key
+        names = [f"{stage}:{step}", stage] if step else [stage]
+        overrides = self._load_overrides()
+        for name in names:
+            if f"{provider}:{name}" in overrides:
+                return overrides[f"{provider}:{name}"]
+        for name in names:
+            if name in overrides:
+                return overrides[name]
+        for name in names:
+            if name in DEFAULT_OUTPUT_BUDGETS:
+                return DEFAULT_OUTPUT_BUDGETS[name]
+        return FALLBACK_TEXT_BUDGET if stage == "text" else FALLBACK_JSON_BUDGET
+
+    def _state(self, key: BudgetKey) -> _BudgetState:
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _BudgetState(self.default_for(key))
+        return state
+
+    def budget_for(self, key: BudgetKey) -> int:
+        with self._lock:
+            return self._state(key).budget
+
+    def observe(self, key: BudgetKey, completion_tokens: int, max_tokens: Optional[int] = None) -> None:
+        """记录一次真实调用的输出tokens；达到 max_tokens 时视为被截断"""
+        if completion_tokens <= 0:
+            return
+        with self._lock:
+            state = self._state(key)
+            state.calls += 1
+            state.samples.append(completion_tokens)
+            truncated = max_tokens is not None and completion_tokens >= max_tokens
+            if truncated:
+                state.truncations += 1
+                state.floor = max(state.floor, _round_up(max_tokens * TRUNCATION_BUMP))
+            state.refit()
+            budget = state.budget
+        if truncated:
+            logger.warning(
+                f"[Output Budget] {format_budget_key(key)} 输出被截断（{completion_tokens}/{max_tokens} tokens），"
+                f"预算调整为 {budget}"
+            )
+
+    def seed(self, key: BudgetKey, samples: List[int]) -> None:
+        """用已持久化的历史输出tokens预热（不计入调用次数和截断统计）"""
+        with self._lock:
+            state = self._state(key)
+            state.samples.extend(value for value in samples if value and value > 0)
+            state.refit()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._states.clear()
+            self._overrides = None
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "key": format_budget_key(key),
+                    "budget": state.budget,
+                    "default": state.default,
+                    "samples": len(state.samples),
+                    "p50": state.percentile(0.5),
+                    "p99": state.percentile(0.99),
+                    "calls": state.calls,
+                    "truncations": state.truncations,
+                }
+                for key, state in sorted(self._states.items())
+            ]
+
+
+_table = OutputBudgetTable()
+
+
+def get_output_budgets() -> OutputBudgetTable:
+    return _table
+
+
+def load_output_budget_history(db, limit: int = 2000) -> int:
+    """从最近的助手消息（Message.completion_tokens）预热预算表，返回使用的消息数"""
+    from app.models.message import Message
+
+    rows = (
+        db.query(Message.output_budget_key, Message.completion_tokens)
+        .filter(
+            Message.role == "assistant",
+            Message.output_budget_key.isnot(None),
+            Message.completion_tokens.isnot(None),
+        )
+        .order_by(Message.id.desc())
+        .limit(limit)
+        .all()
+    )
+    grouped: Dict[BudgetKey, List[int]] = {}
+    for raw_key, completion_tokens in rows:
+        key = parse_budget_key(raw_key)
+        if key is not None:
+            grouped.setdefault(key, []).append(completion_tokens)
+    for key, samples in grouped.items():
+        # 查询按新到旧排序，按时间顺序放入滑动窗口
+        _table.seed(key, list(reversed(samples)))
+    return len(rows)
+
+
+def _observe(key: BudgetKey, max_tokens: int, usage: Optional[Dict[str, Any]]) -> None:
+    if not usage:
+        return
+    completion_tokens = usage.get("completion_tokens") or 0
+    if completion_tokens:
+        _table.observe(key, completion_tokens, max_tokens)
+        usage["output_budget_key"] = format_budget_key(key)
+
+
+def _usage_of(result: str | dict) -> Optional[Dict[str, Any]]:
+    if isinstance(result, dict):
+        return result.get("usage")
+    return None
+
+
+def budgeted(func):
+    """包裹同步的 _perform_chat_completion(self, chat_messages, mode)：记录实际输出tokens并检测截断"""
+
+    @functools.wraps(func)
+    def wrapper(self, chat_messages, mode: str):
+        key = current_budget_key(self._parse_stats_key(), mode)
+        max_tokens = self._sampling_params(mode)["max_tokens"]
+        result = func(self, chat_messages, mode)
+        _observe(key, max_tokens, _usage_of(result))
+        return result
+
+    return wrapper
+
+
+def abudgeted(func):
+    """包裹异步的 _aperform_chat_completion(self, chat_messages, mode)，逻辑同 budgeted"""
+
+    @functools.wraps(func)
+    async def wrapper(self, chat_messages, mode: str):
+        key = current_budget_key(self._parse_stats_key(), mode)
+        max_tokens = self._sampling_params(mode)["max_tokens"]
+        result = await func(self, chat_messages, mode)
+        _observe(key, max_tokens, _usage_of(result))
+        return result
+
+    return wrapper
+
+
+def budgeted_stream(func):
+    """包裹 _astream_chat_completion(self, chat_messages, mode, usage)：流结束后按上报的usage记录"""
+
+    @functools.wraps(func)
+    async def wrapper(self, chat_messages, mode: str, usage: Dict[str, Any]):
+        key = current_budget_key(self._parse_stats_key(), mode)
+        max_tokens = self._sampling_params(mode)["max_tokens"]
+        async for chunk in func(self, chat_messages, mode, usage):
+            yield chunk
+        _observe(key, max_tokens, usage)
+
+    return wrapper
@@ -0,0 +1,430 @@
+"""
+按 (provider, api_key) 的令牌桶限流与优先级队列
+
+上游有 RPM（每分钟请求数）/ TPM（每分钟tokens数）限制，超出后 provider 抛错，最终回退为 SAFE_REPLY。
+这里在真正发出API请求前（位于补全缓存和请求合并之下）按令牌桶排队等待，而不是让请求失败：
+
+- 每个 (provider, base_url, api_key) 一个限流器，包含 RPM、TPM 两个令牌桶
+- 请求的 tokens 消耗按历史用量估算：prompt 字符数 × 历史 tokens/字符比 + 该模式历史平均输出 tokens，
+  请求完成后按实际 usage.total_tokens 多退少补
+- 排队的请求按优先级出队：高风险对话 > 交互式对话 > 每日总结/主题叙事等后台任务，同优先级先进先出
+- 优先级按调用点设置：with llm_priority(PRIORITY_HIGH_RISK): ...（未设置时为交互式）
+
+配置（环境变量，0 表示不限制；两者都为0时不启用限流）：
+- LLM_RATE_LIMIT_RPM / LLM_RATE_LIMIT_TPM: 默认限额
+- LLM_RATE_LIMIT_RPM_<PROVIDER> / LLM_RATE_LIMIT_TPM_<PROVIDER>: 单个provider的限额，如 LLM_RATE_LIMIT_TPM_OPENAI
+"""
+import asyncio
+import contextvars
+import functools
+import hashlib
+import heapq
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH_RISK = "high_risk"
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BACKGROUND = "background"
+
+# 数值越小越先出队
+PRIORITY_ORDER = {
+    PRIORITY_HIGH_RISK: 0,
+    PRIORITY_INTERACTIVE: 1,
+    PRIORITY_BACKGROUND: 2,
+}
+
+# 没有历史数据时的估算参数
+DEFAULT_TOKENS_PER_CHAR = 0.7
+HISTORY_WEIGHT = 0.2  # 指数移动平均中新样本的权重
+
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def llm_priority(priority: str) -> Iterator[None]:
+    """
+    为当前调用点设置LLM请求的排队优先级（对同一上下文中的所有LLM补全生效，可嵌套）
+
+    用法：
+        with llm_priority(PRIORITY_BACKGROUND):
+            provider.generate_text(messages)
+    """
+    if priority not in PRIORITY_ORDER:
+        raise ValueError(f"未知的LLM请求优先级: {priority}")
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class TokenBucket:
+    """每分钟补满 per_minute 个令牌的令牌桶（不加锁，由限流器统一加锁）"""
+
+    def __init__(self, per_minute: int, clock: Callable[[], float] = time.monotonic):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """还需要等待多少秒才有 amount 个令牌"""
+        self._refill(now)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self.tokens -= amount
+
+    def adjust(self, amount: float) -> None:
+        """退还（正数）或追加扣除（负数）令牌；追加扣除可以让令牌数为负，之后的请求多等一会"""
+        self._refill(self._clock())
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _Ticket:
+    """一个排队中的请求，同步调用用 threading.Event 唤醒，异步调用用所属事件循环上的 asyncio.Event 唤醒"""
+
+    __slots__ = ("order", "priority", "cost", "enqueued_at", "event", "loop")
+
+    def __init__(
+        self,
+        order: Tuple[int, int],
+        priority: str,
+        cost: float,
+        loop: Optional[asyncio.AbstractEventLoop],
+        enqueued_at: float,
+    ):
+        self.order = order
+        self.priority = priority
+        self.cost = cost
+        self.enqueued_at = enqueued_at
+        self.loop = loop
+        self.event = asyncio.Event() if loop is not None else threading.Event()
+
+    def __lt__(self, other: "_Ticket") -> bool:
+        return self.order < other.order
+
+    def wake(self) -> None:
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.event.set)
+        else:
+            self.event.set()
+
+
+class ProviderRateLimiter:
+    """单个 (provider, api_key) 的 RPM/TPM 限流器与优先级队列"""
+
+    def __init__(self, label: str, rpm: int = 0, tpm: int = 0, clock: Callable[[], float] = time.monotonic):
+        self.label = label
+        self.rpm = max(0, rpm)
+        self.tpm = max(0, tpm)
+        # 时钟可注入（测试中用假时钟控制令牌补充）
+        self._clock = clock
+        self._requests = TokenBucket(self.rpm, clock) if self.rpm else None
+        self._tokens = TokenBucket(self.tpm, clock) if self.tpm else None
+        self._lock = threading.Lock()
+        self._waiting: List[_Ticket] = []
+        self._seq = itertools.count()
+        # 历史用量（指数移动平均）
+        self._tokens_per_char = DEFAULT_TOKENS_PER_CHAR
+        self._completion_tokens: Dict[str, float] = {}
+        # 统计
+        self.acquired: Dict[str, int] = {priority: 0 for priority in PRIORITY_ORDER}
+        self.queued: Dict[str, int] = {priority: 0 for priority in PRIORITY_ORDER}
+        self.total_wait: Dict[str, float] = {priority: 0.0 for priority in PRIORITY_ORDER}
+        self.max_wait: Dict[str, float] = {priority: 0.0 for priority in PRIORITY_ORDER}
+
+    # ===== tokens 估算 =====
+
+    def estimate(self, chat_messages: List[Dict[str, Any]], mode: str, max_tokens: int) -> int:
+        """按历史用量估算本次请求的 total_tokens"""
+        chars = sum(len(str(message.get("content", ""))) for message in chat_messages)
+        with self._lock:
+            prompt_tokens = chars * self._tokens_per_char
+            completion_tokens = self._completion_tokens.get(mode, max_tokens)
+        return max(1, math.ceil(prompt_tokens + completion_tokens))
+
+    def settle(
+        self,
+        chat_messages: List[Dict[str, Any]],
+        mode: str,
+        estimated: int,
+        usage: Optional[Dict[str, Any]],
+    ) -> None:
+        """
+        请求结束后按实际用量修正TPM令牌桶并更新历史
+
+        usage 为 None 表示请求失败（没有消耗tokens，退还估算值）；没有返回 total_tokens 时保留估算值
+        """
+        if usage is None:
+            actual = 0
+        else:
+            actual = usage.get("total_tokens") or 0
+            if not actual:
+                return
+
+        with self._lock:
+            if self._tokens is not None:
+                self._tokens.adjust(estimated - actual)
+            if usage is None:
+                return
+            chars = sum(len(str(message.get("content", ""))) for message in chat_messages)
+            prompt_tokens = usage.get("prompt_tokens") or 0
+            completion_tokens = usage.get("completion_tokens") or 0
+            if chars and prompt_tokens:
+                self._tokens_per_char += HISTORY_WEIGHT * (prompt_tokens / chars - self._tokens_per_char)
+            if completion_tokens:
+                previous = self._completion_tokens.get(mode)
+                self._completion_tokens[mode] = (
+                    completion_tokens if previous is None
+                    else previous + HISTORY_WEIGHT * (completion_tokens - previous)
+                )
+
+    # ===== 排队 =====
+
+    def acquire(self, cost: int, priority: str) -> float:
+        """同步排队直到RPM/TPM都有余量，返回等待的秒数"""
+        ticket = self._enqueue(cost, priority, loop=None)
+        try:
+            while True:
+                ticket.event.clear()
+                delay = self._poll(ticket)
+                if delay == 0:
+                    return self._record_acquired(ticket)
+                ticket.event.wait(timeout=delay)
+        except BaseException:
+            self._abandon(ticket)
+            raise
+
+    async def aacquire(self, cost: int, priority: str) -> float:
+        """acquire 的异步版本（等待期间不阻塞事件循环，取消时让出队列位置）"""
+        ticket = self._enqueue(cost, priority, loop=asyncio.get_running_loop())
+        try:
+            while True:
+                ticket.event.clear()
+                delay = self._poll(ticket)
+                if delay == 0:
+                    return self._record_acquired(ticket)
+                try:
+                    await asyncio.wait_for(ticket.event.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._abandon(ticket)
+            raise
+
+    def _enqueue(self, cost: int, priority: str, loop: Optional[asyncio.AbstractEventLoop]) -> _Ticket:
+        if self._tokens is not None:
+            # 单个请求超过TPM上限时按上限计，否则永远无法出队
+            cost = min(cost, self.tpm)
+        ticket = _Ticket((PRIORITY_ORDER[priority], next(self._seq)), priority, cost, loop, self._clock())
+        with self._lock:
+            heapq.heappush(self._waiting, ticket)
+        return ticket
+
+    def _poll(self, ticket: _Ticket) -> Optional[float]:
+        """
+        尝试出队
+
+        Returns:
+            0: 已出队并扣除令牌；正数: 位于队首，还需等待的秒数；None: 不在队首，等待被唤醒
+        """
+        with self._lock:
+            if self._waiting[0] is not ticket:
+                return None
+            now = self._clock()
+            delay = 0.0
+            if self._requests is not None:
+                delay = max(delay, self._requests.wait_time(1, now))
+            if self._tokens is not None:
+                delay = max(delay, self._tokens.wait_time(ticket.cost, now))
+            if delay > 0:
+                return delay
+
+            if self._requests is not None:
+                self._requests.consume(1)
+            if self._tokens is not None:
+                self._tokens.consume(ticket.cost)
+            heapq.heappop(self._waiting)
+            if self._waiting:
+                self._waiting[0].wake()
+            return 0
+
+    def _abandon(self, ticket: _Ticket) -> None:
+        """请求被取消或出错时移出队列，必要时唤醒新的队首"""
+        with self._lock:
+            if ticket not in self._waiting:
+                return
+            was_head = self._waiting[0] is ticket
+            self._waiting.remove(ticket)
+            heapq.heapify(self._waiting)
+            if was_head and self._waiting:
+                self._waiting[0].wake()
+
+    def _record_acquired(self, ticket: _Ticket) -> float:
+        waited = self._clock() - ticket.enqueued_at
+        with self._lock:
+            self.acquired[ticket.priority] += 1
+            self.total_wait[ticket.priority] += waited
+            self.max_wait[ticket.priority] = max(self.max_wait[ticket.priority], waited)
+            if waited > 0.001:
+                self.queued[ticket.priority] += 1
+        if waited >= 1:
+            logger.info(f"[Rate Limit] {self.label} {ticket.priority} 请求排队 {waited:.2f}s")
+        return waited
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "label": self.label,
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "waiting": len(self._waiting),
+                "tokens_per_char": round(self._tokens_per_char, 3),
+                "avg_completion_tokens": {mode: round(value, 1) for mode, value in self._completion_tokens.items()},
+                "priorities": {
+                    priority: {
+                        "acquired": self.acquired[priority],
+                        "queued": self.queued[priority],
+                        "avg_wait_ms": round(self.total_wait[priority] / self.acquired[priority] * 1000, 1)
+                        if self.acquired[priority] else 0.0,
+                        "max_wait_ms": round(self.max_wait[priority] * 1000, 1),
+                    }
+                    for priority in PRIORITY_ORDER
+                },
+            }
+
+
+# 全局限流器注册表：(provider类名, base_url, api_key指纹) -> 限流器
+_limiters: Dict[Tuple[str, Optional[str], str], ProviderRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _provider_name(provider: Any) -> str:
+    return provider.__class__.__name__.replace("Provider", "").lower()
+
+
+def get_rate_limiter(provider: Any) -> Optional[ProviderRateLimiter]:
+    """获取 provider 对应的限流器（未配置限额时返回None）"""
+    name = _provider_name(provider)
+    rpm = _env_int(f"LLM_RATE_LIMIT_RPM_{name.upper()}", _env_int("LLM_RATE_LIMIT_RPM", 0))
+    tpm = _env_int(f"LLM_RATE_LIMIT_TPM_{name.upper()}", _env_int("LLM_RATE_LIMIT_TPM", 0))
+    if rpm <= 0 and tpm <= 0:
+        return None
+
+    base_url = getattr(provider, "base_url", None)
+    api_key = getattr(provider, "api_key", None) or ""
+    key = (name, base_url, hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16])
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None or (limiter.rpm, limiter.tpm) != (max(0, rpm), max(0, tpm)):
+            limiter = ProviderRateLimiter(f"{name}:{key[2][:8]}", rpm=rpm, tpm=tpm)
+            _limiters[key] = limiter
+        return limiter
+
+
+def get_rate_limiter_stats() -> List[Dict[str, Any]]:
+    """所有限流器的统计"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return [limiter.stats() for limiter in limiters]
+
+
+def _usage_of(result: str | dict) -> Dict[str, Any]:
+    if isinstance(result, dict):
+        return result.get("usage") or {}
+    return {}
+
+
+def rate_limited(func):
+    """包裹同步的 _perform_chat_completion(self, chat_messages, mode)：按限额排队后再真正调用"""
+
+    @functools.wraps(func)
+    def wrapper(self, chat_messages, mode: str):
+        limiter = get_rate_limiter(self)
+        if limiter is None:
+            return func(self, chat_messages, mode)
+        estimated = limiter.estimate(chat_messages, mode, self._sampling_params(mode)["max_tokens"])
+        limiter.acquire(estimated, current_priority())
+        try:
+            result = func(self, chat_messages, mode)
+        except Exception:
+            limiter.settle(chat_messages, mode, estimated, None)
+            raise
+        limiter.settle(chat_messages, mode, estimated, _usage_of(result))
+        return result
+
+    return wrapper
+
+
+def arate_limited(func):
+    """包裹异步的 _aperform_chat_completion(self, chat_messages, mode)，逻辑同 rate_limited"""
+
+    @functools.wraps(func)
+    async def wrapper(self, chat_messages, mode: str):
+        limiter = get_rate_limiter(self)
+        if limiter is None:
+            return await func(self, chat_messages, mode)
+        estimated = limiter.estimate(chat_messages, mode, self._sampling_params(mode)["max_tokens"])
+        await limiter.aacquire(estimated, current_priority())
+        try:
+            result = await func(self, chat_messages, mode)
+        except Exception:
+            limiter.settle(chat_messages, mode, estimated, None)
+            raise
+        limiter.settle(chat_messages, mode, estimated, _usage_of(result))
+        return result
+
+    return wrapper
+
+
+def rate_limited_stream(func):
+    """包裹 _astream_chat_completion(self, chat_messages, mode, usage)：排队后再开始流式请求"""
+
+    @functools.wraps(func)
+    async def wrapper(self, chat_messages, mode: str, usage: Dict[str, Any]):
+        limiter = get_rate_limiter(self)
+        if limiter is None:
+            async for chunk in func(self, chat_messages, mode, usage):
+                yield chunk
+            return
+        estimated = limiter.estimate(chat_messages, mode, self._sampling_params(mode)["max_tokens"])
+        await limiter.aacquire(estimated, current_priority())
+        has_output = False
+        try:
+            async for chunk in func(self, chat_messages, mode, usage):
+                has_output = True
+                yield chunk
+        except Exception:
+            # 已经开始输出的流按已上报的用量结算（没有上报时保留估算值）
+            limiter.settle(chat_messages, mode, estimated, usage if has_output else None)
+            raise
+        limiter.settle(chat_messages, mode, estimated, usage)
+
+    return wrapper
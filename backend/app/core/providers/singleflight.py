@@ -0,0 +1,135 @@
+"""
+合并并发中的相同LLM请求（singleflight）
+
+同一时刻指纹相同（见 completion_cache.completion_cache_key）的多个请求只会真正调用一次LLM，
+其余调用方等待并共享这次的结果。tokens只记在实际发起请求的调用方上，
+共享结果的调用方拿到的 usage 为 0 并标记 coalesced=True，避免 /stats/tokens 重复计数。
+
+配置（环境变量）：
+- LLM_SINGLEFLIGHT_ENABLED: 是否启用（默认true）
+"""
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def singleflight_enabled() -> bool:
+    return os.getenv("LLM_SINGLEFLIGHT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+class _Call:
+    """一次进行中的同步调用"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """按key合并进行中的调用，同步调用按线程等待，异步调用按事件循环共享同一个Task"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        # (事件循环id, key) -> 进行中的Task
+        self._tasks: Dict[Tuple[int, str], asyncio.Task] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        执行 fn，若相同key的调用正在进行则等待其结果
+
+        Returns:
+            (结果, 是否共享了其他调用方的结果)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                is_leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+                is_leader = True
+
+        if not is_leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    async def ado(self, key: str, coro_fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        do 的异步版本
+
+        实际调用放在独立的Task中执行，某个调用方被取消（如客户端断开）不会影响其他等待者
+        """
+        loop = asyncio.get_running_loop()
+        task_key = (id(loop), key)
+        with self._lock:
+            task = self._tasks.get(task_key)
+            if task is not None and not task.done():
+                self.coalesced += 1
+                is_leader = False
+            else:
+                task = loop.create_task(coro_fn())
+                task.add_done_callback(lambda t: self._on_task_done(task_key, t))
+                self._tasks[task_key] = task
+                self.executed += 1
+                is_leader = True
+
+        return await asyncio.shield(task), not is_leader
+
+    def _on_task_done(self, task_key: Tuple[int, str], task: asyncio.Task) -> None:
+        with self._lock:
+            if self._tasks.get(task_key) is task:
+                del self._tasks[task_key]
+        # 所有调用方都已取消时，避免 "Task exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.executed + self.coalesced
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "coalesce_rate": round(self.coalesced / total, 4) if total else 0.0,
+                "in_flight": len(self._calls) + len(self._tasks),
+            }
+
+
+# 全局单例
+_singleflight = SingleFlight()
+
+
+def get_singleflight() -> SingleFlight:
+    """获取请求合并单例"""
+    return _singleflight
+
+
+def shared_result(result: str | dict) -> Dict[str, Any]:
+    """共享给其他调用方的结果：文本相同，tokens记为0"""
+    text = result.get("text", "") if isinstance(result, dict) else result
+    return {
+        "text": text,
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "coalesced": True},
+    }
@@ -0,0 +1,172 @@
+"""
+结构化输出的响应Schema注册表
+
+每种JSON输出（简单回复、引导阶段回复、5步骤回复、单步骤、情绪解析）对应一个JSON Schema，
+各provider通过原生机制强制输出符合Schema的JSON：
+- OpenAI: response_format={"type": "json_schema", ...}
+- Ollama: format=<schema>
+- Claude: 单个工具 + tool_choice 强制调用，工具参数即结构化输出
+- Gemini: generationConfig.responseSchema
+
+使用哪个Schema按调用点设置：with response_schema("guiding"): ...（text 模式不使用Schema）。
+同时按provider统计 _parse_json_payload 的结果（直接解析 / 清理或提取后解析 / 失败），
+用于观察Schema生效后修复路径是否变得罕见。
+
+配置（环境变量）：
+- LLM_RESPONSE_SCHEMA_ENABLED: 是否下发Schema（默认开启，设为0/false关闭后退回普通JSON模式）
+- LLM_RESPONSE_SCHEMA_ENABLED_<PROVIDER>: 按provider覆盖，如不支持 json_schema 的兼容接口设置 LLM_RESPONSE_SCHEMA_ENABLED_OPENAI=false
+"""
+import contextvars
+import copy
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from app.core.metrics import JSON_PARSE
+
+_STRING = {"type": "string"}
+_STRING_ARRAY = {"type": "array", "items": {"type": "string"}}
+_INTENSITY = {"type": "integer"}
+_RISK_LEVEL = {"type": "string", "enum": ["low", "medium", "high"]}
+
+
+def _object(properties: Dict[str, Any]) -> Dict[str, Any]:
+    # 所有字段都必填且不允许额外字段（OpenAI strict 模式的要求），可选内容用空字符串/空数组表示
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+# 回复类输出共有的标签字段
+_REPLY_TAGS = {
+    "emotion": _STRING,
+    "intensity": _INTENSITY,
+    "topics": _STRING_ARRAY,
+    "risk_level": _RISK_LEVEL,
+}
+
+RESPONSE_SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "simple": _object({"reply": _STRING, **_REPLY_TAGS}),
+    "guiding": _object({"theme": _STRING, "reply": _STRING, **_REPLY_TAGS}),
+    "structured": _object({
+        "theme": _STRING,
+        "step1_emotion_mirror": _STRING,
+        "step1_problem_restate": _STRING,
+        "step2_breakdown": _STRING,
+        "step3_explanation": _STRING,
+        "step4_suggestions": _STRING_ARRAY,
+        "step5_summary": _STRING,
+        **_REPLY_TAGS,
+    }),
+    "step_1": _object({"step1_emotion_mirror": _STRING, "step1_problem_restate": _STRING, **_REPLY_TAGS}),
+    "step_2": _object({"step2_breakdown": _STRING, **_REPLY_TAGS}),
+    "step_3": _object({"step3_explanation": _STRING, **_REPLY_TAGS}),
+    "step_4": _object({"step4_suggestions": _STRING_ARRAY, **_REPLY_TAGS}),
+    "step_5": _object({"step5_summary": _STRING, "theme": _STRING, **_REPLY_TAGS}),
+    "emotion_parse": _object({
+        "emotions": _STRING_ARRAY,
+        "intensity": _INTENSITY,
+        "scene": _STRING,
+        "riskLevel": _RISK_LEVEL,
+        "userGoal": {"type": "string", "enum": ["want_relief", "want_plan", "want_clarification", "want_listen"]},
+        "problemSummary": _STRING,
+    }),
+}
+
+# 引导阶段（只提问和共情）使用 guiding Schema，其余阶段为5步骤结构
+GUIDING_STAGES = ("chatting", "exploring", "summarizing")
+
+
+def structured_schema_name(conversation_stage: Optional[str]) -> str:
+    """结构化回复按对话阶段选择Schema"""
+    return "guiding" if conversation_stage in GUIDING_STAGES else "structured"
+
+
+def step_schema_name(step_num: int) -> str:
+    return f"step_{step_num}"
+
+
+_schema_name: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("response_schema", default=None)
+
+
+@contextmanager
+def response_schema(name: Optional[str]) -> Iterator[None]:
+    """
+    为当前调用点设置响应Schema（None表示不下发Schema）
+
+    用法：
+        with response_schema("guiding"):
+            self._perform_chat_completion(chat_messages, mode="structured")
+    """
+    if name is not None and name not in RESPONSE_SCHEMAS:
+        raise ValueError(f"未注册的响应Schema: {name}")
+    token = _schema_name.set(name)
+    try:
+        yield
+    finally:
+        _schema_name.reset(token)
+
+
+def current_response_schema_name() -> Optional[str]:
+    return _schema_name.get()
+
+
+def schema_enabled(provider_name: Optional[str] = None) -> bool:
+    """是否下发响应Schema（可按provider覆盖）"""
+    value = os.getenv("LLM_RESPONSE_SCHEMA_ENABLED", "true")
+    if provider_name:
+        value = os.getenv(f"LLM_RESPONSE_SCHEMA_ENABLED_{provider_name.upper()}", value)
+    return value.strip().lower() not in ("0", "false", "no", "off")
+
+
+def resolve_response_schema(mode: str, provider_name: Optional[str] = None) -> Optional[tuple[str, Dict[str, Any]]]:
+    """返回本次调用应下发的 (Schema名称, Schema)；text 模式、未设置或已关闭时返回 None"""
+    name = _schema_name.get()
+    if mode == "text" or name is None or not schema_enabled(provider_name):
+        return None
+    # 返回副本，provider 可以按各自的Schema方言改写
+    return name, copy.deepcopy(RESPONSE_SCHEMAS[name])
+
+
+class ParseOutcomeStats:
+    """按provider统计JSON解析结果"""
+
+    OUTCOMES = ("direct", "repaired", "failed")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def record(self, provider: str, outcome: str) -> None:
+        with self._lock:
+            counts = self._counts.setdefault(provider, dict.fromkeys(self.OUTCOMES, 0))
+            counts[outcome] += 1
+        JSON_PARSE.inc(provider=provider, outcome=outcome)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts.clear()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            result = {}
+            for provider, counts in self._counts.items():
+                total = sum(counts.values())
+                result[provider] = {
+                    **counts,
+                    "total": total,
+                    "repair_rate": round(counts["repaired"] / total, 4) if total else 0.0,
+                    "failure_rate": round(counts["failed"] / total, 4) if total else 0.0,
+                }
+            return result
+
+
+_parse_stats = ParseOutcomeStats()
+
+
+def get_parse_stats() -> ParseOutcomeStats:
+    return _parse_stats
@@ -3,9 +3,11 @@
 """
 from typing import Literal
 
+from app.core.keyword_engine import register_keywords, scan_keywords
+
 
 # 高危关键词列表（中英文）
-HIGH_RISK_KEYWORDS = [
+HIGH_RISK_KEYWORDS = register_keywords([
     # 中文
     "不想活",
     "结束这一切",
@@ -31,10 +33,10 @@ HIGH_RISK_KEYWORDS = [
     "self-harm",
     "cut myself",
     "hurt myself",
-]
+])
 
 # 中等风险关键词
-MEDIUM_RISK_KEYWORDS = [
+MEDIUM_RISK_KEYWORDS = register_keywords([
     "绝望",
     "没有希望",
     "hopeless",
@@ -44,18 +46,18 @@ MEDIUM_RISK_KEYWORDS = [
     "没有意义",
     "看不到未来",
     "看不到希望",
-]
+])
 
 # 自伤关键词
-SELF_HARM_KEYWORDS = [
+SELF_HARM_KEYWORDS = register_keywords([
     "自残", "自伤", "割腕", "跳楼", "上吊", "吃药", "结束生命",
     "self-harm", "cut myself", "hurt myself", "kill myself"
-]
+])
 
 # 暴力关键词
-VIOLENCE_KEYWORDS = [
+VIOLENCE_KEYWORDS = register_keywords([
     "伤害", "报复", "打", "kill", "hurt", "violence", "attack", "伤害别人"
-]
+])
 
 
 def detect_risk_level(content: str, intensity: int) -> Literal["low", "medium", "high"]:
@@ -69,11 +71,11 @@ def detect_risk_level(content: str, intensity: int) -> Literal["low", "medium",
     Returns:
         "low", "medium" 或 "high"
     """
-    content_lower = content.lower()
+    hits = scan_keywords(content)
     
     # 检查是否包含高危关键词
-    has_high_risk_keyword = any(keyword.lower() in content_lower for keyword in HIGH_RISK_KEYWORDS)
-    has_medium_risk_keyword = any(keyword.lower() in content_lower for keyword in MEDIUM_RISK_KEYWORDS)
+    has_high_risk_keyword = hits.any(HIGH_RISK_KEYWORDS)
+    has_medium_risk_keyword = hits.any(MEDIUM_RISK_KEYWORDS)
     
     # 高风险：包含高危关键词
     if has_high_risk_keyword:
@@ -88,14 +90,12 @@ def detect_risk_level(content: str, intensity: int) -> Literal["low", "medium",
 
 def detect_self_harm_keywords(content: str) -> bool:
     """检测是否包含自伤关键词"""
-    content_lower = content.lower()
-    return any(keyword.lower() in content_lower for keyword in SELF_HARM_KEYWORDS)
+    return scan_keywords(content).any(SELF_HARM_KEYWORDS)
 
 
 def detect_violence_keywords(content: str) -> bool:
     """检测是否包含暴力关键词"""
-    content_lower = content.lower()
-    return any(keyword.lower() in content_lower for keyword in VIOLENCE_KEYWORDS)
+    return scan_keywords(content).any(VIOLENCE_KEYWORDS)
 
 
 def upgrade_risk_level_if_needed(original_risk: str, content: str, intensity: int) -> Literal["low", "medium", "high"]:
@@ -5,6 +5,7 @@ from typing import Literal, Optional
 from app.schemas.style import (
     ParsedState, UserProfile, ConversationState, ReplyPlan, StyleProfile
 )
+from app.core.keyword_engine import register_keyword_table, register_keywords, scan_keywords
 
 
 class StepController:
@@ -34,6 +35,17 @@ class StepController:
         }
     }
     
+    # 用户输入中的体验模式切换指令（按 A/B/C/D 的顺序检测）
+    EXPERIENCE_MODE_KEYWORDS = register_keyword_table({
+        "A": ["只想被听", "只想倾诉", "只想聊聊", "听我说", "想说话"],  # 只想被听
+        "B": ["想搞懂", "想理解", "为什么会", "怎么回事", "为什么会这样"],  # 想搞懂
+        "C": ["怎么办", "建议", "方法", "怎么做", "如何做"],  # 想要建议
+        "D": ["系统聊", "深聊", "详细聊", "一步步", "慢慢来"],  # 系统深聊
+    })
+    
+    DEEP_MODE_KEYWORDS = register_keywords(["系统聊", "深聊", "详细聊", "慢慢聊", "一步步", "分步"])
+    QUICK_MODE_KEYWORDS = register_keywords(["快速", "简单", "简短", "直接"])
+    
     def determine_mode_and_steps(
         self,
         parsed: ParsedState,
@@ -61,11 +73,9 @@ class StepController:
             experience_mode = conversation_state.experienceMode
         
         # 2. 检测是否要求深聊模式
-        deep_mode_keywords = ["系统聊", "深聊", "详细聊", "慢慢聊", "一步步", "分步"]
-        quick_mode_keywords = ["快速", "简单", "简短", "直接"]
-        
-        is_deep_mode = any(kw in user_input for kw in deep_mode_keywords)
-        is_quick_mode = any(kw in user_input for kw in quick_mode_keywords)
+        hits = scan_keywords(user_input)
+        is_deep_mode = hits.any(self.DEEP_MODE_KEYWORDS)
+        is_quick_mode = hits.any(self.QUICK_MODE_KEYWORDS)
         
         # 3. 如果已有对话状态且处于深聊模式，继续深聊
         if conversation_state and conversation_state.currentMode == "deep":
@@ -86,23 +96,11 @@ class StepController:
     
     def _detect_experience_mode_from_input(self, user_input: str) -> Optional[Literal["A", "B", "C", "D"]]:
         """从用户输入中检测体验模式"""
-        user_lower = user_input.lower()
-        
-        # 模式A：只想被听
-        if any(kw in user_lower for kw in ["只想被听", "只想倾诉", "只想聊聊", "听我说", "想说话"]):
-            return "A"
-        
-        # 模式B：想搞懂
-        if any(kw in user_lower for kw in ["想搞懂", "想理解", "为什么会", "怎么回事", "为什么会这样"]):
-            return "B"
-        
-        # 模式C：想要建议
-        if any(kw in user_lower for kw in ["怎么办", "建议", "方法", "怎么做", "如何做"]):
-            return "C"
+        hits = scan_keywords(user_input)
         
-        # 模式D：系统深聊
-        if any(kw in user_lower for kw in ["系统聊", "深聊", "详细聊", "一步步", "慢慢来"]):
-            return "D"
+        for experience_mode, keywords in self.EXPERIENCE_MODE_KEYWORDS.items():
+            if hits.any(keywords):
+                return experience_mode
         
         return None
     
@@ -0,0 +1,91 @@
+"""
+深聊模式步骤调度器：按照步骤依赖关系（见 prompt_builder.STEP_DEPENDENCIES）并发生成各步骤
+
+依赖已完成的步骤会立即启动，同时运行的步骤数受每个请求的并发上限约束。
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+from app.core.prompt_builder import get_step_dependencies
+
+logger = logging.getLogger(__name__)
+
+# 每个请求内同时生成的步骤数上限（1 表示退化为按拓扑顺序串行执行）
+DEEP_CHAT_MAX_CONCURRENCY = int(os.getenv("DEEP_CHAT_MAX_CONCURRENCY", "3"))
+
+StepRunner = Callable[[int, Dict[int, Dict[str, Any]]], Awaitable[Dict[str, Any]]]
+
+
+async def run_step_dag(
+    steps_to_execute: List[int],
+    run_step: StepRunner,
+    max_concurrency: int | None = None,
+) -> Dict[int, Dict[str, Any]]:
+    """
+    按依赖关系调度步骤生成
+
+    Args:
+        steps_to_execute: 本轮要执行的步骤
+        run_step: 生成单个步骤的协程函数，参数为 (step_num, 依赖步骤的结果)
+        max_concurrency: 并发上限（默认使用 DEEP_CHAT_MAX_CONCURRENCY）
+
+    Returns:
+        {step_num: 步骤结果}，每个结果额外包含 "timing": {"started_ms", "elapsed_ms"}
+    """
+    limit = max(1, max_concurrency or DEEP_CHAT_MAX_CONCURRENCY)
+    semaphore = asyncio.Semaphore(limit)
+    results: Dict[int, Dict[str, Any]] = {}
+    done_events = {step: asyncio.Event() for step in steps_to_execute}
+    request_start = time.perf_counter()
+
+    async def run(step_num: int) -> None:
+        dependencies = get_step_dependencies(step_num, steps_to_execute)
+        for dep in dependencies:
+            await done_events[dep].wait()
+        try:
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    result = await run_step(step_num, {dep: results[dep] for dep in dependencies})
+                except Exception as e:
+                    logger.error(f"[Deep Chat] 步骤 {step_num} 生成失败: {str(e)}", exc_info=True)
+                    # 如果某个步骤失败，使用默认值，依赖它的步骤照常生成
+                    result = {"content": "", "data": {}}
+                finished = time.perf_counter()
+            result["timing"] = {
+                "started_ms": round((started - request_start) * 1000, 1),
+                "elapsed_ms": round((finished - started) * 1000, 1),
+            }
+            results[step_num] = result
+        finally:
+            done_events[step_num].set()
+
+    await asyncio.gather(*(run(step) for step in steps_to_execute))
+
+    total_ms = round((time.perf_counter() - request_start) * 1000, 1)
+    logger.info(f"[Deep Chat] {len(steps_to_execute)} 个步骤完成，总耗时 {total_ms}ms（并发上限 {limit}）")
+    for step_num in steps_to_execute:
+        metric = step_metric(step_num, results[step_num])
+        logger.info(
+            f"[Deep Chat]   步骤 {step_num}: 开始于 {metric['started_ms']}ms, 耗时 {metric['elapsed_ms']}ms, "
+            f"tokens {metric['prompt_tokens']}+{metric['completion_tokens']}"
+        )
+    return results
+
+
+def step_metric(step_num: int, step_result: Dict[str, Any]) -> Dict[str, Any]:
+    """从步骤结果中整理出耗时与tokens统计"""
+    timing = step_result.get("timing", {})
+    usage = step_result.get("usage") or {}
+    return {
+        "step": step_num,
+        "started_ms": timing.get("started_ms"),
+        "elapsed_ms": timing.get("elapsed_ms"),
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0),
+        "total_tokens": usage.get("total_tokens", 0),
+        "cached_tokens": usage.get("cached_tokens", 0),
+    }
@@ -3,12 +3,14 @@
 """
 from typing import Optional
 
+from app.core.keyword_engine import register_keyword_table, scan_keywords
+
 
 class StyleOverrideDetector:
     """风格切换指令检测器"""
     
     # 风格关键词映射
-    STYLE_KEYWORDS = {
+    STYLE_KEYWORDS = register_keyword_table({
         "comfort": ["温柔", "安慰", "温和", "轻柔", "gentle", "comfort"],
         "analyst": ["分析", "理性", "拆解", "分析一下", "analyze", "rational"],
         "coach": ["直接", "直说", "直给", "直接点", "direct", "straightforward"],
@@ -16,7 +18,7 @@ class StyleOverrideDetector:
         "listener": ["听", "倾听", "只听", "listener", "listen"],
         "growth": ["成长", "长期", "习惯", "growth", "long-term"],
         "mentor": ["导师", "老师", "mentor", "teacher"],
-    }
+    })
     
     def detect(self, user_text: str) -> Optional[str]:
         """
@@ -28,10 +30,10 @@ class StyleOverrideDetector:
         Returns:
             Optional[str]: 风格ID，如果没有检测到则返回None
         """
-        user_lower = user_text.lower()
+        hits = scan_keywords(user_text)
         
         for style_id, keywords in self.STYLE_KEYWORDS.items():
-            if any(keyword in user_lower for keyword in keywords):
+            if hits.any(keywords):
                 return style_id
         
         return None
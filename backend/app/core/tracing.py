@@ -0,0 +1,371 @@
+"""
+单轮对话的分阶段耗时追踪（轻量span记录器）
+
+一轮对话慢的时候，需要知道时间花在了哪里：情绪解析（可能包含一次LLM增强调用）、风格选择、规划、
+提示词构建、主回复的LLM调用、安全复查，还是 ChatService 里的几次数据库提交。这里提供一个进程内的
+span记录器，不依赖外部追踪系统：
+
+- 每轮对话一条 trace：with trace_turn("chat", chat_mode=...) as trace: ...
+- 各阶段用 span 包裹：with span("parse"): ...，可嵌套；不在 trace 中时为空操作，开销可忽略
+- LLM补全方法上叠加 @traced / @atraced / @traced_stream，记录 provider、模式、输出预算key与tokens
+- trace 通过 contextvars 传递，asyncio 并发的深聊步骤会各自挂在发起时的父span下
+- trace 结束后写入内存环形缓冲（/debug/traces 查看最近的慢请求），可选追加到 JSONL 文件
+
+span 的属性只记录阶段、模式、tokens 等元数据，不记录用户消息和回复内容。
+
+配置（环境变量）：
+- TRACE_ENABLED: 是否记录（默认true）
+- TRACE_BUFFER_SIZE: 内存中保留的最近trace条数（默认200）
+- TRACE_JSONL_PATH: JSONL导出文件路径（默认为空，不写文件）
+- TRACE_SLOW_MS: /debug/traces 默认只显示总耗时不低于该值的trace（默认3000）
+"""
+import contextvars
+import functools
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def tracing_enabled() -> bool:
+    return os.getenv("TRACE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+def slow_trace_ms() -> int:
+    return _env_int("TRACE_SLOW_MS", 3000)
+
+
+class Span:
+    """一个阶段的耗时记录（时间为相对 trace 开始的毫秒数）"""
+
+    __slots__ = ("span_id", "parent_id", "name", "start", "end", "attributes", "error")
+
+    def __init__(self, span_id: int, parent_id: Optional[int], name: str, attributes: Dict[str, Any]):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    @property
+    def elapsed_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+
+class _NoopSpan:
+    """未在 trace 中（或关闭追踪）时使用，所有操作都是空操作"""
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """一轮对话的 trace：span 按开始顺序保存，parent_id 为 None 的是顶层阶段"""
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attributes = attributes
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+        self.spans: List[Span] = []
+        self._ids = itertools.count(1)
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def start_span(self, name: str, parent_id: Optional[int], attributes: Dict[str, Any]) -> Span:
+        # list.append 是原子操作，线程/协程并发的子span可以直接追加
+        span = Span(next(self._ids), parent_id, name, attributes)
+        self.spans.append(span)
+        return span
+
+    @property
+    def total_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+    def stages(self) -> Dict[str, Dict[str, float]]:
+        """按span名称汇总耗时：{name: {"ms": 累计耗时, "count": 次数}}，按首次出现的顺序"""
+        stages: Dict[str, Dict[str, float]] = {}
+        for span in self.spans:
+            entry = stages.setdefault(span.name, {"ms": 0.0, "count": 0})
+            entry["ms"] = round(entry["ms"] + span.elapsed_ms, 1)
+            entry["count"] += 1
+        return stages
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at.isoformat(timespec="milliseconds"),
+            "total_ms": round(self.total_ms, 1),
+            "error": self.error,
+            "attributes": self.attributes,
+            "stages": self.stages(),
+            "spans": [
+                {
+                    "id": span.span_id,
+                    "parent_id": span.parent_id,
+                    "name": span.name,
+                    "start_ms": round((span.start - self.start) * 1000, 1),
+                    "elapsed_ms": round(span.elapsed_ms, 1),
+                    "attributes": span.attributes,
+                    "error": span.error,
+                }
+                for span in self.spans
+            ],
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+_current_span_id: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("trace_span_id", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def _reset(var: contextvars.ContextVar, token: contextvars.Token) -> None:
+    try:
+        var.reset(token)
+    except ValueError:
+        # 流式响应的异步生成器可能在另一个上下文中被关闭（如客户端断开），原上下文已不再使用
+        pass
+
+
+@contextmanager
+def trace_turn(name: str, **attributes: Any) -> Iterator[Trace | _NoopSpan]:
+    """
+    开始一轮对话的 trace，结束后交给 TraceRecorder（已在 trace 中时退化为一个普通span）
+
+    用法：
+        with trace_turn("chat", chat_mode=chat_mode) as trace:
+            ...
+            trace.set(session_id=session_id)
+    """
+    if current_trace() is not None:
+        with span(name, **attributes) as nested:
+            yield nested
+        return
+    if not tracing_enabled():
+        yield _NOOP_SPAN
+        return
+
+    trace = Trace(name, attributes)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span_id.set(None)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.error = type(e).__name__
+        raise
+    finally:
+        trace.end = time.perf_counter()
+        _reset(_current_span_id, span_token)
+        _reset(_current_trace, trace_token)
+        get_trace_recorder().record(trace)
+
+
+def annotate_trace(**attributes: Any) -> None:
+    """给当前 trace 补充属性（如本轮的对话阶段），不在 trace 中时忽略"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.set(**attributes)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span | _NoopSpan]:
+    """
+    记录一个阶段的耗时（挂在当前span下），不在 trace 中时为空操作
+
+    用法：
+        with span("plan", stage=stage) as s:
+            ...
+            s.set(steps=len(steps))
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NOOP_SPAN
+        return
+
+    current = trace.start_span(name, _current_span_id.get(), attributes)
+    token = _current_span_id.set(current.span_id)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _reset(_current_span_id, token)
+
+
+class TraceRecorder:
+    """已结束 trace 的本地导出：内存环形缓冲 + 可选的 JSONL 文件"""
+
+    def __init__(self, buffer_size: int = 200, jsonl_path: Optional[str] = None):
+        self._buffer: deque[Dict[str, Any]] = deque(maxlen=max(1, buffer_size))
+        self._jsonl_path = jsonl_path
+        self._lock = threading.Lock()
+        self._recorded = 0
+        self._export_failed = False
+
+    def record(self, trace: Trace) -> None:
+        data = trace.to_dict()
+        line = json.dumps(data, ensure_ascii=False, default=str) if self._jsonl_path else None
+        with self._lock:
+            self._buffer.append(data)
+            self._recorded += 1
+            if line is None:
+                return
+            try:
+                with open(self._jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+                self._export_failed = False
+            except OSError as e:
+                # 只在第一次失败时告警，避免每轮对话都刷日志
+                if not self._export_failed:
+                    logger.warning(f"[Tracing] 写入 {self._jsonl_path} 失败: {str(e)}")
+                self._export_failed = True
+
+    def recent(self, min_ms: float = 0, limit: int = 20, name: Optional[str] = None) -> List[Dict[str, Any]]:
+        """最近的 trace（新的在前），只返回总耗时不低于 min_ms 的"""
+        with self._lock:
+            traces = list(self._buffer)
+        selected = []
+        for data in reversed(traces):
+            if data["total_ms"] < min_ms or (name and data["name"] != name):
+                continue
+            selected.append(data)
+            if len(selected) >= limit:
+                break
+        return selected
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "recorded": self._recorded,
+                "buffered": len(self._buffer),
+                "buffer_size": self._buffer.maxlen,
+                "jsonl_path": self._jsonl_path,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buffer.clear()
+
+
+_recorder: Optional[TraceRecorder] = None
+_recorder_lock = threading.Lock()
+
+
+def get_trace_recorder() -> TraceRecorder:
+    global _recorder
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = TraceRecorder(
+                    buffer_size=_env_int("TRACE_BUFFER_SIZE", 200),
+                    jsonl_path=os.getenv("TRACE_JSONL_PATH") or None,
+                )
+    return _recorder
+
+
+def _completion_attributes(provider: Any, mode: str) -> Dict[str, Any]:
+    # 延迟导入：providers 包会导入本模块
+    from app.core.providers.output_budget import current_budget_key, format_budget_key
+
+    return {
+        "provider": provider._parse_stats_key(),
+        "mode": mode,
+        "budget_key": format_budget_key(current_budget_key(provider._parse_stats_key(), mode)),
+    }
+
+
+def _record_usage(current: Span | _NoopSpan, usage: Optional[Dict[str, Any]]) -> None:
+    if not usage:
+        return
+    current.set(**{
+        key: usage[key]
+        for key in ("prompt_tokens", "completion_tokens", "cached_tokens")
+        if usage.get(key) is not None
+    })
+
+
+def traced(func):
+    """包裹同步的 _perform_chat_completion(self, chat_messages, mode)：记录一次LLM调用的span"""
+
+    @functools.wraps(func)
+    def wrapper(self, chat_messages, mode: str):
+        if current_trace() is None:
+            return func(self, chat_messages, mode)
+        with span("llm.completion", **_completion_attributes(self, mode)) as current:
+            result = func(self, chat_messages, mode)
+            _record_usage(current, result.get("usage") if isinstance(result, dict) else None)
+            return result
+
+    return wrapper
+
+
+def atraced(func):
+    """包裹异步的 _aperform_chat_completion(self, chat_messages, mode)，逻辑同 traced"""
+
+    @functools.wraps(func)
+    async def wrapper(self, chat_messages, mode: str):
+        if current_trace() is None:
+            return await func(self, chat_messages, mode)
+        with span("llm.completion", **_completion_attributes(self, mode)) as current:
+            result = await func(self, chat_messages, mode)
+            _record_usage(current, result.get("usage") if isinstance(result, dict) else None)
+            return result
+
+    return wrapper
+
+
+def traced_stream(func):
+    """包裹 _astream_chat_completion(self, chat_messages, mode, usage)：额外记录首个片段的耗时"""
+
+    @functools.wraps(func)
+    async def wrapper(self, chat_messages, mode: str, usage: Dict[str, Any]):
+        if current_trace() is None:
+            async for chunk in func(self, chat_messages, mode, usage):
+                yield chunk
+            return
+        with span("llm.stream", **_completion_attributes(self, mode)) as current:
+            first_chunk = True
+            async for chunk in func(self, chat_messages, mode, usage):
+                if first_chunk:
+                    current.set(first_chunk_ms=round(current.elapsed_ms, 1))
+                    first_chunk = False
+                yield chunk
+            _record_usage(current, usage)
+
+    return wrapper
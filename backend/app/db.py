@@ -1,7 +1,7 @@
 """
 数据库配置和会话管理
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -30,3 +30,24 @@ def get_db():
     finally:
         db.close()
 
+
+
+def add_missing_columns():
+    """
+    为已存在的表补上新增的可空列
+
+    create_all 只创建缺失的表，不会修改已有的表；新增字段都是可空列，这里直接 ALTER TABLE 补上，
+    旧数据库升级后无需手动迁移
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
@@ -2,12 +2,17 @@
 ZhiQingYu - AI情绪陪伴应用后端主入口
 """
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
-from app.db import engine, Base
-from app.api import chat, daily, stats, ai_config
+from app.db import engine, Base, SessionLocal, add_missing_columns
+from app.api import chat, daily, stats, ai_config, debug, metrics
 from app.middleware.error_handler import validation_exception_handler, general_exception_handler
+from app.core.local_classifier import load_local_classifier
+from app.core.metrics import install_db_metrics
+from app.core.providers.http_pool import aclose_http_clients
+from app.core.providers.output_budget import load_output_budget_history
 
 # 配置日志
 logging.basicConfig(
@@ -16,13 +21,37 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
-# 创建数据库表
+# 创建数据库表，并为旧数据库补上新增的字段
 Base.metadata.create_all(bind=engine)
+add_missing_columns()
+
+# 数据库提交耗时计入 /metrics
+install_db_metrics(SessionLocal)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    应用生命周期：启动时用历史输出tokens预热输出预算表、加载本地情绪分类器权重，
+    关闭时释放LLM Provider的共享HTTP连接池
+    """
+    db = SessionLocal()
+    try:
+        load_output_budget_history(db)
+    except Exception:
+        logging.getLogger(__name__).exception("[Output Budget] 预热输出预算失败，使用默认预算")
+    finally:
+        db.close()
+    load_local_classifier()
+    yield
+    await aclose_http_clients()
+
 
 app = FastAPI(
     title="ZhiQingYu API",
     description="AI情绪陪伴应用后端API",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # 配置CORS
@@ -43,6 +72,9 @@ app.include_router(chat.router, prefix="/api", tags=["chat"])
 app.include_router(daily.router, prefix="/api", tags=["daily"])
 app.include_router(stats.router, prefix="/api", tags=["stats"])
 app.include_router(ai_config.router, prefix="/api", tags=["ai-config"])
+# 调试接口与 /health 一样挂在根路径下
+app.include_router(debug.router, tags=["debug"])
+app.include_router(metrics.router, tags=["metrics"])
 
 
 @app.get("/health")
@@ -5,5 +5,6 @@ from app.models.message import Message
 from app.models.daily_summary import DailySummary
 from app.models.session import Session
 from app.models.ai_config import AIConfig
+from app.models.conversation_summary import ConversationSummary
 
-__all__ = ["Message", "DailySummary", "Session", "AIConfig"]
+__all__ = ["Message", "DailySummary", "Session", "AIConfig", "ConversationSummary"]
@@ -0,0 +1,19 @@
+"""
+会话滚动摘要模型
+"""
+from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy.sql import func
+from app.db import Base
+
+
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summaries"
+
+    session_id = Column(String, primary_key=True, index=True)
+    summary_text = Column(Text, nullable=False)  # 较早对话的滚动摘要
+    summarized_count = Column(Integer, nullable=False, default=0)  # 摘要覆盖的前缀消息条数
+    prefix_hash = Column(String, nullable=False)  # 被摘要的前缀消息指纹（历史被修改时摘要失效）
+    compacted_turns = Column(Integer, nullable=False, default=0)  # 使用压缩历史的对话轮数
+    tokens_saved = Column(Integer, nullable=False, default=0)  # 累计节省的估算prompt tokens
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -1,7 +1,7 @@
 """
 消息模型
 """
-from sqlalchemy import Column, Integer, String, DateTime, JSON, Text
+from sqlalchemy import Column, Integer, String, DateTime, JSON, Text, Float
 from sqlalchemy.sql import func
 from app.db import Base
 
@@ -20,5 +20,12 @@ class Message(Base):
     prompt_tokens = Column(Integer, nullable=True)  # 输入tokens数
     completion_tokens = Column(Integer, nullable=True)  # 输出tokens数
     total_tokens = Column(Integer, nullable=True)  # 总tokens数
+    cached_tokens = Column(Integer, nullable=True)  # 输入tokens中命中上游前缀缓存的部分
+    output_budget_key = Column(String, nullable=True)  # 单次LLM调用生成时的输出预算key，用于按实际输出重新拟合预算
+    # 用户消息的解析标注（写入时保存，后续轮次的趋势/一致性分析直接读取，无需重新解析历史）
+    parsed_emotions = Column(JSON, nullable=True)  # 解析出的情绪列表（第一个为主情绪）
+    parsed_intensity = Column(Integer, nullable=True)  # 解析出的情绪强度 1-10
+    parsed_scene = Column(String, nullable=True)  # 解析出的场景
+    parse_confidence = Column(Float, nullable=True)  # 解析置信度 0-1
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
@@ -13,6 +13,15 @@ class ChatMessage(BaseModel):
     card_data: Optional[dict] = None  # 卡片数据（可选，用于卡片展示）
 
 
+class AnnotatedChatMessage(ChatMessage):
+    """带解析标注的历史用户消息（服务端内部使用，由存储的解析结果还原，供情绪趋势/一致性分析读取）"""
+    emotion: Optional[str] = None  # 主情绪
+    emotions: Optional[list[str]] = None
+    intensity: Optional[int] = None
+    scene: Optional[str] = None
+    confidence: Optional[float] = None
+
+
 class ChatRequest(BaseModel):
     """聊天请求"""
     session_id: Optional[str] = None
@@ -20,6 +29,7 @@ class ChatRequest(BaseModel):
     experience_mode: Optional[Literal["A", "B", "C", "D"]] = None  # 体验模式：A:只想被听 B:想搞懂 C:想要建议 D:系统深聊
     ai_style: Optional[str] = None  # AI风格：comfort, analyst, coach, mentor, friend, listener, growth, crisis_safe
     chat_mode: Optional[Literal["deep", "quick"]] = None  # 聊天模式：deep(深聊模式) 或 quick(快速模式)
+    deep_chat_engine: Optional[Literal["multi_step", "single_shot"]] = None  # 深聊引擎（为空时使用部署默认值 DEEP_CHAT_ENGINE）
 
 
 class ChatResponse(BaseModel):
@@ -0,0 +1,12 @@
+"""
+调试接口相关的Pydantic模型
+"""
+from pydantic import BaseModel
+from typing import Dict, Any
+
+
+class TraceList(BaseModel):
+    """最近的对话轮次追踪（进程内环形缓冲）"""
+    min_ms: float  # 只返回总耗时不低于该值的trace
+    recorder: Dict[str, Any]  # {"recorded": 1200, "buffered": 200, "buffer_size": 200, "jsonl_path": None}
+    traces: list[Dict[str, Any]]  # [{"trace_id", "name", "started_at", "total_ms", "attributes", "stages": {"parse": {"ms": 820.5, "count": 1}, ...}, "spans": [...]}, ...]
@@ -17,6 +17,75 @@ class TokensUsageStats(BaseModel):
     total_prompt_tokens: int  # 总输入tokens
     total_completion_tokens: int  # 总输出tokens
     total_tokens: int  # 总tokens
-    daily_usage: list[Dict[str, Any]]  # [{"date": "2025-01-10", "prompt_tokens": 1000, "completion_tokens": 500, "total_tokens": 1500}, ...]
+    total_cached_tokens: int = 0  # 输入tokens中命中上游前缀缓存的部分
+    cache_hit_rate: float = 0.0  # 前缀缓存命中率（cached / prompt）
+    daily_usage: list[Dict[str, Any]]  # [{"date": "2025-01-10", "prompt_tokens": 1000, "completion_tokens": 500, "total_tokens": 1500, "cached_tokens": 800}, ...]
     message_count: int  # 消息数量
 
+
+class DeepChatEngineStats(BaseModel):
+    """深聊引擎统计（进程内，重启后清零）"""
+    default_engine: str  # 当前部署默认引擎
+    engines: Dict[str, Dict[str, Any]]  # {"multi_step": {...}, "single_shot": {"repair_rate": 0.12, "repaired_steps": {3: 5}, ...}}
+
+
+class CompletionCacheStats(BaseModel):
+    """LLM补全缓存统计（进程内）"""
+    hits: int  # 命中次数（内存+SQLite）
+    misses: int  # 未命中次数
+    sqlite_hits: int  # 其中来自SQLite持久化存储的命中次数
+    hit_rate: float  # 命中率
+    entries: int  # 内存LRU当前条目数
+    max_entries: int  # 内存LRU最大条目数
+    sqlite_enabled: bool  # 是否启用SQLite持久化
+
+
+class PromptTemplateCacheStats(BaseModel):
+    """提示词模板缓存统计（进程内）"""
+    hits: int  # 命中次数
+    misses: int  # 未命中（重新编译模板）次数
+    hit_rate: float  # 命中率
+    entries: int  # 当前缓存的模板数
+    max_entries: int  # 最大模板数
+
+
+class CoalescingStats(BaseModel):
+    """相同LLM请求合并统计（进程内）"""
+    executed: int  # 实际发出的LLM请求数
+    coalesced: int  # 被合并（共享其他请求结果）的调用数
+    coalesce_rate: float  # 合并比例
+    in_flight: int  # 当前进行中的请求数
+
+
+class ProviderPoolStats(BaseModel):
+    """LLM provider故障转移池统计（进程内；未启用故障转移时 failover_enabled=False、members为空）"""
+    failover_enabled: bool  # 当前激活的provider是否为故障转移池
+    hedged_requests: int  # 发出的对冲请求数
+    hedge_wins: int  # 对冲请求先于主请求返回的次数
+    members: list[Dict[str, Any]]  # [{"label": "openai:gpt-4o-mini", "breaker_state": "closed", "p95_latency_ms": 820.0, ...}, ...]
+
+
+class RateLimitStats(BaseModel):
+    """LLM请求限流统计（进程内；未配置 LLM_RATE_LIMIT_RPM/TPM 时 limiters 为空）"""
+    limiters: list[Dict[str, Any]]  # [{"label": "openai:3f2a9c1d", "rpm": 60, "tpm": 90000, "waiting": 2, "priorities": {"high_risk": {...}, ...}}, ...]
+
+
+class JsonParseStats(BaseModel):
+    """LLM输出的JSON解析结果统计（进程内）"""
+    schema_enabled: bool  # 是否全局开启结构化输出Schema（LLM_RESPONSE_SCHEMA_ENABLED）
+    providers: Dict[str, Dict[str, Any]]  # {"openai": {"direct": 120, "repaired": 2, "failed": 0, "total": 122, "repair_rate": 0.0164, "failure_rate": 0.0}, ...}
+
+
+class OutputBudgetStats(BaseModel):
+    """LLM输出长度预算统计（进程内）"""
+    refit_enabled: bool  # 是否按实际输出重新拟合（LLM_OUTPUT_BUDGET_REFIT）
+    budgets: list[Dict[str, Any]]  # [{"key": "openai:exploring", "budget": 448, "default": 800, "samples": 120, "p50": 180, "p99": 350, "calls": 120, "truncations": 0}, ...]
+
+
+class HistoryCompactionStats(BaseModel):
+    """对话历史压缩统计（估算值与已持久化的实际prompt tokens对比）"""
+    compacted_sessions: int  # 有滚动摘要的会话数
+    compacted_turns: int  # 使用压缩历史的对话轮数
+    estimated_tokens_saved: int  # 累计节省的估算prompt tokens
+    prompt_tokens: int  # Message 上已记录的实际prompt tokens总数（压缩后）
+    savings_rate: float  # 节省比例 = 节省 / (实际 + 节省)
@@ -2,19 +2,34 @@
 聊天服务层
 """
 import uuid
+from typing import AsyncIterator
 from datetime import date, datetime
 from sqlalchemy.orm import Session
 from sqlalchemy import func
+from starlette.concurrency import run_in_threadpool
 from app.models import Message, Session as SessionModel, DailySummary
 from app.schemas.chat import ChatMessage
 from app.schemas.style import UserProfile
 from app.core.llm_provider import LLMProvider
+from app.core.providers.completion_cache import completion_cache_policy
+from app.core.history_compaction import history_compaction
+from app.services.history_compaction_service import HistoryCompactionService
+from app.services.message_annotation_service import MessageAnnotationService
 from app.core.risk_detection import upgrade_risk_level_if_needed
-from app.core.conversation_algorithm import generate_reply_with_algorithm, parse_user_message
+from app.core.conversation_algorithm import (
+    agenerate_reply_with_algorithm,
+    astream_reply_with_algorithm,
+    generate_reply_with_algorithm,
+    parse_user_message,
+)
 from app.schemas.style import ConversationState
 import json
 from app.core.style_override_detector import StyleOverrideDetector
 from app.core.safety_checker import SafetyChecker
+from app.core.analysis_context import analysis_scope, memoized_parse
+from app.core.emotion_parser_adapter import RULE_BASED_CONFIDENCE
+from app.core.metrics import annotate_chat_turn, chat_turn
+from app.core.tracing import annotate_trace, span, trace_turn
 import logging
 
 
@@ -24,14 +39,156 @@ class ChatService:
     def __init__(self, db: Session, llm_provider: LLMProvider):
         self.db = db
         self.llm_provider = llm_provider
+        self.history_service = HistoryCompactionService(db, llm_provider)
+        self.annotation_service = MessageAnnotationService(db)
     
-    def process_chat(self, session_id: str | None, messages: list[ChatMessage], experience_mode: str | None = None, ai_style: str | None = None, chat_mode: str | None = None) -> dict:
+    def process_chat(self, session_id: str | None, messages: list[ChatMessage], experience_mode: str | None = None, ai_style: str | None = None, chat_mode: str | None = None, deep_chat_engine: str | None = None) -> dict:
         """
         处理聊天请求
         
         Returns:
             包含session_id和LLM结果的字典
         """
+        with chat_turn("chat"), trace_turn("chat", chat_mode=chat_mode, history_messages=len(messages)) as trace, analysis_scope():
+            with span("prepare"):
+                session_id, session, user_message, messages, conversation_state, user_profile = self._prepare_chat(
+                    session_id, messages, experience_mode, ai_style
+                )
+            trace.set(session_id=session_id)
+            
+            # 历史超出tokens预算时，较早的对话折叠为滚动摘要（只影响发给LLM的消息）
+            with span("history_compaction"):
+                compaction = self.history_service.prepare(session_id, messages)
+            
+            # 6. 使用对话算法生成回复（增强版：支持5步骤系统）
+            # 对话回复不走补全缓存：用户重发/点"不满意"时应得到新的回复（情绪解析等调用点自行设置缓存策略）
+            with history_compaction(compaction):
+                try:
+                    with span("algorithm"), completion_cache_policy(enabled=False):
+                        llm_result, updated_conversation_state = generate_reply_with_algorithm(
+                            self.llm_provider,
+                            messages,
+                            user_profile,
+                            conversation_state=conversation_state,
+                            chat_mode=chat_mode,
+                            deep_chat_engine=deep_chat_engine
+                        )
+                    self._on_algorithm_success(session, user_message, llm_result, updated_conversation_state)
+                except Exception as e:
+                    # 如果新算法失败，回退到旧方法
+                    logger = logging.getLogger(__name__)
+                    logger.warning(f"对话算法失败，回退到旧方法: {str(e)}", exc_info=True)
+                    with span("fallback"):
+                        llm_result = self.llm_provider.generate_reply(messages)
+                    self._log_fallback_result(user_message, llm_result)
+            self.history_service.record_savings(session_id, compaction)
+            
+            with span("finalize"):
+                return self._finalize_chat(session_id, session, user_message, messages, llm_result)
+    
+    async def aprocess_chat(self, session_id: str | None, messages: list[ChatMessage], experience_mode: str | None = None, ai_style: str | None = None, chat_mode: str | None = None, deep_chat_engine: str | None = None) -> dict:
+        """
+        处理聊天请求（异步版本，LLM调用通过 await 执行，同步的数据库阶段放到线程池执行，均不阻塞事件循环）
+        
+        Returns:
+            包含session_id和LLM结果的字典
+        """
+        with chat_turn("chat"), trace_turn("chat", chat_mode=chat_mode, history_messages=len(messages)) as trace, analysis_scope():
+            with span("prepare"):
+                session_id, session, user_message, messages, conversation_state, user_profile = await run_in_threadpool(
+                    self._prepare_chat, session_id, messages, experience_mode, ai_style
+                )
+            trace.set(session_id=session_id)
+            
+            with span("history_compaction"):
+                compaction = await self.history_service.aprepare(session_id, messages)
+            
+            with history_compaction(compaction):
+                try:
+                    with span("algorithm"), completion_cache_policy(enabled=False):
+                        llm_result, updated_conversation_state = await agenerate_reply_with_algorithm(
+                            self.llm_provider,
+                            messages,
+                            user_profile,
+                            conversation_state=conversation_state,
+                            chat_mode=chat_mode,
+                            deep_chat_engine=deep_chat_engine
+                        )
+                    await run_in_threadpool(self._on_algorithm_success, session, user_message, llm_result, updated_conversation_state)
+                except Exception as e:
+                    logger = logging.getLogger(__name__)
+                    logger.warning(f"对话算法失败，回退到旧方法: {str(e)}", exc_info=True)
+                    with span("fallback"):
+                        llm_result = await self.llm_provider.agenerate_reply(messages)
+                    self._log_fallback_result(user_message, llm_result)
+            await run_in_threadpool(self.history_service.record_savings, session_id, compaction)
+            
+            with span("finalize"):
+                return await run_in_threadpool(self._finalize_chat, session_id, session, user_message, messages, llm_result)
+    
+    async def astream_chat(self, session_id: str | None, messages: list[ChatMessage], experience_mode: str | None = None, ai_style: str | None = None, chat_mode: str | None = None, deep_chat_engine: str | None = None) -> AsyncIterator[dict]:
+        """
+        流式处理聊天请求
+        
+        产出事件：
+        - {"event": "start", "data": {"session_id"}}
+        - {"event": "delta", "data": {"field", "index", "text"}}：回复字段增量
+        - {"event": "final", "data": 与 process_chat 返回值相同的字典}
+        """
+        with chat_turn("chat_stream"), trace_turn("chat_stream", chat_mode=chat_mode, history_messages=len(messages)) as trace, analysis_scope():
+            with span("prepare"):
+                session_id, session, user_message, messages, conversation_state, user_profile = await run_in_threadpool(
+                    self._prepare_chat, session_id, messages, experience_mode, ai_style
+                )
+            trace.set(session_id=session_id)
+            yield {"event": "start", "data": {"session_id": session_id}}
+            with span("history_compaction"):
+                compaction = await self.history_service.aprepare(session_id, messages)
+            
+            llm_result = None
+            has_streamed = False
+            with history_compaction(compaction):
+                try:
+                    with span("algorithm"):
+                        async for event in astream_reply_with_algorithm(
+                            self.llm_provider,
+                            messages,
+                            user_profile,
+                            conversation_state=conversation_state,
+                            chat_mode=chat_mode,
+                            deep_chat_engine=deep_chat_engine
+                        ):
+                            if event["type"] == "done":
+                                llm_result = event["result"]
+                                await run_in_threadpool(self._on_algorithm_success, session, user_message, llm_result, event["state"])
+                            else:
+                                has_streamed = True
+                                yield {
+                                    "event": "delta",
+                                    "data": {"field": event["field"], "index": event["index"], "text": event["text"]},
+                                }
+                except Exception as e:
+                    logger = logging.getLogger(__name__)
+                    logger.warning(f"对话算法失败，回退到旧方法: {str(e)}", exc_info=True)
+                    with span("fallback"):
+                        llm_result = await self.llm_provider.agenerate_reply(messages)
+                    self._log_fallback_result(user_message, llm_result)
+                    if not has_streamed:
+                        yield {"event": "delta", "data": {"field": "reply", "index": None, "text": llm_result.reply}}
+            await run_in_threadpool(self.history_service.record_savings, session_id, compaction)
+            
+            with span("finalize"):
+                final_data = await run_in_threadpool(self._finalize_chat, session_id, session, user_message, messages, llm_result)
+            yield {"event": "final", "data": final_data}
+    
+    def _prepare_chat(self, session_id: str | None, messages: list[ChatMessage], experience_mode: str | None = None, ai_style: str | None = None):
+        """
+        LLM调用前的准备：创建/获取Session、保存用户消息、恢复对话状态、构建用户配置
+        
+        Returns:
+            (session_id, session, user_message, messages, conversation_state, user_profile)，
+            messages 为还原了历史解析标注的新列表
+        """
         # 1. 创建或获取Session
         if not session_id:
             session_id = str(uuid.uuid4())
@@ -52,7 +209,8 @@ class ChatService:
             else:
                 session.latest_message_at = datetime.now()
         
-        self.db.commit()
+        with span("db.commit", what="session"):
+            self.db.commit()
         
         # 2. 保存用户最新消息
         user_message = messages[-1] if messages else None
@@ -63,7 +221,13 @@ class ChatService:
                 content=user_message.content
             )
             self.db.add(db_message)
-            self.db.commit()
+            with span("db.commit", what="user_message"):
+                self.db.commit()
+        
+        # 历史用户消息还原已保存的解析标注（情绪趋势、一致性分析使用），得到新的消息列表，不修改请求本身
+        with span("hydrate_annotations") as current:
+            messages, hydrated = self.annotation_service.hydrate(session_id, messages)
+            current.set(hydrated=hydrated)
         
         # 3. 恢复对话状态（从session或创建新的）- 需要先恢复，因为后面会用到
         conversation_state = None
@@ -98,83 +262,93 @@ class ChatService:
             preferredExperienceMode=preferred_experience_mode  # 使用前端提供的体验模式
         )
         
-        # 6. 使用对话算法生成回复（增强版：支持5步骤系统）
-        try:
-            llm_result, updated_conversation_state = generate_reply_with_algorithm(
-                self.llm_provider,
-                messages,
-                user_profile,
-                conversation_state=conversation_state,
-                chat_mode=chat_mode
-            )
-            
-            # 保存对话状态到session（如果session支持）
-            if session and hasattr(session, 'conversation_state'):
-                try:
-                    session.conversation_state = json.dumps(updated_conversation_state.model_dump(), ensure_ascii=False)
+        return session_id, session, user_message, messages, conversation_state, user_profile
+    
+    def _on_algorithm_success(self, session, user_message: ChatMessage | None, llm_result, updated_conversation_state: ConversationState):
+        annotate_trace(stage=updated_conversation_state.conversationStage, mode=updated_conversation_state.currentMode)
+        annotate_chat_turn(updated_conversation_state.conversationStage)
+        
+        # 保存对话状态到session（如果session支持）
+        if session and hasattr(session, 'conversation_state'):
+            try:
+                session.conversation_state = json.dumps(updated_conversation_state.model_dump(), ensure_ascii=False)
+                with span("db.commit", what="conversation_state"):
                     self.db.commit()
-                except Exception as e:
-                    logger = logging.getLogger(__name__)
-                    logger.warning(f"保存对话状态失败: {e}")
-            
-            logger = logging.getLogger(__name__)
-            logger.info("=" * 80)
-            logger.info("[Chat Service] AI回复生成完成")
-            logger.info(f"  用户消息: {user_message.content if user_message else 'N/A'}")
-            logger.info(f"  回复长度: {len(llm_result.reply)} 字符")
-            logger.info(f"  完整回复内容:\n{llm_result.reply}")
-            logger.info(f"  情绪: {llm_result.emotion}, 强度: {llm_result.intensity}")
-            logger.info(f"  主题: {llm_result.topics}, 风险等级: {llm_result.risk_level}")
-            logger.info(f"  对话模式: {updated_conversation_state.currentMode}, 当前步骤: {updated_conversation_state.currentStep}")
-            logger.info("=" * 80)
-        except Exception as e:
-            # 如果新算法失败，回退到旧方法
-            logger = logging.getLogger(__name__)
-            logger.warning(f"对话算法失败，回退到旧方法: {str(e)}", exc_info=True)
-            llm_result = self.llm_provider.generate_reply(messages)
-            updated_conversation_state = ConversationState()  # 创建默认状态
-            logger.info("=" * 80)
-            logger.info("[Chat Service] AI回复生成完成（使用旧方法）")
-            logger.info(f"  用户消息: {user_message.content if user_message else 'N/A'}")
-            logger.info(f"  回复长度: {len(llm_result.reply)} 字符")
-            logger.info(f"  完整回复内容:\n{llm_result.reply}")
-            logger.info("=" * 80)
+            except Exception as e:
+                logger = logging.getLogger(__name__)
+                logger.warning(f"保存对话状态失败: {e}")
+        
+        logger = logging.getLogger(__name__)
+        logger.info("=" * 80)
+        logger.info("[Chat Service] AI回复生成完成")
+        logger.info(f"  用户消息: {user_message.content if user_message else 'N/A'}")
+        logger.info(f"  回复长度: {len(llm_result.reply)} 字符")
+        logger.info(f"  完整回复内容:\n{llm_result.reply}")
+        logger.info(f"  情绪: {llm_result.emotion}, 强度: {llm_result.intensity}")
+        logger.info(f"  主题: {llm_result.topics}, 风险等级: {llm_result.risk_level}")
+        logger.info(f"  对话模式: {updated_conversation_state.currentMode}, 当前步骤: {updated_conversation_state.currentStep}")
+        logger.info("=" * 80)
+    
+    def _log_fallback_result(self, user_message: ChatMessage | None, llm_result):
+        logger = logging.getLogger(__name__)
+        logger.info("=" * 80)
+        logger.info("[Chat Service] AI回复生成完成（使用旧方法）")
+        logger.info(f"  用户消息: {user_message.content if user_message else 'N/A'}")
+        logger.info(f"  回复长度: {len(llm_result.reply)} 字符")
+        logger.info(f"  完整回复内容:\n{llm_result.reply}")
+        logger.info("=" * 80)
+    
+    def _finalize_chat(self, session_id: str, session, user_message: ChatMessage | None, messages: list[ChatMessage], llm_result) -> dict:
+        """
+        LLM调用后的处理：风险二次检查、质量自检、保存助手回复、更新每日摘要与会话标题
         
+        Returns:
+            包含session_id和LLM结果的字典
+        """
         # 7. 应用风险检测规则（二次检查）
         if user_message:
-            final_risk_level = upgrade_risk_level_if_needed(
-                llm_result.risk_level,
-                user_message.content,
-                llm_result.intensity
-            )
+            with span("risk_recheck"):
+                final_risk_level = upgrade_risk_level_if_needed(
+                    llm_result.risk_level,
+                    user_message.content,
+                    llm_result.intensity
+                )
             llm_result.risk_level = final_risk_level
         
-        # 7.5. 质量自检（在保存前检查回复质量）
+        # 7.5. 质量自检（在保存前检查回复质量），并把解析结果记到用户消息上
         if user_message:
-            try:
-                # 重新解析用户消息以获取ParsedState（传入历史消息）
-                parsed = parse_user_message(user_message, history=messages[:-1] if len(messages) > 1 else [])
-                safety_checker = SafetyChecker()
-                check_result = safety_checker.check_reply_quality(
-                    user_message=user_message,
-                    assistant_reply=llm_result.reply,
-                    parsed=parsed
-                )
+            with span("quality_check"):
+                try:
+                    # 复用本轮对话算法的解析结果（没有时按规则解析，如算法失败走了回退）
+                    history = messages[:-1] if len(messages) > 1 else []
+                    parsed, confidence = memoized_parse(
+                        user_message,
+                        history,
+                        "rules",
+                        lambda: (parse_user_message(user_message, history=history), RULE_BASED_CONFIDENCE),
+                    )
+                    self.annotation_service.annotate(session_id, user_message, parsed, confidence)
+                    safety_checker = SafetyChecker()
+                    check_result = safety_checker.check_reply_quality(
+                        user_message=user_message,
+                        assistant_reply=llm_result.reply,
+                        parsed=parsed
+                    )
                 
-                if not check_result.passed:
-                    # 质量检查失败，记录日志
+                    if not check_result.passed:
+                        # 质量检查失败，记录日志
+                        logger = logging.getLogger(__name__)
+                        logger.warning(
+                            f"回复质量检查失败: {check_result.reason}. "
+                            f"用户消息: {user_message.content[:50]}... "
+                            f"助手回复: {llm_result.reply[:50]}..."
+                        )
+                        # 注意：这里不阻止回复，只是记录日志
+                        # 如果需要，可以在这里触发重新生成或使用默认回复
+                except Exception as e:
+                    # 质量检查本身出错，记录但不影响主流程
                     logger = logging.getLogger(__name__)
-                    logger.warning(
-                        f"回复质量检查失败: {check_result.reason}. "
-                        f"用户消息: {user_message.content[:50]}... "
-                        f"助手回复: {llm_result.reply[:50]}..."
-                    )
-                    # 注意：这里不阻止回复，只是记录日志
-                    # 如果需要，可以在这里触发重新生成或使用默认回复
-            except Exception as e:
-                # 质量检查本身出错，记录但不影响主流程
-                logger = logging.getLogger(__name__)
-                logger.error(f"质量检查过程出错: {str(e)}", exc_info=True)
+                    logger.error(f"质量检查过程出错: {str(e)}", exc_info=True)
         
         # 8. 保存助手回复
         assistant_message = Message(
@@ -187,17 +361,20 @@ class ChatService:
             card_data=llm_result.card_data,
             prompt_tokens=llm_result.prompt_tokens,
             completion_tokens=llm_result.completion_tokens,
-            total_tokens=llm_result.total_tokens
+            total_tokens=llm_result.total_tokens,
+            cached_tokens=llm_result.cached_tokens,
+            output_budget_key=llm_result.output_budget_key
         )
         self.db.add(assistant_message)
         
         # 9. 更新或创建DailySummary
-        self._update_daily_summary(
-            date.today(),
-            llm_result.emotion,
-            llm_result.intensity,
-            llm_result.topics
-        )
+        with span("daily_summary"):
+            self._update_daily_summary(
+                date.today(),
+                llm_result.emotion,
+                llm_result.intensity,
+                llm_result.topics
+            )
         
         # 10. 根据AI总结的主题生成会话标题
         if llm_result.card_data and llm_result.card_data.get("theme"):
@@ -211,7 +388,8 @@ class ChatService:
                     preview += "..."
                 session.title = preview
         
-        self.db.commit()
+        with span("db.commit", what="reply"):
+            self.db.commit()
         
         # 映射风险级别：为了保持API兼容性，将low/medium/high映射到normal/high
         # low和medium都映射到normal，high保持为high
@@ -7,12 +7,27 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func
 from app.models import DailySummary, Message
 from app.core.llm_provider import LLMProvider
+from app.core.providers.completion_cache import completion_cache_policy
+from app.core.providers.rate_limiter import PRIORITY_BACKGROUND, llm_priority
 from app.schemas.chat import ChatMessage
 import json
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 主题叙事摘要的缓存时间（秒）：同一主题、同一组消息的叙事不必在每次打开日记详情时重新生成
+NARRATIVE_CACHE_TTL = 24 * 3600
+
+
+def _system_message(prompt: str) -> ChatMessage:
+    """
+    构建 system 消息
+
+    ChatMessage.role 只允许 user/assistant（对外接口不接受 system 消息），
+    这里是服务内部构造的提示词，跳过校验直接构建
+    """
+    return ChatMessage.model_construct(role="system", content=prompt, card_data=None)
+
 
 class DailySummaryService:
     """日记生成服务"""
@@ -73,7 +88,7 @@ class DailySummaryService:
             )
             
             # 调用 LLM 生成总结
-            system_message = ChatMessage(role="system", content=prompt)
+            system_message = _system_message(prompt)
             llm_messages = [system_message] + chat_messages
             
             # 使用简单的文本生成方法
@@ -134,7 +149,8 @@ class DailySummaryService:
         try:
             # 使用 provider 的 generate_text 方法
             if hasattr(self.llm_provider, 'generate_text'):
-                result = self.llm_provider.generate_text(messages)
+                with llm_priority(PRIORITY_BACKGROUND):
+                    result = self.llm_provider.generate_text(messages)
                 if result:
                     return result
             else:
@@ -166,17 +182,71 @@ class DailySummaryService:
             生成的叙事式摘要文本，如果生成失败则返回 None
         """
         try:
-            if not messages:
+            llm_messages = self._build_topic_narrative_messages(topic, messages, emotion_summary)
+            if not llm_messages:
                 return None
             
-            # 只保留用户消息用于生成叙事
-            user_messages = [msg for msg in messages if msg.role == "user"]
-            if not user_messages:
+            # 调用 LLM 生成叙事文本
+            if hasattr(self.llm_provider, 'generate_text'):
+                with completion_cache_policy(ttl=NARRATIVE_CACHE_TTL), llm_priority(PRIORITY_BACKGROUND):
+                    result = self.llm_provider.generate_text(llm_messages)
+                if result:
+                    logger.info(f"[Daily Summary] 成功为主题 {topic} 生成叙事式摘要")
+                    return result.strip()
+            
+            logger.warning(f"[Daily Summary] 为主题 {topic} 生成叙事式摘要失败")
+            return None
+            
+        except Exception as e:
+            logger.exception(f"[Daily Summary] 为主题 {topic} 生成叙事式摘要时发生错误: {str(e)}")
+            return None
+
+    async def agenerate_topic_narrative(
+        self,
+        topic: str,
+        messages: list[ChatMessage],
+        emotion_summary: str | None = None
+    ) -> str | None:
+        """
+        generate_topic_narrative 的异步版本
+        """
+        try:
+            llm_messages = self._build_topic_narrative_messages(topic, messages, emotion_summary)
+            if not llm_messages:
                 return None
             
-            # 构建提示词
-            emotion_info = f"主要情绪：{emotion_summary}" if emotion_summary else ""
-            prompt = f"""你是一位情绪陪伴助手。请根据用户关于"{topic}"这个主题的对话内容，生成一段连贯的叙事式日记摘要。
+            if hasattr(self.llm_provider, 'agenerate_text'):
+                with completion_cache_policy(ttl=NARRATIVE_CACHE_TTL), llm_priority(PRIORITY_BACKGROUND):
+                    result = await self.llm_provider.agenerate_text(llm_messages)
+                if result:
+                    logger.info(f"[Daily Summary] 成功为主题 {topic} 生成叙事式摘要")
+                    return result.strip()
+            
+            logger.warning(f"[Daily Summary] 为主题 {topic} 生成叙事式摘要失败")
+            return None
+            
+        except Exception as e:
+            logger.exception(f"[Daily Summary] 为主题 {topic} 生成叙事式摘要时发生错误: {str(e)}")
+            return None
+    
+    def _build_topic_narrative_messages(
+        self,
+        topic: str,
+        messages: list[ChatMessage],
+        emotion_summary: str | None = None
+    ) -> list[ChatMessage] | None:
+        """构建主题叙事摘要的LLM消息列表，没有用户消息时返回 None"""
+        if not messages:
+            return None
+        
+        # 只保留用户消息用于生成叙事
+        user_messages = [msg for msg in messages if msg.role == "user"]
+        if not user_messages:
+            return None
+        
+        # 构建提示词
+        emotion_info = f"主要情绪：{emotion_summary}" if emotion_summary else ""
+        prompt = f"""你是一位情绪陪伴助手。请根据用户关于"{topic}"这个主题的对话内容，生成一段连贯的叙事式日记摘要。
 
 要求：
 1. 将对话内容转换为第一人称的叙事文本，就像用户在写日记一样
@@ -191,22 +261,9 @@ class DailySummaryService:
 {emotion_info}
 
 请直接输出叙事文本，不要包含任何其他说明或格式标记。"""
-            
-            # 构建消息列表
-            system_message = ChatMessage(role="system", content=prompt)
-            llm_messages = [system_message] + user_messages
-            
-            # 调用 LLM 生成叙事文本
-            if hasattr(self.llm_provider, 'generate_text'):
-                result = self.llm_provider.generate_text(llm_messages)
-                if result:
-                    logger.info(f"[Daily Summary] 成功为主题 {topic} 生成叙事式摘要")
-                    return result.strip()
-            
-            logger.warning(f"[Daily Summary] 为主题 {topic} 生成叙事式摘要失败")
-            return None
-            
-        except Exception as e:
-            logger.exception(f"[Daily Summary] 为主题 {topic} 生成叙事式摘要时发生错误: {str(e)}")
-            return None
+        
+        # 构建消息列表
+        system_message = _system_message(prompt)
+        llm_messages = [system_message] + user_messages
+        return llm_messages
 
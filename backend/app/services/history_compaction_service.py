@@ -0,0 +1,168 @@
+"""
+对话历史压缩服务
+维护按会话保存的滚动摘要，为每轮对话生成历史压缩结果（见 app.core.history_compaction）
+"""
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app.models import ConversationSummary
+from app.core.llm_provider import LLMProvider
+from app.core.history_compaction import (
+    SUMMARY_HEADER,
+    HistoryCompaction,
+    estimate_messages_tokens,
+    estimate_tokens,
+    history_budget_for,
+    history_fingerprint,
+    recent_window_start,
+)
+from app.schemas.chat import ChatMessage
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 滚动摘要的长度上限（字）
+SUMMARY_MAX_CHARS = 400
+
+
+class HistoryCompactionService:
+    """对话历史压缩服务"""
+
+    def __init__(self, db: Session, llm_provider: LLMProvider):
+        self.db = db
+        self.llm_provider = llm_provider
+
+    def prepare(self, session_id: str, messages: list[ChatMessage]) -> HistoryCompaction | None:
+        """
+        为本轮对话准备压缩后的历史
+
+        历史超出tokens预算时，把最近N轮之前、尚未进入摘要的消息增量折叠进滚动摘要（一次文本生成调用）
+
+        Returns:
+            压缩结果；历史在预算内或压缩失败时返回 None（使用完整历史）
+        """
+        try:
+            record, summary, summarized_count, fold_end = self._plan(session_id, messages)
+            if fold_end:
+                folded = self._generate_summary(summary, messages[summarized_count:fold_end])
+                if folded:
+                    summary, summarized_count = folded, fold_end
+                    self._save(record, session_id, messages, summary, summarized_count)
+            return self._build_compaction(messages, summary, summarized_count)
+        except Exception as e:
+            logger.exception(f"[History Compaction] 压缩会话 {session_id} 的历史时发生错误: {str(e)}")
+            return None
+
+    async def aprepare(self, session_id: str, messages: list[ChatMessage]) -> HistoryCompaction | None:
+        """prepare 的异步版本（读写摘要的同步数据库操作放到线程池执行，不阻塞事件循环）"""
+        try:
+            record, summary, summarized_count, fold_end = await run_in_threadpool(self._plan, session_id, messages)
+            if fold_end:
+                folded = await self._agenerate_summary(summary, messages[summarized_count:fold_end])
+                if folded:
+                    summary, summarized_count = folded, fold_end
+                    await run_in_threadpool(self._save, record, session_id, messages, summary, summarized_count)
+            return self._build_compaction(messages, summary, summarized_count)
+        except Exception as e:
+            logger.exception(f"[History Compaction] 压缩会话 {session_id} 的历史时发生错误: {str(e)}")
+            return None
+
+    def record_savings(self, session_id: str, compaction: HistoryCompaction | None) -> None:
+        """累计本轮节省的估算tokens（每次LLM调用都少发了被摘要替代的消息）"""
+        if compaction is None or compaction.applied_calls == 0:
+            return
+        try:
+            record = self.db.query(ConversationSummary).filter(ConversationSummary.session_id == session_id).first()
+            if record is None:
+                return
+            saved = compaction.saved_tokens * compaction.applied_calls
+            record.compacted_turns = (record.compacted_turns or 0) + 1
+            record.tokens_saved = (record.tokens_saved or 0) + saved
+            self.db.commit()
+            logger.info(
+                f"[History Compaction] 会话 {session_id} 折叠 {compaction.folded_count} 条消息，"
+                f"{compaction.applied_calls} 次调用共节省约 {saved} tokens"
+            )
+        except Exception as e:
+            self.db.rollback()
+            logger.warning(f"[History Compaction] 记录节省的tokens失败: {str(e)}")
+
+    def _plan(self, session_id: str, messages: list[ChatMessage]):
+        """
+        读取已保存的摘要并判断是否需要继续折叠
+
+        Returns:
+            (摘要记录, 摘要文本, 摘要覆盖的消息条数, 本次需要折叠到的下标；不需要折叠时为0)
+        """
+        budget = history_budget_for(self.llm_provider)
+        record = self.db.query(ConversationSummary).filter(ConversationSummary.session_id == session_id).first()
+
+        summary, summarized_count = "", 0
+        if record is not None:
+            # 前端带来的历史与摘要覆盖的前缀不一致（如历史被清空或编辑）时，摘要作废
+            if record.summarized_count < len(messages) and record.prefix_hash == history_fingerprint(messages[:record.summarized_count]):
+                summary, summarized_count = record.summary_text, record.summarized_count
+            else:
+                logger.info(f"[History Compaction] 会话 {session_id} 的历史与已保存的摘要不一致，重新开始压缩")
+
+        if budget.max_tokens <= 0:
+            return record, summary, summarized_count, 0
+
+        remaining_tokens = estimate_tokens(summary) + estimate_messages_tokens(messages[summarized_count:])
+        if remaining_tokens <= budget.max_tokens:
+            return record, summary, summarized_count, 0
+
+        fold_end = recent_window_start(messages, budget.keep_turns)
+        if fold_end <= summarized_count:
+            return record, summary, summarized_count, 0
+        return record, summary, summarized_count, fold_end
+
+    def _build_compaction(self, messages: list[ChatMessage], summary: str, summarized_count: int) -> HistoryCompaction | None:
+        if not summary or summarized_count <= 0:
+            return None
+        saved_tokens = estimate_messages_tokens(messages[:summarized_count]) - estimate_tokens(SUMMARY_HEADER + summary)
+        if saved_tokens <= 0:
+            return None
+        return HistoryCompaction(
+            summary=summary,
+            folded_count=summarized_count,
+            message_count=len(messages),
+            saved_tokens=saved_tokens,
+        )
+
+    def _save(self, record: ConversationSummary | None, session_id: str, messages: list[ChatMessage], summary: str, summarized_count: int) -> None:
+        if record is None:
+            record = ConversationSummary(session_id=session_id, compacted_turns=0, tokens_saved=0)
+            self.db.add(record)
+        record.summary_text = summary
+        record.summarized_count = summarized_count
+        record.prefix_hash = history_fingerprint(messages[:summarized_count])
+        self.db.commit()
+        logger.info(f"[History Compaction] 会话 {session_id} 的滚动摘要已更新，覆盖前 {summarized_count} 条消息")
+
+    def _generate_summary(self, summary: str, new_messages: list[ChatMessage]) -> str | None:
+        result = self.llm_provider.generate_text(self._build_summary_messages(summary, new_messages))
+        return result.strip() if result and result.strip() else None
+
+    async def _agenerate_summary(self, summary: str, new_messages: list[ChatMessage]) -> str | None:
+        result = await self.llm_provider.agenerate_text(self._build_summary_messages(summary, new_messages))
+        return result.strip() if result and result.strip() else None
+
+    def _build_summary_messages(self, summary: str, new_messages: list[ChatMessage]) -> list[ChatMessage]:
+        """构建增量更新摘要的提示词：已有摘要 + 新折叠的对话 -> 新摘要（不重新总结全部历史）"""
+        dialogue = "\n".join(
+            f"{'用户' if msg.role == 'user' else '助手'}：{msg.content}"
+            for msg in new_messages
+        )
+        prompt = f"""你是一个对话记录整理助手。请把「新增对话」合并进「已有摘要」，输出更新后的摘要。
+
+要求：
+- 保留用户提到的关键事件、人物、情绪变化、困扰，以及已经讨论过的想法和建议
+- 用第三人称简洁叙述（用"用户"指代对方），不超过{SUMMARY_MAX_CHARS}字
+- 只输出摘要本身，不要包含其他说明或格式标记
+
+已有摘要：
+{summary or "（无）"}
+
+新增对话：
+{dialogue}"""
+        return [ChatMessage(role="user", content=prompt)]
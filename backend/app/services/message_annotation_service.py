@@ -0,0 +1,100 @@
+"""
+用户消息解析标注服务
+用户消息写入后保存本轮的解析结果（情绪、强度、场景、置信度）；后续轮次把最近窗口内的历史用户消息
+还原为带标注的消息，情绪趋势、持续困扰和上下文一致性分析直接读取，无需重新解析历史
+"""
+from sqlalchemy.orm import Session
+from app.models import Message
+from app.schemas.chat import AnnotatedChatMessage, ChatMessage
+from app.schemas.style import ParsedState
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 解析器最多回看最近5条历史消息（情绪趋势分析），只需还原这个窗口内的用户消息
+ANNOTATION_WINDOW = 5
+
+
+def chat_message_from_row(row: Message) -> ChatMessage:
+    """数据库消息转为 ChatMessage；带解析标注的用户消息转为 AnnotatedChatMessage"""
+    if row.role == "user" and row.parsed_emotions:
+        return AnnotatedChatMessage(
+            role="user",
+            content=row.content,
+            card_data=row.card_data,
+            emotion=row.parsed_emotions[0],
+            emotions=row.parsed_emotions,
+            intensity=row.parsed_intensity,
+            scene=row.parsed_scene,
+            confidence=row.parse_confidence,
+        )
+    return ChatMessage(role=row.role, content=row.content, card_data=row.card_data)
+
+
+class MessageAnnotationService:
+    """用户消息解析标注服务"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def hydrate(self, session_id: str, messages: list[ChatMessage]) -> tuple[list[ChatMessage], int]:
+        """
+        返回一份新的消息列表：最近窗口内（不含最后一条，即本轮消息）的历史用户消息换成带标注的消息
+
+        按位置对齐：本轮用户消息刚写入数据库，是本会话最新的一条，因此 messages 的末尾与本会话最近的
+        数据库消息逐条对应。对应位置的角色或内容不一致（前端带来的历史与数据库不同步）时该条保持原样。
+        传入的列表不会被修改。
+
+        Returns:
+            (新的消息列表, 还原了标注的消息数)
+        """
+        hydrated_messages = list(messages)
+        if not messages or messages[-1].role != "user":
+            return hydrated_messages, 0
+        window_start = max(0, len(messages) - 1 - ANNOTATION_WINDOW)
+        if not any(
+            m.role == "user" and not isinstance(m, AnnotatedChatMessage)
+            for m in messages[window_start:-1]
+        ):
+            return hydrated_messages, 0
+        try:
+            rows = (
+                self.db.query(Message)
+                .filter(Message.session_id == session_id)
+                .order_by(Message.id.desc())
+                .limit(len(messages) - window_start)
+                .all()
+            )
+        except Exception as e:
+            logger.warning(f"[Message Annotation] 读取会话 {session_id} 的解析标注失败: {str(e)}")
+            return hydrated_messages, 0
+
+        # rows[0] 对应 messages[-1]（本轮消息），rows[k] 对应 messages[-1 - k]
+        if not rows or rows[0].role != "user" or rows[0].content != messages[-1].content:
+            return hydrated_messages, 0
+        hydrated = 0
+        for offset, row in enumerate(rows[1:], start=2):
+            i = len(messages) - offset
+            message = messages[i]
+            if message.role != "user" or isinstance(message, AnnotatedChatMessage):
+                continue
+            if row.role != "user" or row.content != message.content or not row.parsed_emotions:
+                continue
+            hydrated_messages[i] = chat_message_from_row(row)
+            hydrated += 1
+        return hydrated_messages, hydrated
+
+    def annotate(self, session_id: str, user_message: ChatMessage, parsed: ParsedState, confidence: float) -> None:
+        """把本轮的解析结果记到刚保存的用户消息上（随后续的提交一起写入，不单独提交）"""
+        row = (
+            self.db.query(Message)
+            .filter(Message.session_id == session_id, Message.role == "user")
+            .order_by(Message.id.desc())
+            .first()
+        )
+        if row is None or row.content != user_message.content:
+            return
+        row.parsed_emotions = list(parsed.emotions)
+        row.parsed_intensity = parsed.intensity
+        row.parsed_scene = parsed.scene
+        row.parse_confidence = round(confidence, 3)
@@ -0,0 +1,405 @@
+"""
+纯CPU热路径微基准套件：带JSON基线与回归阈值，不依赖LLM/网络/数据库，可在CI的CPU机器上运行
+
+覆盖：
+    conversation_algorithm.parse_user_message、EnhancedEmotionParser.parse（关闭LLM）、
+    extract_resources_from_conversation、select_interventions、FiveStepPlanner.plan_steps、
+    build_structured_prompt、build_single_step_prompt、_parse_json_payload、_extract_json_object、
+    SafetyChecker.check、upgrade_risk_level_if_needed
+输入为不同长度（short/medium/long）的中文消息，对话历史深度 0/10/50/200。
+
+不同机器的绝对耗时不可比，因此每次运行先测一段固定的纯Python校准负载，基线与对比都使用
+「用例耗时 / 校准耗时」的归一化值；基线里可以为单个用例写 threshold 覆盖默认阈值。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_cpu                              # 运行并打印结果
+    python -m benchmarks.bench_cpu --save-baseline              # 写入 benchmarks/baseline_cpu.json
+    python -m benchmarks.bench_cpu --check --quick              # CI：与基线对比，超过阈值时退出码为1
+    python -m benchmarks.bench_cpu --filter parse_user_message --json result.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from contextlib import redirect_stdout
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional
+
+from app.core.conversation_algorithm import (
+    extract_resources_from_conversation,
+    parse_user_message,
+    select_interventions,
+)
+from app.core.enhanced_emotion_parser import EnhancedEmotionParser
+from app.core.five_step_planner import FiveStepPlanner
+from app.core.prompt_builder import build_single_step_prompt, build_structured_prompt
+from app.core.providers.base_provider import JsonChatLLMProvider
+from app.core.risk_detection import upgrade_risk_level_if_needed
+from app.core.safety_checker import SafetyChecker
+from app.core.style_manager import StyleManager
+from app.schemas.chat import ChatMessage
+from app.schemas.style import InterventionConfig, ParsedState
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_cpu.json")
+# 归一化耗时相对基线的最大允许倍数；CI机器噪声较大，默认值放得比较宽
+DEFAULT_THRESHOLD = 1.5
+BASELINE_VERSION = 1
+
+HISTORY_DEPTHS = (0, 10, 50, 200)
+
+# 用户消息素材：按长度拼接成 short / medium / long 三档
+_USER_SENTENCES = [
+    "最近工作压力好大，每天都很焦虑。",
+    "老板总是临时加需求，我怎么做都不够。",
+    "晚上躺下就开始想白天的事情，翻来覆去睡不着。",
+    "我觉得自己不够好，别人好像都比我轻松。",
+    "家里人也不太理解，说我想太多了。",
+    "考试快到了，我复习不进去，心里特别慌。",
+    "和朋友吵了一架之后，我一直很内疚，也有点生气。",
+    "我试过跑步和写日记，坚持了两周，后来又放弃了。",
+    "室友有时候会陪我聊聊，但我不想总是麻烦她。",
+    "有时候真的很累，感觉快撑不住了，什么都不想做。",
+]
+_ASSISTANT_SENTENCES = [
+    "听起来你最近真的承受了很多，这种持续的紧绷感一定很消耗人。",
+    "你愿意多说说，是哪些时刻让你觉得最难熬吗？",
+    "你已经在努力照顾自己了，比如坚持跑步和写日记，这本身就很不容易。",
+    "我们可以先把让你焦虑的事情列出来，看看哪一件最想先处理。",
+]
+MESSAGE_LENGTHS = {"short": 1, "medium": 4, "long": 20}
+
+
+def _user_text(sentences: int, offset: int = 0) -> str:
+    return "".join(_USER_SENTENCES[(offset + i) % len(_USER_SENTENCES)] for i in range(sentences))
+
+
+def _history(depth: int) -> List[ChatMessage]:
+    """构造 depth 条交替的用户/助手消息"""
+    messages = []
+    for i in range(depth):
+        if i % 2 == 0:
+            messages.append(ChatMessage(role="user", content=_user_text(1 + i % 3, offset=i)))
+        else:
+            messages.append(ChatMessage(role="assistant", content="".join(_ASSISTANT_SENTENCES[: 1 + i % 4])))
+    return messages
+
+
+def _structured_payload(sentences: int) -> str:
+    """构造一份典型的结构化回复JSON"""
+    return json.dumps(
+        {
+            "reply": _user_text(sentences),
+            "emotion": "anxiety",
+            "intensity": 7,
+            "topics": ["work", "sleep"],
+            "risk_level": "low",
+            "theme": "在压力里照顾好自己",
+            "emotion_reflection": _ASSISTANT_SENTENCES[0],
+            "cognitive_clarification": _ASSISTANT_SENTENCES[2] * max(1, sentences // 4),
+            "action_suggestions": _ASSISTANT_SENTENCES[3:] * 3,
+        },
+        ensure_ascii=False,
+    )
+
+
+class _BenchProvider(JsonChatLLMProvider):
+    """只用于调用JSON解析方法的最小provider，不发起任何请求"""
+
+    def _raw_chat_completion(self, chat_messages, mode):
+        raise NotImplementedError
+
+    async def _araw_chat_completion(self, chat_messages, mode):
+        raise NotImplementedError
+
+
+@dataclass
+class BenchResult:
+    """单个用例的结果（耗时为单次调用的最小值，单位微秒）"""
+    name: str
+    us: float
+    normalized: float
+    loops: int
+
+
+def _calibration_workload() -> None:
+    """固定的纯Python负载（字符串拼接、字典、json往返），用于把用例耗时归一化到当前机器速度"""
+    data = {f"k{i}": [i, str(i) * 3, {"v": i * 0.5}] for i in range(50)}
+    text = json.dumps(data)
+    json.loads(text)
+    "".join(sorted(text)).count("k")
+
+
+def _time_case(func: Callable[[], object], min_time: float, repeat: int) -> tuple[float, int]:
+    """类似 timeit.autorange：先确定循环次数使每轮至少 min_time 秒，再取 repeat 轮中的最小单次耗时"""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    best = elapsed / loops
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, (time.perf_counter() - start) / loops)
+    return best * 1_000_000, loops
+
+
+def build_cases() -> Dict[str, Callable[[], object]]:
+    """构造全部用例：名称 -> 无参可调用对象（输入提前准备好，不计入耗时）"""
+    cases: Dict[str, Callable[[], object]] = {}
+    histories = {depth: _history(depth) for depth in HISTORY_DEPTHS}
+    messages = {
+        label: ChatMessage(role="user", content=_user_text(n)) for label, n in MESSAGE_LENGTHS.items()
+    }
+
+    enhanced_parser = EnhancedEmotionParser(llm_provider=None, enable_llm=False)
+    for label, message in messages.items():
+        for depth, history in histories.items():
+            cases[f"parse_user_message/{label}/h{depth}"] = (
+                lambda m=message, h=history: parse_user_message(m, h)
+            )
+    for label, message in messages.items():
+        for depth, history in histories.items():
+            cases[f"enhanced_parse/{label}/h{depth}"] = (
+                lambda m=message, h=history: enhanced_parser.parse(m, h, use_llm_enhancement=False)
+            )
+
+    for depth, history in histories.items():
+        conversation = history + [messages["medium"]]
+        cases[f"extract_resources/h{depth}"] = lambda c=conversation: extract_resources_from_conversation(c)
+
+    styles = StyleManager().get_all_styles()
+    parsed_states = {
+        "low": ParsedState(
+            emotions=["anxiety"], intensity=4, scene="work", riskLevel="low", userGoal="want_listen",
+        ),
+        "mixed": ParsedState(
+            emotions=["anxiety", "tired", "guilt"], intensity=7, scene="relationship",
+            riskLevel="medium", userGoal="want_plan", problemSummary="和朋友吵架后一直内疚",
+        ),
+        "high": ParsedState(
+            emotions=["overwhelmed", "sadness"], intensity=9, scene="study", riskLevel="high",
+            userGoal="want_relief", hasSelfHarmKeywords=True,
+        ),
+    }
+    for label, parsed in parsed_states.items():
+        cases[f"select_interventions/{label}"] = (
+            lambda p=parsed: [select_interventions(p, style) for style in styles]
+        )
+
+    planner = FiveStepPlanner()
+    interventions = [
+        InterventionConfig(id="emotion_naming", triggers={}, role="emotion"),
+        InterventionConfig(id="reframing", triggers={}, role="clarification"),
+        InterventionConfig(id="task_breakdown", triggers={}, role="action"),
+    ]
+    for label, steps in (("steps1-3", [1, 2, 3]), ("steps1-5", [1, 2, 3, 4, 5])):
+        cases[f"plan_steps/{label}"] = (
+            lambda s=steps: planner.plan_steps(parsed_states["mixed"], styles[0], interventions, s)
+        )
+
+    plan = planner.plan_steps(parsed_states["mixed"], styles[0], interventions, [1, 2, 3, 4, 5])
+    for stage in ("chatting", "exploring", "summarizing", "inviting", None):
+        cases[f"build_structured_prompt/{stage or 'default'}"] = (
+            lambda st=stage: build_structured_prompt(parsed_states["mixed"], styles[0], plan, interventions, st)
+        )
+    previous_steps = {
+        n: {"data": {f"step{n}_text": _user_text(2, offset=n)}} for n in range(1, 5)
+    }
+    for step_num in range(1, 6):
+        previous = {n: previous_steps[n] for n in range(1, step_num)}
+        cases[f"build_single_step_prompt/step{step_num}"] = (
+            lambda n=step_num, prev=previous: build_single_step_prompt(
+                n, parsed_states["mixed"], styles[0], plan, interventions, prev
+            )
+        )
+
+    provider = _BenchProvider()
+    for label, n in MESSAGE_LENGTHS.items():
+        payload = _structured_payload(n)
+        variants = {
+            "clean": payload,
+            "fenced": f"```json\n{payload}\n```",
+            "prose": f"好的，下面是按要求生成的结果：\n{payload}\n希望对你有帮助。",
+        }
+        for variant, text in variants.items():
+            cases[f"parse_json_payload/{variant}/{label}"] = lambda t=text: provider._parse_json_payload(t)
+        prose = variants["prose"]
+        cases[f"extract_json_object/{label}"] = lambda t=prose: provider._extract_json_object(t)
+
+    checker = SafetyChecker()
+    replies = {
+        "short": "".join(_ASSISTANT_SENTENCES[:2]),
+        "medium": "".join(_ASSISTANT_SENTENCES) * 3,
+        # 超过 MAX_CHUNK_LENGTH，走分块检查
+        "long": "".join(_ASSISTANT_SENTENCES) * 40,
+    }
+    for label, reply in replies.items():
+        cases[f"safety_check/{label}"] = lambda r=reply: checker.check(r, parsed_states["mixed"])
+
+    for label, n in MESSAGE_LENGTHS.items():
+        content = _user_text(n)
+        cases[f"upgrade_risk/{label}"] = lambda c=content: upgrade_risk_level_if_needed("low", c, 6)
+
+    return cases
+
+
+def run_benchmarks(
+    name_filter: Optional[str] = None,
+    min_time: float = 0.02,
+    repeat: int = 5,
+    names: Optional[set[str]] = None,
+) -> tuple[float, List[BenchResult]]:
+    """运行用例（name_filter 为名称子串，names 为精确名称集合），返回 (校准耗时us, 结果列表)"""
+    cases = build_cases()
+    if name_filter:
+        cases = {name: func for name, func in cases.items() if name_filter in name}
+    if names is not None:
+        cases = {name: func for name, func in cases.items() if name in names}
+
+    # JSON解析失败路径会打warning，关闭LLM时的解析器也可能print，两者都与计时无关
+    logging.disable(logging.CRITICAL)
+    try:
+        with open(os.devnull, "w", encoding="utf-8") as devnull, redirect_stdout(devnull):
+            for func in cases.values():
+                func()  # 预热（模块导入、模板缓存等）
+            calibration_us, _ = _time_case(_calibration_workload, min_time, repeat)
+            results = []
+            for name, func in cases.items():
+                us, loops = _time_case(func, min_time, repeat)
+                results.append(BenchResult(name=name, us=us, normalized=us / calibration_us, loops=loops))
+    finally:
+        logging.disable(logging.NOTSET)
+    return calibration_us, results
+
+
+def load_baseline(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("version") != BASELINE_VERSION:
+        raise ValueError(f"基线版本不匹配: {baseline.get('version')} != {BASELINE_VERSION}")
+    return baseline
+
+
+def save_baseline(path: str, calibration_us: float, results: List[BenchResult], threshold: float) -> None:
+    """写入基线；保留旧基线里为单个用例手工设置的 threshold"""
+    previous_cases = {}
+    if os.path.exists(path):
+        try:
+            previous_cases = load_baseline(path).get("cases", {})
+        except (ValueError, json.JSONDecodeError):
+            previous_cases = {}
+    cases = {}
+    for result in results:
+        entry = {"us": round(result.us, 3), "normalized": round(result.normalized, 4)}
+        if "threshold" in previous_cases.get(result.name, {}):
+            entry["threshold"] = previous_cases[result.name]["threshold"]
+        cases[result.name] = entry
+    baseline = {
+        "version": BASELINE_VERSION,
+        "python": platform.python_version(),
+        "calibration_us": round(calibration_us, 3),
+        "default_threshold": threshold,
+        "cases": cases,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+def compare_with_baseline(results: List[BenchResult], baseline: dict, threshold: Optional[float] = None) -> List[dict]:
+    """
+    与基线对比归一化耗时
+
+    Returns:
+        每个用例一条：{name, ratio, threshold, status}，status 为 ok / regressed / new
+    """
+    default_threshold = threshold or baseline.get("default_threshold", DEFAULT_THRESHOLD)
+    rows = []
+    for result in results:
+        entry = baseline.get("cases", {}).get(result.name)
+        if entry is None:
+            rows.append({"name": result.name, "ratio": None, "threshold": default_threshold, "status": "new"})
+            continue
+        case_threshold = entry.get("threshold", default_threshold)
+        ratio = result.normalized / entry["normalized"]
+        rows.append({
+            "name": result.name,
+            "ratio": ratio,
+            "threshold": case_threshold,
+            "status": "regressed" if ratio > case_threshold else "ok",
+        })
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="纯CPU热路径微基准")
+    parser.add_argument("--filter", default=None, help="只运行名称包含该子串的用例")
+    parser.add_argument("--quick", action="store_true", help="缩短每轮时长和重复次数（CI用）")
+    parser.add_argument("--min-time", type=float, default=None, help="每轮最少运行秒数（默认0.02，--quick为0.005）")
+    parser.add_argument("--repeat", type=int, default=None, help="重复轮数，取最小值（默认5，--quick为3）")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="基线JSON路径")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果写入基线")
+    parser.add_argument("--check", action="store_true", help="与基线对比，有用例超过阈值时退出码为1")
+    parser.add_argument("--threshold", type=float, default=None, help=f"覆盖基线里的默认阈值（默认{DEFAULT_THRESHOLD}）")
+    parser.add_argument("--json", dest="json_path", default=None, help="把本次结果写入JSON文件")
+    args = parser.parse_args()
+
+    min_time = args.min_time if args.min_time is not None else (0.005 if args.quick else 0.02)
+    repeat = args.repeat if args.repeat is not None else (3 if args.quick else 5)
+    calibration_us, results = run_benchmarks(args.filter, min_time=min_time, repeat=repeat)
+
+    rows_by_name = {}
+    if args.check:
+        baseline = load_baseline(args.baseline)
+        rows_by_name = {row["name"]: row for row in compare_with_baseline(results, baseline, args.threshold)}
+        # 单次抖动很常见：超过阈值的用例用完整参数再测一次，仍超过才算回归
+        suspects = {name for name, row in rows_by_name.items() if row["status"] == "regressed"}
+        if suspects:
+            calibration_us, rerun = run_benchmarks(names=suspects, min_time=max(min_time, 0.02), repeat=max(repeat, 5))
+            rerun_by_name = {result.name: result for result in rerun}
+            results = [rerun_by_name.get(result.name, result) for result in results]
+            for row in compare_with_baseline(rerun, baseline, args.threshold):
+                rows_by_name[row["name"]] = row
+
+    print(f"校准负载 {calibration_us:.1f}us  (python {platform.python_version()})")
+    for result in results:
+        line = f"{result.name:<44} {result.us:10.1f}us  归一化 {result.normalized:8.3f}"
+        row = rows_by_name.get(result.name)
+        if row is not None:
+            if row["status"] == "new":
+                line += "  [基线中无此用例]"
+            else:
+                line += f"  对比基线 {row['ratio']:5.2f}x (阈值 {row['threshold']:.2f}x)"
+                if row["status"] == "regressed":
+                    line += "  REGRESSED"
+        print(line)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"calibration_us": calibration_us, "results": [asdict(r) for r in results],
+                 "comparison": list(rows_by_name.values())},
+                f, ensure_ascii=False, indent=2,
+            )
+
+    if args.save_baseline:
+        save_baseline(args.baseline, calibration_us, results, args.threshold or DEFAULT_THRESHOLD)
+        print(f"基线已写入 {args.baseline}")
+
+    regressed = [row for row in rows_by_name.values() if row["status"] == "regressed"]
+    if regressed:
+        print(f"{len(regressed)} 个用例超过回归阈值: {', '.join(row['name'] for row in regressed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
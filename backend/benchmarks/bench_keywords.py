@@ -0,0 +1,99 @@
+"""
+关键词检测微基准：对比共享关键词自动机（一次扫描，结果按原文缓存）与逐个子串查找（KEYWORD_ENGINE=substring）
+
+每个用例模拟一轮对话里会扫描同一条用户消息的全部检测器：
+    parse_user_message、EmotionParser._rule_based_parse、detect_risk_level / detect_self_harm_keywords /
+    detect_violence_keywords、StyleOverrideDetector.detect、StepController._detect_experience_mode_from_input、
+    EnhancedEmotionParser 的规则阶段（置信度与复杂度判断，关闭LLM）
+每次调用前清空扫描缓存，计入每轮第一次扫描的成本。消息长度 short/medium/long，对话历史深度 0/10/50/200；
+运行前会先确认两种实现的检测结果一致。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_keywords
+    python -m benchmarks.bench_keywords --quick --filter long
+"""
+import argparse
+import os
+from typing import Callable, Dict, List
+
+from app.core.conversation_algorithm import parse_user_message
+from app.core.emotion_parser import EmotionParser
+from app.core.enhanced_emotion_parser import EnhancedEmotionParser
+from app.core.keyword_engine import clear_keyword_scan_cache, get_keyword_automaton
+from app.core.risk_detection import detect_risk_level, detect_self_harm_keywords, detect_violence_keywords
+from app.core.step_controller import StepController
+from app.core.style_override_detector import StyleOverrideDetector
+from app.schemas.chat import ChatMessage
+from benchmarks.bench_cpu import HISTORY_DEPTHS, MESSAGE_LENGTHS, _history, _time_case, _user_text
+
+
+def _build_turns() -> Dict[str, Callable[[], object]]:
+    emotion_parser = EmotionParser(None)
+    enhanced_parser = EnhancedEmotionParser(llm_provider=None, enable_llm=False)
+    style_detector = StyleOverrideDetector()
+    step_controller = StepController()
+
+    def make_turn(message: ChatMessage, history: List[ChatMessage]) -> Callable[[], object]:
+        def turn():
+            clear_keyword_scan_cache()
+            parsed = parse_user_message(message, history)
+            rule_result, confidence, use_llm = enhanced_parser._rule_stage(message, history, None)
+            return (
+                parsed,
+                emotion_parser._rule_based_parse(message.content),
+                detect_risk_level(message.content, parsed.intensity),
+                detect_self_harm_keywords(message.content),
+                detect_violence_keywords(message.content),
+                style_detector.detect(message.content),
+                step_controller._detect_experience_mode_from_input(message.content),
+                rule_result,
+                confidence,
+                use_llm,
+            )
+
+        return turn
+
+    turns = {}
+    for label, sentences in MESSAGE_LENGTHS.items():
+        message = ChatMessage(role="user", content=_user_text(sentences))
+        for depth in HISTORY_DEPTHS:
+            turns[f"{label}/h{depth}"] = make_turn(message, _history(depth))
+    return turns
+
+
+def _with_engine(engine: str, func: Callable[[], object]):
+    previous = os.environ.get("KEYWORD_ENGINE")
+    os.environ["KEYWORD_ENGINE"] = engine
+    try:
+        return func()
+    finally:
+        if previous is None:
+            os.environ.pop("KEYWORD_ENGINE", None)
+        else:
+            os.environ["KEYWORD_ENGINE"] = previous
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="关键词检测：自动机 vs 逐个子串查找")
+    parser.add_argument("--quick", action="store_true", help="缩短计时，适合快速对比")
+    parser.add_argument("--filter", default="", help="只运行名称包含该子串的用例")
+    args = parser.parse_args()
+    min_time, repeat = (0.05, 3) if args.quick else (0.2, 5)
+
+    automaton = get_keyword_automaton()
+    print(f"自动机: {len(automaton.keywords)} 个关键词, {automaton.state_count} 个状态")
+
+    turns = {name: turn for name, turn in _build_turns().items() if args.filter in name}
+    for name, turn in turns.items():
+        if _with_engine("substring", turn) != _with_engine("automaton", turn):
+            raise SystemExit(f"{name}: 两种实现的检测结果不一致")
+
+    print(f"{'case':<16} {'substring(us)':>14} {'automaton(us)':>14} {'speedup':>8}")
+    for name, turn in turns.items():
+        substring_us, _ = _with_engine("substring", lambda: _time_case(turn, min_time, repeat))
+        automaton_us, _ = _with_engine("automaton", lambda: _time_case(turn, min_time, repeat))
+        print(f"{name:<16} {substring_us:14.1f} {automaton_us:14.1f} {substring_us / automaton_us:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
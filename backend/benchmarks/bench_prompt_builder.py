@@ -0,0 +1,90 @@
+"""
+提示词构建微基准：对比模板缓存命中（每轮只代入用户状态）与每次重新编译模板的耗时
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_prompt_builder
+    python -m benchmarks.bench_prompt_builder --iterations 5000
+"""
+import argparse
+import time
+from typing import Callable, Dict
+
+from app.core.prompt_builder import (
+    build_single_step_prompt,
+    build_structured_prompt,
+    get_prompt_template_cache,
+)
+from app.core.style_manager import StyleManager
+from app.schemas.style import InterventionConfig, ParsedState, ReplyPlan
+
+
+def _build_cases() -> Dict[str, Callable[[int], object]]:
+    styles = StyleManager().get_all_styles()
+    interventions = [
+        InterventionConfig(id="emotion_naming", triggers={}, role="emotion"),
+        InterventionConfig(id="reframing", triggers={}, role="clarification"),
+        InterventionConfig(id="task_breakdown", triggers={}, role="action"),
+    ]
+    plan = ReplyPlan(
+        style=styles[0],
+        interventions=[interv.id for interv in interventions],
+        structure={},
+        stepsToExecute=[1, 2, 3, 4, 5],
+        stepContents={1: {"required_elements": {"emotion_mirror": "点出焦虑和疲惫", "problem_restate": "复述考试压力"}}},
+    )
+    # 每轮的用户状态都不同，只有阶段/步骤、风格和干预模块会重复
+    parsed_states = [
+        ParsedState(
+            emotions=["anxiety", "tired"][: 1 + i % 2],
+            intensity=1 + i % 10,
+            scene=["study", "work", "relationship"][i % 3],
+            riskLevel="high" if i % 17 == 0 else "low",
+            userGoal="want_relief",
+        )
+        for i in range(64)
+    ]
+    previous_steps = {1: {"data": {"step1_emotion_mirror": "听起来你最近真的很累。" * 5}}}
+
+    def structured(i: int):
+        stage = ["chatting", "exploring", "summarizing", None][i % 4]
+        return build_structured_prompt(parsed_states[i % 64], styles[i % len(styles)], plan, interventions, stage)
+
+    def single_step(i: int):
+        step_num = 1 + i % 5
+        return build_single_step_prompt(
+            step_num, parsed_states[i % 64], styles[i % len(styles)], plan, interventions,
+            previous_steps if step_num > 1 else {},
+        )
+
+    return {"build_structured_prompt": structured, "build_single_step_prompt": single_step}
+
+
+def _run(func: Callable[[int], object], iterations: int, cached: bool) -> float:
+    cache = get_prompt_template_cache()
+    cache.clear()
+    start = time.perf_counter()
+    for i in range(iterations):
+        if not cached:
+            cache.clear()
+        func(i)
+    return (time.perf_counter() - start) / iterations * 1_000_000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="提示词模板缓存微基准")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    for name, func in _build_cases().items():
+        func(0)  # 预热（导入干预模块说明等）
+        uncached_us = _run(func, args.iterations, cached=False)
+        cached_us = _run(func, args.iterations, cached=True)
+        stats = get_prompt_template_cache().stats()
+        print(
+            f"{name:<26} 每次编译 {uncached_us:8.1f}us  缓存命中 {cached_us:8.1f}us  "
+            f"加速 {uncached_us / cached_us:5.2f}x  命中率 {stats['hit_rate']:.2%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,456 @@
+"""
+离线的假LLM服务：兼容 OpenAI / Ollama / Anthropic 接口，用于在本机压测真实的 provider 代码路径
+
+MockLLMProvider 完全绕过了 HTTP 请求与 JSON 解析，无法测出 provider 本身的开销；这里在本地起一个服务，
+让 OpenAIProvider / OllamaProvider / ClaudeProvider 走完整的请求、流式解析、Schema 与 usage 逻辑，不消耗 tokens。
+
+- POST /v1/chat/completions: OpenAI 格式（支持 stream 与 stream_options.include_usage）
+- POST /api/chat: Ollama 格式（支持 stream 的 NDJSON）
+- POST /v1/messages: Anthropic 格式（支持 stream 的 SSE，以及 tools + tool_choice 强制工具调用）
+- GET /stats、POST /stats/reset: 服务端请求统计
+
+按请求中的 Schema（json_schema / format / tool input_schema）生成符合 Schema 的 JSON；
+只要求 JSON 模式而没有 Schema 时，按系统提示词中出现的字段名推断是哪种输出（app.core.response_schemas）；
+text 模式返回一段中文纯文本。输出tokens超过请求的 max_tokens 时按真实服务的行为截断（finish_reason=length）。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.fake_llm_server --port 8900
+    python -m benchmarks.fake_llm_server --latency lognormal:400,0.6 --token-ms uniform:2,6 --error-rate 0.02
+
+对应的 provider 配置：
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1      OPENAI_API_KEY=fake
+    OLLAMA_BASE_URL=http://127.0.0.1:8900
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8900/v1   ANTHROPIC_API_KEY=fake
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.core.response_schemas import RESPONSE_SCHEMAS
+
+TOKENS_PER_CHAR = 0.7  # 估算 prompt tokens（与限流器的默认估算一致）
+STREAM_CHUNK_CHARS = 8
+
+# 无Schema时按系统提示词推断输出类型：越具体的越先匹配
+_SCHEMA_GUESS_ORDER = (
+    "structured", "emotion_parse", "step_1", "step_2", "step_3", "step_4", "step_5", "guiding", "simple",
+)
+
+_FILLER = (
+    "听起来你最近真的承受了很多，", "这种感觉一点都不奇怪，", "我们可以先慢下来看看发生了什么，",
+    "你已经在很努力地撑着了，", "也许可以先从一件小事开始，", "不管结果怎样你的感受都是重要的，",
+    "愿意说出来本身就很不容易，", "我们一起把它拆开来看看。",
+)
+_FIELD_VALUES: Dict[str, List[Any]] = {
+    "emotion": ["anxiety", "sadness", "tired", "anger", "neutral"],
+    "emotions": ["anxiety", "sadness", "tired", "anger"],
+    "topics": ["work", "study", "relationship", "family", "health"],
+    "scene": ["work", "study", "relationship", "family", "other"],
+}
+# 风险字段固定为 low，避免压测流量触发危机干预流程
+_ENUM_DEFAULTS = {"risk_level": "low", "riskLevel": "low"}
+
+
+@dataclass
+class Distribution:
+    """延迟/tokens数的分布：fixed:v、uniform:lo,hi、lognormal:中位数,sigma"""
+    kind: str
+    params: List[float]
+
+    @classmethod
+    def parse(cls, spec: str) -> "Distribution":
+        kind, _, raw = spec.partition(":")
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"未知的分布类型: {spec}")
+        params = [float(value) for value in raw.split(",") if value]
+        if len(params) != (1 if kind == "fixed" else 2):
+            raise ValueError(f"分布参数个数不正确: {spec}")
+        return cls(kind, params)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return rng.uniform(*self.params)
+        median, sigma = self.params
+        return rng.lognormvariate(0.0, sigma) * median
+
+
+@dataclass
+class FakeLLMConfig:
+    latency_ms: Distribution = field(default_factory=lambda: Distribution.parse("lognormal:300,0.5"))  # 首token延迟
+    token_ms: Distribution = field(default_factory=lambda: Distribution.parse("uniform:2,6"))  # 每个输出token的耗时
+    completion_tokens: Distribution = field(default_factory=lambda: Distribution.parse("uniform:120,400"))
+    text_tokens: Distribution = field(default_factory=lambda: Distribution.parse("uniform:60,200"))  # text 模式
+    error_rate: float = 0.0
+    error_statuses: List[int] = field(default_factory=lambda: [500])
+    seed: Optional[int] = None
+
+
+class FakeLLMStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests: Dict[str, int] = {}
+            self.streamed = 0
+            self.errors = 0
+            self.truncated = 0
+            self.completion_tokens = 0
+
+    def record(self, api: str, stream: bool, error: bool = False, truncated: bool = False, completion_tokens: int = 0) -> None:
+        with self._lock:
+            self.requests[api] = self.requests.get(api, 0) + 1
+            self.streamed += int(stream)
+            self.errors += int(error)
+            self.truncated += int(truncated)
+            self.completion_tokens += completion_tokens
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "streamed": self.streamed,
+                "errors": self.errors,
+                "truncated": self.truncated,
+                "completion_tokens": self.completion_tokens,
+            }
+
+
+@dataclass
+class FakeCompletion:
+    """一次假补全：完整输出、按 max_tokens 截断后的输出与tokens统计"""
+    text: str
+    payload: Optional[Dict[str, Any]]  # JSON输出的对象（工具调用的 input），text 模式为 None
+    prompt_tokens: int
+    completion_tokens: int
+    truncated: bool
+    latency_s: float
+    token_s: float
+
+    def chunks(self) -> List[str]:
+        return [self.text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(self.text), STREAM_CHUNK_CHARS)] or [""]
+
+
+class FakeLLM:
+    def __init__(self, config: FakeLLMConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.stats = FakeLLMStats()
+
+    # ===== 内容生成 =====
+
+    def _filler(self, chars: int) -> str:
+        parts: List[str] = []
+        total = 0
+        while total < chars:
+            part = self.rng.choice(_FILLER)
+            parts.append(part)
+            total += len(part)
+        return "".join(parts)[:max(1, chars)]
+
+    def _value(self, name: str, schema: Dict[str, Any], chars: int) -> Any:
+        schema_type = schema.get("type")
+        if "enum" in schema:
+            return _ENUM_DEFAULTS.get(name) or self.rng.choice(schema["enum"])
+        if schema_type == "integer":
+            return self.rng.randint(1, 5)
+        if schema_type == "array":
+            pool = _FIELD_VALUES.get(name)
+            if pool:
+                return self.rng.sample(pool, 2)
+            count = 3
+            return [self._value(name, schema.get("items", {}), max(1, chars // count)) for _ in range(count)]
+        if schema_type == "object":
+            return self._object(schema, chars)
+        pool = _FIELD_VALUES.get(name)
+        return self.rng.choice(pool) if pool else self._filler(chars)
+
+    def _object(self, schema: Dict[str, Any], chars: int) -> Dict[str, Any]:
+        properties = schema.get("properties", {})
+        # 输出长度按字符串字段平均分配
+        text_fields = [name for name, prop in properties.items() if prop.get("type") in ("string", "array")
+                       and "enum" not in prop and name not in _FIELD_VALUES] or [None]
+        per_field = max(1, chars // len(text_fields))
+        return {name: self._value(name, prop, per_field) for name, prop in properties.items()}
+
+    @staticmethod
+    def guess_schema(system_text: str) -> Dict[str, Any]:
+        for name in _SCHEMA_GUESS_ORDER:
+            schema = RESPONSE_SCHEMAS[name]
+            if all(f'"{field}"' in system_text for field in schema["required"]):
+                return schema
+        return RESPONSE_SCHEMAS["simple"]
+
+    def complete(
+        self,
+        messages: List[Dict[str, Any]],
+        max_tokens: Optional[int],
+        schema: Optional[Dict[str, Any]],
+        json_mode: bool,
+    ) -> FakeCompletion:
+        prompt_chars = sum(len(_content_text(message.get("content"))) for message in messages)
+        if schema is None and json_mode:
+            system_text = "\n".join(_content_text(m.get("content")) for m in messages if m.get("role") == "system")
+            schema = self.guess_schema(system_text)
+
+        target = self.config.completion_tokens if schema is not None else self.config.text_tokens
+        tokens = max(1, int(target.sample(self.rng)))
+        # 中文输出约 1 token/字，JSON 结构本身也占一部分
+        payload = self._object(schema, tokens) if schema is not None else None
+        text = json.dumps(payload, ensure_ascii=False) if payload is not None else self._filler(tokens)
+        tokens = max(tokens, len(text)) if payload is not None else tokens
+
+        truncated = max_tokens is not None and tokens > max_tokens
+        if truncated:
+            text = text[:max_tokens]
+            tokens = max_tokens
+        return FakeCompletion(
+            text=text,
+            payload=payload,
+            prompt_tokens=max(1, int(prompt_chars * TOKENS_PER_CHAR)),
+            completion_tokens=tokens,
+            truncated=truncated,
+            latency_s=max(0.0, self.config.latency_ms.sample(self.rng)) / 1000,
+            token_s=max(0.0, self.config.token_ms.sample(self.rng)) / 1000,
+        )
+
+    def should_fail(self) -> Optional[int]:
+        if self.config.error_rate and self.rng.random() < self.config.error_rate:
+            return self.rng.choice(self.config.error_statuses)
+        return None
+
+
+def _content_text(content: Any) -> str:
+    """消息内容可能是字符串，也可能是 Anthropic 风格的内容块列表"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+    return ""
+
+
+def _error_response(status: int) -> JSONResponse:
+    return JSONResponse(status_code=status, content={"error": {"message": f"fake upstream error {status}", "type": "fake_error"}})
+
+
+def create_app(config: Optional[FakeLLMConfig] = None) -> FastAPI:
+    fake = FakeLLM(config or FakeLLMConfig())
+    app = FastAPI(title="Fake LLM Server")
+    app.state.fake = fake
+
+    async def stream_chunks(completion: FakeCompletion) -> AsyncIterator[str]:
+        """按首token延迟和每token耗时产出文本片段"""
+        await asyncio.sleep(completion.latency_s)
+        for chunk in completion.chunks():
+            await asyncio.sleep(completion.token_s * len(chunk))
+            yield chunk
+
+    async def wait_full(completion: FakeCompletion) -> None:
+        await asyncio.sleep(completion.latency_s + completion.token_s * completion.completion_tokens)
+
+    # ===== OpenAI =====
+
+    @app.post("/v1/chat/completions")
+    async def openai_chat(request: Request):
+        body = await request.json()
+        stream = bool(body.get("stream"))
+        status = fake.should_fail()
+        if status:
+            fake.stats.record("openai", stream, error=True)
+            return _error_response(status)
+
+        response_format = body.get("response_format") or {}
+        schema = response_format.get("json_schema", {}).get("schema") if response_format.get("type") == "json_schema" else None
+        completion = fake.complete(body.get("messages", []), body.get("max_tokens"), schema, bool(response_format))
+        fake.stats.record("openai", stream, truncated=completion.truncated, completion_tokens=completion.completion_tokens)
+        finish_reason = "length" if completion.truncated else "stop"
+        usage = {
+            "prompt_tokens": completion.prompt_tokens,
+            "completion_tokens": completion.completion_tokens,
+            "total_tokens": completion.prompt_tokens + completion.completion_tokens,
+        }
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()), "model": body.get("model", "fake")}
+
+        if not stream:
+            await wait_full(completion)
+            return {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": completion.text}, "finish_reason": finish_reason}],
+                "usage": usage,
+            }
+
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        async def events() -> AsyncIterator[str]:
+            def chunk(choices: List[Dict[str, Any]], **extra: Any) -> str:
+                return f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': choices, **extra}, ensure_ascii=False)}\n\n"
+
+            yield chunk([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+            async for text in stream_chunks(completion):
+                yield chunk([{"index": 0, "delta": {"content": text}, "finish_reason": None}])
+            yield chunk([{"index": 0, "delta": {}, "finish_reason": finish_reason}])
+            if include_usage:
+                yield chunk([], usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    # ===== Ollama =====
+
+    @app.post("/api/chat")
+    async def ollama_chat(request: Request):
+        body = await request.json()
+        stream = body.get("stream", True)
+        status = fake.should_fail()
+        if status:
+            fake.stats.record("ollama", stream, error=True)
+            return _error_response(status)
+
+        response_format = body.get("format")
+        schema = response_format if isinstance(response_format, dict) else None
+        max_tokens = (body.get("options") or {}).get("num_predict")
+        completion = fake.complete(body.get("messages", []), max_tokens, schema, bool(response_format))
+        fake.stats.record("ollama", stream, truncated=completion.truncated, completion_tokens=completion.completion_tokens)
+        model = body.get("model", "fake")
+        final = {
+            "model": model,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "done": True,
+            "done_reason": "length" if completion.truncated else "stop",
+            "prompt_eval_count": completion.prompt_tokens,
+            "eval_count": completion.completion_tokens,
+        }
+
+        if not stream:
+            await wait_full(completion)
+            return {**final, "message": {"role": "assistant", "content": completion.text}}
+
+        async def lines() -> AsyncIterator[str]:
+            async for text in stream_chunks(completion):
+                yield json.dumps({"model": model, "message": {"role": "assistant", "content": text}, "done": False}, ensure_ascii=False) + "\n"
+            yield json.dumps({**final, "message": {"role": "assistant", "content": ""}}) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    # ===== Anthropic =====
+
+    @app.post("/v1/messages")
+    async def anthropic_messages(request: Request):
+        body = await request.json()
+        stream = bool(body.get("stream"))
+        status = fake.should_fail()
+        if status:
+            fake.stats.record("anthropic", stream, error=True)
+            return _error_response(status)
+
+        system = body.get("system") or ""
+        messages = [{"role": "system", "content": system}] + list(body.get("messages", []))
+        tool = None
+        tool_choice = body.get("tool_choice") or {}
+        if tool_choice.get("type") == "tool":
+            tool = next((t for t in body.get("tools", []) if t.get("name") == tool_choice.get("name")), None)
+        # Claude 没有JSON模式：没有强制工具调用时，按系统提示词是否要求JSON推断
+        json_mode = tool is not None or "JSON" in _content_text(system)
+        completion = fake.complete(messages, body.get("max_tokens"), tool["input_schema"] if tool else None, json_mode)
+        fake.stats.record("anthropic", stream, truncated=completion.truncated, completion_tokens=completion.completion_tokens)
+        stop_reason = "max_tokens" if completion.truncated else ("tool_use" if tool else "end_turn")
+        input_usage = {"input_tokens": completion.prompt_tokens, "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+        message_id = f"msg_{uuid.uuid4().hex[:12]}"
+
+        if not stream:
+            await wait_full(completion)
+            if tool:
+                # 截断的工具参数不是完整JSON，与真实服务一样返回空参数
+                block = {"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex[:12]}", "name": tool["name"],
+                         "input": {} if completion.truncated else completion.payload}
+            else:
+                block = {"type": "text", "text": completion.text}
+            return {
+                "id": message_id, "type": "message", "role": "assistant", "model": body.get("model", "fake"),
+                "content": [block], "stop_reason": stop_reason,
+                "usage": {**input_usage, "output_tokens": completion.completion_tokens},
+            }
+
+        async def events() -> AsyncIterator[str]:
+            def event(event_type: str, data: Dict[str, Any]) -> str:
+                return f"event: {event_type}\ndata: {json.dumps({'type': event_type, **data}, ensure_ascii=False)}\n\n"
+
+            yield event("message_start", {"message": {"id": message_id, "type": "message", "role": "assistant",
+                                                      "content": [], "usage": {**input_usage, "output_tokens": 0}}})
+            if tool:
+                start_block = {"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex[:12]}", "name": tool["name"], "input": {}}
+            else:
+                start_block = {"type": "text", "text": ""}
+            yield event("content_block_start", {"index": 0, "content_block": start_block})
+            async for text in stream_chunks(completion):
+                delta = {"type": "input_json_delta", "partial_json": text} if tool else {"type": "text_delta", "text": text}
+                yield event("content_block_delta", {"index": 0, "delta": delta})
+            yield event("content_block_stop", {"index": 0})
+            yield event("message_delta", {"delta": {"stop_reason": stop_reason}, "usage": {"output_tokens": completion.completion_tokens}})
+            yield event("message_stop", {})
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    # ===== 统计 =====
+
+    @app.get("/stats")
+    async def stats():
+        return fake.stats.snapshot()
+
+    @app.post("/stats/reset")
+    async def reset_stats():
+        fake.stats.reset()
+        return fake.stats.snapshot()
+
+    return app
+
+
+def build_config(args: argparse.Namespace) -> FakeLLMConfig:
+    return FakeLLMConfig(
+        latency_ms=Distribution.parse(args.latency),
+        token_ms=Distribution.parse(args.token_ms),
+        completion_tokens=Distribution.parse(args.completion_tokens),
+        text_tokens=Distribution.parse(args.text_tokens),
+        error_rate=args.error_rate,
+        error_statuses=[int(status) for status in args.error_status.split(",") if status],
+        seed=args.seed,
+    )
+
+
+def add_config_arguments(parser: argparse.ArgumentParser) -> None:
+    """假LLM服务的配置参数（压测驱动内嵌启动时复用）"""
+    parser.add_argument("--latency", default="lognormal:300,0.5", help="首token延迟(ms)分布：fixed:v / uniform:lo,hi / lognormal:中位数,sigma")
+    parser.add_argument("--token-ms", default="uniform:2,6", help="每个输出token的耗时(ms)分布")
+    parser.add_argument("--completion-tokens", default="uniform:120,400", help="JSON输出的tokens数分布")
+    parser.add_argument("--text-tokens", default="uniform:60,200", help="text 模式输出的tokens数分布")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回错误的请求比例")
+    parser.add_argument("--error-status", default="500", help="错误状态码（逗号分隔，随机选择），如 429,500,503")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="离线的 OpenAI/Ollama/Anthropic 兼容假LLM服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(build_config(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
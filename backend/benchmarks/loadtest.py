@@ -0,0 +1,420 @@
+"""
+端到端压测：模拟 N 个并发用户按真实的阶段机（determine_conversation_stage）走完整个会话
+
+每个会话依次发送：
+    第1轮 chatting → 第2、3轮 exploring → 第4轮 summarizing → 点击「满意」（进入 inviting）→ 生成关心卡
+经 /api/chat 与 /api/sessions/{id}/generate-card，统计吞吐量、按接口和按阶段的 p50/p95/p99 延迟、
+阶段与预期不符的次数，以及数据库增长（会话/消息行数、SQLite 文件大小）。
+
+两种目标：
+- 进程内（默认）：通过 ASGI 直接调用 app.main.app，使用独立的数据库（--database-url），
+  provider 为 mock，或者 openai / ollama / claude 连到进程内启动的假LLM服务（benchmarks/fake_llm_server.py）
+- --base-url：压测已经启动的后端（provider 由该后端自己的配置决定）
+
+用法（在 backend 目录下）：
+    python -m benchmarks.loadtest --users 20 --sessions 5
+    python -m benchmarks.loadtest --users 50 --provider openai --latency lognormal:400,0.5 --json report.json
+    python -m benchmarks.loadtest --base-url http://127.0.0.1:8000 --users 10
+
+作为库使用：
+    report = asyncio.run(run_load_test(LoadTestConfig(users=10), client))
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import threading
+import time
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from benchmarks.fake_llm_server import add_config_arguments, build_config, create_app as create_fake_llm_app
+
+# 按阶段准备的用户消息（同一会话内随机挑选，不同会话不完全相同，避免全部命中补全缓存）
+USER_MESSAGES: Dict[str, List[str]] = {
+    "chatting": [
+        "最近工作压力好大，每天都很焦虑",
+        "这几天总是睡不好，心里很乱",
+        "考试快到了，我有点慌",
+        "和朋友吵了一架，心里很难受",
+    ],
+    "exploring": [
+        "老板总是临时加需求，我怎么做都不够",
+        "晚上躺下就开始想白天的事情，停不下来",
+        "我觉得自己不够好，别人都比我轻松",
+        "其实也说不清楚，就是很累，什么都不想做",
+        "家里人也不太理解，说我想太多",
+    ],
+    "summarizing": [
+        "对，差不多就是这样，我就是怕自己做不好",
+        "你说得挺准的，我确实一直在逼自己",
+        "嗯，可能主要还是担心别人怎么看我",
+    ],
+}
+SATISFACTION_MESSAGE = "[SATISFACTION:满意]"
+
+# 会话脚本：(阶段, 消息来源)；阶段即本轮请求后预期进入的阶段
+SESSION_SCRIPT = (
+    ("chatting", "chatting"),
+    ("exploring", "exploring"),
+    ("exploring", "exploring"),
+    ("summarizing", "summarizing"),
+    ("inviting", SATISFACTION_MESSAGE),
+)
+
+
+@dataclass
+class LoadTestConfig:
+    users: int = 10  # 并发用户数
+    sessions_per_user: int = 3  # 每个用户依次完成的会话数
+    chat_mode: str = "deep"
+    deep_chat_engine: Optional[str] = None
+    think_time_ms: float = 0.0  # 同一会话相邻两次请求之间的平均间隔（指数分布）
+    ramp_up_s: float = 0.0  # 用户在该时间内均匀启动
+    generate_card: bool = True
+    timeout_s: float = 120.0
+    seed: Optional[int] = None
+
+
+@dataclass
+class RequestSample:
+    endpoint: str  # "chat" / "generate-card"
+    stage: str
+    latency_ms: float
+    ok: bool
+    error: Optional[str] = None
+
+
+@dataclass
+class LoadTestReport:
+    config: Dict[str, Any]
+    elapsed_s: float
+    requests: int
+    errors: int
+    sessions_completed: int
+    stage_mismatches: int
+    throughput_rps: float
+    sessions_per_s: float
+    endpoints: Dict[str, Dict[str, Any]]
+    stages: Dict[str, Dict[str, Any]]
+    db_growth: Dict[str, Any] = field(default_factory=dict)
+    error_samples: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    """最近秩百分位"""
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return round(ordered[index], 1)
+
+
+def _summarize(samples: List[RequestSample]) -> Dict[str, Any]:
+    latencies = sorted(sample.latency_ms for sample in samples if sample.ok)
+    return {
+        "count": len(samples),
+        "errors": sum(not sample.ok for sample in samples),
+        "mean_ms": round(sum(latencies) / len(latencies), 1) if latencies else 0.0,
+        "p50_ms": _percentile(latencies, 0.50),
+        "p95_ms": _percentile(latencies, 0.95),
+        "p99_ms": _percentile(latencies, 0.99),
+        "max_ms": round(latencies[-1], 1) if latencies else 0.0,
+    }
+
+
+class _SessionRunner:
+    """单个模拟用户：按脚本完成会话，记录每个请求的耗时"""
+
+    def __init__(self, client: httpx.AsyncClient, config: LoadTestConfig, rng: random.Random, samples: List[RequestSample]):
+        self.client = client
+        self.config = config
+        self.rng = rng
+        self.samples = samples
+        self.stage_mismatches = 0
+        self.sessions_completed = 0
+
+    async def _think(self) -> None:
+        if self.config.think_time_ms > 0:
+            await asyncio.sleep(self.rng.expovariate(1000.0 / self.config.think_time_ms))
+
+    async def _post(self, endpoint: str, stage: str, url: str, **kwargs: Any) -> Optional[Dict[str, Any]]:
+        started = time.perf_counter()
+        error = None
+        data = None
+        try:
+            response = await self.client.post(url, timeout=self.config.timeout_s, **kwargs)
+            response.raise_for_status()
+            body = response.json()
+            if body.get("error"):
+                error = f"{body['error'].get('code')}: {body['error'].get('message')}"
+            else:
+                data = body.get("data")
+        except (httpx.HTTPError, ValueError) as e:
+            error = f"{type(e).__name__}: {str(e)}"
+        self.samples.append(RequestSample(
+            endpoint=endpoint,
+            stage=stage,
+            latency_ms=(time.perf_counter() - started) * 1000,
+            ok=error is None,
+            error=error,
+        ))
+        return data
+
+    async def run_session(self) -> None:
+        session_id = None
+        messages: List[Dict[str, str]] = []
+        for stage, source in SESSION_SCRIPT:
+            content = source if source == SATISFACTION_MESSAGE else self.rng.choice(USER_MESSAGES[source])
+            messages.append({"role": "user", "content": content})
+            payload = {"session_id": session_id, "messages": messages, "chat_mode": self.config.chat_mode}
+            if self.config.deep_chat_engine:
+                payload["deep_chat_engine"] = self.config.deep_chat_engine
+            data = await self._post("chat", stage, "/api/chat", json=payload)
+            if data is None:
+                return
+            session_id = data["session_id"]
+            messages.append({"role": "assistant", "content": data["reply"]})
+            # summarizing 之后应显示满意度按钮，点击满意后应显示「开始关心吧！」按钮
+            if stage == "summarizing" and not data.get("should_show_satisfaction_buttons"):
+                self.stage_mismatches += 1
+            if stage == "inviting" and not data.get("should_show_card_button"):
+                self.stage_mismatches += 1
+            await self._think()
+
+        if self.config.generate_card:
+            params = {"engine": self.config.deep_chat_engine} if self.config.deep_chat_engine else None
+            data = await self._post("generate-card", "card_generated", f"/api/sessions/{session_id}/generate-card", params=params)
+            if data is None:
+                return
+        self.sessions_completed += 1
+
+    async def run(self, start_delay: float) -> None:
+        if start_delay:
+            await asyncio.sleep(start_delay)
+        for _ in range(self.config.sessions_per_user):
+            await self.run_session()
+
+
+async def run_load_test(
+    config: LoadTestConfig,
+    client: httpx.AsyncClient,
+    db_stats: Optional[Any] = None,
+) -> LoadTestReport:
+    """
+    用给定的 httpx 客户端（base_url 指向后端，或 ASGITransport 的进程内应用）执行压测
+
+    db_stats: 可选的无参函数，返回数据库规模（行数、文件大小），压测前后各调用一次计算增长
+    """
+    rng = random.Random(config.seed)
+    samples: List[RequestSample] = []
+    runners = [
+        _SessionRunner(client, config, random.Random(rng.random()), samples)
+        for _ in range(config.users)
+    ]
+    before = db_stats() if db_stats else None
+
+    started = time.perf_counter()
+    stagger = config.ramp_up_s / config.users if config.users else 0.0
+    await asyncio.gather(*(runner.run(index * stagger) for index, runner in enumerate(runners)))
+    elapsed = time.perf_counter() - started
+
+    db_growth: Dict[str, Any] = {}
+    if db_stats:
+        after = db_stats()
+        db_growth = {name: {"before": before[name], "after": after[name], "delta": after[name] - before[name]} for name in after}
+
+    stages = [stage for stage, _ in SESSION_SCRIPT] + (["card_generated"] if config.generate_card else [])
+    sessions_completed = sum(runner.sessions_completed for runner in runners)
+    return LoadTestReport(
+        config=asdict(config),
+        elapsed_s=round(elapsed, 3),
+        requests=len(samples),
+        errors=sum(not sample.ok for sample in samples),
+        sessions_completed=sessions_completed,
+        stage_mismatches=sum(runner.stage_mismatches for runner in runners),
+        throughput_rps=round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        sessions_per_s=round(sessions_completed / elapsed, 3) if elapsed else 0.0,
+        endpoints={
+            endpoint: _summarize([sample for sample in samples if sample.endpoint == endpoint])
+            for endpoint in ("chat", "generate-card")
+            if any(sample.endpoint == endpoint for sample in samples)
+        },
+        stages={
+            stage: _summarize([sample for sample in samples if sample.stage == stage])
+            for stage in dict.fromkeys(stages)
+            if any(sample.stage == stage for sample in samples)
+        },
+        db_growth=db_growth,
+        error_samples=list(dict.fromkeys(sample.error for sample in samples if sample.error))[:10],
+    )
+
+
+def format_report(report: LoadTestReport) -> str:
+    lines = [
+        f"耗时 {report.elapsed_s}s  请求 {report.requests}  失败 {report.errors}  "
+        f"完成会话 {report.sessions_completed}  阶段不符 {report.stage_mismatches}",
+        f"吞吐量 {report.throughput_rps} req/s  {report.sessions_per_s} 会话/s",
+        "",
+        f"{'':<16}{'count':>7}{'errors':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)",
+    ]
+    for title, rows in (("接口", report.endpoints), ("阶段", report.stages)):
+        lines.append(f"[{title}]")
+        for name, row in rows.items():
+            lines.append(
+                f"{name:<16}{row['count']:>7}{row['errors']:>8}{row['mean_ms']:>10}{row['p50_ms']:>10}"
+                f"{row['p95_ms']:>10}{row['p99_ms']:>10}{row['max_ms']:>10}"
+            )
+    if report.db_growth:
+        lines.append("[数据库增长]")
+        for name, growth in report.db_growth.items():
+            lines.append(f"{name:<16}{growth['before']:>12} -> {growth['after']:<12} (+{growth['delta']})")
+    if report.error_samples:
+        lines.append("[错误示例]")
+        lines.extend(f"- {error}" for error in report.error_samples)
+    return "\n".join(lines)
+
+
+# ===== 进程内目标 =====
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_llm_server(args: argparse.Namespace) -> str:
+    """在后台线程中启动假LLM服务，返回其地址"""
+    import uvicorn
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(
+        create_fake_llm_app(build_config(args)), host="127.0.0.1", port=port, log_level="warning",
+    ))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("假LLM服务启动超时")
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def configure_provider(provider: str, fake_llm_url: Optional[str]) -> None:
+    """在导入应用之前通过环境变量选择 provider（claude 需要数据库配置，导入后再写入）"""
+    os.environ["LLM_PROVIDER"] = provider if provider in ("openai", "ollama") else "mock"
+    if provider == "openai":
+        os.environ["OPENAI_BASE_URL"] = f"{fake_llm_url}/v1"
+        os.environ.setdefault("OPENAI_API_KEY", "fake")
+    elif provider == "ollama":
+        os.environ["OLLAMA_BASE_URL"] = fake_llm_url
+
+
+def _activate_db_provider(provider: str, base_url: str) -> None:
+    from app.core.provider_factory import invalidate_llm_provider_cache
+    from app.db import SessionLocal
+    from app.models.ai_config import AIConfig
+
+    db = SessionLocal()
+    try:
+        db.query(AIConfig).update({AIConfig.is_active: False})
+        config = db.query(AIConfig).filter(AIConfig.provider == provider).first()
+        if config is None:
+            config = AIConfig(id=provider, provider=provider)
+            db.add(config)
+        config.api_key = "fake"
+        config.base_url = base_url
+        config.is_active = True
+        db.commit()
+    finally:
+        db.close()
+    invalidate_llm_provider_cache()
+
+
+def _database_stats() -> Dict[str, int]:
+    from sqlalchemy import text
+
+    from app.db import DATABASE_URL, engine
+
+    with engine.connect() as conn:
+        stats = {
+            "sessions": conn.execute(text("SELECT COUNT(*) FROM sessions")).scalar() or 0,
+            "messages": conn.execute(text("SELECT COUNT(*) FROM messages")).scalar() or 0,
+        }
+    if DATABASE_URL.startswith("sqlite:///"):
+        path = DATABASE_URL[len("sqlite:///"):]
+        stats["db_file_bytes"] = os.path.getsize(path) if os.path.exists(path) else 0
+    return stats
+
+
+@asynccontextmanager
+async def in_process_client(args: argparse.Namespace) -> AsyncIterator[tuple[httpx.AsyncClient, Any]]:
+    """进程内的应用与客户端（独立数据库、可选的假LLM服务）"""
+    os.environ["DATABASE_URL"] = args.database_url
+    fake_llm_url = start_fake_llm_server(args) if args.provider != "mock" else None
+    configure_provider(args.provider, fake_llm_url)
+
+    from app.main import app
+
+    if args.provider == "claude":
+        _activate_db_provider("claude", f"{fake_llm_url}/v1")
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+            yield client, _database_stats
+
+
+async def _main(args: argparse.Namespace) -> LoadTestReport:
+    config = LoadTestConfig(
+        users=args.users,
+        sessions_per_user=args.sessions,
+        chat_mode=args.chat_mode,
+        deep_chat_engine=args.engine,
+        think_time_ms=args.think_ms,
+        ramp_up_s=args.ramp_up,
+        generate_card=not args.no_card,
+        timeout_s=args.timeout,
+        seed=args.seed,
+    )
+    if args.base_url:
+        async with httpx.AsyncClient(base_url=args.base_url) as client:
+            return await run_load_test(config, client)
+    async with in_process_client(args) as (client, db_stats):
+        return await run_load_test(config, client, db_stats)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="模拟多轮会话的端到端压测")
+    parser.add_argument("--users", type=int, default=10, help="并发用户数")
+    parser.add_argument("--sessions", type=int, default=3, help="每个用户完成的会话数")
+    parser.add_argument("--chat-mode", choices=["deep", "quick"], default="deep")
+    parser.add_argument("--engine", choices=["multi_step", "single_shot"], default=None, help="深聊引擎")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="同一会话相邻请求的平均间隔(ms)")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="用户在该秒数内均匀启动")
+    parser.add_argument("--no-card", action="store_true", help="不请求生成关心卡")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", dest="json_path", default=None, help="把报告写入JSON文件")
+    parser.add_argument("--base-url", default=None, help="压测已启动的后端；不指定时在进程内运行应用")
+    parser.add_argument("--database-url", default="sqlite:///./loadtest.db", help="进程内运行时使用的数据库")
+    parser.add_argument("--provider", choices=["mock", "openai", "ollama", "claude"], default="mock",
+                        help="进程内运行时的 provider（非 mock 时连到进程内启动的假LLM服务）")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    report = asyncio.run(_main(args))
+    print(format_report(report))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report.to_dict(), f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
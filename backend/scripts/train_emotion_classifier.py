@@ -0,0 +1,161 @@
+"""
+训练本地情绪分类器（app/core/local_classifier.py）
+
+训练数据来自 Message 表中带解析标注（parsed_emotions / parsed_scene / parsed_intensity）的用户消息，
+默认只使用置信度不低于 --min-confidence 的标注（经LLM增强的解析结果置信度更高）。也可以先导出为JSONL，
+人工校对后再用 --data 训练。训练完成后在留出集上报告情绪/场景/强度的指标，以及在当前阈值下
+本地分类器能代替LLM的比例，权重写入 LOCAL_CLASSIFIER_PATH（默认 app/config/emotion_classifier.npz）。
+
+用法（在 backend 目录下）：
+    python -m scripts.train_emotion_classifier                         # 从数据库训练并保存
+    python -m scripts.train_emotion_classifier --export samples.jsonl  # 只导出训练样本
+    python -m scripts.train_emotion_classifier --data samples.jsonl --version 2024-06-01 --output /tmp/clf.npz
+"""
+import argparse
+import json
+import zlib
+from dataclasses import asdict
+from pathlib import Path
+from typing import List
+
+from app.core.enhanced_emotion_parser import EMOTION_BASE_INTENSITY, SCENE_INTENSITY_MODIFIERS
+from app.core.local_classifier import (
+    DEFAULT_HASH_DIM,
+    LocalEmotionClassifier,
+    TrainingSample,
+    local_classifier_min_confidence,
+    local_classifier_path,
+    train_classifier,
+)
+from app.db import SessionLocal
+from app.models.message import Message
+
+
+def export_samples(min_confidence: float, limit: int) -> List[TrainingSample]:
+    """从数据库导出带解析标注的用户消息（按时间从新到旧，最多 limit 条）"""
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(Message)
+            .filter(
+                Message.role == "user",
+                Message.parsed_emotions.isnot(None),
+                Message.parse_confidence >= min_confidence,
+            )
+            .order_by(Message.id.desc())
+            .limit(limit)
+            .all()
+        )
+        return [
+            TrainingSample(
+                text=row.content,
+                emotions=list(row.parsed_emotions),
+                scene=row.parsed_scene or "general",
+                intensity=row.parsed_intensity or EMOTION_BASE_INTENSITY.get(row.parsed_emotions[0], 5),
+            )
+            for row in rows
+            if row.content and row.parsed_emotions
+        ]
+    finally:
+        db.close()
+
+
+def read_samples(path: Path) -> List[TrainingSample]:
+    with open(path, encoding="utf-8") as f:
+        return [TrainingSample(**json.loads(line)) for line in f if line.strip()]
+
+
+def write_samples(path: Path, samples: List[TrainingSample]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for sample in samples:
+            f.write(json.dumps(asdict(sample), ensure_ascii=False) + "\n")
+
+
+def hash_bucket(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8")) % 100
+
+
+def evaluate(classifier: LocalEmotionClassifier, samples: List[TrainingSample], min_confidence: float) -> dict:
+    """留出集指标：情绪 micro-F1、主情绪准确率、场景准确率、强度MAE、达到阈值的比例及其中的主情绪准确率"""
+    true_positive = predicted_total = actual_total = 0
+    primary_correct = scene_correct = confident = confident_correct = 0
+    intensity_error = 0.0
+    for sample in samples:
+        prediction = classifier.predict(sample.text)
+        predicted, actual = set(prediction.emotions), set(sample.emotions)
+        true_positive += len(predicted & actual)
+        predicted_total += len(predicted)
+        actual_total += len(actual)
+        correct = prediction.emotions[0] == sample.emotions[0]
+        primary_correct += correct
+        scene_correct += prediction.scene == sample.scene
+        intensity_error += abs(prediction.intensity - sample.intensity)
+        if prediction.confidence >= min_confidence:
+            confident += 1
+            confident_correct += correct
+    precision = true_positive / max(1, predicted_total)
+    recall = true_positive / max(1, actual_total)
+    return {
+        "samples": len(samples),
+        "emotion_micro_f1": round(2 * precision * recall / max(1e-9, precision + recall), 3),
+        "primary_emotion_accuracy": round(primary_correct / len(samples), 3),
+        "scene_accuracy": round(scene_correct / len(samples), 3),
+        "intensity_mae": round(intensity_error / len(samples), 2),
+        "coverage": round(confident / len(samples), 3),
+        "covered_primary_accuracy": round(confident_correct / max(1, confident), 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="训练本地情绪分类器")
+    parser.add_argument("--data", type=Path, help="从JSONL读取训练样本（默认从数据库导出）")
+    parser.add_argument("--export", type=Path, help="只把数据库中的训练样本导出为JSONL，不训练")
+    parser.add_argument("--min-confidence", type=float, default=0.8, help="只使用置信度不低于该值的解析标注")
+    parser.add_argument("--limit", type=int, default=50000, help="最多导出的消息数")
+    parser.add_argument("--output", type=Path, default=None, help="权重文件路径（默认 LOCAL_CLASSIFIER_PATH）")
+    parser.add_argument("--version", default=None, help="写入权重文件的模型版本（默认训练时间）")
+    parser.add_argument("--hash-dim", type=int, default=DEFAULT_HASH_DIM)
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--learning-rate", type=float, default=0.1)
+    parser.add_argument("--holdout", type=float, default=0.1, help="留出评估的样本比例")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    samples = read_samples(args.data) if args.data else export_samples(args.min_confidence, args.limit)
+    if args.export:
+        write_samples(args.export, samples)
+        print(f"已导出 {len(samples)} 条样本到 {args.export}")
+        return
+    if not samples:
+        raise SystemExit("没有可用的训练样本（用户消息需先带有解析标注）")
+
+    # 按内容哈希稳定划分留出集，同一条消息不会同时出现在训练集和留出集
+    holdout_buckets = int(args.holdout * 100)
+    train, holdout = [], []
+    for sample in samples:
+        (holdout if hash_bucket(sample.text) < holdout_buckets else train).append(sample)
+    if not train:
+        train, holdout = samples, []
+
+    classifier = train_classifier(
+        train,
+        emotion_labels=list(EMOTION_BASE_INTENSITY),
+        scene_labels=list(SCENE_INTENSITY_MODIFIERS),
+        hash_dim=args.hash_dim,
+        epochs=args.epochs,
+        learning_rate=args.learning_rate,
+        seed=args.seed,
+        model_version=args.version,
+    )
+    if holdout:
+        report = evaluate(classifier, holdout, local_classifier_min_confidence())
+        classifier.metadata["holdout"] = report
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    output = args.output or local_classifier_path()
+    classifier.save(output)
+    print(f"已保存 {output}（版本 {classifier.version}，{len(train)} 条训练样本，{len(holdout)} 条留出）")
+
+
+if __name__ == "__main__":
+    main()
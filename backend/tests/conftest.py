@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from app.core.providers.base_provider import JsonChatLLMProvider
+
+REPLY_JSON = json.dumps(
+    {"reply": "我在这里陪着你。", "emotion": "anxiety", "intensity": 5, "topics": ["work"], "risk_level": "low"},
+    ensure_ascii=False,
+)
+USAGE = {"prompt_tokens": 120, "completion_tokens": 30, "total_tokens": 150}
+
+
+class ScriptedProvider(JsonChatLLMProvider):
+    """
+    不发起网络请求的 provider：按脚本逐次返回结果或抛出异常，记录 _raw_* 的调用次数
+
+    script 中的元素：字符串/字典作为返回值，异常实例会被抛出，可调用对象（异步路径可返回协程）在调用时执行
+    """
+
+    def __init__(self, script=None, model: str = "scripted-model"):
+        super().__init__()
+        self.model = model
+        self.script = list(script or [])
+        self.calls = 0
+        self.stream_calls = 0
+
+    def _next(self):
+        self.calls += 1
+        step = self.script.pop(0) if self.script else {"text": REPLY_JSON, "usage": dict(USAGE)}
+        if isinstance(step, BaseException):
+            raise step
+        return step
+
+    def _raw_chat_completion(self, chat_messages, mode):
+        step = self._next()
+        return step() if callable(step) else step
+
+    async def _araw_chat_completion(self, chat_messages, mode):
+        step = self._next()
+        if callable(step):
+            step = step()
+            if hasattr(step, "__await__"):
+                step = await step
+        return step
+
+    async def _araw_stream(self, chat_messages, mode, usage):
+        self.stream_calls += 1
+        async for chunk in super()._araw_stream(chat_messages, mode, usage):
+            yield chunk
+
+
+@pytest.fixture
+def scripted_provider_class():
+    return ScriptedProvider
+
+
+class FakeClock:
+    """可手动推进的时钟（替代 time.monotonic）"""
+
+    def __init__(self, start: float = 1000.0):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
@@ -0,0 +1,61 @@
+from app.core.analysis_context import analysis_scope, cached_parse, memoized_parse, remember_parse
+from app.schemas.chat import AnnotatedChatMessage, ChatMessage
+from app.schemas.style import ParsedState
+
+
+def _parsed(emotion: str) -> ParsedState:
+    return ParsedState(emotions=[emotion], intensity=5, scene="general", riskLevel="low", userGoal="unknown")
+
+
+def test_same_content_with_different_history_is_parsed_separately():
+    message = ChatMessage(role="user", content="嗯")
+    calm = [ChatMessage(role="user", content="今天挺开心的"), ChatMessage(role="assistant", content="真好")]
+    upset = [ChatMessage(role="user", content="我被裁员了"), ChatMessage(role="assistant", content="听起来很难受")]
+    calls = []
+
+    def parse(emotion):
+        def run():
+            calls.append(emotion)
+            return _parsed(emotion), 0.6
+        return run
+
+    with analysis_scope() as context:
+        first, _ = memoized_parse(message, calm, "rules", parse("joy"))
+        second, _ = memoized_parse(message, upset, "rules", parse("sadness"))
+        again, _ = memoized_parse(message, list(calm), "rules", parse("unused"))
+
+    assert calls == ["joy", "sadness"]
+    assert first.emotions == ["joy"]
+    assert second.emotions == ["sadness"]
+    assert again.emotions == ["joy"]
+    assert context.hits == 1
+
+
+def test_history_outside_window_and_annotations_in_key():
+    message = ChatMessage(role="user", content="还是很烦")
+    recent = [ChatMessage(role="user", content=f"第{i}条") for i in range(5)]
+    older = [ChatMessage(role="user", content="很久以前的消息")]
+    annotated = [
+        AnnotatedChatMessage(role="user", content=m.content, emotions=["anxiety"], intensity=6, scene="work")
+        for m in recent
+    ]
+
+    with analysis_scope():
+        remember_parse(message, recent, "llm", _parsed("anxiety"), 0.9)
+        # 窗口外的历史不影响解析结果，仍然命中
+        assert cached_parse(message, older + recent, "rules") is not None
+        # 同样的内容但带了不同的解析标注，视为不同的上下文
+        assert cached_parse(message, annotated, "rules") is None
+        assert cached_parse(message, None, "rules") is None
+
+
+def test_level_ordering_and_copies():
+    message = ChatMessage(role="user", content="有点焦虑")
+    with analysis_scope():
+        remember_parse(message, [], "rules", _parsed("anxiety"), 0.6)
+        assert cached_parse(message, [], "llm") is None
+        parsed, confidence = cached_parse(message, [], "rules")
+        parsed.emotions.append("sadness")
+        assert cached_parse(message, [], "rules")[0].emotions == ["anxiety"]
+        assert confidence == 0.6
+    assert cached_parse(message, [], "rules") is None
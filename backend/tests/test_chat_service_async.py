@@ -0,0 +1,56 @@
+import asyncio
+import threading
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.db import Base
+from app.models import Message
+from app.schemas.chat import ChatMessage
+from app.services.chat_service import ChatService
+from tests.conftest import ScriptedProvider
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def _record_statement_threads(engine):
+    threads = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        threads.append(threading.get_ident())
+
+    return threads
+
+
+async def _run_turn(db, stream: bool):
+    service = ChatService(db, ScriptedProvider())
+    messages = [ChatMessage(role="user", content="最近工作压力很大，睡不好")]
+    if stream:
+        events = [event async for event in service.astream_chat(None, messages, chat_mode="quick")]
+        return events[-1]["data"], threading.get_ident()
+    return await service.aprocess_chat(None, messages, chat_mode="quick"), threading.get_ident()
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_async_chat_runs_db_phases_off_event_loop(engine, stream):
+    db = sessionmaker(bind=engine)()
+    threads = _record_statement_threads(engine)
+
+    result, loop_thread = asyncio.run(_run_turn(db, stream))
+    turn_threads = list(threads)
+
+    assert result["session_id"]
+    # 用户消息与助手回复都已落库
+    assert db.query(Message).filter(Message.session_id == result["session_id"]).count() == 2
+    # 所有SQL都在线程池中执行，没有阻塞事件循环所在的线程
+    assert turn_threads
+    assert loop_thread not in turn_threads
+    db.close()
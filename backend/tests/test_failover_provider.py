@@ -0,0 +1,196 @@
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core import provider_factory
+from app.core.providers.completion_cache import completion_cache_policy
+from app.core.providers.failover_provider import CircuitBreaker, FailoverLLMProvider
+from app.db import Base
+from app.models.ai_config import AIConfig
+
+from tests.conftest import FakeClock, ScriptedProvider
+
+CHAT = [{"role": "user", "content": "你好"}]
+
+
+@pytest.fixture(autouse=True)
+def no_completion_cache():
+    # 成员之间不共享缓存/合并结果，每次调用都真正走到 _raw_*
+    with completion_cache_policy(enabled=False):
+        yield
+
+
+def _pool(*providers):
+    return FailoverLLMProvider([(f"m{i}", provider) for i, provider in enumerate(providers)])
+
+
+def test_breaker_transitions_closed_open_half_open_closed():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=30.0, clock=clock)
+    assert breaker.state == "closed"
+
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow_request()
+
+    clock.advance(29.9)
+    assert breaker.state == "open"
+    clock.advance(0.1)
+    assert breaker.state == "half_open"
+    # 半开只放行一个试探请求
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow_request()
+
+
+def test_half_open_probe_failure_reopens_and_cancel_releases_slot():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=10.0, clock=clock)
+    breaker.record_failure()
+    clock.advance(10)
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.advance(9)
+    assert breaker.state == "open"
+    clock.advance(1)
+    assert breaker.allow_request()
+    breaker.release()
+    assert breaker.allow_request()
+
+
+def test_failover_tries_members_in_order_and_opens_breaker(monkeypatch):
+    monkeypatch.setenv("LLM_BREAKER_FAILURE_THRESHOLD", "2")
+    primary = ScriptedProvider(script=[RuntimeError("503"), RuntimeError("503")], model="primary")
+    backup = ScriptedProvider(model="backup")
+    spare = ScriptedProvider(model="spare")
+    pool = _pool(primary, backup, spare)
+
+    for _ in range(3):
+        assert pool._perform_chat_completion(CHAT, "text")["usage"]["total_tokens"] == 150
+
+    # 主成员失败两次后熔断，第三次直接跳过；备用成员始终排在 spare 前面
+    assert (primary.calls, backup.calls, spare.calls) == (2, 3, 0)
+    assert [m["breaker_state"] for m in pool.stats()["members"]] == ["open", "closed", "closed"]
+
+
+def test_async_failover_raises_last_error_when_all_members_fail():
+    first = ScriptedProvider(script=[RuntimeError("first down")], model="a")
+    second = ScriptedProvider(script=[ValueError("second down")], model="b")
+    pool = _pool(first, second)
+
+    with pytest.raises(ValueError, match="second down"):
+        asyncio.run(pool._aperform_chat_completion(CHAT, "text"))
+    assert (first.calls, second.calls) == (1, 1)
+
+
+def test_stream_switches_member_only_before_first_chunk():
+    broken = ScriptedProvider(script=[RuntimeError("connect failed")], model="a")
+    healthy = ScriptedProvider(script=[{"text": "流式回复", "usage": {}}], model="b")
+    pool = _pool(broken, healthy)
+
+    async def run():
+        return [chunk async for chunk in pool._astream_chat_completion(CHAT, "text", {})]
+
+    assert asyncio.run(run()) == ["流式回复"]
+    assert pool.members[0].failures == 1
+    assert pool.members[1].successes == 1
+
+
+def test_failover_priority_orders_pool(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    rows = [
+        AIConfig(id="openai", provider="openai", is_active=True, api_key="k", model="gpt"),
+        AIConfig(id="claude", provider="claude", api_key="k", extra_config=json.dumps({"failover_priority": 20})),
+        AIConfig(id="gemini", provider="gemini", api_key="k", extra_config=json.dumps({"failover_priority": 10})),
+        AIConfig(id="ollama", provider="ollama"),  # 未设置优先级，默认100
+        AIConfig(id="doubao", provider="doubao", api_key="k", extra_config=json.dumps({"failover": False})),
+    ]
+    db.add_all(rows)
+    db.commit()
+
+    fallbacks = provider_factory._load_fallback_configs(db, rows[0])
+    assert [config.provider for config in fallbacks] == ["gemini", "claude", "ollama"]
+
+    pool = provider_factory._create_failover_provider([rows[0]] + fallbacks)
+    assert isinstance(pool, FailoverLLMProvider)
+    assert [member.label.split(":")[0] for member in pool.members] == ["openai", "gemini", "claude", "ollama"]
+    db.close()
+
+
+@pytest.mark.parametrize("p95, min_delay, expected", [(0.2, 0.05, 0.2), (0.01, 0.05, 0.05)])
+def test_hedge_delay_is_max_of_p95_and_min_delay(monkeypatch, p95, min_delay, expected):
+    monkeypatch.setenv("LLM_HEDGE_ENABLED", "true")
+    monkeypatch.setenv("LLM_HEDGE_MIN_SAMPLES", "5")
+    monkeypatch.setenv("LLM_HEDGE_MIN_DELAY", str(min_delay))
+    pool = _pool(ScriptedProvider(model="a"), ScriptedProvider(model="b"))
+    member = pool.members[0]
+
+    for _ in range(4):
+        member.record_latency(p95)
+    # 样本不足时不对冲
+    assert pool._hedge_delay(member) is None
+    member.record_latency(p95)
+    assert pool._hedge_delay(member) == pytest.approx(expected)
+
+    monkeypatch.setenv("LLM_HEDGE_ENABLED", "false")
+    assert pool._hedge_delay(member) is None
+
+
+def test_hedged_request_wins_and_cancels_primary(monkeypatch):
+    monkeypatch.setenv("LLM_HEDGE_ENABLED", "true")
+    monkeypatch.setenv("LLM_HEDGE_MIN_SAMPLES", "1")
+    monkeypatch.setenv("LLM_HEDGE_MIN_DELAY", "0.02")
+    cancelled = []
+
+    async def stuck():
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    primary = ScriptedProvider(script=[stuck], model="slow")
+    backup = ScriptedProvider(script=[{"text": "对冲结果", "usage": {}}], model="fast")
+    pool = _pool(primary, backup)
+    pool.members[0].record_latency(0.001)
+
+    async def run():
+        result = await pool._aperform_chat_completion(CHAT, "text")
+        await asyncio.sleep(0)
+        return result
+
+    result = asyncio.run(run())
+
+    assert result["text"] == "对冲结果"
+    assert (pool.hedged_requests, pool.hedge_wins) == (1, 1)
+    assert cancelled == [True]
+    # 被取消的主请求不计失败，熔断器保持关闭
+    assert pool.members[0].failures == 0
+    assert pool.members[0].breaker.state == "closed"
+
+
+def test_no_hedge_when_primary_is_fast(monkeypatch):
+    monkeypatch.setenv("LLM_HEDGE_ENABLED", "true")
+    monkeypatch.setenv("LLM_HEDGE_MIN_SAMPLES", "1")
+    monkeypatch.setenv("LLM_HEDGE_MIN_DELAY", "5")
+    primary = ScriptedProvider(model="a")
+    backup = ScriptedProvider(model="b")
+    pool = _pool(primary, backup)
+    pool.members[0].record_latency(0.001)
+
+    asyncio.run(pool._aperform_chat_completion(CHAT, "text"))
+
+    assert (primary.calls, backup.calls, pool.hedged_requests) == (1, 0, 0)
@@ -0,0 +1,129 @@
+import random
+
+import pytest
+
+from app.core.keyword_engine import (
+    KeywordAutomaton,
+    clear_keyword_scan_cache,
+    register_keyword_table,
+    register_keywords,
+    scan_keywords,
+)
+from app.schemas.chat import ChatMessage
+
+# 互为前缀/后缀、相互嵌套、大小写混合以及表内重复的关键词
+OVERLAPPING = register_keywords(["难", "难过", "很难过", "过", "过不去", "He", "she", "hers", "his", "难过"])
+TABLE = register_keyword_table({
+    "sadness": ["难过", "难受", "难过", "伤心"],
+    "anxiety": ["焦虑", "焦", "虑", "担心", "担心死了"],
+    "english": ["SAD", "sadness", "ness"],
+})
+
+TEXTS = [
+    "",
+    "今天很难过，真的过不去了",
+    "难难难过过过",
+    "ushers: she said his hers",
+    "SADNESS is Sad",
+    "我焦虑得担心死了，担心担心",
+    "完全无关的一句话",
+    "难过难过难过",
+    "很难过不去",
+]
+
+
+def _scan(monkeypatch, engine, text):
+    monkeypatch.setenv("KEYWORD_ENGINE", engine)
+    return scan_keywords(text)
+
+
+def _brute_force(keywords, text):
+    return frozenset(kw for kw in keywords if kw and kw in text)
+
+
+@pytest.fixture(autouse=True)
+def fresh_scan_cache():
+    clear_keyword_scan_cache()
+    yield
+    clear_keyword_scan_cache()
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_automaton_matches_substring_engine(monkeypatch, text):
+    automaton = _scan(monkeypatch, "automaton", text)
+    substring = _scan(monkeypatch, "substring", text)
+
+    for keyword in set(OVERLAPPING):
+        assert (keyword in automaton) == (keyword in substring), keyword
+    assert automaton.count(OVERLAPPING) == substring.count(OVERLAPPING)
+    for label, keywords in TABLE.items():
+        assert automaton.count(keywords) == substring.count(keywords), label
+        assert automaton.any(keywords) == substring.any(keywords), label
+
+
+def test_duplicate_keywords_are_counted_per_occurrence_in_table(monkeypatch):
+    for engine in ("automaton", "substring"):
+        hits = _scan(monkeypatch, engine, "今天很难过")
+        # 关键词表里 "难过" 出现两次，与原来的 sum(1 for kw in keywords if kw in content) 一致
+        assert hits.count(TABLE["sadness"]) == 2
+        assert hits.count(OVERLAPPING) == 5  # 难 难过 很难过 过 难过
+
+
+def test_scan_is_case_insensitive(monkeypatch):
+    for engine in ("automaton", "substring"):
+        hits = _scan(monkeypatch, engine, "I feel SaDnEsS")
+        assert hits.count(TABLE["english"]) == 3
+
+
+def test_automaton_finds_overlapping_keywords_like_brute_force():
+    keywords = ["a", "ab", "bab", "bc", "bca", "c", "caa", "abcab", "aaa"]
+    automaton = KeywordAutomaton(keywords)
+    rng = random.Random(0)
+    for _ in range(500):
+        text = "".join(rng.choice("abc") for _ in range(rng.randint(0, 20)))
+        assert automaton.find(text) == _brute_force(keywords, text), text
+
+
+def test_automaton_handles_cjk_nested_keywords():
+    keywords = ["想死", "不想活", "想", "活", "不想活了", "死"]
+    automaton = KeywordAutomaton(keywords)
+    rng = random.Random(1)
+    alphabet = "想死不活了我"
+    for _ in range(500):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 15)))
+        assert automaton.find(text) == _brute_force(keywords, text), text
+
+
+MESSAGES = [
+    "最近工作压力很大，有点难过",
+    "考试又挂了，我真的好焦虑，睡不着",
+    "我不想活了",
+    "和男朋友吵架了，很生气也很委屈",
+    "能不能换个风格，直接给我建议",
+    "说不清，可能有点难过吧？",
+    "今天天气还行",
+    "I'm SO anxious about the exam",
+]
+
+
+@pytest.mark.parametrize("content", MESSAGES)
+def test_detectors_agree_across_engines(monkeypatch, content):
+    from app.core.conversation_algorithm import parse_user_message
+    from app.core.enhanced_emotion_parser import EnhancedEmotionParser
+    from app.core.risk_detection import detect_risk_level
+    from app.core.style_override_detector import StyleOverrideDetector
+
+    monkeypatch.setenv("LOCAL_CLASSIFIER_ENABLED", "false")
+    message = ChatMessage(role="user", content=content)
+
+    def run_all(engine):
+        monkeypatch.setenv("KEYWORD_ENGINE", engine)
+        clear_keyword_scan_cache()
+        return (
+            parse_user_message(message),
+            detect_risk_level(content, 5),
+            StyleOverrideDetector().detect(content),
+            EnhancedEmotionParser(llm_provider=None, enable_llm=False).parse(message),
+        )
+
+    assert run_all("automaton") == run_all("substring")
@@ -0,0 +1,87 @@
+import json
+
+import numpy as np
+import pytest
+
+from app.core.local_classifier import (
+    MODEL_FORMAT_VERSION,
+    LocalEmotionClassifier,
+    TrainingSample,
+    load_local_classifier,
+    train_classifier,
+)
+
+EMOTIONS = ["焦虑", "开心", "难过"]
+SCENES = ["学业", "工作"]
+
+SAMPLES = [
+    TrainingSample(text="考试好焦虑，复习不完", emotions=["焦虑"], scene="学业", intensity=7),
+    TrainingSample(text="明天考试，紧张焦虑睡不着", emotions=["焦虑"], scene="学业", intensity=8),
+    TrainingSample(text="论文通过了，好开心", emotions=["开心"], scene="学业", intensity=3),
+    TrainingSample(text="升职加薪了，太开心了", emotions=["开心"], scene="工作", intensity=3),
+    TrainingSample(text="被老板骂了，很难过", emotions=["难过"], scene="工作", intensity=6),
+    TrainingSample(text="项目失败，难过又焦虑", emotions=["难过", "焦虑"], scene="工作", intensity=7),
+]
+
+
+@pytest.fixture
+def classifier():
+    return train_classifier(SAMPLES, EMOTIONS, SCENES, hash_dim=512, epochs=40, model_version="test-1")
+
+
+def test_round_trip_preserves_predictions(classifier, tmp_path):
+    path = tmp_path / "clf.npz"
+    classifier.save(path)
+    loaded = LocalEmotionClassifier.load(path)
+
+    assert loaded.version == "test-1"
+    assert loaded.emotion_labels == EMOTIONS
+    assert loaded.scene_labels == SCENES
+    for sample in SAMPLES + [TrainingSample(text="", emotions=[], scene="", intensity=0)]:
+        assert loaded.predict(sample.text) == classifier.predict(sample.text)
+
+
+def test_trained_classifier_fits_training_data(classifier):
+    prediction = classifier.predict("考试好焦虑，复习不完")
+    assert prediction.emotions[0] == "焦虑"
+    assert prediction.scene == "学业"
+    assert 0.0 <= prediction.confidence <= 1.0
+
+
+def test_load_rejects_other_format_version(classifier, tmp_path, monkeypatch):
+    path = tmp_path / "clf.npz"
+    classifier.save(path)
+    with np.load(path, allow_pickle=False) as data:
+        arrays = {name: data[name] for name in data.files}
+    metadata = json.loads(str(arrays["metadata"]))
+    metadata["format_version"] = MODEL_FORMAT_VERSION + 1
+    arrays["metadata"] = np.array(json.dumps(metadata, ensure_ascii=False))
+    with open(path, "wb") as f:
+        np.savez_compressed(f, **arrays)
+
+    with pytest.raises(ValueError, match="格式版本"):
+        LocalEmotionClassifier.load(path)
+    # 服务启动时加载失败不抛错，只是不启用本地分类器
+    monkeypatch.setenv("LOCAL_CLASSIFIER_ENABLED", "true")
+    assert load_local_classifier(path) is None
+
+
+def test_predict_when_every_label_is_chosen():
+    # 标签数少于 MAX_EMOTIONS 且全部高于0.5时，没有落选的情绪可比
+    hash_dim = 8
+    model = LocalEmotionClassifier(
+        emotion_labels=["焦虑", "难过"],
+        scene_labels=SCENES,
+        emotion_weights=np.zeros((hash_dim, 2)),
+        emotion_bias=np.array([3.0, 2.0]),
+        scene_weights=np.zeros((hash_dim, 2)),
+        scene_bias=np.array([4.0, 0.0]),
+        intensity_weights=np.zeros(hash_dim),
+        intensity_bias=5.0,
+        hash_dim=hash_dim,
+    )
+    prediction = model.predict("好难受")
+    assert prediction.emotions == ["焦虑", "难过"]
+    assert prediction.scene == "学业"
+    assert prediction.intensity == 5
+    assert prediction.confidence == pytest.approx(min(1 / (1 + np.exp(-2.0)), prediction.scene_score))
@@ -0,0 +1,85 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.db import Base
+from app.models import Message
+from app.schemas.chat import AnnotatedChatMessage, ChatMessage
+from app.services.message_annotation_service import MessageAnnotationService
+
+SESSION = "s1"
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def _store(db, role, content, emotions=None, **annotation):
+    db.add(Message(session_id=SESSION, role=role, content=content, parsed_emotions=emotions, **annotation))
+    db.commit()
+
+
+def test_hydrate_returns_new_list_matched_by_position(db):
+    # 同一内容出现两次，各自带不同的标注，按位置而不是按内容还原
+    _store(db, "user", "嗯", ["sadness"], parsed_intensity=6, parsed_scene="work", parse_confidence=0.9)
+    _store(db, "assistant", "我在听")
+    _store(db, "user", "嗯", ["relief"], parsed_intensity=3, parsed_scene="general", parse_confidence=0.8)
+    _store(db, "assistant", "好的")
+    _store(db, "user", "今天还是有点累")
+    messages = [
+        ChatMessage(role="user", content="嗯"),
+        ChatMessage(role="assistant", content="我在听"),
+        ChatMessage(role="user", content="嗯"),
+        ChatMessage(role="assistant", content="好的"),
+        ChatMessage(role="user", content="今天还是有点累"),
+    ]
+    original = list(messages)
+
+    hydrated_messages, hydrated = MessageAnnotationService(db).hydrate(SESSION, messages)
+
+    assert messages == original
+    assert all(type(m) is ChatMessage for m in messages)
+    assert hydrated == 2
+    assert isinstance(hydrated_messages[0], AnnotatedChatMessage)
+    assert hydrated_messages[0].emotions == ["sadness"]
+    assert hydrated_messages[2].emotions == ["relief"]
+    assert hydrated_messages[1] is messages[1]
+    assert hydrated_messages[-1] is messages[-1]
+
+
+def test_hydrate_leaves_mismatched_positions_alone(db):
+    _store(db, "user", "数据库里的旧消息", ["anxiety"], parsed_intensity=5, parsed_scene="exam", parse_confidence=0.9)
+    _store(db, "assistant", "嗯嗯")
+    _store(db, "user", "现在的消息")
+    # 前端带来的历史与数据库不同步：同一位置的内容不同
+    messages = [
+        ChatMessage(role="user", content="前端改过的消息"),
+        ChatMessage(role="assistant", content="嗯嗯"),
+        ChatMessage(role="user", content="现在的消息"),
+    ]
+
+    hydrated_messages, hydrated = MessageAnnotationService(db).hydrate(SESSION, messages)
+
+    assert hydrated == 0
+    assert hydrated_messages == messages
+    assert hydrated_messages is not messages
+
+
+def test_hydrate_requires_current_message_to_be_latest_row(db):
+    _store(db, "user", "第一条", ["anxiety"], parsed_intensity=5, parsed_scene="exam", parse_confidence=0.9)
+    _store(db, "assistant", "回复")
+    messages = [
+        ChatMessage(role="user", content="第一条"),
+        ChatMessage(role="assistant", content="回复"),
+        ChatMessage(role="user", content="还没保存的消息"),
+    ]
+
+    _, hydrated = MessageAnnotationService(db).hydrate(SESSION, messages)
+
+    assert hydrated == 0
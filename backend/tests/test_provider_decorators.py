@@ -0,0 +1,100 @@
+import asyncio
+
+from app.core.metrics import LLM_PROMPT_TOKENS
+from app.core.providers.completion_cache import completion_cache_policy, get_completion_cache
+from app.core.providers.singleflight import get_singleflight
+from app.schemas.chat import ChatMessage
+
+from tests.conftest import USAGE, ScriptedProvider
+
+MESSAGES = [ChatMessage(role="user", content="最近工作压力很大")]
+
+
+class CacheTestProvider(ScriptedProvider):
+    pass
+
+
+class CoalesceTestProvider(ScriptedProvider):
+    pass
+
+
+def _prompt_tokens(provider) -> float:
+    return LLM_PROMPT_TOKENS.value(provider=provider._parse_stats_key(), model=provider.model)
+
+
+def test_subclasses_only_implement_raw_methods():
+    from app.core.providers.base_provider import JsonChatLLMProvider
+    from app.core.providers.claude_provider import ClaudeProvider
+    from app.core.providers.gemini_provider import GeminiProvider
+    from app.core.providers.ollama_provider import OllamaProvider
+    from app.core.providers.openai_provider import OpenAIProvider
+
+    for cls in (OpenAIProvider, ClaudeProvider, GeminiProvider, OllamaProvider):
+        for name in ("_perform_chat_completion", "_aperform_chat_completion", "_astream_chat_completion"):
+            assert getattr(cls, name) is getattr(JsonChatLLMProvider, name), (cls.__name__, name)
+        for name in ("_raw_chat_completion", "_araw_chat_completion", "_araw_stream"):
+            assert name in vars(cls), (cls.__name__, name)
+
+
+def test_cache_hit_reports_zero_usage_without_calling_client():
+    get_completion_cache().clear()
+    provider = CacheTestProvider()
+    with completion_cache_policy(ttl=60):
+        first = provider.generate_reply(MESSAGES)
+        tokens_after_first = _prompt_tokens(provider)
+        second = provider.generate_reply(MESSAGES)
+
+    assert provider.calls == 1
+    assert first.total_tokens == USAGE["total_tokens"]
+    assert second.reply == first.reply
+    assert (second.prompt_tokens, second.completion_tokens, second.total_tokens) == (0, 0, 0)
+    # 命中缓存不经过指标装饰器，tokens计数不变
+    assert tokens_after_first == USAGE["prompt_tokens"]
+    assert _prompt_tokens(provider) == tokens_after_first
+
+
+def test_singleflight_follower_reports_zero_usage_without_calling_client():
+    release = None
+
+    async def slow_completion():
+        await release.wait()
+        return {"text": "好的", "usage": dict(USAGE)}
+
+    provider = CoalesceTestProvider(script=[slow_completion, slow_completion])
+    coalesced_before = get_singleflight().coalesced
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        chat_messages = [{"role": "user", "content": "一样的请求"}]
+        with completion_cache_policy(enabled=False):
+            leader = asyncio.create_task(provider._aperform_chat_completion(chat_messages, "text"))
+            follower = asyncio.create_task(provider._aperform_chat_completion(chat_messages, "text"))
+            await asyncio.sleep(0)
+            release.set()
+            return await leader, await follower
+
+    leader, follower = asyncio.run(run())
+
+    assert provider.calls == 1
+    assert get_singleflight().coalesced == coalesced_before + 1
+    assert leader["usage"]["total_tokens"] == USAGE["total_tokens"]
+    assert follower["text"] == "好的"
+    assert follower["usage"] == {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "coalesced": True}
+    assert _prompt_tokens(provider) == USAGE["prompt_tokens"]
+
+
+def test_default_stream_falls_back_to_single_chunk():
+    provider = ScriptedProvider(script=[{"text": "完整回复", "usage": dict(USAGE)}])
+
+    async def run():
+        usage = {}
+        chunks = [chunk async for chunk in provider._astream_chat_completion([{"role": "user", "content": "x"}], "text", usage)]
+        return chunks, usage
+
+    chunks, usage = asyncio.run(run())
+    assert chunks == ["完整回复"]
+    assert {k: usage[k] for k in USAGE} == USAGE
+    # 流式同样经过装饰器栈（输出预算装饰器记下了预算key）
+    assert usage["output_budget_key"] == "scripted:text"
+    assert provider.stream_calls == 1
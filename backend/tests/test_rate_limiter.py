@@ -0,0 +1,203 @@
+import asyncio
+import math
+
+import pytest
+
+from app.core.providers.rate_limiter import (
+    DEFAULT_TOKENS_PER_CHAR,
+    HISTORY_WEIGHT,
+    PRIORITY_BACKGROUND,
+    PRIORITY_HIGH_RISK,
+    PRIORITY_INTERACTIVE,
+    ProviderRateLimiter,
+    TokenBucket,
+    get_rate_limiter,
+    llm_priority,
+)
+
+from tests.conftest import FakeClock, ScriptedProvider
+
+CHAT = [{"role": "user", "content": "字" * 100}]
+
+
+def test_token_bucket_refills_at_per_minute_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock)  # 每秒补1个
+    assert bucket.wait_time(60, clock()) == 0
+    bucket.consume(60)
+
+    assert bucket.wait_time(1, clock()) == pytest.approx(1.0)
+    clock.advance(0.5)
+    assert bucket.wait_time(1, clock()) == pytest.approx(0.5)
+    clock.advance(10)
+    assert bucket.tokens == pytest.approx(0.5)  # wait_time 只在查询时补充
+    assert bucket.wait_time(10, clock()) == 0
+    assert bucket.tokens == pytest.approx(10.5)
+
+    # 补充不超过容量
+    clock.advance(3600)
+    bucket.wait_time(1, clock())
+    assert bucket.tokens == 60
+
+
+def test_token_bucket_adjust_can_go_negative():
+    clock = FakeClock()
+    bucket = TokenBucket(600, clock)  # 每秒补10个
+    bucket.consume(600)
+    bucket.adjust(-100)
+    assert bucket.wait_time(1, clock()) == pytest.approx(10.1)
+    bucket.adjust(1000)
+    assert bucket.tokens == 600
+
+
+def test_rpm_and_tpm_both_gate_the_head_of_queue():
+    clock = FakeClock()
+    limiter = ProviderRateLimiter("test", rpm=2, tpm=1200, clock=clock)  # 每30秒1个请求、每秒20 tokens
+
+    assert limiter.acquire(100, PRIORITY_INTERACTIVE) == 0
+    assert limiter.acquire(100, PRIORITY_INTERACTIVE) == 0
+
+    ticket = limiter._enqueue(1100, PRIORITY_INTERACTIVE, loop=None)
+    # RPM 需要等30秒，TPM 需要 (1100 - 1000) / 20 = 5 秒，取较长者
+    assert limiter._poll(ticket) == pytest.approx(30.0)
+    clock.advance(30)
+    assert limiter._poll(ticket) == 0
+    assert limiter.stats()["waiting"] == 0
+
+
+def test_single_request_above_tpm_is_capped():
+    clock = FakeClock()
+    limiter = ProviderRateLimiter("test", tpm=600, clock=clock)
+    ticket = limiter._enqueue(10_000, PRIORITY_INTERACTIVE, loop=None)
+    assert ticket.cost == 600
+    assert limiter._poll(ticket) == 0
+
+
+def test_priority_heap_order_under_contention():
+    clock = FakeClock()
+    limiter = ProviderRateLimiter("test", rpm=60, clock=clock)  # 每秒1个请求
+    limiter._requests.consume(60)
+
+    order = [PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, PRIORITY_HIGH_RISK, PRIORITY_INTERACTIVE]
+    tickets = [limiter._enqueue(1, priority, loop=None) for priority in order]
+
+    # 只有队首能出队，其他请求等待被唤醒
+    assert limiter._poll(tickets[0]) is None
+    acquired = []
+    while limiter._waiting:
+        head = limiter._waiting[0]
+        for ticket in limiter._waiting[1:]:
+            assert limiter._poll(ticket) is None
+        assert limiter._poll(head) == pytest.approx(1.0)
+        clock.advance(1.0)
+        assert limiter._poll(head) == 0
+        limiter._record_acquired(head)
+        acquired.append(tickets.index(head))
+
+    # 高风险 > 交互 > 后台，同优先级先进先出
+    assert acquired == [3, 1, 4, 0, 2]
+    stats = limiter.stats()["priorities"]
+    assert stats[PRIORITY_HIGH_RISK]["max_wait_ms"] == pytest.approx(1000.0)
+    assert stats[PRIORITY_BACKGROUND]["max_wait_ms"] == pytest.approx(5000.0)
+
+
+def test_async_waiters_are_served_by_priority():
+    clock = FakeClock()
+    limiter = ProviderRateLimiter("test", rpm=1, clock=clock)
+    limiter._requests.consume(1)
+    served = []
+
+    async def request(priority):
+        await limiter.aacquire(1, priority)
+        served.append(priority)
+
+    async def run():
+        tasks = [asyncio.create_task(request(p)) for p in (PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, PRIORITY_HIGH_RISK)]
+        await asyncio.sleep(0)
+        assert len(limiter._waiting) == 3
+        for round_ in range(len(tasks)):
+            # 推进一分钟补满1个请求，唤醒当前队首（不必等待真实的超时）
+            clock.advance(60)
+            limiter._waiting[0].wake()
+            for _ in range(10):
+                await asyncio.sleep(0)
+            assert len(served) == round_ + 1
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert served == [PRIORITY_HIGH_RISK, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND]
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    clock = FakeClock()
+    limiter = ProviderRateLimiter("test", rpm=1, clock=clock)
+    limiter._requests.consume(1)
+
+    async def run():
+        urgent = asyncio.create_task(limiter.aacquire(1, PRIORITY_HIGH_RISK))
+        normal = asyncio.create_task(limiter.aacquire(1, PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0)
+        urgent.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await urgent
+        assert [t.priority for t in limiter._waiting] == [PRIORITY_INTERACTIVE]
+        clock.advance(60)
+        limiter._waiting[0].wake()
+        return await normal
+
+    assert asyncio.run(run()) == pytest.approx(60.0)
+
+
+def test_estimate_is_corrected_by_actual_usage():
+    clock = FakeClock()
+    limiter = ProviderRateLimiter("test", tpm=10_000, clock=clock)
+
+    # 没有历史时：字符数 × 默认比例 + max_tokens
+    first = limiter.estimate(CHAT, "structured", max_tokens=800)
+    assert first == math.ceil(100 * DEFAULT_TOKENS_PER_CHAR + 800)
+    limiter.acquire(first, PRIORITY_INTERACTIVE)
+    assert limiter._tokens.tokens == pytest.approx(10_000 - first)
+
+    limiter.settle(CHAT, "structured", first, {"prompt_tokens": 50, "completion_tokens": 200, "total_tokens": 250})
+    # 多扣的部分退回令牌桶
+    assert limiter._tokens.tokens == pytest.approx(10_000 - 250)
+    tokens_per_char = DEFAULT_TOKENS_PER_CHAR + HISTORY_WEIGHT * (0.5 - DEFAULT_TOKENS_PER_CHAR)
+    assert limiter.stats()["tokens_per_char"] == pytest.approx(round(tokens_per_char, 3))
+    # 第一个输出样本直接作为该模式的平均值，之后按EMA更新
+    assert limiter.estimate(CHAT, "structured", max_tokens=800) == math.ceil(100 * tokens_per_char + 200)
+
+    limiter.settle(CHAT, "structured", 0, {"prompt_tokens": 50, "completion_tokens": 400, "total_tokens": 450})
+    completion = 200 + HISTORY_WEIGHT * (400 - 200)
+    assert limiter.stats()["avg_completion_tokens"] == {"structured": completion}
+    # 其他模式不受影响
+    assert limiter.estimate(CHAT, "text", max_tokens=300) > 300
+
+
+def test_settle_refunds_failed_requests_and_keeps_estimate_without_usage():
+    clock = FakeClock()
+    limiter = ProviderRateLimiter("test", tpm=1000, clock=clock)
+    limiter.acquire(300, PRIORITY_INTERACTIVE)
+
+    limiter.settle(CHAT, "text", 300, {})
+    assert limiter._tokens.tokens == pytest.approx(700)
+    limiter.settle(CHAT, "text", 300, None)
+    assert limiter._tokens.tokens == pytest.approx(1000)
+    assert limiter.stats()["tokens_per_char"] == DEFAULT_TOKENS_PER_CHAR
+
+
+class RateLimitedTestProvider(ScriptedProvider):
+    pass
+
+
+def test_decorator_settles_with_reported_usage(monkeypatch):
+    monkeypatch.setenv("LLM_RATE_LIMIT_TPM_RATELIMITEDTEST", "100000")
+    provider = RateLimitedTestProvider(script=[{"text": "好的", "usage": {"prompt_tokens": 40, "completion_tokens": 60, "total_tokens": 100}}])
+    limiter = get_rate_limiter(provider)
+
+    with llm_priority(PRIORITY_BACKGROUND):
+        provider._perform_chat_completion(CHAT, "text")
+
+    stats = limiter.stats()
+    assert stats["priorities"][PRIORITY_BACKGROUND]["acquired"] == 1
+    assert stats["avg_completion_tokens"] == {"text": 60}
+    assert limiter._tokens.tokens == pytest.approx(100000 - 100, abs=5)
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.api.chat import delete_session
+from app.db import Base
+from app.models import ConversationSummary, Message, Session as SessionModel
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def _seed(db, session_id):
+    db.add(SessionModel(id=session_id))
+    db.add(Message(session_id=session_id, role="user", content="最近很难过"))
+    db.add(Message(session_id=session_id, role="assistant", content="我在听"))
+    db.add(ConversationSummary(
+        session_id=session_id, summary_text="用户说最近很难过", summarized_count=2, prefix_hash="x",
+        compacted_turns=3, tokens_saved=120,
+    ))
+    db.commit()
+
+
+def test_delete_session_removes_messages_and_summary(db):
+    _seed(db, "s1")
+    _seed(db, "s2")
+
+    response = asyncio.run(delete_session("s1", db=db))
+
+    assert response.error is None
+    assert db.query(SessionModel).filter(SessionModel.id == "s1").count() == 0
+    assert db.query(Message).filter(Message.session_id == "s1").count() == 0
+    assert db.query(ConversationSummary).filter(ConversationSummary.session_id == "s1").count() == 0
+    # 其他会话不受影响
+    assert db.query(Message).filter(Message.session_id == "s2").count() == 2
+    assert db.query(ConversationSummary).filter(ConversationSummary.session_id == "s2").count() == 1
+
+
+def test_delete_missing_session_reports_error(db):
+    response = asyncio.run(delete_session("missing", db=db))
+    assert response.error.code == "SESSION_NOT_FOUND"
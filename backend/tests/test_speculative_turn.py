@@ -0,0 +1,114 @@
+import asyncio
+
+from app.core.conversation_algorithm import SpeculativeTurn, parse_user_message
+from app.core.llm_provider import LLMResult
+from app.core.metrics import SPECULATIVE_PARSE
+from app.schemas.chat import ChatMessage
+from app.schemas.style import UserProfile
+
+MESSAGES = [ChatMessage(role="user", content="最近工作压力很大，有点难过")]
+
+
+class StreamingProvider:
+    """按调用顺序为每次流式生成编号，增量文本带上编号和本次规划的风险等级"""
+
+    def __init__(self):
+        self.calls = []
+        self.closed = []
+
+    async def astream_structured_reply(self, **kwargs):
+        call = len(self.calls)
+        self.calls.append(kwargs["parsed"].riskLevel)
+        try:
+            for i in range(3):
+                await asyncio.sleep(0)
+                yield {"type": "delta", "field": "reply", "index": None, "text": f"{call}:{i}"}
+            yield {"type": "result", "result": LLMResult(
+                reply=f"reply-{call}", emotion="neutral", intensity=3, topics=["general"], risk_level="low",
+            )}
+        finally:
+            self.closed.append(call)
+
+
+async def _refine(parsed, delay: float = 0.01):
+    await asyncio.sleep(delay)
+    return parsed
+
+
+async def _collect(turn: SpeculativeTurn, draft):
+    return [event async for event in turn.astream(draft)]
+
+
+def _turn(provider, refinement) -> SpeculativeTurn:
+    return SpeculativeTurn(
+        llm_provider=provider,
+        messages=MESSAGES,
+        user_profile=UserProfile(id="u"),
+        conversation_state=None,
+        chat_mode=None,
+        deep_chat_engine=None,
+        refinement=refinement,
+    )
+
+
+def test_kept_draft_is_streamed_unchanged():
+    draft = parse_user_message(MESSAGES[-1])
+    refined = draft.model_copy(update={"emotions": ["sadness"]})
+    provider = StreamingProvider()
+    before = SPECULATIVE_PARSE.value(outcome="kept")
+
+    async def run():
+        turn = _turn(provider, asyncio.create_task(_refine(refined)))
+        return turn, await _collect(turn, draft)
+
+    turn, events = asyncio.run(run())
+
+    assert provider.calls == [draft.riskLevel]
+    assert [e["text"] for e in events if e["type"] == "delta"] == ["0:0", "0:1", "0:2"]
+    assert events[-1]["result"].reply == "reply-0"
+    # 草稿规划保留，换上精确解析
+    assert turn.turn.parsed.emotions == ["sadness"]
+    assert SPECULATIVE_PARSE.value(outcome="kept") == before + 1
+
+
+def test_invalidated_draft_is_discarded():
+    draft = parse_user_message(MESSAGES[-1])
+    assert draft.riskLevel != "high"
+    refined = draft.model_copy(update={"riskLevel": "high"})
+    provider = StreamingProvider()
+    before = SPECULATIVE_PARSE.value(outcome="risk_raised")
+
+    async def run():
+        turn = _turn(provider, asyncio.create_task(_refine(refined)))
+        return turn, await _collect(turn, draft)
+
+    turn, events = asyncio.run(run())
+
+    # 草稿流已经开始生成，但它的增量一个都没有发出
+    assert provider.calls == [draft.riskLevel, "high"]
+    assert 0 in provider.closed
+    assert [e["text"] for e in events if e["type"] == "delta"] == ["1:0", "1:1", "1:2"]
+    assert events[-1]["result"].reply == "reply-1"
+    assert turn.turn.parsed.riskLevel == "high"
+    assert SPECULATIVE_PARSE.value(outcome="risk_raised") == before + 1
+
+
+def test_failed_refinement_keeps_draft():
+    draft = parse_user_message(MESSAGES[-1])
+    provider = StreamingProvider()
+    before = SPECULATIVE_PARSE.value(outcome="refine_failed")
+
+    async def failing():
+        await asyncio.sleep(0)
+        raise RuntimeError("upstream timeout")
+
+    async def run():
+        turn = _turn(provider, asyncio.create_task(failing()))
+        return turn, await _collect(turn, draft)
+
+    turn, events = asyncio.run(run())
+
+    assert provider.calls == [draft.riskLevel]
+    assert [e["text"] for e in events if e["type"] == "delta"] == ["0:0", "0:1", "0:2"]
+    assert turn.turn.parsed == draft
+    assert SPECULATIVE_PARSE.value(outcome="refine_failed") == before + 1